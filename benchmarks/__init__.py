@@ -0,0 +1 @@
+"""Benchmarks of s3os against a local s3 stand-in."""
@@ -0,0 +1,59 @@
+"""
+Benchmark of creating a new boto3 client per operation vs using the shared client pool.
+
+Run with:
+
+    python -m benchmarks.bench_client_pool
+"""
+
+import argparse
+import boto3
+import io
+import os
+
+from s3os.api import store, retrieve, delete
+from s3os.s3_wrapper import BucketLocation, ObjectLocation, create_bucket
+
+from .common import ENDPOINT_URL_ENV_VAR, local_s3, ops_per_second
+
+BUCKET = BucketLocation("s3os-benchmark")
+
+
+def _unpooled_client():
+    """Create a new client, as every operation did before the client pool existed."""
+    return boto3.client("s3", endpoint_url=os.environ.get(ENDPOINT_URL_ENV_VAR))
+
+
+def unpooled_round_trip(index: int) -> None:
+    """Upload, download and delete a small object using a fresh client for every request."""
+    key = f"unpooled/{index}"
+    _unpooled_client().upload_fileobj(io.BytesIO(b"1\n"), BUCKET.name, key)
+    _unpooled_client().download_fileobj(BUCKET.name, key, io.BytesIO())
+    _unpooled_client().delete_object(Bucket=BUCKET.name, Key=key)
+
+
+def pooled_round_trip(index: int) -> None:
+    """Upload, download and delete a small object using the s3os API."""
+    location = ObjectLocation(f"pooled/{index}", bucket=BUCKET)
+    store(location, 1)
+    retrieve(location)
+    delete(location)
+
+
+def main() -> None:
+    """Run the benchmark and print the results."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=200)
+    args = parser.parse_args()
+
+    with local_s3():
+        create_bucket(BUCKET)
+        before = ops_per_second(unpooled_round_trip, args.count)
+        after = ops_per_second(pooled_round_trip, args.count)
+
+    print(f"Client per call: {before:8.1f} round trips/sec")
+    print(f"Shared pool:     {after:8.1f} round trips/sec ({after / before:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Benchmark of bytes on the wire against encode/decode CPU time for each compression level.
+
+Run with:
+
+    python -m benchmarks.bench_compression
+"""
+
+import argparse
+import time
+
+from typing import Any, Optional
+
+from s3os.compression import CompressionConfig, available_compressors
+from s3os.encoding import object_from_stream, object_to_stream
+
+LEVELS = {
+    "zlib": [1, 6, 9],
+    "gzip": [1, 6, 9],
+    "zstd": [1, 3, 9, 19],
+    "lz4": [0, 9, 16],
+}
+
+
+def make_payload(records: int) -> Any:
+    """Create a large, repetitive object like the ones typically stored."""
+    return [
+        {"id": i, "status": "active", "tags": ["alpha", "beta"], "score": i % 100}
+        for i in range(records)
+    ]
+
+
+def measure(
+    obj: Any, codec: str, compression: Optional[CompressionConfig], repeats: int
+) -> None:
+    """Print the encoded size and mean encode/decode time of the object."""
+    start = time.perf_counter()
+    for _ in range(repeats):
+        stream = object_to_stream(obj, codec=codec, compression=compression)
+    encode_ms = (time.perf_counter() - start) / repeats * 1000
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        stream.seek(0)
+        object_from_stream(stream, allowed_codecs=[codec])
+    decode_ms = (time.perf_counter() - start) / repeats * 1000
+
+    name = "none" if compression is None else compression.algorithm
+    level = "-" if compression is None else compression.level
+    print(
+        f"{codec:8} {name:6} {level!s:>5} {len(stream.getvalue()):>12,} "
+        f"{encode_ms:>10.2f} {decode_ms:>10.2f}"
+    )
+
+
+def main() -> None:
+    """Run the benchmark and print the results."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--records", type=int, default=5000)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--codec", default="yaml")
+    args = parser.parse_args()
+
+    obj = make_payload(args.records)
+    print(
+        f"{'codec':8} {'algo':6} {'level':>5} {'bytes':>12} {'encode ms':>10} {'decode ms':>10}"
+    )
+    measure(obj, args.codec, None, args.repeats)
+    for algorithm in available_compressors():
+        for level in LEVELS.get(algorithm, [None]):
+            compression = CompressionConfig(algorithm, level=level, min_size=0)
+            measure(obj, args.codec, compression, args.repeats)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Benchmark of bulk reads decoding YAML in threads against a pool of processes.
+
+Objects are kept in the in-memory backend, so the time measured is almost all decoding.
+Decoding in threads is limited by the GIL to about one core, whereas decoding in a pool
+of processes should scale with the number of workers, up to the number of cores.
+
+Run with:
+
+    python -m benchmarks.bench_decode
+"""
+
+import argparse
+import os
+import time
+
+from typing import Any, List, Optional
+
+from s3os.api import retrieve_many, store_many
+from s3os.decode_pool import DecodeConfig, get_decode_pool
+from s3os.s3_wrapper import BucketLocation, ObjectLocation
+
+BUCKET = BucketLocation("s3os-benchmark", backend="memory")
+
+
+def make_payload(records: int) -> Any:
+    """Create an object like the ones typically stored."""
+    return [
+        {"id": i, "status": "active", "tags": ["alpha", "beta"], "score": i % 100}
+        for i in range(records)
+    ]
+
+
+def measure(
+    locations: List[ObjectLocation], decode: Optional[DecodeConfig], repeats: int
+) -> float:
+    """Return the number of objects read per second by `retrieve_many`."""
+    if decode is not None:
+        # Start the worker processes before timing.
+        pool = get_decode_pool(decode.workers)
+        list(pool.map(abs, range(decode.workers)))
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        retrieve_many(locations, decode=decode).raise_for_errors()
+    return len(locations) * repeats / (time.perf_counter() - start)
+
+
+def main() -> None:
+    """Run the benchmark and print the results."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--objects", type=int, default=200)
+    parser.add_argument("--records", type=int, default=500)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=DecodeConfig.batch_size)
+    args = parser.parse_args()
+
+    locations = [
+        ObjectLocation(f"decode/{index}", bucket=BUCKET)
+        for index in range(args.objects)
+    ]
+    payload = make_payload(args.records)
+    store_many((location, payload) for location in locations).raise_for_errors()
+
+    print(f"{'decode':>10} {'objects/s':>10} {'speedup':>8}")
+    baseline = measure(locations, None, args.repeats)
+    print(f"{'threads':>10} {baseline:>10.1f} {1:>8.2f}")
+
+    workers = 1
+    while workers <= (os.cpu_count() or 1):
+        decode = DecodeConfig(
+            max_workers=workers, batch_size=args.batch_size, min_size=0
+        )
+        rate = measure(locations, decode, args.repeats)
+        print(f"{f'{workers} procs':>10} {rate:>10.1f} {rate / baseline:>8.2f}")
+        workers *= 2
+
+
+if __name__ == "__main__":
+    main()
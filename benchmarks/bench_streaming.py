@@ -0,0 +1,69 @@
+"""
+Benchmark of the peak memory used to store and retrieve a large object.
+
+Compares `store`/`retrieve`, which hold the complete encoded object in memory, with
+`store_streaming`/`retrieve_streaming`, which encode and decode it a part at a time.
+
+The in-process s3 fake from `moto` keeps its own copies of the object, which are
+counted too. Set `S3OS_BENCH_ENDPOINT_URL` to a separate s3-compatible server to measure
+the memory used by s3os alone.
+
+Run with:
+
+    python -m benchmarks.bench_streaming
+"""
+
+import argparse
+import time
+import tracemalloc
+
+from typing import Any, Callable, Tuple
+
+from s3os.api import retrieve, retrieve_streaming, store, store_streaming
+from s3os.s3_wrapper import BucketLocation, ObjectLocation, create_bucket
+
+from .common import local_s3
+
+BUCKET = BucketLocation("s3os-benchmark")
+
+
+def peak_memory(operation: Callable[[], Any]) -> Tuple[float, float]:
+    """Return the peak memory allocated by the operation in MiB, and its duration."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        operation()
+        return tracemalloc.get_traced_memory()[1] / 2 ** 20, time.perf_counter() - start
+    finally:
+        tracemalloc.stop()
+
+
+def main() -> None:
+    """Run the benchmark and print the results."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size-mib", type=int, default=64)
+    parser.add_argument("--codec", default="bytes")
+    args = parser.parse_args()
+
+    obj = bytes(range(256)) * (args.size_mib * 2 ** 12)
+    location = ObjectLocation("streaming", bucket=BUCKET, codec=args.codec)
+    allowed_codecs = [args.codec]
+
+    with local_s3():
+        create_bucket(BUCKET)
+        results = {
+            "store": peak_memory(lambda: store(location, obj)),
+            "store_streaming": peak_memory(lambda: store_streaming(location, obj)),
+            "retrieve": peak_memory(lambda: retrieve(location, allowed_codecs)),
+            "retrieve_streaming": peak_memory(
+                lambda: retrieve_streaming(location, allowed_codecs)
+            ),
+        }
+
+    print(f"Object of {args.size_mib} MiB, encoded with {args.codec!r}:")
+    for name, (peak, duration) in results.items():
+        print(f"{name:20} peak {peak:8.1f} MiB in {duration:6.2f}s")
+
+
+if __name__ == "__main__":
+    main()
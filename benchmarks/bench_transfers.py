@@ -0,0 +1,67 @@
+"""
+Benchmark of the latency of uploading and downloading objects of different sizes.
+
+Compares always using the s3transfer manager (`upload_fileobj`/`download_fileobj`), as
+s3os used to, with s3os's size-aware choice of single requests for small objects.
+
+Run with:
+
+    python -m benchmarks.bench_transfers
+"""
+
+import argparse
+import io
+
+from s3os.clients import get_client
+from s3os.s3_wrapper import (
+    BucketLocation,
+    ObjectLocation,
+    create_bucket,
+    download_object_with_info,
+    upload_object,
+)
+
+from .common import latency_percentiles, local_s3
+
+BUCKET = BucketLocation("s3os-benchmark")
+SIZES = [40, 2 ** 10, 2 ** 16, 2 ** 20, 16 * 2 ** 20]
+
+
+def main() -> None:
+    """Run the benchmark and print the results."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=100)
+    args = parser.parse_args()
+
+    with local_s3():
+        create_bucket(BUCKET)
+        client = get_client()
+        print(f"{'size':>10} {'method':10} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8}")
+
+        for size in SIZES:
+            data = bytes(size)
+            location = ObjectLocation(f"transfers/{size}", bucket=BUCKET)
+            # Fewer repeats of the largest objects, to keep the run short.
+            count = max(5, args.count * 2 ** 16 // max(size, 2 ** 16))
+
+            def transfer_manager(index: int) -> None:
+                client.upload_fileobj(io.BytesIO(data), BUCKET.name, location.key)
+                client.download_fileobj(BUCKET.name, location.key, io.BytesIO())
+
+            def size_aware(index: int) -> None:
+                upload_object(location, io.BytesIO(data))
+                download_object_with_info(location)
+
+            for name, operation in [
+                ("transfer", transfer_manager),
+                ("s3os", size_aware),
+            ]:
+                result = latency_percentiles(operation, count)
+                print(
+                    f"{size:>10} {name:10} "
+                    + " ".join(f"{result[p]:8.2f}" for p in (50, 90, 99))
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""Shared helpers for running benchmarks against a local s3 stand-in."""
+
+import contextlib
+import os
+import time
+
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterator, List, Optional, Sequence
+
+from s3os.clients import ClientConfig, configure_client_pool
+
+#: Set this to the URL of a local s3-compatible server (e.g. MinIO) to benchmark against it.
+#: Otherwise the in-process s3 fake from `moto` is used.
+ENDPOINT_URL_ENV_VAR = "S3OS_BENCH_ENDPOINT_URL"
+
+
+@contextlib.contextmanager
+def local_s3() -> Iterator[None]:
+    """
+    Point s3os at a local s3 stand-in for the duration of the context.
+
+    Uses the server given by the `S3OS_BENCH_ENDPOINT_URL` environment variable if set.
+    Otherwise requires `moto` to be installed (`pip install moto`).
+    """
+    endpoint_url = os.environ.get(ENDPOINT_URL_ENV_VAR)
+    if endpoint_url is not None:
+        configure_client_pool(ClientConfig(endpoint_url=endpoint_url))
+        try:
+            yield
+        finally:
+            configure_client_pool()
+        return
+
+    try:
+        from moto import mock_aws
+    except ImportError:  # pragma: no cover
+        raise RuntimeError(
+            f"Benchmarks need either `moto` installed or {ENDPOINT_URL_ENV_VAR} set."
+        )
+
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "benchmark")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "benchmark")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    with mock_aws():
+        # Clients must be created inside the mock so their requests are intercepted.
+        configure_client_pool()
+        try:
+            yield
+        finally:
+            configure_client_pool()
+
+
+def ops_per_second(operation: Callable[[int], None], count: int) -> float:
+    """Call `operation` with each index in range(count) and return the achieved rate."""
+    start = time.perf_counter()
+    for index in range(count):
+        operation(index)
+    return count / (time.perf_counter() - start)
+
+
+def _latencies(
+    operation: Callable[[int], None],
+    count: int,
+    prepare: Optional[Callable[[int], None]] = None,
+) -> List[float]:
+    """Call `operation` with each index in range(count) and return the sorted latencies."""
+    latencies = []
+    for index in range(count):
+        if prepare is not None:
+            prepare(index)
+        start = time.perf_counter()
+        operation(index)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return latencies
+
+
+def _percentile(latencies: List[float], percentile: float) -> float:
+    """Return the given percentile of the sorted latencies."""
+    return latencies[min(len(latencies) - 1, int(len(latencies) * percentile / 100))]
+
+
+def latency_percentiles(
+    operation: Callable[[int], None],
+    count: int,
+    percentiles: Sequence[float] = (50, 90, 99),
+) -> Dict[float, float]:
+    """
+    Call `operation` with each index in range(count) and return latency percentiles.
+
+    :return: Dict of each percentile to the latency at that percentile, in milliseconds.
+    """
+    latencies = _latencies(operation, count)
+    return {
+        percentile: _percentile(latencies, percentile) * 1000
+        for percentile in percentiles
+    }
+
+
+@dataclass(frozen=True)
+class Measurement:
+    """
+    Throughput and latency of repeated calls of an operation.
+
+    :param ops_per_second: Number of items processed per second, over all the calls.
+    :param p50_ms: Median latency of a call, in milliseconds.
+    :param p95_ms: 95th percentile latency of a call, in milliseconds.
+    :param p99_ms: 99th percentile latency of a call, in milliseconds.
+    """
+
+    ops_per_second: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+
+
+def measure(
+    operation: Callable[[int], None],
+    count: int,
+    items_per_call: int = 1,
+    prepare: Optional[Callable[[int], None]] = None,
+) -> Measurement:
+    """
+    Call `operation` with each index in range(count) and measure its throughput and latency.
+
+    :param operation: The operation to measure.
+    :param count: Number of times to call the operation.
+    :param items_per_call: Number of items (e.g. keys) each call processes, so that
+        bulk operations report items per second rather than calls per second.
+    :param prepare: Optional. Called with each index before each call of the operation,
+        without being timed. E.g. to create the objects the operation deletes.
+    """
+    latencies = _latencies(operation, count, prepare)
+    total = sum(latencies)
+    return Measurement(
+        ops_per_second=count * items_per_call / total if total else float("inf"),
+        p50_ms=_percentile(latencies, 50) * 1000,
+        p95_ms=_percentile(latencies, 95) * 1000,
+        p99_ms=_percentile(latencies, 99) * 1000,
+    )
@@ -0,0 +1,382 @@
+"""
+Suite of throughput and latency benchmarks of the main s3os operations.
+
+Covers `store`/`retrieve`/`delete` of objects of several sizes, bulk operations at
+several concurrency levels, S3Dict gets, sets and clears with different cache settings
+and layouts, and listing keys across several pages.
+
+Reports the throughput in items per second, and the p50/p95/p99 latency of each call,
+of each scenario. Results can be saved as a baseline, and later runs compared against
+it. Scenarios whose throughput drops, or whose p95 latency rises, by more than the
+tolerance are reported as regressions, and the run exits with status 1.
+
+Run with:
+
+    python -m benchmarks.suite --output baseline.json
+    python -m benchmarks.suite --baseline baseline.json
+
+Baselines are only comparable between runs on the same machine and s3 stand-in.
+"""
+
+import argparse
+import dataclasses
+import json
+import sys
+import tempfile
+
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from s3os.api import delete, retrieve, retrieve_many, store, store_many
+from s3os.disk_cache import DiskCacheConfig
+from s3os.s3_dict import S3Dict, S3DictConfig
+from s3os.s3_wrapper import (
+    BucketLocation,
+    ObjectLocation,
+    create_bucket,
+    generate_items_in_bucket,
+)
+
+from .common import Measurement, local_s3, measure
+
+BUCKET = BucketLocation("s3os-benchmark")
+SIZES = [2 ** 10, 2 ** 16, 2 ** 20]
+CONCURRENCY_LEVELS = [1, 4, 16]
+KEY_COUNTS = [100, 2500]
+#: Number of keys written or read by each call of bulk operations.
+BULK_KEYS = 100
+
+
+@dataclass
+class Scenario:
+    """
+    A benchmarked operation.
+
+    :param name: Name of the scenario, unique within the suite.
+    :param operation: Called with the index of each call.
+    :param count: Number of times to call the operation.
+    :param items_per_call: Number of items each call processes.
+    :param setup: Optional. Called once before the operation is measured.
+    :param prepare: Optional. Called before each call of the operation, untimed.
+    """
+
+    name: str
+    operation: Callable[[int], Any]
+    count: int
+    items_per_call: int = 1
+    setup: Optional[Callable[[], Any]] = None
+    prepare: Optional[Callable[[int], Any]] = None
+
+
+def _location(prefix: str, index: int) -> ObjectLocation:
+    return ObjectLocation(f"{prefix}/{index}", bucket=BUCKET, codec="bytes")
+
+
+def _populate(prefix: str, count: int, value: Any) -> None:
+    """Store `count` copies of the value under the prefix."""
+    store_many(
+        ((_location(prefix, index), value) for index in range(count)),
+        check_bucket=False,
+    ).raise_for_errors()
+
+
+def _size_scenarios(size: int, count: int) -> Iterator[Scenario]:
+    prefix = f"api/{size}"
+    data = bytes(size)
+
+    def populate() -> None:
+        _populate(prefix, count, data)
+
+    def store_object(index: int) -> None:
+        store(_location(prefix, index), data, check_bucket=False)
+
+    def retrieve_object(index: int) -> None:
+        retrieve(_location(prefix, index))
+
+    def delete_object(index: int) -> None:
+        delete(_location(prefix, index))
+
+    yield Scenario(f"store/{size}B", store_object, count)
+    yield Scenario(f"retrieve/{size}B", retrieve_object, count, setup=populate)
+    yield Scenario(f"delete/{size}B", delete_object, count, setup=populate)
+
+
+def api_scenarios(scale: float) -> Iterator[Scenario]:
+    """Single object operations, for objects of each size."""
+    for size in SIZES:
+        # Fewer repeats of the largest objects, to keep the run short.
+        yield from _size_scenarios(
+            size, max(5, int(200 * scale * 2 ** 16 / max(size, 2 ** 16)))
+        )
+
+
+def _concurrency_scenarios(concurrency: int, count: int) -> Iterator[Scenario]:
+    prefix = f"bulk/{concurrency}"
+
+    def store_objects(index: int = 0) -> None:
+        store_many(
+            ((_location(prefix, key), bytes(2 ** 10)) for key in range(BULK_KEYS)),
+            check_bucket=False,
+            max_concurrency=concurrency,
+        ).raise_for_errors()
+
+    def retrieve_objects(index: int) -> None:
+        retrieve_many(
+            (_location(prefix, key) for key in range(BULK_KEYS)),
+            max_concurrency=concurrency,
+        ).raise_for_errors()
+
+    yield Scenario(f"store_many/c{concurrency}", store_objects, count, BULK_KEYS)
+    yield Scenario(
+        f"retrieve_many/c{concurrency}",
+        retrieve_objects,
+        count,
+        BULK_KEYS,
+        setup=store_objects,
+    )
+
+
+def bulk_scenarios(scale: float) -> Iterator[Scenario]:
+    """Bulk operations on many small objects, at each concurrency level."""
+    for concurrency in CONCURRENCY_LEVELS:
+        yield from _concurrency_scenarios(concurrency, max(2, int(10 * scale)))
+
+
+def _cache_scenarios(use_cache: bool, count: int) -> Iterator[Scenario]:
+    s3dict = S3Dict(
+        _config=S3DictConfig(
+            id=f"dict-cache-{use_cache}",
+            bucket=BUCKET,
+            codec="json",
+            use_cache=use_cache,
+        )
+    )
+
+    def set_item(index: int) -> None:
+        s3dict[f"key-{index}"] = {"value": index}
+
+    def populate() -> None:
+        s3dict.update({f"key-{index}": {"value": index} for index in range(count)})
+
+    def get_item(index: int) -> None:
+        s3dict[f"key-{index}"]
+
+    yield Scenario(f"s3dict.set/cache={use_cache}", set_item, count)
+    yield Scenario(f"s3dict.get/cache={use_cache}", get_item, count, setup=populate)
+
+
+def _disk_cache_scenario(count: int) -> Scenario:
+    config = S3DictConfig(
+        id="dict-disk-cache",
+        bucket=BUCKET,
+        codec="json",
+        disk_cache=DiskCacheConfig(directory=tempfile.mkdtemp(prefix="s3os-bench-")),
+    )
+
+    def populate() -> None:
+        S3Dict(
+            {f"key-{index}": {"value": index} for index in range(count)},
+            _config=config,
+        )
+
+    def get_item(index: int) -> None:
+        # A new dict each time, so the value is read from disk rather than memory.
+        S3Dict(_config=config)[f"key-{index}"]
+
+    return Scenario("s3dict.get/disk_cache", get_item, count, setup=populate)
+
+
+def _layout_scenarios(layout: str, count: int) -> Iterator[Scenario]:
+    s3dict = S3Dict(
+        _config=S3DictConfig(
+            id=f"dict-{layout}",
+            bucket=BUCKET,
+            codec="json",
+            use_cache=False,
+            write_mode="deferred",
+            layout=layout,
+        )
+    )
+
+    def update_and_flush(index: int) -> None:
+        s3dict.update({f"key-{key}": {"value": index} for key in range(BULK_KEYS)})
+        s3dict.flush()
+
+    def populate() -> None:
+        s3dict.update({f"key-{key}": key for key in range(BULK_KEYS * 10)})
+        s3dict.flush()
+
+    def get_all(index: int) -> None:
+        s3dict.get_all_from_s3()
+
+    def clear(index: int) -> None:
+        s3dict.clear()
+
+    yield Scenario(f"s3dict.update+flush/{layout}", update_and_flush, count, BULK_KEYS)
+    yield Scenario(
+        f"s3dict.get_all_from_s3/{layout}",
+        get_all,
+        count,
+        BULK_KEYS * 10,
+        setup=populate,
+    )
+    yield Scenario(
+        f"s3dict.clear/{layout}", clear, count, BULK_KEYS, prepare=update_and_flush,
+    )
+
+
+def s3_dict_scenarios(scale: float) -> Iterator[Scenario]:
+    """S3Dict gets, sets, flushes and clears, with each cache setting and layout."""
+    for use_cache in (True, False):
+        yield from _cache_scenarios(use_cache, max(10, int(200 * scale)))
+    yield _disk_cache_scenario(max(10, int(200 * scale)))
+    for layout in ("objects", "packed"):
+        yield from _layout_scenarios(layout, max(2, int(5 * scale)))
+
+
+def _listing_scenario(keys: int, count: int) -> Scenario:
+    prefix = f"listing/{keys}"
+
+    def list_keys(index: int) -> None:
+        for _ in generate_items_in_bucket(BUCKET, prefix=f"{prefix}/"):
+            pass
+
+    return Scenario(
+        f"list/{keys}keys",
+        list_keys,
+        count,
+        keys,
+        setup=lambda: _populate(prefix, keys, b""),
+    )
+
+
+def listing_scenarios(scale: float) -> Iterator[Scenario]:
+    """Listing all the keys under a prefix, across one or more pages."""
+    for keys in KEY_COUNTS:
+        yield _listing_scenario(keys, max(3, int(10 * scale)))
+
+
+SCENARIO_GROUPS: List[Callable[[float], Iterator[Scenario]]] = [
+    api_scenarios,
+    bulk_scenarios,
+    s3_dict_scenarios,
+    listing_scenarios,
+]
+
+
+def run(scale: float = 1.0, only: Optional[str] = None) -> Dict[str, Measurement]:
+    """
+    Run the benchmarks against a local s3 stand-in.
+
+    :param scale: Multiplier of the number of calls made of each operation.
+    :param only: Optional. Only run scenarios whose name contains this string.
+    :return: The measurement of each scenario, by name.
+    """
+    results = {}
+    with local_s3():
+        create_bucket(BUCKET)
+        for group in SCENARIO_GROUPS:
+            for scenario in group(scale):
+                if only is not None and only not in scenario.name:
+                    continue
+                if scenario.setup is not None:
+                    scenario.setup()
+                results[scenario.name] = measure(
+                    scenario.operation,
+                    scenario.count,
+                    scenario.items_per_call,
+                    prepare=scenario.prepare,
+                )
+                print(format_row(scenario.name, results[scenario.name]), flush=True)
+    return results
+
+
+def find_regressions(
+    results: Dict[str, Measurement], baseline: Dict[str, Measurement], tolerance: float,
+) -> Dict[str, str]:
+    """
+    Compare the results against a baseline.
+
+    :param tolerance: Fraction by which throughput may drop, or p95 latency may rise,
+        before it is a regression.
+    :return: Description of each regression, by scenario name.
+    """
+    regressions = {}
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result.ops_per_second < base.ops_per_second * (1 - tolerance):
+            regressions[name] = (
+                f"throughput {result.ops_per_second:.1f}/s "
+                f"< baseline {base.ops_per_second:.1f}/s"
+            )
+        elif result.p95_ms > base.p95_ms * (1 + tolerance):
+            regressions[
+                name
+            ] = f"p95 {result.p95_ms:.2f}ms > baseline {base.p95_ms:.2f}ms"
+    return regressions
+
+
+def format_row(name: str, result: Measurement) -> str:
+    """Format the measurement of a scenario as a row of the results table."""
+    return (
+        f"{name:34} {result.ops_per_second:10.1f} "
+        f"{result.p50_ms:9.2f} {result.p95_ms:9.2f} {result.p99_ms:9.2f}"
+    )
+
+
+def load_results(path: str) -> Dict[str, Measurement]:
+    """Load results saved by `save_results`."""
+    with open(path) as file:
+        return {name: Measurement(**values) for name, values in json.load(file).items()}
+
+
+def save_results(path: str, results: Dict[str, Measurement]) -> None:
+    """Save results as JSON, e.g. to compare later runs against."""
+    with open(path, "w") as file:
+        json.dump(
+            {name: dataclasses.asdict(result) for name, result in results.items()},
+            file,
+            indent=2,
+            sort_keys=True,
+        )
+
+
+def main() -> None:
+    """Run the benchmarks, print the results and compare them against a baseline."""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--scale", type=float, default=1.0, help="Multiplier of the number of calls."
+    )
+    parser.add_argument("--only", help="Only run scenarios containing this string.")
+    parser.add_argument("--output", help="Save the results to this JSON file.")
+    parser.add_argument("--baseline", help="Compare against results saved before.")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Fraction of change from the baseline allowed before it is a regression.",
+    )
+    args = parser.parse_args()
+
+    print(f"{'scenario':34} {'items/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    results = run(args.scale, args.only)
+    if args.output:
+        save_results(args.output, results)
+
+    if args.baseline:
+        regressions = find_regressions(
+            results, load_results(args.baseline), args.tolerance
+        )
+        for name, description in regressions.items():
+            print(f"REGRESSION {name}: {description}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {args.baseline}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,5 +2,25 @@
 # flake8: noqa
 
 from .api import store, retrieve, delete, store_simple, retrieve_simple, delete_simple
-from .s3_dict import S3Dict, S3DictConfig
-from .s3_wrapper import BucketLocation, ObjectLocation
+from .api import store_streaming, retrieve_streaming, store_by_content
+from .api import BulkResult, BulkOperationError, store_many, retrieve_many, delete_many
+from .s3_dict import S3Dict, S3DictConfig, RefreshSummary
+from .s3_wrapper import BucketLocation, ObjectLocation, configure_transfers
+from .clients import ClientConfig, ClientPool, configure_client_pool
+from .compression import CompressionConfig
+from .encoding import CodecNotAllowedError
+from .concurrency import configure_executor
+from .decode_pool import DecodeConfig
+from .cache import CachePolicy
+from .disk_cache import DiskCacheConfig
+from .write_buffer import FlushPolicy
+from .streaming import MultipartConfig
+from .segments import SegmentPolicy
+from .backends import StorageBackend, MemoryBackend, LocalBackend, register_backend
+from .metrics import TraceHook, add_trace_hook, enable_metrics, get_metrics_registry
+from .throttling import (
+    ConcurrencyPolicy,
+    RetryPolicy,
+    configure_throttling,
+    get_limiter,
+)
@@ -0,0 +1,367 @@
+"""
+Asyncio interface to s3.
+
+All blocking s3 calls are run on a thread pool dedicated to this module, so they never
+block the event loop. The pool is separate from the executor used by the synchronous bulk
+operations, so those can safely be awaited from here.
+
+The size of the pool limits the number of concurrent s3 calls made through this module by
+the whole process. Each bulk call additionally runs a bounded number of worker tasks,
+which take items from its input as they are ready for them.
+"""
+
+import asyncio
+import functools
+import itertools
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Any,
+    AsyncGenerator,
+    Callable,
+    Collection,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+)
+
+from . import api
+from .api import BulkResult
+from .cache import Cache, CacheStats
+from .compression import CompressionConfig
+from .concurrency import DEFAULT_MAX_CONCURRENCY, DEFAULT_MAX_WORKERS
+from .s3_dict import RefreshSummary, S3Dict, S3DictConfig
+from .s3_wrapper import ObjectInfo, ObjectLocation
+from .write_buffer import DELETED
+
+R = TypeVar("R")
+
+#: Number of keys or items fetched from a listing per trip to the thread pool.
+ITERATION_CHUNK_SIZE = 100
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+_max_workers = DEFAULT_MAX_WORKERS
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Return the thread pool used to run blocking s3 calls, creating it if needed."""
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=_max_workers, thread_name_prefix="s3os-aio"
+            )
+        return _executor
+
+
+def configure_executor(max_workers: int = DEFAULT_MAX_WORKERS) -> None:
+    """
+    Set the number of threads used to run blocking s3 calls for this module.
+
+    The `max_pool_connections` of the ClientConfig should be at least this large.
+    Calls already running on the previous pool are allowed to finish.
+    """
+    global _executor, _max_workers
+
+    if max_workers < 1:
+        raise ValueError(
+            f"`max_workers` must be at least 1. You passed: {max_workers=}."
+        )
+
+    with _executor_lock:
+        old_executor = _executor
+        _executor = None
+        _max_workers = max_workers
+
+    if old_executor is not None:
+        old_executor.shutdown(wait=False)
+
+
+async def run_blocking(function: Callable[..., R], *args: Any, **kwargs: Any) -> R:
+    """Run a blocking function on the thread pool of this module and await the result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_executor(), functools.partial(function, *args, **kwargs)
+    )
+
+
+async def _bounded_gather(
+    function: Callable[[Any], Any],
+    items: Iterable[Tuple[ObjectLocation, Any]],
+    max_concurrency: Optional[int],
+) -> BulkResult:
+    """
+    Run a blocking function for each (location, argument) pair, a bounded number at once.
+
+    Items are consumed lazily, by a fixed number of worker tasks, so memory use doesn't
+    grow with the number of items. Items are taken on the thread pool, as taking them
+    may block, e.g. if they come from listing a bucket.
+
+    :return: BulkResult of the outcome for each location.
+    """
+    iterator = iter(items)
+    iterator_lock = asyncio.Lock()
+    exhausted = object()
+    result = BulkResult()
+
+    async def worker() -> None:
+        while True:
+            # Workers share the iterator, so take turns to advance it.
+            async with iterator_lock:
+                item = await run_blocking(next, iterator, exhausted)
+            if item is exhausted:
+                return
+            object_location, argument = item
+            try:
+                result.results[object_location] = await run_blocking(function, argument)
+            except Exception as err:
+                result.errors[object_location] = err
+
+    workers = max_concurrency or DEFAULT_MAX_CONCURRENCY
+    await asyncio.gather(*(worker() for _ in range(workers)))
+    return result
+
+
+async def store(
+    object_location: ObjectLocation,
+    obj: Any,
+    check_bucket: bool = True,
+    codec: Optional[str] = None,
+    compression: Optional[CompressionConfig] = None,
+) -> ObjectInfo:
+    """Store the given object in s3 at the given location. See `s3os.api.store`."""
+    return await run_blocking(
+        api.store,
+        object_location,
+        obj,
+        check_bucket=check_bucket,
+        codec=codec,
+        compression=compression,
+    )
+
+
+async def retrieve(
+    object_location: ObjectLocation, allowed_codecs: Optional[Collection[str]] = None
+) -> Any:
+    """Retrieve the object stored in s3 at the given location. See `s3os.api.retrieve`."""
+    return await run_blocking(
+        api.retrieve, object_location, allowed_codecs=allowed_codecs
+    )
+
+
+async def delete(object_location: ObjectLocation) -> None:
+    """Delete the object stored in s3 at the given location. See `s3os.api.delete`."""
+    await run_blocking(api.delete, object_location)
+
+
+async def store_many(
+    items: Union[Mapping[ObjectLocation, Any], Iterable[Tuple[ObjectLocation, Any]]],
+    check_bucket: bool = True,
+    codec: Optional[str] = None,
+    compression: Optional[CompressionConfig] = None,
+    max_concurrency: Optional[int] = None,
+) -> BulkResult:
+    """Store many objects in s3 concurrently. See `s3os.api.store_many`."""
+    pairs = items.items() if isinstance(items, Mapping) else items
+
+    def store_pair(pair: Tuple[ObjectLocation, Any]) -> ObjectInfo:
+        return api.store(
+            pair[0],
+            pair[1],
+            check_bucket=check_bucket,
+            codec=codec,
+            compression=compression,
+        )
+
+    return await _bounded_gather(
+        store_pair, ((pair[0], pair) for pair in pairs), max_concurrency
+    )
+
+
+async def retrieve_many(
+    object_locations: Iterable[ObjectLocation],
+    max_concurrency: Optional[int] = None,
+    with_info: bool = False,
+    allowed_codecs: Optional[Collection[str]] = None,
+) -> BulkResult:
+    """Retrieve many objects from s3 concurrently. See `s3os.api.retrieve_many`."""
+    function: Callable[[ObjectLocation], Any] = functools.partial(
+        api.retrieve_with_info if with_info else api.retrieve,
+        allowed_codecs=allowed_codecs,
+    )
+    return await _bounded_gather(
+        function,
+        ((location, location) for location in object_locations),
+        max_concurrency,
+    )
+
+
+async def delete_many(
+    object_locations: Iterable[ObjectLocation], max_concurrency: Optional[int] = None
+) -> BulkResult:
+    """Delete many objects stored in s3 in batches. See `s3os.api.delete_many`."""
+    return await run_blocking(
+        api.delete_many, object_locations, max_concurrency=max_concurrency
+    )
+
+
+async def _iterate_in_chunks(iterator: Iterator[R]) -> AsyncGenerator[R, None]:
+    """Iterate a blocking iterator, fetching chunks of it on the thread pool."""
+    while True:
+        chunk: List[R] = await run_blocking(
+            lambda: list(itertools.islice(iterator, ITERATION_CHUNK_SIZE))
+        )
+        if not chunk:
+            return
+        for item in chunk:
+            yield item
+
+
+class AsyncS3Dict:
+    """
+    Provides an asyncio dict-like interface to objects stored in s3.
+
+    Behaves like an S3Dict with the same config, except that every operation is awaitable.
+    Keys and items can be iterated over with `async for`, and all methods are safe
+    to run concurrently with `asyncio.gather`.
+
+    See S3DictConfig for configuration options.
+    """
+
+    def __init__(self, _config: Optional[S3DictConfig] = None):
+        """
+        Create a new AsyncS3Dict.
+
+        :param _config: Optional S3DictConfig object. See S3DictConfig for default behaviour.
+        """
+        self._dict = S3Dict(_config=_config)
+        self._config: S3DictConfig = self._dict._config
+
+    @property
+    def data(self) -> Cache:
+        """The local cache of this dict."""
+        return self._dict.data
+
+    @property
+    def cache_stats(self) -> CacheStats:
+        """Hit, miss and eviction counters of the local cache of this dict."""
+        return self._dict.cache_stats
+
+    async def __aenter__(self) -> "AsyncS3Dict":
+        """Use the dict as a context manager, which flushes deferred writes on exit."""
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        """Flush any deferred writes, and stop the background flusher."""
+        await self.close()
+
+    @property
+    def pending_writes(self) -> int:
+        """Number of keys with deferred writes that have not been flushed to s3 yet."""
+        return self._dict.pending_writes
+
+    async def flush(self) -> None:
+        """Make all deferred writes in s3. See `S3Dict.flush`."""
+        await run_blocking(self._dict.flush)
+
+    async def close(self) -> None:
+        """Flush any deferred writes, and stop the background flusher. See `S3Dict.close`."""
+        await run_blocking(self._dict.close)
+
+    async def get(self, key: str, default: Any = None) -> Any:
+        """Return the value for the key, or `default` if it does not exist."""
+        try:
+            value = self._dict._get_pending(key)
+        except KeyError:
+            pass
+        else:
+            return default if value is DELETED else value
+
+        fetch: Callable[[str], Any]
+        if self._config.use_cache:
+            prefetch = self._dict._prefetches.get(key)
+            try:
+                # No need for a trip to the thread pool.
+                return self.data[key]
+            except KeyError:
+                # Skip the cache lookup in `__getitem__`, so the miss isn't counted twice.
+                fetch = functools.partial(self._dict._fetch_or_wait, future=prefetch)
+        else:
+            fetch = self._dict.__getitem__
+
+        try:
+            return await run_blocking(fetch, key)
+        except KeyError:
+            return default
+
+    def prefetch(self, keys: Iterable[str]) -> None:
+        """Start downloading the values of the keys into the cache. See `S3Dict.prefetch`."""
+        self._dict.prefetch(keys)
+
+    async def contains(self, key: str) -> bool:
+        """Return True if the key is stored in s3 under this dict. See `S3Dict.__contains__`."""
+        return await run_blocking(self._dict.__contains__, key)
+
+    async def length(self) -> int:
+        """Return the number of keys stored in s3 under this dict. See `S3Dict.__len__`."""
+        return await run_blocking(self._dict.__len__)
+
+    async def set(self, key: str, value: Any) -> None:
+        """Store the value under the key."""
+        await run_blocking(self._dict.__setitem__, key, value)
+
+    async def delete(self, key: str) -> None:
+        """Delete the key. No error is raised if it does not exist."""
+        await run_blocking(self._dict.__delitem__, key)
+
+    async def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        """Get many items, downloading them concurrently. See `S3Dict.get_many`."""
+        return await run_blocking(self._dict.get_many, list(keys))
+
+    async def update(self, *args: Any, **kwargs: Any) -> None:
+        """Store many items concurrently. See `S3Dict.update`."""
+        await run_blocking(self._dict.update, dict(*args, **kwargs))
+
+    async def clear(self) -> None:
+        """Delete all the objects stored in s3 under this dict. See `S3Dict.clear`."""
+        await run_blocking(self._dict.clear)
+
+    async def refresh(self) -> RefreshSummary:
+        """Download only the values that changed in s3 into the cache. See `S3Dict.refresh`."""
+        return await run_blocking(self._dict.refresh)
+
+    async def get_all_from_s3(self) -> Dict[str, Any]:
+        """Discover all objects stored in s3 under this dict. See `S3Dict.get_all_from_s3`."""
+        return {key: value async for key, value in self.items()}
+
+    async def keys(self) -> AsyncGenerator[str, None]:
+        """Generate the keys stored in s3 under this dict. See `S3Dict.__iter__`."""
+        # Listing the keys blocks, so it is done on the pool too.
+        iterator = await run_blocking(self._dict.__iter__)
+        async for key in _iterate_in_chunks(iterator):
+            yield key
+
+    async def items(
+        self, ordered: bool = False
+    ) -> AsyncGenerator[Tuple[str, Any], None]:
+        """
+        Generate all (key, value) pairs stored in s3 under this dict.
+
+        Values are downloaded concurrently. See `S3Dict.iter_items_from_s3`.
+        """
+        iterator = self._dict.iter_items_from_s3(ordered=ordered)
+        async for item in _iterate_in_chunks(iterator):
+            yield item
+
+    def __aiter__(self) -> AsyncGenerator[str, None]:
+        """Iterate over the keys of all objects stored in s3 under this dict."""
+        return self.keys()
@@ -1,48 +1,579 @@
 """Definition of the simplest API to s3."""
 
-from typing import Any
+import functools
+import hashlib
+import logging
+
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import (
+    Any,
+    Callable,
+    Collection,
+    Dict,
+    Generator,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+    Union,
+)
 
 from .s3_wrapper import (
+    MAX_KEYS_PER_DELETE,
+    BucketLocation,
+    ObjectInfo,
     ObjectLocation,
+    ObjectNotModified,
     ensure_bucket,
+    head_object,
     upload_object,
-    download_object,
+    download_object_with_info,
     delete_object,
+    delete_objects,
+    open_object_reader,
+    open_object_writer,
+)
+from .compression import CompressionConfig
+from .buffers import Buffer, BufferStream
+from .concurrency import bounded_map
+from .decode_pool import DecodeConfig, decode_in_processes
+from .disk_cache import DiskCache
+from .encoding import (
+    content_hash,
+    object_from_buffer,
+    object_from_file,
+    object_to_file,
+    object_to_stream,
 )
-from .encoding import object_from_yaml_stream, object_to_yaml_stream
+from .metrics import operation, record_transfer
+from .streaming import MultipartConfig
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class BulkResult:
+    """
+    Outcome of an operation on many objects.
+
+    :param results: The result for each object the operation succeeded for.
+    :param errors: The exception raised for each object the operation failed for.
+    """
+
+    results: Dict[ObjectLocation, Any] = field(default_factory=dict)
+    errors: Dict[ObjectLocation, Exception] = field(default_factory=dict)
+
+    @property
+    def ok(self) -> bool:
+        """True if the operation succeeded for every object."""
+        return not self.errors
+
+    def raise_for_errors(self) -> None:
+        """Raise a BulkOperationError if the operation failed for any object."""
+        if self.errors:
+            raise BulkOperationError(self)
 
 
-def store(object_location: ObjectLocation, obj: Any) -> None:
+class BulkOperationError(Exception):
+    """Raised when an operation on many objects fails for some of them."""
+
+    def __init__(self, result: BulkResult):
+        """
+        Create a new BulkOperationError.
+
+        :param result: The outcome of the operation, including the errors.
+        """
+        self.result = result
+        examples = ", ".join(
+            f"{location.key!r}: {err}"
+            for location, err in list(result.errors.items())[:3]
+        )
+        super().__init__(
+            f"Operation failed for {len(result.errors)} of "
+            f"{len(result.errors) + len(result.results)} objects. E.g. {examples}"
+        )
+
+
+def _attributes(object_location: ObjectLocation) -> Dict[str, str]:
+    """Return the attributes of the span of an operation on the object."""
+    return {"bucket": object_location.bucket.name, "key": object_location.key}
+
+
+def store(
+    object_location: ObjectLocation,
+    obj: Any,
+    check_bucket: bool = True,
+    codec: Optional[str] = None,
+    compression: Optional[CompressionConfig] = None,
+    disk_cache: Optional[DiskCache] = None,
+    skip_unchanged: bool = False,
+    current: Optional[ObjectInfo] = None,
+) -> ObjectInfo:
     """
     Store the given object in s3 at the given location.
 
     :param object_location: Definition of the bucket and key to store the object under.
-    :param obj: The object to store. Must be able to be dumped/loaded to/from YAML.
+    :param obj: The object to store. Must be able to be encoded by the chosen codec.
+    :param check_bucket: If True, the bucket is created if it does not already exist.
+        Set to False for buckets that are managed elsewhere to skip the check entirely.
+    :param codec: Optional ID of the codec to encode the object with. If not given,
+        the codec of the `object_location` is used, falling back to YAML.
+        See `s3os.encoding.available_codecs()`.
+    :param compression: Optional configuration of compression to apply to the encoded
+        object. If not given, the compression of the `object_location` is used.
+        Objects are uncompressed by default.
+    :param disk_cache: Optional DiskCache to also store the encoded object in, so that
+        it can be retrieved without downloading it. Only objects whose ETag is known
+        after upload are cached.
+    :param skip_unchanged: If True, the hash of the encoded object is kept in the
+        metadata of the stored object, and the upload is skipped if the object already
+        stored has the same hash. See `find_unchanged`.
+    :param current: Optional ObjectInfo of the object known to be stored already, e.g.
+        from a cache, which saves a request to find it. Only used if `skip_unchanged`.
+    :return: ObjectInfo describing the stored object.
     """
-    ensure_bucket(object_location.bucket)
-    obj_stream = object_to_yaml_stream(obj)
-    upload_object(object_location, obj_stream)
+    if codec is None:
+        codec = object_location.codec
+    if compression is None:
+        compression = object_location.compression
+    with operation("store", **_attributes(object_location)):
+        if check_bucket:
+            ensure_bucket(object_location.bucket)
+        obj_stream = object_to_stream(obj, codec=codec, compression=compression)
+        digest = None
+        if skip_unchanged:
+            digest = content_hash(obj_stream)
+            unchanged = find_unchanged(object_location, obj_stream, digest, current)
+            if unchanged is not None:
+                log.debug(f"Skipped storing unchanged object {object_location}.")
+                return unchanged
+        etag = upload_object(object_location, obj_stream, content_hash=digest)
+        if disk_cache is not None and etag is not None:
+            disk_cache.put(object_location, etag, *obj_stream.buffers)
+        return ObjectInfo(size=len(obj_stream), etag=etag, content_hash=digest)
 
 
-def retrieve(object_location: ObjectLocation) -> Any:
+def find_unchanged(
+    object_location: ObjectLocation,
+    obj_stream: BufferStream,
+    digest: str,
+    current: Optional[ObjectInfo] = None,
+) -> Optional[ObjectInfo]:
+    """
+    Check whether the object stored at the location already has the given data.
+
+    If the hash of the stored object is known from `current`, it is compared without
+    any requests. Otherwise the object is described by a HEAD request, and its hash
+    compared if it was stored with one. Failing that, its ETag is compared with the MD5
+    of the data, which is the ETag s3 gives objects uploaded in a single request.
+
+    :param object_location: Location of the stored object.
+    :param obj_stream: The encoded data.
+    :param digest: The hash of the encoded data. See `s3os.encoding.content_hash`.
+    :param current: Optional ObjectInfo of the object known to be stored already.
+    :return: ObjectInfo describing the stored object if it has the same data.
+        Otherwise None.
+    """
+    if current is not None and current.content_hash is not None:
+        return current if current.content_hash == digest else None
+
+    try:
+        stored = head_object(object_location)
+    except KeyError:
+        return None
+    if stored.content_hash is not None:
+        unchanged = stored.content_hash == digest
+    else:
+        md5 = hashlib.md5()
+        for buffer in obj_stream.buffers:
+            md5.update(buffer)
+        unchanged = stored.etag == f'"{md5.hexdigest()}"'
+    if not unchanged:
+        return None
+    return ObjectInfo(size=stored.size, etag=stored.etag, content_hash=digest)
+
+
+def store_by_content(
+    bucket: BucketLocation,
+    prefix: str,
+    obj: Any,
+    check_bucket: bool = True,
+    codec: Optional[str] = None,
+    compression: Optional[CompressionConfig] = None,
+    disk_cache: Optional[DiskCache] = None,
+) -> Tuple[ObjectLocation, ObjectInfo]:
+    """
+    Store the object under a key made of the prefix and the hash of its encoded data.
+
+    Equal objects are only stored once, so the upload is skipped if the key exists.
+    Objects stored this way must never be modified, only deleted.
+
+    :param bucket: The bucket to store the object in.
+    :param prefix: Prefix of the key to store the object under.
+    :param obj: The object to store. Must be able to be encoded by the chosen codec.
+    :param check_bucket: See `store`.
+    :param codec: See `store`. Defaults to YAML.
+    :param compression: See `store`. Objects are uncompressed by default.
+    :param disk_cache: See `store`.
+    :return: Tuple of the location the object is stored at, and an ObjectInfo
+        describing it. The `content_hash` is the hash in the key.
+    """
+    if check_bucket:
+        ensure_bucket(bucket)
+    obj_stream = object_to_stream(obj, codec=codec, compression=compression)
+    digest = content_hash(obj_stream)
+    object_location = ObjectLocation(
+        f"{prefix}{digest}", bucket=bucket, codec=codec, compression=compression
+    )
+    with operation("store_by_content", **_attributes(object_location)):
+        try:
+            stored = head_object(object_location)
+        except KeyError:
+            etag = upload_object(object_location, obj_stream, content_hash=digest)
+            if disk_cache is not None and etag is not None:
+                disk_cache.put(object_location, etag, *obj_stream.buffers)
+            return object_location, ObjectInfo(len(obj_stream), etag, digest)
+        return object_location, ObjectInfo(stored.size, stored.etag, digest)
+
+
+def retrieve(
+    object_location: ObjectLocation, allowed_codecs: Optional[Collection[str]] = None
+) -> Any:
     """
     Retrieve the object stored in s3 at the given location.
 
+    The object is decompressed and decoded using whichever compression and codec
+    it was stored with.
+
     :param object_location: Definition of the bucket and key to download.
+    :param allowed_codecs: Optional. IDs of the codecs allowed to decode the object.
+        Defaults to every codec that is safe to decode untrusted data with, which
+        excludes pickle, as anyone who can write to the bucket could otherwise run code
+        in the reader. Objects stored with any other codec raise CodecNotAllowedError.
     :return: The object retrieved, as a native python object.
     """
-    obj_stream = download_object(object_location)
-    obj = object_from_yaml_stream(obj_stream)
+    obj, _ = retrieve_with_info(object_location, allowed_codecs=allowed_codecs)
     return obj
 
 
+def retrieve_with_info(
+    object_location: ObjectLocation,
+    if_none_match: Optional[str] = None,
+    disk_cache: Optional[DiskCache] = None,
+    revalidate_disk_cache: bool = True,
+    allowed_codecs: Optional[Collection[str]] = None,
+) -> Tuple[Any, ObjectInfo]:
+    """
+    Retrieve the object stored in s3 at the given location, along with details of it.
+
+    See `retrieve`.
+
+    :param object_location: Definition of the bucket and key to download.
+    :param if_none_match: Optional ETag of a copy of the object that is already held.
+        If the object is unchanged, then ObjectNotModified is raised rather than
+        downloading and decoding it again.
+    :param disk_cache: Optional DiskCache to read the encoded object from, rather than
+        downloading it. Downloaded objects are stored in the cache.
+    :param revalidate_disk_cache: If True, a copy of the object in the `disk_cache` is
+        only used if a conditional request to s3 finds that the object is unchanged.
+        Otherwise the copy is always used.
+    :param allowed_codecs: See `retrieve`.
+    :return: Tuple of the object retrieved, and an ObjectInfo describing it.
+    """
+    with operation("retrieve", **_attributes(object_location)):
+        data, info = _retrieve_encoded(
+            object_location, if_none_match, disk_cache, revalidate_disk_cache
+        )
+        return object_from_buffer(data, allowed_codecs), info
+
+
+def retrieve_encoded(
+    object_location: ObjectLocation,
+    if_none_match: Optional[str] = None,
+    disk_cache: Optional[DiskCache] = None,
+    revalidate_disk_cache: bool = True,
+) -> Tuple[Buffer, ObjectInfo]:
+    """
+    Retrieve the encoded data of the object stored in s3 at the given location.
+
+    The data can be decoded later, e.g. in another process, by `object_from_buffer`.
+    Accepts the same arguments as `retrieve_with_info`, except `allowed_codecs`.
+
+    :return: Tuple of the encoded data, and an ObjectInfo describing the object.
+    """
+    with operation("retrieve_encoded", **_attributes(object_location)):
+        return _retrieve_encoded(
+            object_location, if_none_match, disk_cache, revalidate_disk_cache
+        )
+
+
+def _retrieve_encoded(
+    object_location: ObjectLocation,
+    if_none_match: Optional[str],
+    disk_cache: Optional[DiskCache],
+    revalidate_disk_cache: bool,
+) -> Tuple[Buffer, ObjectInfo]:
+    """Retrieve the encoded data of the object. See `retrieve_encoded`."""
+    on_disk = None
+    if disk_cache is not None and if_none_match is None:
+        on_disk = disk_cache.get(object_location)
+
+    if on_disk is not None:
+        data, etag = on_disk
+        if not revalidate_disk_cache:
+            return data, ObjectInfo(len(data), etag)
+        try:
+            obj_stream, info = download_object_with_info(
+                object_location, if_none_match=etag
+            )
+        except ObjectNotModified:
+            return data, ObjectInfo(len(data), etag)
+    else:
+        obj_stream, info = download_object_with_info(
+            object_location, if_none_match=if_none_match
+        )
+
+    if disk_cache is not None and info.etag is not None:
+        disk_cache.put(object_location, info.etag, obj_stream.getbuffer())
+    return obj_stream.getbuffer()[obj_stream.tell() :], info
+
+
+def store_streaming(
+    object_location: ObjectLocation,
+    obj: Any,
+    check_bucket: bool = True,
+    codec: Optional[str] = None,
+    compression: Optional[CompressionConfig] = None,
+    multipart: Optional[MultipartConfig] = None,
+) -> ObjectInfo:
+    """
+    Store the given object in s3, encoding it straight into a multipart upload.
+
+    Only a few parts of the encoded object are held in memory at once, so use this
+    rather than `store` for very large objects. Compression is always applied if
+    configured, and must be by an algorithm that supports streaming.
+
+    :param object_location: See `store`.
+    :param obj: See `store`.
+    :param check_bucket: See `store`.
+    :param codec: See `store`.
+    :param compression: See `store`.
+    :param multipart: Optional MultipartConfig of the part size and the number of
+        parts uploaded at once. Defaults to `MultipartConfig()`.
+    :return: ObjectInfo describing the stored object.
+    """
+    if codec is None:
+        codec = object_location.codec
+    if compression is None:
+        compression = object_location.compression
+    with operation("store_streaming", **_attributes(object_location)):
+        if check_bucket:
+            ensure_bucket(object_location.bucket)
+        with open_object_writer(object_location, multipart) as upload:
+            object_to_file(obj, upload, codec=codec, compression=compression)
+        # Encoding and uploading are interleaved, so aren't measured separately.
+        record_transfer(sent=upload.info.size)
+        return upload.info
+
+
+def retrieve_streaming(
+    object_location: ObjectLocation, allowed_codecs: Optional[Collection[str]] = None
+) -> Any:
+    """
+    Retrieve the object stored in s3, decoding it as it is downloaded.
+
+    Objects stored by either `store` or `store_streaming` can be retrieved. For codecs
+    and compression that support it, the encoded object is never held in memory all
+    at once.
+
+    :param object_location: Definition of the bucket and key to download.
+    :param allowed_codecs: See `retrieve`.
+    :return: The object retrieved, as a native python object.
+    """
+    with operation("retrieve_streaming", **_attributes(object_location)):
+        stream, info = open_object_reader(object_location)
+        with stream:
+            obj = object_from_file(stream, allowed_codecs)
+        record_transfer(received=info.size)
+        return obj
+
+
 def delete(object_location: ObjectLocation) -> None:
     """
     Delete the object stored in s3 at the given location.
 
     :param object_location: Definition of the bucket and key to delete.
     """
-    delete_object(object_location)
+    with operation("delete", **_attributes(object_location)):
+        delete_object(object_location)
+
+
+def _chunk_by_bucket(
+    object_locations: Iterable[ObjectLocation], chunk_size: int
+) -> Generator[Tuple[BucketLocation, List[ObjectLocation]], None, None]:
+    """Lazily group object locations into chunks of up to `chunk_size` in the same bucket."""
+    chunks: Dict[BucketLocation, List[ObjectLocation]] = {}
+    for object_location in object_locations:
+        chunk = chunks.setdefault(object_location.bucket, [])
+        chunk.append(object_location)
+        if len(chunk) == chunk_size:
+            yield object_location.bucket, chunks.pop(object_location.bucket)
+
+    yield from chunks.items()
+
+
+def _delete_chunk(chunk: Tuple[BucketLocation, List[ObjectLocation]]) -> BulkResult:
+    """Delete a chunk of objects from the same bucket with a single request."""
+    bucket, object_locations = chunk
+    locations_by_key = {location.key: location for location in object_locations}
+    deleted, errors = delete_objects(bucket, list(locations_by_key))
+    return BulkResult(
+        results={locations_by_key[key]: None for key in deleted},
+        errors={locations_by_key[key]: err for key, err in errors.items()},
+    )
+
+
+def _collect(
+    results: Iterable[Tuple[ObjectLocation, "Future[Any]"]], bulk_result: BulkResult
+) -> BulkResult:
+    """Record the outcome of each completed future against its object location."""
+    for object_location, future in results:
+        try:
+            bulk_result.results[object_location] = future.result()
+        except Exception as err:
+            bulk_result.errors[object_location] = err
+    return bulk_result
+
+
+def store_many(
+    items: Union[Mapping[ObjectLocation, Any], Iterable[Tuple[ObjectLocation, Any]]],
+    check_bucket: bool = True,
+    codec: Optional[str] = None,
+    compression: Optional[CompressionConfig] = None,
+    max_concurrency: Optional[int] = None,
+    disk_cache: Optional[DiskCache] = None,
+    skip_unchanged: bool = False,
+    current: Optional[Mapping[ObjectLocation, ObjectInfo]] = None,
+) -> BulkResult:
+    """
+    Store many objects in s3 concurrently.
+
+    Failures do not stop the remaining objects from being stored.
+
+    :param items: Mapping, or iterable of pairs, of the location to store each object
+        at and the object to store. Iterables are consumed lazily.
+    :param check_bucket: See `store`.
+    :param codec: See `store`.
+    :param compression: See `store`.
+    :param max_concurrency: Maximum number of uploads in progress at once.
+        Defaults to `s3os.concurrency.DEFAULT_MAX_CONCURRENCY`.
+    :param disk_cache: See `store`.
+    :param skip_unchanged: See `store`.
+    :param current: Optional mapping of locations to the ObjectInfo of the object known
+        to be stored there already. See `store`.
+    :return: BulkResult of the ObjectInfo of each object stored, and any failures.
+    """
+    pairs = items.items() if isinstance(items, Mapping) else items
+    known = {} if current is None else current
+
+    def store_pair(pair: Tuple[ObjectLocation, Any]) -> ObjectInfo:
+        unchanged_kwargs: Dict[str, Any] = {}
+        if skip_unchanged:
+            unchanged_kwargs = dict(skip_unchanged=True, current=known.get(pair[0]))
+        return store(
+            pair[0],
+            pair[1],
+            check_bucket=check_bucket,
+            codec=codec,
+            compression=compression,
+            disk_cache=disk_cache,
+            **unchanged_kwargs,
+        )
+
+    results = bounded_map(store_pair, pairs, max_in_flight=max_concurrency)
+    return _collect(((pair[0], future) for pair, future in results), BulkResult())
+
+
+def retrieve_many(
+    object_locations: Iterable[ObjectLocation],
+    max_concurrency: Optional[int] = None,
+    with_info: bool = False,
+    decode: Optional[DecodeConfig] = None,
+    allowed_codecs: Optional[Collection[str]] = None,
+) -> BulkResult:
+    """
+    Retrieve many objects from s3 concurrently.
+
+    Failures, including objects that do not exist, do not stop the remaining objects
+    from being retrieved. Objects that do not exist have a KeyError recorded.
+
+    :param object_locations: Definitions of the bucket and key of each object to retrieve.
+        Consumed lazily.
+    :param max_concurrency: Maximum number of downloads in progress at once.
+        Defaults to `s3os.concurrency.DEFAULT_MAX_CONCURRENCY`.
+    :param with_info: If True, the result for each object is a tuple of the object and
+        an ObjectInfo describing it, as returned by `retrieve_with_info`.
+    :param decode: Optional DecodeConfig. If given, objects are downloaded on threads
+        but decoded in a pool of processes, which suits codecs that are slow to decode
+        in Python, e.g. YAML. See `s3os.decode_pool`.
+    :param allowed_codecs: See `retrieve`.
+    :return: BulkResult containing the retrieved objects and any failures.
+    """
+    if decode is None:
+        function: Callable[[ObjectLocation], Any] = functools.partial(
+            retrieve_with_info if with_info else retrieve,
+            allowed_codecs=allowed_codecs,
+        )
+        results = bounded_map(function, object_locations, max_in_flight=max_concurrency)
+        return _collect(results, BulkResult())
+
+    downloads = bounded_map(
+        retrieve_encoded, object_locations, max_in_flight=max_concurrency
+    )
+    result = _collect(
+        decode_in_processes(downloads, decode, allowed_codecs=allowed_codecs),
+        BulkResult(),
+    )
+    if not with_info:
+        result.results = {
+            location: obj for location, (obj, _) in result.results.items()
+        }
+    return result
+
+
+def delete_many(
+    object_locations: Iterable[ObjectLocation], max_concurrency: Optional[int] = None
+) -> BulkResult:
+    """
+    Delete many objects stored in s3.
+
+    Objects are deleted in batches of up to 1000 per request, with batches sent
+    concurrently. Failures do not stop the remaining objects from being deleted.
+
+    :param object_locations: Definitions of the bucket and key of each object to delete.
+        Consumed lazily, so may be a generator over a very large number of objects.
+    :param max_concurrency: Maximum number of batches to send concurrently.
+        Defaults to `s3os.concurrency.DEFAULT_MAX_CONCURRENCY`.
+    :return: BulkResult recording which objects were deleted and which failed.
+    """
+    result = BulkResult()
+    chunks = _chunk_by_bucket(object_locations, MAX_KEYS_PER_DELETE)
+
+    for chunk, future in bounded_map(
+        _delete_chunk, chunks, max_in_flight=max_concurrency
+    ):
+        try:
+            chunk_result = future.result()
+        except Exception as err:
+            # The whole request failed, so none of the chunk was deleted.
+            result.errors.update({location: err for location in chunk[1]})
+        else:
+            result.results.update(chunk_result.results)
+            result.errors.update(chunk_result.errors)
+
+    return result
 
 
 def store_simple(key: str, value: Any) -> None:
@@ -0,0 +1,595 @@
+"""
+Definition of the storage backends that buckets of objects can be kept in.
+
+Every s3os operation on an object is made by the backend named by the `backend` of its
+BucketLocation. The default backend is s3 itself, via boto3 (see `s3os.s3_wrapper`).
+This module also provides backends that keep objects in memory, for fast tests, or in a
+directory on local disk, e.g. as a local tier on edge nodes:
+
+    s3dict = S3Dict(_config=S3DictConfig(bucket=BucketLocation(backend="memory")))
+
+Further backends can be added with `register_backend`.
+"""
+
+import abc
+import hashlib
+import io
+import os
+import tempfile
+import threading
+
+from typing import (
+    Any,
+    BinaryIO,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+from urllib.parse import quote, unquote
+
+from .buffers import BufferStream
+from .locations import BucketLocation, ObjectInfo, ObjectLocation, ObjectNotModified
+
+#: Environment variable giving the directory of the "local" backend.
+LOCAL_ROOT_ENV_VAR = "S3OS_LOCAL_ROOT"
+#: Longest file name the "local" backend uses, the NAME_MAX of most filesystems.
+MAX_FILE_NAME_LENGTH = 255
+#: Prefix of the file names of keys whose percent-encoding is too long. `quote` never
+#: produces it, so these names can't clash with those of other keys.
+HASHED_NAME_PREFIX = "%~"
+
+Stream = Union[io.BytesIO, BufferStream]
+
+
+class StorageBackend(abc.ABC):
+    """
+    Interface of a store of buckets of objects, with the semantics of s3.
+
+    All methods must be thread-safe. Missing objects raise KeyError.
+    """
+
+    @abc.abstractmethod
+    def bucket_exists(self, bucket: BucketLocation) -> bool:
+        """Return True if the given bucket exists. Otherwise False."""
+
+    @abc.abstractmethod
+    def create_bucket(self, bucket: BucketLocation) -> None:
+        """Create the given bucket."""
+
+    @abc.abstractmethod
+    def put(
+        self,
+        object_location: ObjectLocation,
+        stream: Stream,
+        content_hash: Optional[str] = None,
+    ) -> Optional[str]:
+        """
+        Create or replace the object with the data of the given stream.
+
+        :param content_hash: Optional SHA-256 hex digest of the data, to keep with the
+            object and return as the `content_hash` of its ObjectInfo. Backends that
+            can't keep it may ignore it.
+        :return: The ETag of the stored object, if known.
+        """
+
+    @abc.abstractmethod
+    def get(
+        self, object_location: ObjectLocation, if_none_match: Optional[str] = None
+    ) -> Tuple[BufferStream, ObjectInfo]:
+        """
+        Read the data of the object.
+
+        :param if_none_match: Optional ETag. If the object still has this ETag, then
+            ObjectNotModified is raised instead.
+        :return: Tuple of the object data, and an ObjectInfo describing it.
+        """
+
+    @abc.abstractmethod
+    def get_range(
+        self, object_location: ObjectLocation, start: int, length: int
+    ) -> BufferStream:
+        """Read `length` bytes of the object data from offset `start`."""
+
+    @abc.abstractmethod
+    def head(self, object_location: ObjectLocation) -> ObjectInfo:
+        """Return an ObjectInfo describing the object, without reading its data."""
+
+    @abc.abstractmethod
+    def delete(self, object_location: ObjectLocation) -> None:
+        """Delete the object. Does nothing if it doesn't exist."""
+
+    @abc.abstractmethod
+    def delete_batch(
+        self, bucket: BucketLocation, keys: Sequence[str]
+    ) -> Tuple[List[str], Dict[str, Exception]]:
+        """
+        Delete many objects from the bucket at once.
+
+        :return: Tuple of the keys that were deleted, and the error for each key that
+            failed to be deleted.
+        """
+
+    @abc.abstractmethod
+    def list(
+        self, bucket: BucketLocation, prefix: Optional[str] = None
+    ) -> Iterator[str]:
+        """Generate the keys of the objects in the bucket that start with `prefix`."""
+
+    def list_with_info(
+        self, bucket: BucketLocation, prefix: Optional[str] = None
+    ) -> Iterator[Tuple[str, ObjectInfo]]:
+        """
+        Generate the keys of the objects that start with `prefix`, with their details.
+
+        Each key is given with an ObjectInfo describing its object. By default each
+        listed object is described by `head`, and objects deleted since they were
+        listed are skipped. Backends that can describe objects as they list them
+        should override this.
+        """
+        for key in self.list(bucket, prefix):
+            try:
+                yield key, self.head(ObjectLocation(key, bucket=bucket))
+            except KeyError:
+                continue
+
+    def open_reader(
+        self, object_location: ObjectLocation
+    ) -> Tuple[BinaryIO, ObjectInfo]:
+        """
+        Open the object for reading, without necessarily reading it all at once.
+
+        By default the whole object is read by `get`.
+
+        :return: Tuple of a readable binary file of the object data, which should be
+            closed once read, and an ObjectInfo describing the object.
+        """
+        stream, info = self.get(object_location)
+        return io.BufferedReader(stream), info
+
+    def open_writer(
+        self, object_location: ObjectLocation, multipart: Any = None
+    ) -> Any:
+        """
+        Open the object for writing, without necessarily holding it all in memory.
+
+        By default the data is buffered, and stored by `put` when the file is closed.
+
+        :param multipart: Optional `s3os.streaming.MultipartConfig` of backends that
+            upload objects in parts.
+        :return: Writable binary file, with an `info` attribute holding an ObjectInfo
+            describing the object once closed. If used as a context manager and an
+            exception is raised, nothing is written.
+        """
+        return _PutOnClose(self, object_location)
+
+
+class _PutOnClose(io.BytesIO):
+    """Writable file that stores the data written to it in a backend when closed."""
+
+    def __init__(self, backend: StorageBackend, object_location: ObjectLocation):
+        super().__init__()
+        self.info: Optional[ObjectInfo] = None
+        self._backend = backend
+        self._object_location = object_location
+
+    def close(self) -> None:
+        if not self.closed:
+            etag = self._backend.put(self._object_location, self)
+            self.info = ObjectInfo(size=len(self.getbuffer()), etag=etag)
+        super().close()
+
+    def __exit__(self, exc_type: Any, *args: Any) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            super().close()
+
+
+def _md5_etag(data: bytes) -> str:
+    """Return the ETag s3 gives objects uploaded in a single request."""
+    return f'"{hashlib.md5(data).hexdigest()}"'
+
+
+class MemoryBackend(StorageBackend):
+    """
+    Backend that keeps objects in memory, in this process only.
+
+    Buckets are created implicitly by writing objects to them.
+    """
+
+    def __init__(self) -> None:
+        """Create a new, empty MemoryBackend."""
+        self._buckets: Dict[str, Dict[str, Tuple[bytes, ObjectInfo]]] = {}
+        self._lock = threading.Lock()
+
+    def _object(self, object_location: ObjectLocation) -> Tuple[bytes, ObjectInfo]:
+        with self._lock:
+            try:
+                return self._buckets[object_location.bucket.name][object_location.key]
+            except KeyError:
+                raise KeyError(f"Object {object_location} does not exist.") from None
+
+    def clear(self) -> None:
+        """Remove all buckets and objects."""
+        with self._lock:
+            self._buckets.clear()
+
+    def bucket_exists(self, bucket: BucketLocation) -> bool:
+        """Return True if the given bucket exists. Otherwise False."""
+        with self._lock:
+            return bucket.name in self._buckets
+
+    def create_bucket(self, bucket: BucketLocation) -> None:
+        """Create the given bucket."""
+        with self._lock:
+            self._buckets.setdefault(bucket.name, {})
+
+    def put(
+        self,
+        object_location: ObjectLocation,
+        stream: Stream,
+        content_hash: Optional[str] = None,
+    ) -> Optional[str]:
+        """Store a copy of the data of the stream. See `StorageBackend.put`."""
+        data = stream.getvalue()
+        info = ObjectInfo(
+            size=len(data), etag=_md5_etag(data), content_hash=content_hash
+        )
+        with self._lock:
+            objects = self._buckets.setdefault(object_location.bucket.name, {})
+            objects[object_location.key] = (data, info)
+        return info.etag
+
+    def get(
+        self, object_location: ObjectLocation, if_none_match: Optional[str] = None
+    ) -> Tuple[BufferStream, ObjectInfo]:
+        """Return a view of the stored data. See `StorageBackend.get`."""
+        data, info = self._object(object_location)
+        if if_none_match is not None and if_none_match == info.etag:
+            raise ObjectNotModified(object_location)
+        return BufferStream([data]), info
+
+    def get_range(
+        self, object_location: ObjectLocation, start: int, length: int
+    ) -> BufferStream:
+        """Return a view of part of the stored data. See `StorageBackend.get_range`."""
+        data, _ = self._object(object_location)
+        return BufferStream([memoryview(data)[start : start + length]])
+
+    def head(self, object_location: ObjectLocation) -> ObjectInfo:
+        """Describe the stored object. See `StorageBackend.head`."""
+        _, info = self._object(object_location)
+        return info
+
+    def delete(self, object_location: ObjectLocation) -> None:
+        """Delete the object. See `StorageBackend.delete`."""
+        with self._lock:
+            self._buckets.get(object_location.bucket.name, {}).pop(
+                object_location.key, None
+            )
+
+    def delete_batch(
+        self, bucket: BucketLocation, keys: Sequence[str]
+    ) -> Tuple[List[str], Dict[str, Exception]]:
+        """Delete many objects. See `StorageBackend.delete_batch`."""
+        with self._lock:
+            objects = self._buckets.get(bucket.name, {})
+            for key in keys:
+                objects.pop(key, None)
+        return list(keys), {}
+
+    def list(
+        self, bucket: BucketLocation, prefix: Optional[str] = None
+    ) -> Iterator[str]:
+        """Generate the keys in the bucket, in order. See `StorageBackend.list`."""
+        with self._lock:
+            keys = sorted(self._buckets.get(bucket.name, {}))
+        return (key for key in keys if prefix is None or key.startswith(prefix))
+
+    def list_with_info(
+        self, bucket: BucketLocation, prefix: Optional[str] = None
+    ) -> Iterator[Tuple[str, ObjectInfo]]:
+        """Generate the keys in the bucket, in order, with details of their objects."""
+        with self._lock:
+            objects = sorted(self._buckets.get(bucket.name, {}).items())
+        return (
+            (key, info)
+            for key, (_, info) in objects
+            if prefix is None or key.startswith(prefix)
+        )
+
+
+class LocalBackend(StorageBackend):
+    """
+    Backend that keeps objects as files in a directory on local disk.
+
+    Each bucket is a subdirectory of the root directory, and each object is a file in
+    its bucket's directory, named by its percent-encoded key. Keys too long to be file
+    names once encoded are named by their hash instead, and the key is kept in a file
+    of the same name under a hidden directory of the root, to be listed. Objects are
+    written to a temporary file and then moved into place, so readers in other
+    processes never see partly written objects. ETags are derived from the modification
+    time and size of each file, so a change that keeps both is not seen as a change,
+    e.g. by `S3Dict.refresh`. Content hashes are kept in a file per object under a
+    hidden directory of the root, along with the ETag of the data they describe, so
+    that the hash of data that has since been replaced is never given.
+
+    Buckets are created implicitly by writing objects to them.
+    """
+
+    def __init__(self, root: str):
+        """
+        Create a new LocalBackend.
+
+        :param root: The directory to keep buckets in. Created if it doesn't exist.
+        """
+        self.root = os.path.abspath(root)
+        # Bucket names can't start with ".", so these can't clash with a bucket.
+        self._temp_dir = os.path.join(self.root, ".tmp")
+        self._hash_dir = os.path.join(self.root, ".hash")
+        self._key_dir = os.path.join(self.root, ".keys")
+
+    def _bucket_path(self, bucket: BucketLocation) -> str:
+        return os.path.join(self.root, quote(bucket.name, safe=""))
+
+    @staticmethod
+    def _file_name(key: str) -> str:
+        name = quote(key, safe="")
+        if len(name) > MAX_FILE_NAME_LENGTH:
+            return HASHED_NAME_PREFIX + hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return name
+
+    def _path(self, object_location: ObjectLocation) -> str:
+        return os.path.join(
+            self._bucket_path(object_location.bucket),
+            self._file_name(object_location.key),
+        )
+
+    def _hash_path(self, object_location: ObjectLocation) -> str:
+        return os.path.join(
+            self._hash_dir,
+            quote(object_location.bucket.name, safe=""),
+            self._file_name(object_location.key),
+        )
+
+    def _key_path(self, bucket: BucketLocation, name: str) -> str:
+        return os.path.join(self._key_dir, quote(bucket.name, safe=""), name)
+
+    def _key(self, bucket: BucketLocation, name: str) -> Optional[str]:
+        """Return the key of the object with the given file name, if it still exists."""
+        if not name.startswith(HASHED_NAME_PREFIX):
+            return unquote(name)
+        try:
+            with open(self._key_path(bucket, name), encoding="utf-8") as file:
+                return file.read()
+        except FileNotFoundError:
+            # Deleted since it was listed.
+            return None
+
+    def _write_text(self, path: str, text: str) -> None:
+        """Write the text to a file, replacing it atomically."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        descriptor, temp_path = tempfile.mkstemp(dir=self._temp_dir)
+        try:
+            with os.fdopen(descriptor, "w", encoding="utf-8") as file:
+                file.write(text)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    @staticmethod
+    def _etag(stat: os.stat_result) -> str:
+        return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+    def _info(
+        self, object_location: ObjectLocation, stat: os.stat_result
+    ) -> ObjectInfo:
+        """Describe the object, given the status of its file."""
+        etag = self._etag(stat)
+        content_hash = None
+        try:
+            with open(self._hash_path(object_location)) as file:
+                hashed_etag, _, recorded_hash = file.read().partition(" ")
+        except FileNotFoundError:
+            pass
+        else:
+            # The hash of data that has since been replaced must not be given.
+            if hashed_etag == etag and recorded_hash:
+                content_hash = recorded_hash
+        return ObjectInfo(size=stat.st_size, etag=etag, content_hash=content_hash)
+
+    def _write_hash(
+        self, object_location: ObjectLocation, etag: str, content_hash: Optional[str]
+    ) -> None:
+        """Record the content hash of the data with the given ETag, or forget it."""
+        if content_hash is None:
+            self._remove_hash(object_location)
+            return
+        self._write_text(self._hash_path(object_location), f"{etag} {content_hash}")
+
+    def _remove_hash(self, object_location: ObjectLocation) -> None:
+        try:
+            os.remove(self._hash_path(object_location))
+        except FileNotFoundError:
+            pass
+
+    def _open(self, object_location: ObjectLocation) -> BinaryIO:
+        try:
+            return open(self._path(object_location), "rb")
+        except FileNotFoundError:
+            raise KeyError(f"Object {object_location} does not exist.") from None
+
+    def bucket_exists(self, bucket: BucketLocation) -> bool:
+        """Return True if the given bucket exists. Otherwise False."""
+        return os.path.isdir(self._bucket_path(bucket))
+
+    def create_bucket(self, bucket: BucketLocation) -> None:
+        """Create the given bucket."""
+        os.makedirs(self._bucket_path(bucket), exist_ok=True)
+
+    def put(
+        self,
+        object_location: ObjectLocation,
+        stream: Stream,
+        content_hash: Optional[str] = None,
+    ) -> Optional[str]:
+        """Write the data of the stream to a file. See `StorageBackend.put`."""
+        self.create_bucket(object_location.bucket)
+        os.makedirs(self._temp_dir, exist_ok=True)
+        name = self._file_name(object_location.key)
+        if name.startswith(HASHED_NAME_PREFIX):
+            # Written first, so that the object is never listed without its key.
+            self._write_text(
+                self._key_path(object_location.bucket, name), object_location.key
+            )
+        buffers = (
+            stream.buffers if isinstance(stream, BufferStream) else [stream.getbuffer()]
+        )
+        descriptor, temp_path = tempfile.mkstemp(dir=self._temp_dir)
+        try:
+            with os.fdopen(descriptor, "wb") as file:
+                for buffer in buffers:
+                    file.write(buffer)
+                file.flush()
+                stat = os.fstat(file.fileno())
+            os.replace(temp_path, self._path(object_location))
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        etag = self._etag(stat)
+        self._write_hash(object_location, etag, content_hash)
+        return etag
+
+    def get(
+        self, object_location: ObjectLocation, if_none_match: Optional[str] = None
+    ) -> Tuple[BufferStream, ObjectInfo]:
+        """Read the file of the object. See `StorageBackend.get`."""
+        with self._open(object_location) as file:
+            stat = os.fstat(file.fileno())
+            if if_none_match is not None and if_none_match == self._etag(stat):
+                raise ObjectNotModified(object_location)
+            data = bytearray(stat.st_size)
+            if file.readinto(data) != stat.st_size:  # type: ignore
+                raise IOError(f"{object_location} changed while it was being read.")
+        return BufferStream([data]), self._info(object_location, stat)
+
+    def get_range(
+        self, object_location: ObjectLocation, start: int, length: int
+    ) -> BufferStream:
+        """Read part of the file of the object. See `StorageBackend.get_range`."""
+        with self._open(object_location) as file:
+            file.seek(start)
+            return BufferStream([file.read(length)])
+
+    def head(self, object_location: ObjectLocation) -> ObjectInfo:
+        """Describe the file of the object. See `StorageBackend.head`."""
+        try:
+            stat = os.stat(self._path(object_location))
+        except FileNotFoundError:
+            raise KeyError(f"Object {object_location} does not exist.") from None
+        return self._info(object_location, stat)
+
+    def open_reader(
+        self, object_location: ObjectLocation
+    ) -> Tuple[BinaryIO, ObjectInfo]:
+        """Open the file of the object. See `StorageBackend.open_reader`."""
+        file = self._open(object_location)
+        stat = os.fstat(file.fileno())
+        return file, self._info(object_location, stat)
+
+    def delete(self, object_location: ObjectLocation) -> None:
+        """Delete the file of the object. See `StorageBackend.delete`."""
+        try:
+            os.remove(self._path(object_location))
+        except FileNotFoundError:
+            pass
+        self._remove_hash(object_location)
+        name = self._file_name(object_location.key)
+        if name.startswith(HASHED_NAME_PREFIX):
+            try:
+                os.remove(self._key_path(object_location.bucket, name))
+            except FileNotFoundError:
+                pass
+
+    def delete_batch(
+        self, bucket: BucketLocation, keys: Sequence[str]
+    ) -> Tuple[List[str], Dict[str, Exception]]:
+        """Delete many files. See `StorageBackend.delete_batch`."""
+        deleted = []
+        errors: Dict[str, Exception] = {}
+        for key in keys:
+            try:
+                self.delete(ObjectLocation(key, bucket=bucket))
+            except OSError as err:
+                errors[key] = err
+            else:
+                deleted.append(key)
+        return deleted, errors
+
+    def list(
+        self, bucket: BucketLocation, prefix: Optional[str] = None
+    ) -> Iterator[str]:
+        """Generate the keys in the bucket, in order. See `StorageBackend.list`."""
+        try:
+            names = os.listdir(self._bucket_path(bucket))
+        except FileNotFoundError:
+            return iter(())
+        keys = sorted(
+            key
+            for key in (self._key(bucket, name) for name in names)
+            if key is not None and (prefix is None or key.startswith(prefix))
+        )
+        return iter(keys)
+
+
+_backends: Dict[str, StorageBackend] = {}
+_backends_lock = threading.Lock()
+
+
+def register_backend(name: str, backend: StorageBackend) -> None:
+    """
+    Register a backend, so buckets can be kept in it by giving its name.
+
+    Replaces any backend already registered with the same name. For example, to keep
+    the buckets of the "local" backend in a particular directory:
+
+        register_backend("local", LocalBackend("/mnt/s3os"))
+
+    :param name: The name buckets refer to the backend by.
+    :param backend: The backend.
+    """
+    if not isinstance(backend, StorageBackend):
+        raise TypeError(f"`backend` must be a StorageBackend. You passed: {backend=}.")
+    with _backends_lock:
+        _backends[name] = backend
+
+
+def get_backend(name: str) -> StorageBackend:
+    """Return the backend registered with the given name. Raises ValueError if none is."""
+    try:
+        return _backends[name]
+    except KeyError:
+        raise ValueError(
+            f"Unknown storage backend {name!r}. Available: {available_backends()}."
+        ) from None
+
+
+def available_backends() -> List[str]:
+    """Return the names of all registered backends."""
+    return sorted(_backends)
+
+
+register_backend("memory", MemoryBackend())
+register_backend(
+    "local",
+    LocalBackend(
+        os.environ.get(
+            LOCAL_ROOT_ENV_VAR, os.path.join(os.path.expanduser("~"), ".s3os")
+        )
+    ),
+)
@@ -0,0 +1,105 @@
+"""Definition of a file-like view of encoded object data that avoids copying it."""
+
+import io
+
+from typing import List, Sequence, Union
+
+#: Any object exposing its bytes through the buffer protocol.
+Buffer = Union[bytes, bytearray, memoryview]
+
+
+class BufferStream(io.RawIOBase):
+    """
+    Seekable, readable binary file over a sequence of buffers, without copying them.
+
+    Used in place of `io.BytesIO`, which copies the data it is created from. For example
+    an encoded object is the header followed by the payload, which may be the memory of
+    the object itself. These can be uploaded one after the other rather than joined.
+    """
+
+    def __init__(self, buffers: Sequence[Buffer]):
+        """
+        Create a new BufferStream.
+
+        :param buffers: The buffers the file consists of, in order. Must not be modified
+            while the file is in use.
+        """
+        super().__init__()
+        self.buffers: List[memoryview] = [
+            view.cast("B") if view.format != "B" or view.ndim != 1 else view
+            for view in (memoryview(buffer) for buffer in buffers)
+            if view.nbytes
+        ]
+        self._size = sum(view.nbytes for view in self.buffers)
+        self._position = 0
+
+    def __len__(self) -> int:
+        """Return the total number of bytes in the file."""
+        return self._size
+
+    def readable(self) -> bool:
+        """Return True, as the file can be read."""
+        return True
+
+    def seekable(self) -> bool:
+        """Return True, as the file supports random access."""
+        return True
+
+    def tell(self) -> int:
+        """Return the current position in the file."""
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        """Move to the given position in the file, as `io.IOBase.seek`."""
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self._size
+        elif whence != io.SEEK_SET:
+            raise ValueError(f"Invalid whence: {whence}.")
+        if offset < 0:
+            raise ValueError(f"Negative seek position: {offset}.")
+        self._position = offset
+        return offset
+
+    def readinto(self, buffer) -> int:  # type: ignore
+        """Copy bytes from the current position into the given buffer."""
+        target = memoryview(buffer).cast("B")
+        written = 0
+        start = 0
+        for view in self.buffers:
+            end = start + view.nbytes
+            if self._position < end and written < target.nbytes:
+                offset = self._position - start
+                count = min(view.nbytes - offset, target.nbytes - written)
+                target[written : written + count] = view[offset : offset + count]
+                written += count
+                self._position += count
+            start = end
+        return written
+
+    def readall(self) -> bytes:
+        """Read all the bytes from the current position, in a single copy."""
+        slices = []
+        start = 0
+        for view in self.buffers:
+            end = start + view.nbytes
+            if self._position < end:
+                slices.append(view[max(0, self._position - start) :])
+            start = end
+        self._position = max(self._position, self._size)
+        return b"".join(slices)
+
+    def getbuffer(self) -> memoryview:
+        """
+        Return a view of all the bytes in the file.
+
+        This only avoids a copy if the file consists of a single buffer.
+        """
+        if len(self.buffers) == 1:
+            return self.buffers[0]
+        return memoryview(self.getvalue())
+
+    def getvalue(self) -> bytes:
+        """Return a copy of all the bytes in the file."""
+        return b"".join(self.buffers)
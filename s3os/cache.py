@@ -0,0 +1,468 @@
+"""Definition of the local cache of values used by S3Dict."""
+
+import collections
+import sys
+import threading
+import time
+
+from dataclasses import dataclass
+from typing import (
+    Any,
+    Dict,
+    ItemsView,
+    Iterator,
+    List,
+    MutableMapping,
+    Optional,
+    Set,
+    ValuesView,
+)
+
+from .locations import ObjectInfo
+from .metrics import record_cache_event
+
+
+@dataclass(frozen=True)
+class CachePolicy:
+    """
+    Limits on the contents of an S3Dict cache.
+
+    When a limit is exceeded, entries are evicted from the cache. Evicted entries are still
+    stored in s3, and are downloaded again the next time they are accessed.
+
+    :param max_entries: Optional. Maximum number of values to cache.
+    :param max_bytes: Optional. Maximum total size of the cached values, measured
+        approximately as the size of the values once encoded for storage. The size of
+        values that haven't been stored yet is estimated. See `estimate_size`.
+    :param ttl: Optional. Number of seconds each value is cached for before it is
+        downloaded again, so that changes made by other processes are seen.
+    :param eviction: Which values to evict first. Either "lru" (least recently used)
+        or "lfu" (least frequently used).
+    :param revalidate_after: Optional. Number of seconds each value is used for before
+        checking with s3 whether it has changed. Unlike `ttl`, unchanged values are
+        kept, so only a conditional request is made rather than downloading and
+        decoding the value again. Use 0 to check on every access.
+    """
+
+    max_entries: Optional[int] = None
+    max_bytes: Optional[int] = None
+    ttl: Optional[float] = None
+    eviction: str = "lru"
+    revalidate_after: Optional[float] = None
+
+    def __post_init__(self):
+        """Validate the policy."""
+        if self.eviction not in ("lru", "lfu"):
+            raise ValueError(
+                f"`eviction` must be 'lru' or 'lfu'. You passed: {self.eviction=}."
+            )
+
+
+@dataclass
+class CacheStats:
+    """
+    Counters describing the effectiveness of a cache.
+
+    :param hits: Number of lookups that found a value in the cache.
+    :param misses: Number of lookups that did not find a value in the cache.
+    :param evictions: Number of values removed to stay within the cache limits,
+        including values that expired.
+    :param revalidations: Number of values that were due to be revalidated, and found
+        to be unchanged in s3.
+    """
+
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    revalidations: int = 0
+
+
+@dataclass
+class CacheEntry:
+    """A single cached value, along with the information needed to evict it."""
+
+    value: Any
+    size: int
+    expiry_time: Optional[float]
+    etag: Optional[str] = None
+    content_hash: Optional[str] = None
+    revalidation_time: Optional[float] = None
+    uses: int = 0
+
+
+def estimate_size(value: Any) -> int:
+    """
+    Estimate the size of the value once encoded, without encoding it.
+
+    Used to limit the size of a cache by values that haven't been stored yet, e.g. the
+    deferred writes of an S3Dict. Buffers, e.g. bytes and numpy arrays, count their
+    size in bytes, containers the sum of their contents, and other objects their size
+    in memory.
+    """
+    total = 0
+    stack: List[Any] = [value]
+    seen: Set[int] = set()
+    while stack:
+        item = stack.pop()
+        if isinstance(item, (str, bytes, bytearray)):
+            total += len(item)
+        elif isinstance(getattr(item, "nbytes", None), int):
+            total += item.nbytes
+        elif isinstance(item, (dict, list, tuple, set, frozenset)):
+            if id(item) in seen:
+                continue
+            seen.add(id(item))
+            # Roughly one byte of separators per item.
+            total += len(item)
+            stack.extend(item)
+            if isinstance(item, dict):
+                stack.extend(item.values())
+        else:
+            total += sys.getsizeof(item)
+    return total
+
+
+class _UseCount:
+    """The keys with the same number of uses, linked to the next and previous counts."""
+
+    __slots__ = ("uses", "keys", "prev", "next")
+
+    def __init__(self, uses: int):
+        self.uses = uses
+        # Keys in the order they reached this number of uses.
+        self.keys: "collections.OrderedDict[str, None]" = collections.OrderedDict()
+        self.prev: Optional["_UseCount"] = None
+        self.next: Optional["_UseCount"] = None
+
+
+class _UseCounts:
+    """
+    Keys grouped by their number of uses, to find the least frequently used in O(1).
+
+    The groups are kept in a linked list in order of their number of uses. As each use
+    moves a key to the next group, only adjacent groups ever need to be found. Within a
+    group, keys are in the order they were last used, so ties are broken by LRU.
+    """
+
+    def __init__(self) -> None:
+        self._head: Optional[_UseCount] = None
+        self._groups: Dict[str, _UseCount] = {}
+
+    def _insert_after(self, group: _UseCount, previous: Optional[_UseCount]) -> None:
+        group.prev = previous
+        group.next = self._head if previous is None else previous.next
+        if group.next is not None:
+            group.next.prev = group
+        if previous is None:
+            self._head = group
+        else:
+            previous.next = group
+
+    def _unlink(self, group: _UseCount) -> None:
+        if group.prev is None:
+            self._head = group.next
+        else:
+            group.prev.next = group.next
+        if group.next is not None:
+            group.next.prev = group.prev
+
+    def add(self, key: str) -> None:
+        """Add a key that has not been used yet."""
+        group = self._head
+        if group is None or group.uses != 0:
+            group = _UseCount(0)
+            self._insert_after(group, None)
+        group.keys[key] = None
+        self._groups[key] = group
+
+    def use(self, key: str) -> None:
+        """Record a use of the key."""
+        group = self._groups[key]
+        following = group.next
+        if following is None or following.uses != group.uses + 1:
+            following = _UseCount(group.uses + 1)
+            self._insert_after(following, group)
+        following.keys[key] = None
+        self._groups[key] = following
+        del group.keys[key]
+        if not group.keys:
+            self._unlink(group)
+
+    def remove(self, key: str) -> None:
+        """Remove the key, if present."""
+        group = self._groups.pop(key, None)
+        if group is None:
+            return
+        del group.keys[key]
+        if not group.keys:
+            self._unlink(group)
+
+    def least_used(self) -> Optional[str]:
+        """Return the least frequently used key, or None if there are none."""
+        if self._head is None:
+            return None
+        return next(iter(self._head.keys))
+
+
+class Cache(MutableMapping[str, Any]):
+    """
+    Thread-safe mapping of keys to cached values, with optional limits on its size.
+
+    Behaves like a normal dict, except that values may disappear when they are evicted
+    to stay within the limits of the CachePolicy.
+    """
+
+    def __init__(self, policy: Optional[CachePolicy] = None):
+        """
+        Create a new Cache.
+
+        :param policy: Optional CachePolicy. If not given, the cache is unbounded.
+        """
+        self.policy: CachePolicy = policy if policy is not None else CachePolicy()
+        self.stats = CacheStats()
+        self._entries: "collections.OrderedDict[str, CacheEntry]" = (
+            collections.OrderedDict()
+        )
+        self._nbytes = 0
+        self._lock = threading.RLock()
+        self._use_counts = _UseCounts() if self.policy.eviction == "lfu" else None
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate total size of the cached values."""
+        return self._nbytes
+
+    def _is_expired(self, entry: CacheEntry) -> bool:
+        return entry.expiry_time is not None and entry.expiry_time <= time.monotonic()
+
+    def _is_stale(self, entry: CacheEntry) -> bool:
+        return (
+            entry.revalidation_time is not None
+            and entry.revalidation_time <= time.monotonic()
+        )
+
+    def _revalidation_time(self) -> Optional[float]:
+        revalidate_after = self.policy.revalidate_after
+        return None if revalidate_after is None else time.monotonic() + revalidate_after
+
+    def _remove(self, key: str) -> CacheEntry:
+        entry = self._entries.pop(key)
+        self._nbytes -= entry.size
+        if self._use_counts is not None:
+            self._use_counts.remove(key)
+        return entry
+
+    def _record_use(self, key: str) -> None:
+        self._entries[key].uses += 1
+        self._entries.move_to_end(key)
+        if self._use_counts is not None:
+            self._use_counts.use(key)
+
+    def _evict(self, key: str) -> None:
+        self._remove(key)
+        self.stats.evictions += 1
+        record_cache_event("memory", "eviction")
+
+    def _purge_expired(self) -> None:
+        if self.policy.ttl is None:
+            return
+        for key in [
+            key for key, entry in self._entries.items() if self._is_expired(entry)
+        ]:
+            self._evict(key)
+
+    def _enforce_limits(self, newest_key: str) -> None:
+        """
+        Evict entries until the cache is within the limits of its policy.
+
+        The newest entry is only evicted if it doesn't fit in the cache on its own.
+        Otherwise it would always be the first choice for LFU eviction, as it has no uses.
+        So it is only counted for LFU eviction once the limits have been enforced.
+        """
+        max_entries = self.policy.max_entries
+        max_bytes = self.policy.max_bytes
+
+        while self._entries and (
+            (max_entries is not None and len(self._entries) > max_entries)
+            or (max_bytes is not None and self._nbytes > max_bytes)
+        ):
+            if self._use_counts is None:
+                # Entries are moved to the end on every use, so the first is the oldest.
+                candidates = (key for key in self._entries if key != newest_key)
+                victim = next(candidates, newest_key)
+            else:
+                least_used = self._use_counts.least_used()
+                victim = newest_key if least_used is None else least_used
+            self._evict(victim)
+
+        if self._use_counts is not None and newest_key in self._entries:
+            self._use_counts.add(newest_key)
+
+    def set(
+        self,
+        key: str,
+        value: Any,
+        size: int = 0,
+        etag: Optional[str] = None,
+        content_hash: Optional[str] = None,
+    ) -> None:
+        """
+        Cache the value under the key.
+
+        :param key: The key of the value.
+        :param value: The value to cache.
+        :param size: The approximate size of the value, used to enforce `max_bytes`.
+        :param etag: Optional ETag of the object the value was stored as in s3.
+            Values without an ETag can't be revalidated, so are downloaded again
+            in full once they are stale.
+        :param content_hash: Optional hash of the data of the object the value was
+            stored as in s3. See `s3os.encoding.content_hash`.
+        """
+        ttl = self.policy.ttl
+        entry = CacheEntry(
+            value=value,
+            size=size,
+            expiry_time=None if ttl is None else time.monotonic() + ttl,
+            etag=etag,
+            content_hash=content_hash,
+            revalidation_time=self._revalidation_time(),
+        )
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._nbytes += size
+            self._enforce_limits(key)
+
+    def peek(self, key: str) -> Any:
+        """
+        Return the cached value for the key, without counting it as a use.
+
+        Raises KeyError if the key is not cached.
+        """
+        with self._lock:
+            entry = self._entries[key]
+            if self._is_expired(entry):
+                self._evict(key)
+                raise KeyError(key)
+            return entry.value
+
+    def etag(self, key: str) -> Optional[str]:
+        """Return the ETag of the cached value for the key, or None if it isn't known."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self._is_expired(entry):
+                return None
+            return entry.etag
+
+    def object_info(self, key: str) -> Optional[ObjectInfo]:
+        """
+        Return the details of the object the cached value for the key was stored as.
+
+        Returns None if the key isn't cached, or its value is due to be revalidated, as
+        the object may have changed in s3 since.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self._is_expired(entry) or self._is_stale(entry):
+                return None
+            return ObjectInfo(entry.size, entry.etag, entry.content_hash)
+
+    def revalidate(self, key: str, etag: Optional[str]) -> Any:
+        """
+        Mark the cached value for the key as fresh, as s3 still has the given ETag.
+
+        Raises KeyError if the value is no longer cached, or has been replaced
+        by a value with a different ETag.
+
+        :return: The cached value.
+        """
+        with self._lock:
+            entry = self._entries[key]
+            if etag is None or entry.etag != etag or self._is_expired(entry):
+                raise KeyError(key)
+            entry.revalidation_time = self._revalidation_time()
+            self._record_use(key)
+            self.stats.revalidations += 1
+            record_cache_event("memory", "revalidation")
+            return entry.value
+
+    def __getitem__(self, key: str) -> Any:
+        """
+        Return the cached value for the key, recording a hit or miss.
+
+        Values that are due to be revalidated count as a miss, but stay cached so
+        that they can be revalidated by their ETag.
+        """
+        with self._lock:
+            try:
+                value = self.peek(key)
+                if self._is_stale(self._entries[key]):
+                    raise KeyError(key)
+            except KeyError:
+                self.stats.misses += 1
+                record_cache_event("memory", "miss")
+                raise
+
+            self.stats.hits += 1
+            record_cache_event("memory", "hit")
+            self._record_use(key)
+            return value
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        """Cache the value under the key, with no known size."""
+        self.set(key, value)
+
+    def __delitem__(self, key: str) -> None:
+        """Remove the key from the cache."""
+        with self._lock:
+            self._remove(key)
+
+    def __contains__(self, key: object) -> bool:
+        """Return True if the key is cached and has not expired."""
+        with self._lock:
+            try:
+                self.peek(key)  # type: ignore
+            except KeyError:
+                return False
+            return True
+
+    def __iter__(self) -> Iterator[str]:
+        """Iterate over the cached keys."""
+        with self._lock:
+            self._purge_expired()
+            return iter(list(self._entries))
+
+    def __len__(self) -> int:
+        """Return the number of cached values."""
+        with self._lock:
+            self._purge_expired()
+            return len(self._entries)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return a copy of the cached values, without counting them as uses."""
+        with self._lock:
+            self._purge_expired()
+            return {key: entry.value for key, entry in self._entries.items()}
+
+    # Looking at all the values isn't a use of them, so shouldn't affect the stats or
+    # eviction order. The default implementations would call `__getitem__` for each key.
+
+    def items(self) -> ItemsView[str, Any]:
+        """Return a view of a copy of the cached items."""
+        return self.snapshot().items()
+
+    def values(self) -> ValuesView[Any]:
+        """Return a view of a copy of the cached values."""
+        return self.snapshot().values()
+
+    def __eq__(self, other: object) -> bool:
+        """Compare the cached values with another mapping."""
+        if not isinstance(other, (Cache, dict)):
+            return NotImplemented
+        other_values = other.snapshot() if isinstance(other, Cache) else other
+        return self.snapshot() == other_values
+
+    def __repr__(self) -> str:
+        """Represent the cache as a dict of its contents."""
+        return repr(self.snapshot())
@@ -0,0 +1,194 @@
+"""Management of shared, reusable boto3 s3 clients."""
+
+import boto3
+import threading
+
+from botocore.config import Config
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+from .metrics import record_retries
+
+
+@dataclass(frozen=True)
+class ClientConfig:
+    """
+    Configuration of the boto3 clients created by a ClientPool.
+
+    :param max_pool_connections: Maximum number of HTTP connections kept open by
+        each client. Should be at least as large as the number of threads that
+        share the client.
+    :param tcp_keepalive: Whether to enable TCP keep-alive on pooled connections.
+        Requires a version of botocore that supports the option.
+    :param connect_timeout: Seconds to wait when opening a new connection.
+    :param read_timeout: Seconds to wait when reading from an open connection.
+    :param endpoint_url: Optional. Alternative s3 endpoint to use, e.g. a local
+        s3-compatible server.
+    :param max_attempts: Number of times botocore makes each request, including the
+        first. s3os retries requests itself, within adaptive concurrency limits (see
+        `s3os.throttling`), so by default botocore doesn't retry. Requests made by the
+        s3transfer manager for large uploads are then retried by s3os as a whole.
+    """
+
+    max_pool_connections: int = 10
+    tcp_keepalive: bool = False
+    connect_timeout: float = 60
+    read_timeout: float = 60
+    endpoint_url: Optional[str] = None
+    max_attempts: int = 1
+
+    def to_botocore_config(self) -> Config:
+        """Convert this configuration into a botocore Config object."""
+        kwargs: Dict[str, Any] = dict(
+            max_pool_connections=self.max_pool_connections,
+            connect_timeout=self.connect_timeout,
+            read_timeout=self.read_timeout,
+            # botocore before 1.15 only accepts `max_attempts`, which counts retries
+            # rather than attempts.
+            retries={"max_attempts": self.max_attempts - 1},
+        )
+        # Older versions of botocore don't know about this option at all,
+        # so only pass it through when it's actually wanted.
+        if self.tcp_keepalive:
+            kwargs["tcp_keepalive"] = True
+        return Config(**kwargs)
+
+
+class ClientPool:
+    """
+    Thread-safe pool of s3 clients, with one client per region and set of credentials.
+
+    boto3 clients are safe to share between threads, but creating one is expensive:
+    the service model is loaded and a fresh HTTP connection pool is built every time.
+    This pool creates each client once and then hands the same client out to all callers.
+
+    Clients are looked up without locking, so that threads making requests don't wait
+    on each other. The lock is only taken to create a client, or when the credentials
+    of the session have changed.
+    """
+
+    def __init__(
+        self,
+        config: Optional[ClientConfig] = None,
+        session: Optional[boto3.session.Session] = None,
+    ):
+        """
+        Create a new ClientPool.
+
+        :param config: Optional ClientConfig. See ClientConfig for default behaviour.
+        :param session: Optional boto3 Session to create clients from.
+            If not given, a new Session using the default credential chain is used.
+        """
+        self.config: ClientConfig = config if config is not None else ClientConfig()
+        self._session = session
+        self._clients: Dict[Tuple[Optional[str], Tuple[Any, ...]], Any] = {}
+        # The credentials and client last handed out for each region.
+        self._latest: Dict[Optional[str], Tuple[Any, Any]] = {}
+        # boto3 sessions are not thread-safe, so all client creation happens under this lock.
+        self._lock = threading.Lock()
+
+    @property
+    def session(self) -> boto3.session.Session:
+        """The boto3 Session used to create clients. Must be created under the lock."""
+        if self._session is None:
+            self._session = boto3.session.Session()
+        return self._session
+
+    @staticmethod
+    def _credentials_key(credentials: Any) -> Tuple[Any, ...]:
+        """Return a hashable identifier of the current values of the credentials."""
+        if credentials is None:
+            return ()
+        frozen = credentials.get_frozen_credentials()
+        return frozen.access_key, frozen.secret_key, frozen.token
+
+    def get_client(self, region: Optional[str] = None) -> Any:
+        """
+        Return the shared s3 client for the given region, creating it if needed.
+
+        :param region: Optional AWS region name. If not given, the default region
+            of the session is used.
+        """
+        latest = self._latest.get(region)
+        # Credentials are loaded by the session under the lock the first time, after
+        # which getting them is a read of the same object. Refreshable credentials stay
+        # the same object when they are refreshed, and clients use the new ones.
+        if latest is not None and latest[0] is self.session.get_credentials():
+            return latest[1]
+
+        with self._lock:
+            credentials = self.session.get_credentials()
+            key = (region, self._credentials_key(credentials))
+            try:
+                client = self._clients[key]
+            except KeyError:
+                pass
+            else:
+                self._latest[region] = (credentials, client)
+                return client
+
+            client = self.session.client(
+                "s3",
+                region_name=region,
+                endpoint_url=self.config.endpoint_url,
+                config=self.config.to_botocore_config(),
+            )
+            # Emitted after every request, including those of the s3transfer manager.
+            client.meta.events.register("after-call.s3", _record_retries)
+            self._clients[key] = client
+            self._latest[region] = (credentials, client)
+            return client
+
+    def clear(self) -> None:
+        """
+        Discard all clients in the pool.
+
+        Connections are released once any callers still holding a client are finished with it.
+        """
+        with self._lock:
+            self._latest.clear()
+            self._clients.clear()
+
+
+def _record_retries(parsed: Any = None, model: Any = None, **kwargs: Any) -> None:
+    """Count the retries of a request made by a client. Handles `after-call` events."""
+    retries = (parsed or {}).get("ResponseMetadata", {}).get("RetryAttempts", 0)
+    if retries:
+        record_retries(retries, model.name)
+
+
+_default_pool = ClientPool()
+_default_pool_lock = threading.Lock()
+
+
+def get_client_pool() -> ClientPool:
+    """Return the ClientPool used by all s3os operations."""
+    return _default_pool
+
+
+def configure_client_pool(
+    config: Optional[ClientConfig] = None,
+    session: Optional[boto3.session.Session] = None,
+) -> ClientPool:
+    """
+    Replace the ClientPool used by all s3os operations.
+
+    Clients held by the previous pool are discarded.
+
+    :param config: Optional ClientConfig for the new pool.
+    :param session: Optional boto3 Session for the new pool.
+    :return: The new ClientPool.
+    """
+    global _default_pool
+
+    with _default_pool_lock:
+        old_pool = _default_pool
+        _default_pool = ClientPool(config=config, session=session)
+
+    old_pool.clear()
+    return _default_pool
+
+
+def get_client(region: Optional[str] = None) -> Any:
+    """Return the shared s3 client for the given region."""
+    return _default_pool.get_client(region)
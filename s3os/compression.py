@@ -0,0 +1,234 @@
+"""Definition of compression algorithms applied to encoded objects before upload."""
+
+import gzip
+import importlib
+import io
+import zlib
+
+from dataclasses import dataclass
+from typing import Any, BinaryIO, Callable, Dict, List, Optional
+
+from .buffers import Buffer
+
+# Optional dependencies are imported by name, so that their types are the same
+# whether or not they are installed.
+try:
+    zstandard: Any = importlib.import_module("zstandard")
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+try:
+    lz4_frame: Any = importlib.import_module("lz4.frame")
+except ImportError:  # pragma: no cover
+    lz4_frame = None
+
+
+@dataclass(frozen=True)
+class Compressor:
+    """
+    Definition of a compression algorithm.
+
+    :param id: Short unique name of the algorithm, recorded in the header of stored objects.
+    :param compress: Function to compress a bytes-like object at the given level.
+        A level of None means the algorithm's default level.
+    :param decompress: Function to decompress a bytes-like object.
+    :param compress_stream: Optional. Function to wrap a writable binary file, so that
+        data written to the wrapper is compressed at the given level into the file.
+        Closing the wrapper must flush it without closing the file.
+    :param decompress_stream: Optional. Function to wrap a readable binary file, so that
+        data read from the wrapper is decompressed incrementally from the file.
+    """
+
+    id: str
+    compress: Callable[[Buffer, Optional[int]], bytes]
+    decompress: Callable[[Buffer], bytes]
+    compress_stream: Optional[Callable[[BinaryIO, Optional[int]], BinaryIO]] = None
+    decompress_stream: Optional[Callable[[BinaryIO], BinaryIO]] = None
+
+
+@dataclass(frozen=True)
+class CompressionConfig:
+    """
+    Configuration of compression of stored objects.
+
+    :param algorithm: ID of the compression algorithm to use.
+        See `s3os.compression.available_compressors()`.
+    :param level: Optional. Compression level, with a meaning specific to the algorithm.
+        If not given, the algorithm's default level is used.
+    :param min_size: Encoded objects smaller than this number of bytes are not compressed,
+        as the saving is not worth the CPU time.
+    """
+
+    algorithm: str = "zlib"
+    level: Optional[int] = None
+    min_size: int = 1024
+
+
+_compressors: Dict[str, Compressor] = {}
+
+
+def register_compressor(compressor: Compressor) -> None:
+    """Make the given compression algorithm available."""
+    if not compressor.id.isidentifier():
+        raise ValueError(
+            f"Compressor IDs must be valid identifiers. You passed: {compressor.id=}."
+        )
+    _compressors[compressor.id] = compressor
+
+
+def get_compressor(compressor_id: str) -> Compressor:
+    """Return the registered compression algorithm with the given ID."""
+    try:
+        return _compressors[compressor_id]
+    except KeyError:
+        raise ValueError(
+            f"Unknown compression algorithm {compressor_id!r}. "
+            f"Available algorithms: {available_compressors()}."
+        ) from None
+
+
+def available_compressors() -> List[str]:
+    """Return the IDs of all registered compression algorithms."""
+    return sorted(_compressors)
+
+
+#: Number of compressed bytes read from the underlying file at a time when streaming.
+STREAM_CHUNK_SIZE = 2 ** 16
+
+
+class _ZlibWriter(io.RawIOBase):
+    """Writable file that compresses data with zlib into another file."""
+
+    def __init__(self, file: BinaryIO, level: Optional[int]):
+        self._file = file
+        self._compressor = zlib.compressobj(-1 if level is None else level)
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:  # type: ignore
+        self._file.write(self._compressor.compress(data))
+        return len(data)
+
+    def close(self) -> None:
+        if not self.closed:
+            self._file.write(self._compressor.flush())
+        super().close()
+
+
+class _ZlibReader(io.RawIOBase):
+    """Readable file that decompresses zlib data from another file."""
+
+    def __init__(self, file: BinaryIO):
+        self._file = file
+        self._decompressor = zlib.decompressobj()
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:  # type: ignore
+        data = b""
+        while not data and not self._decompressor.eof:
+            compressed = self._decompressor.unconsumed_tail or self._file.read(
+                STREAM_CHUNK_SIZE
+            )
+            if not compressed:
+                raise EOFError("Compressed data ended before the end of the stream.")
+            data = self._decompressor.decompress(compressed, len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+
+def _zlib_compress(data: Buffer, level: Optional[int]) -> bytes:
+    return zlib.compress(data, -1 if level is None else level)
+
+
+def _gzip_compress(data: Buffer, level: Optional[int]) -> bytes:
+    return gzip.compress(data, 9 if level is None else level, mtime=0)
+
+
+def _zlib_compress_stream(file: BinaryIO, level: Optional[int]) -> BinaryIO:
+    return io.BufferedWriter(_ZlibWriter(file, level))
+
+
+def _zlib_decompress_stream(file: BinaryIO) -> BinaryIO:
+    return io.BufferedReader(_ZlibReader(file))
+
+
+def _gzip_compress_stream(file: BinaryIO, level: Optional[int]) -> BinaryIO:
+    return gzip.GzipFile(  # type: ignore
+        fileobj=file, mode="wb", compresslevel=9 if level is None else level, mtime=0
+    )
+
+
+def _gzip_decompress_stream(file: BinaryIO) -> BinaryIO:
+    return gzip.GzipFile(fileobj=file, mode="rb")  # type: ignore
+
+
+register_compressor(
+    Compressor(
+        "zlib",
+        _zlib_compress,
+        zlib.decompress,
+        _zlib_compress_stream,
+        _zlib_decompress_stream,
+    )
+)
+register_compressor(
+    Compressor(
+        "gzip",
+        _gzip_compress,
+        gzip.decompress,
+        _gzip_compress_stream,
+        _gzip_decompress_stream,
+    )
+)
+
+if zstandard is not None:
+
+    def _zstd_compress(data: Buffer, level: Optional[int]) -> bytes:
+        return zstandard.ZstdCompressor(level=3 if level is None else level).compress(
+            data
+        )
+
+    def _zstd_decompress(data: Buffer) -> bytes:
+        # Streamed frames don't record their content size, which `decompress` requires.
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+
+    def _zstd_compress_stream(file: BinaryIO, level: Optional[int]) -> BinaryIO:
+        compressor = zstandard.ZstdCompressor(level=3 if level is None else level)
+        return compressor.stream_writer(file, closefd=False)
+
+    def _zstd_decompress_stream(file: BinaryIO) -> BinaryIO:
+        return zstandard.ZstdDecompressor().stream_reader(file, closefd=False)
+
+    register_compressor(
+        Compressor(
+            "zstd",
+            _zstd_compress,
+            _zstd_decompress,
+            _zstd_compress_stream,
+            _zstd_decompress_stream,
+        )
+    )
+
+if lz4_frame is not None:
+
+    def _lz4_compress(data: Buffer, level: Optional[int]) -> bytes:
+        return lz4_frame.compress(data, compression_level=level or 0)
+
+    def _lz4_compress_stream(file: BinaryIO, level: Optional[int]) -> BinaryIO:
+        return lz4_frame.LZ4FrameFile(file, "wb", compression_level=level or 0)
+
+    def _lz4_decompress_stream(file: BinaryIO) -> BinaryIO:
+        return lz4_frame.LZ4FrameFile(file, "rb")
+
+    register_compressor(
+        Compressor(
+            "lz4",
+            _lz4_compress,
+            lz4_frame.decompress,
+            _lz4_compress_stream,
+            _lz4_decompress_stream,
+        )
+    )
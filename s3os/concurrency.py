@@ -0,0 +1,193 @@
+"""Helpers for running many s3 operations concurrently."""
+
+import collections
+import threading
+
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Executor,
+    Future,
+    ThreadPoolExecutor,
+    wait,
+)
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Generator,
+    Iterable,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+)
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+#: Default number of threads in the shared executor.
+#: Matches the default connection pool size of s3 clients.
+DEFAULT_MAX_WORKERS = 10
+#: Default number of operations a single bulk call has in flight at once.
+DEFAULT_MAX_CONCURRENCY = 10
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+_max_workers = DEFAULT_MAX_WORKERS
+_worker_state = threading.local()
+
+
+def _mark_worker() -> None:
+    _worker_state.is_worker = True
+
+
+def new_worker_executor(
+    max_workers: int, thread_name_prefix: str
+) -> ThreadPoolExecutor:
+    """
+    Create a thread pool whose threads make any bulk operations of their own inline.
+
+    Use this for pools whose calls may be waited on by calls on the shared executor,
+    so that they never wait on the shared executor in turn. See `bounded_map`.
+    """
+    return ThreadPoolExecutor(
+        max_workers=max_workers,
+        thread_name_prefix=thread_name_prefix,
+        initializer=_mark_worker,
+    )
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Return the executor shared by all s3os bulk operations, creating it if needed."""
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = new_worker_executor(_max_workers, "s3os")
+        return _executor
+
+
+class _InlineExecutor(Executor):
+    """Executor that makes each call as soon as it is submitted, in the caller's thread."""
+
+    def submit(self, fn: Callable[..., R], *args: Any, **kwargs: Any) -> "Future[R]":
+        future: "Future[R]" = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as err:
+            future.set_exception(err)
+        return future
+
+
+def configure_executor(max_workers: int = DEFAULT_MAX_WORKERS) -> None:
+    """
+    Set the number of threads in the executor shared by all s3os bulk operations.
+
+    This is the limit on the number of concurrent s3 requests made by the whole process.
+    The `max_pool_connections` of the ClientConfig should be at least this large.
+    Operations already running on the previous executor are allowed to finish.
+    """
+    global _executor, _max_workers
+
+    if max_workers < 1:
+        raise ValueError(
+            f"`max_workers` must be at least 1. You passed: {max_workers=}."
+        )
+
+    with _executor_lock:
+        old_executor = _executor
+        _executor = None
+        _max_workers = max_workers
+
+    if old_executor is not None:
+        old_executor.shutdown(wait=False)
+
+
+def bounded_map(
+    function: Callable[[T], R],
+    items: Iterable[T],
+    max_in_flight: Optional[int] = None,
+    ordered: bool = False,
+    executor: Optional[Executor] = None,
+) -> Generator[Tuple[T, "Future[R]"], None, None]:
+    """
+    Call `function` on each of `items` concurrently.
+
+    At most `max_in_flight` calls are submitted but not yet yielded at any time, so memory
+    use stays flat however many items there are. `items` is consumed lazily, so slow
+    producers (e.g. paginated listings) overlap with the calls already in flight.
+
+    If the generator is closed early, calls that have not yet started are cancelled.
+
+    Calls made from threads of the shared executor, or of any pool made by
+    `new_worker_executor`, are made inline one by one rather than on the shared executor.
+    Otherwise nested bulk operations, e.g. reloading the index of a packed S3Dict while
+    fetching its values, could wait on each other for a free worker and deadlock.
+
+    NB: `function` must not itself wait on other calls submitted to an explicitly given
+    executor, or that executor may deadlock.
+
+    :param function: Function to call on each item.
+    :param items: Iterable of items to call the function on.
+    :param max_in_flight: Maximum number of outstanding calls.
+        Defaults to DEFAULT_MAX_CONCURRENCY.
+    :param ordered: If True, results are yielded in the same order as `items`.
+        Otherwise results are yielded as soon as they complete.
+    :param executor: Optional executor to run the calls on.
+        Defaults to the executor shared by all s3os bulk operations, unless called from
+        a worker thread, in which case the calls are made inline.
+    :return: Generator of (item, future) pairs. Each future is already complete.
+        Call `future.result()` to get the result of the call or raise its exception.
+    """
+    if max_in_flight is None:
+        max_in_flight = DEFAULT_MAX_CONCURRENCY
+    elif max_in_flight < 1:
+        raise ValueError(
+            f"`max_in_flight` must be at least 1. You passed: {max_in_flight=}."
+        )
+    if executor is None:
+        if getattr(_worker_state, "is_worker", False):
+            executor = _InlineExecutor()
+        else:
+            executor = get_executor()
+
+    iterator = iter(items)
+    in_flight: Deque[Tuple[T, "Future[R]"]] = collections.deque()
+
+    def submit_next() -> bool:
+        """Submit the next item to the executor. Return False if there are none left."""
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return False
+        in_flight.append((item, executor.submit(function, item)))
+        return True
+
+    try:
+        while len(in_flight) < max_in_flight and submit_next():
+            pass
+
+        while in_flight:
+            if ordered:
+                item, future = in_flight.popleft()
+                wait([future])
+            else:
+                done: Set["Future[R]"] = wait(
+                    [future for _, future in in_flight], return_when=FIRST_COMPLETED
+                ).done
+                # Find the completed future by identity, as items may not be comparable.
+                index = next(
+                    index
+                    for index, (_, future) in enumerate(in_flight)
+                    if future in done
+                )
+                item, future = in_flight[index]
+                del in_flight[index]
+
+            # Top up the window before handing control back to the caller, so the
+            # workers stay busy while the caller deals with this result.
+            submit_next()
+            yield item, future
+    finally:
+        for _, future in in_flight:
+            future.cancel()
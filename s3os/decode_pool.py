@@ -0,0 +1,250 @@
+"""
+Decoding of downloaded objects in a pool of processes.
+
+Decoding some codecs, e.g. YAML, is pure Python, so bulk reads on many threads are
+limited by the GIL to one core's worth of decoding however fast the downloads are.
+`decode_in_processes` takes the encoded data downloaded by threads and decodes it in
+a pool of worker processes instead, in batches, so decoding scales with the number of
+cores. Payloads smaller than the `min_size` of the DecodeConfig are decoded in the
+calling thread, as sending them to another process costs more than decoding them.
+
+NB: Worker processes only know the codecs and compressors registered when s3os is
+imported. Codecs registered with `register_codec` at runtime must also be registered
+on import of a module the worker processes import, or their objects fail to decode.
+"""
+
+import collections
+import os
+import threading
+
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from dataclasses import dataclass
+from typing import (
+    Any,
+    Collection,
+    Deque,
+    Generator,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+
+from .buffers import Buffer
+from .encoding import object_from_buffer
+
+T = TypeVar("T")
+I = TypeVar("I")  # noqa: E741
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+
+@dataclass(frozen=True)
+class DecodeConfig:
+    """
+    Configuration of decoding downloaded objects in a pool of processes.
+
+    :param max_workers: Number of worker processes. Defaults to the number of CPUs.
+    :param batch_size: Number of objects sent to a worker process at once. Larger
+        batches cost less to send, but results arrive later.
+    :param min_size: Objects smaller than this many bytes when encoded are decoded in
+        the thread that downloaded them instead.
+    """
+
+    max_workers: Optional[int] = None
+    batch_size: int = 16
+    min_size: int = 64 * 1024
+
+    def __post_init__(self):
+        """Validate the config."""
+        if self.max_workers is not None and self.max_workers < 1:
+            raise ValueError(
+                f"`max_workers` must be at least 1. You passed: {self.max_workers=}."
+            )
+        if self.batch_size < 1:
+            raise ValueError(
+                f"`batch_size` must be at least 1. You passed: {self.batch_size=}."
+            )
+        if self.min_size < 0:
+            raise ValueError(
+                f"`min_size` must be at least 0. You passed: {self.min_size=}."
+            )
+
+    @property
+    def workers(self) -> int:
+        """The number of worker processes to use."""
+        return self.max_workers or os.cpu_count() or 1
+
+
+def get_decode_pool(max_workers: int) -> ProcessPoolExecutor:
+    """
+    Return the pool of processes shared by all decoding, creating it if needed.
+
+    The pool is replaced if a different number of workers is asked for, or if it is
+    broken because a worker process died. Decoding already running on the previous
+    pool is allowed to finish.
+    """
+    global _pool, _pool_workers
+
+    with _pool_lock:
+        old_pool = None
+        # ProcessPoolExecutor has no public way to tell whether it is broken.
+        if _pool is not None and (
+            _pool_workers != max_workers or getattr(_pool, "_broken", False)
+        ):
+            old_pool, _pool = _pool, None
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=max_workers)
+            _pool_workers = max_workers
+
+    if old_pool is not None:
+        old_pool.shutdown(wait=False)
+    return _pool
+
+
+def _decode_batch(
+    payloads: List[bytes], allowed_codecs: Optional[Collection[str]]
+) -> List[Tuple[bool, Any]]:
+    """
+    Decode each payload in a worker process, with the codecs allowed.
+
+    :return: For each payload, whether it was decoded, and either the object or the
+        exception raised decoding it.
+    """
+    outcomes: List[Tuple[bool, Any]] = []
+    for payload in payloads:
+        try:
+            outcomes.append((True, object_from_buffer(payload, allowed_codecs)))
+        except Exception as err:
+            outcomes.append((False, err))
+    return outcomes
+
+
+class _Batch:
+    """Encoded objects waiting to be sent to a worker process together."""
+
+    def __init__(self) -> None:
+        """Create a new, empty _Batch."""
+        self.payloads: List[bytes] = []
+        self.entries: List[Tuple["Future[Tuple[Any, Any]]", Any]] = []
+
+    def add(self, future: "Future[Tuple[Any, Any]]", data: Buffer, info: Any) -> None:
+        """Add the data to decode into the future, along with its info."""
+        self.payloads.append(bytes(data))
+        self.entries.append((future, info))
+
+    def submit(
+        self, pool: ProcessPoolExecutor, allowed_codecs: Optional[Collection[str]]
+    ) -> None:
+        """Send the batch to a worker process, and resolve its futures once decoded."""
+        entries = self.entries
+
+        def resolve(batch_future: "Future[List[Tuple[bool, Any]]]") -> None:
+            try:
+                outcomes = batch_future.result()
+            except BaseException as err:
+                # E.g. a worker process died. Every object in the batch failed.
+                for future, _ in entries:
+                    future.set_exception(err)
+                return
+            for (future, info), (ok, value) in zip(entries, outcomes):
+                if ok:
+                    future.set_result((value, info))
+                else:
+                    future.set_exception(value)
+
+        try:
+            batch_future = pool.submit(_decode_batch, self.payloads, allowed_codecs)
+        except Exception as err:
+            # E.g. the pool broke since it was handed out.
+            for future, _ in entries:
+                future.set_exception(err)
+        else:
+            batch_future.add_done_callback(resolve)
+        self.payloads = []
+        self.entries = []
+
+
+def decode_in_processes(
+    downloads: Iterable[Tuple[T, "Future[Tuple[Buffer, I]]"]],
+    config: DecodeConfig,
+    ordered: bool = False,
+    allowed_codecs: Optional[Collection[str]] = None,
+) -> Generator[Tuple[T, "Future[Tuple[Any, I]]"], None, None]:
+    """
+    Decode downloaded objects, in a pool of processes if they are large enough.
+
+    Designed to be given the results of `bounded_map` of a download function, so that
+    downloads run on threads while earlier objects are decoded. Downloads are consumed
+    as decoding keeps up, so at most a few batches per worker are held at once.
+
+    :param downloads: Iterable of (item, future) pairs, whose futures are complete
+        with the encoded data of an object and any info about it, e.g. an ObjectInfo.
+        Failed downloads are passed through with their exception.
+    :param config: DecodeConfig of the pool and batches.
+    :param ordered: If True, results are yielded in the same order as `downloads`.
+        Otherwise results are yielded as soon as they are decoded.
+    :param allowed_codecs: Optional. IDs of the codecs allowed to decode objects.
+        See `s3os.encoding.object_from_buffer`.
+    :return: Generator of (item, future) pairs. Each future is already complete with
+        the decoded object and its info. Call `future.result()` to get them or raise
+        the exception of the download or decoding.
+    """
+    batch = _Batch()
+    pending: Deque[Tuple[T, "Future[Tuple[Any, I]]"]] = collections.deque()
+    max_pending = config.batch_size * config.workers * 2
+
+    def submit_batch() -> None:
+        if batch.entries:
+            batch.submit(get_decode_pool(config.workers), allowed_codecs)
+
+    def pop_completed(
+        block: bool,
+    ) -> Generator[Tuple[T, "Future[Tuple[Any, I]]"], None, None]:
+        """Yield the pending results that are complete, waiting for one if `block`."""
+        if block:
+            # Anything left in the batch would never complete otherwise.
+            submit_batch()
+            if ordered:
+                wait([pending[0][1]])
+            else:
+                wait([future for _, future in pending], return_when=FIRST_COMPLETED)
+
+        if ordered:
+            while pending and pending[0][1].done():
+                yield pending.popleft()
+        else:
+            # Split by whether each future is done, as items may not be comparable.
+            completed: List[Tuple[T, "Future[Tuple[Any, I]]"]] = []
+            waiting: List[Tuple[T, "Future[Tuple[Any, I]]"]] = []
+            for entry in pending:
+                (completed if entry[1].done() else waiting).append(entry)
+            pending.clear()
+            pending.extend(waiting)
+            yield from completed
+
+    for item, download in downloads:
+        future: "Future[Tuple[Any, I]]" = Future()
+        future.set_running_or_notify_cancel()
+        try:
+            data, info = download.result()
+        except Exception as err:
+            future.set_exception(err)
+        else:
+            if len(data) < config.min_size:
+                try:
+                    future.set_result((object_from_buffer(data, allowed_codecs), info))
+                except Exception as err:
+                    future.set_exception(err)
+            else:
+                batch.add(future, data, info)
+                if len(batch.entries) >= config.batch_size:
+                    submit_batch()
+        pending.append((item, future))
+        yield from pop_completed(block=len(pending) >= max_pending)
+
+    while pending:
+        yield from pop_completed(block=True)
@@ -0,0 +1,241 @@
+"""
+Definition of a cache of encoded objects on local disk, shared between processes.
+
+Each object is stored in its own file, named by a hash of its bucket and key, along with
+the ETag of the object it is a copy of. Files are written to a temporary file and then
+atomically renamed into place, so readers in other processes only ever see complete
+files. Least recently used files are removed once the cache grows past its size limit.
+
+Large files are memory-mapped rather than read, so objects that can share memory with
+their encoded data (e.g. numpy arrays) are paged in from disk as they are used. The
+ETag is padded so that the data starts as aligned as the mapping. Files are only ever
+replaced or removed, never modified, so mapped files don't change under their readers.
+"""
+
+import hashlib
+import logging
+import mmap
+import os
+import tempfile
+import threading
+import time
+
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from .buffers import Buffer
+from .cache import CacheStats
+from .encoding import PAYLOAD_ALIGNMENT
+from .locations import DEFAULT_BACKEND, ObjectLocation
+from .metrics import record_cache_event
+
+log = logging.getLogger(__name__)
+
+#: Once the cache is over its size limit, files are removed until it is this fraction
+#: of the limit, so that the cache directory isn't scanned on every write.
+EVICTION_LOW_WATERMARK = 0.9
+#: The cache directory is scanned at least this often (in seconds) while writing, to
+#: account for files written by other processes.
+SCAN_INTERVAL = 60
+#: Files of at least this many bytes are memory-mapped rather than read into memory.
+MMAP_MIN_SIZE = 2 ** 20
+TEMP_PREFIX = ".tmp-"
+#: Temporary files older than this (in seconds) were left behind by writers that crashed
+#: before renaming them into place, and are removed when the cache is next scanned.
+STALE_TEMP_FILE_AGE = 5 * 60
+
+
+@dataclass(frozen=True)
+class DiskCacheConfig:
+    """
+    Configuration of a cache of encoded objects on local disk.
+
+    Any number of processes may share the same directory.
+
+    :param directory: Directory to store the cached objects in. Created if needed.
+    :param max_bytes: Approximate maximum total size of the cached objects.
+    """
+
+    directory: str
+    max_bytes: int = 2 ** 30
+
+
+def _data_offset(etag_length: int) -> int:
+    """Return the offset of the data in a cache file, after its ETag and padding."""
+    return -(-(2 + etag_length) // PAYLOAD_ALIGNMENT) * PAYLOAD_ALIGNMENT
+
+
+class DiskCache:
+    """Cache of the encoded data of objects on local disk, validated by their ETag."""
+
+    def __init__(self, config: DiskCacheConfig):
+        """
+        Create a new DiskCache.
+
+        :param config: DiskCacheConfig of the cache.
+        """
+        self.config = config
+        self.stats = CacheStats()
+        self._estimated_bytes: Optional[int] = None
+        self._last_scan_time = 0.0
+        self._lock = threading.Lock()
+        os.makedirs(config.directory, exist_ok=True)
+
+    def _path(self, object_location: ObjectLocation) -> str:
+        bucket = object_location.bucket
+        # Objects in s3 keep the paths they had before there were other backends.
+        if bucket.backend != DEFAULT_BACKEND:
+            name = f"{bucket.backend}\0{bucket.name}\0{object_location.key}"
+        else:
+            name = f"{bucket.name}\0{object_location.key}"
+        digest = hashlib.sha256(name.encode("utf-8")).hexdigest()
+        return os.path.join(self.config.directory, digest[:2], digest)
+
+    def get(self, object_location: ObjectLocation) -> Optional[Tuple[Buffer, str]]:
+        """
+        Return the cached data of the object, and the ETag of the object it is a copy of.
+
+        :return: Tuple of (data, etag), or None if the object is not cached. The data of
+            large objects is a read-only memoryview of the memory-mapped file.
+        """
+        path = self._path(object_location)
+        contents: Buffer
+        try:
+            with open(path, "rb") as file:
+                if os.fstat(file.fileno()).st_size >= MMAP_MIN_SIZE:
+                    contents = memoryview(
+                        mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+                    )
+                else:
+                    contents = file.read()
+        except FileNotFoundError:
+            with self._lock:
+                self.stats.misses += 1
+            record_cache_event("disk", "miss")
+            return None
+
+        try:
+            # Record the use for LRU eviction. Access times are often not updated.
+            os.utime(path)
+        except OSError:
+            pass
+
+        etag_length = int.from_bytes(contents[:2], "big")
+        etag = bytes(contents[2 : 2 + etag_length]).decode("ascii")
+        with self._lock:
+            self.stats.hits += 1
+        record_cache_event("disk", "hit")
+        return contents[_data_offset(etag_length) :], etag
+
+    def put(self, object_location: ObjectLocation, etag: str, *data: Buffer) -> None:
+        """
+        Cache the data of the object with the given ETag, replacing any older copy.
+
+        Failures to write to disk are logged, as the cache is only an optimisation.
+
+        :param data: The data of the object, which may be given in several pieces to
+            avoid joining them.
+        """
+        path = self._path(object_location)
+        encoded_etag = etag.encode("ascii")
+        offset = _data_offset(len(encoded_etag))
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(
+                prefix=TEMP_PREFIX, dir=os.path.dirname(path)
+            )
+            try:
+                with os.fdopen(fd, "wb") as file:
+                    file.write(len(encoded_etag).to_bytes(2, "big"))
+                    file.write(encoded_etag)
+                    file.write(bytes(offset - 2 - len(encoded_etag)))
+                    for piece in data:
+                        file.write(piece)
+                os.replace(temp_path, path)
+            except BaseException:
+                os.remove(temp_path)
+                raise
+        except OSError:
+            log.warning(f"Failed to cache {object_location} on disk.", exc_info=True)
+            return
+
+        self._account(offset + sum(memoryview(piece).nbytes for piece in data))
+
+    def _account(self, size: int) -> None:
+        """Record that `size` bytes were written, and evict files if over the limit."""
+        with self._lock:
+            if self._estimated_bytes is not None:
+                self._estimated_bytes += size
+            if (
+                self._estimated_bytes is not None
+                and self._estimated_bytes <= self.config.max_bytes
+                and time.monotonic() - self._last_scan_time < SCAN_INTERVAL
+            ):
+                return
+            self._estimated_bytes = self._evict()
+            self._last_scan_time = time.monotonic()
+
+    def _scan(self) -> Tuple[List[Tuple[float, int, str]], List[str]]:
+        """
+        Return the (modification time, size, path) of every cached file.
+
+        :return: Tuple of the cached files, and the paths of stale temporary files.
+        """
+        files = []
+        stale_temp_files = []
+        stale_time = time.time() - STALE_TEMP_FILE_AGE
+        for shard in os.scandir(self.config.directory):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    # Removed by another process since it was listed.
+                    continue
+                if not entry.name.startswith(TEMP_PREFIX):
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+                elif stat.st_mtime < stale_time:
+                    stale_temp_files.append(entry.path)
+        return files, stale_temp_files
+
+    def _evict(self) -> int:
+        """
+        Remove the least recently used files if the cache is over its size limit.
+
+        Stale temporary files are always removed.
+
+        :return: The total size of the remaining files.
+        """
+        files, stale_temp_files = self._scan()
+        for path in stale_temp_files:
+            try:
+                os.remove(path)
+            except OSError:
+                # Removed by another process, or can't be removed yet.
+                pass
+
+        total = sum(size for _, size, _ in files)
+        if total <= self.config.max_bytes:
+            return total
+
+        target = self.config.max_bytes * EVICTION_LOW_WATERMARK
+        for _, size, path in sorted(files):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # Another process got there first.
+                pass
+            except OSError:
+                # E.g. on Windows, files that are open or memory mapped can't be removed.
+                log.warning(
+                    f"Failed to evict {path} from the disk cache.", exc_info=True
+                )
+                continue
+            else:
+                self.stats.evictions += 1
+                record_cache_event("disk", "eviction")
+            total -= size
+        return total
@@ -1,10 +1,565 @@
 """Definition of dump and loading operations for storing objects in s3."""
 
+import hashlib
+import importlib
 import io
+import json
+import pickle
 
+from dataclasses import dataclass
 from ruamel import yaml
 
-from typing import Any
+from typing import (
+    Any,
+    BinaryIO,
+    Callable,
+    Collection,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+
+from .buffers import Buffer, BufferStream
+from .compression import CompressionConfig, get_compressor
+from .metrics import phase
+
+# Optional dependencies are imported by name, so that their types are the same
+# whether or not they are installed.
+try:
+    msgpack: Any = importlib.import_module("msgpack")
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+try:
+    numpy: Any = importlib.import_module("numpy")
+except ImportError:  # pragma: no cover
+    numpy = None
+
+
+#: Prefix of the header written before encoded objects. YAML documents never start
+#: with a null byte, so objects without this prefix are plain YAML.
+HEADER_MAGIC = b"\x00s3os"
+HEADER_VERSION = 1
+DEFAULT_CODEC = "yaml"
+#: The payloads of codecs that decode to views of their data start a multiple of this
+#: many bytes into the encoded object, so the views are as aligned as the data is.
+PAYLOAD_ALIGNMENT = 64
+
+
+@dataclass(frozen=True)
+class Codec:
+    """
+    Definition of a way to convert objects to and from bytes.
+
+    :param id: Short unique name of the codec, recorded in the header of stored objects.
+    :param encode: Function to convert an object into bytes.
+    :param decode: Function to convert bytes back into an object.
+    :param dump: Optional. Function to write an object to a binary file incrementally,
+        rather than building all its bytes in memory at once.
+    :param load: Optional. Function to read an object from a binary file incrementally.
+    :param encode_buffer: Optional. Function to expose an object as a buffer without
+        copying it, along with any fields to record in the header to decode it with.
+        Used instead of `encode` and `dump` if given.
+    :param decode_buffer: Optional. Function to create an object from a memoryview of
+        its data and the fields of its header, without copying the data.
+        Used instead of `decode` and `load` if given.
+    :param aligned: If True, the header is padded so that uncompressed payloads start
+        at a multiple of PAYLOAD_ALIGNMENT bytes. Use for codecs whose decoded objects
+        are views of their data, e.g. numpy arrays.
+    :param safe: If True (the default), decoding data from an untrusted source with
+        this codec can't run arbitrary code. Objects stored with codecs that aren't
+        safe, e.g. pickle, are only decoded if the codec is explicitly allowed.
+    """
+
+    id: str
+    encode: Optional[Callable[[Any], bytes]]
+    decode: Optional[Callable[[bytes], Any]]
+    dump: Optional[Callable[[Any, BinaryIO], None]] = None
+    load: Optional[Callable[[BinaryIO], Any]] = None
+    encode_buffer: Optional[Callable[[Any], Tuple[Buffer, Dict[str, str]]]] = None
+    decode_buffer: Optional[Callable[[memoryview, Dict[str, str]], Any]] = None
+    aligned: bool = False
+    safe: bool = True
+
+
+class CodecNotAllowedError(ValueError):
+    """Raised when decoding an object stored with a codec that isn't allowed."""
+
+
+_codecs: Dict[str, Codec] = {}
+
+
+def register_codec(codec: Codec) -> None:
+    """Make the given codec available for encoding and decoding objects."""
+    if not codec.id.isidentifier():
+        raise ValueError(
+            f"Codec IDs must be valid identifiers. You passed: {codec.id=}."
+        )
+    if codec.encode is None and codec.encode_buffer is None:
+        raise ValueError(f"Codec {codec.id!r} needs `encode` or `encode_buffer`.")
+    if codec.decode is None and codec.decode_buffer is None:
+        raise ValueError(f"Codec {codec.id!r} needs `decode` or `decode_buffer`.")
+    _codecs[codec.id] = codec
+
+
+def get_codec(codec_id: str) -> Codec:
+    """Return the registered codec with the given ID."""
+    try:
+        return _codecs[codec_id]
+    except KeyError:
+        raise ValueError(
+            f"Unknown codec {codec_id!r}. Available codecs: {available_codecs()}."
+        ) from None
+
+
+def available_codecs() -> List[str]:
+    """Return the IDs of all registered codecs."""
+    return sorted(_codecs)
+
+
+def get_decoding_codec(
+    codec_id: str, allowed_codecs: Optional[Collection[str]] = None
+) -> Codec:
+    """
+    Return the registered codec with the given ID, if it is allowed to decode objects.
+
+    :param codec_id: ID of the codec recorded in the header of an object.
+    :param allowed_codecs: Optional. IDs of the codecs allowed to decode objects.
+        Defaults to every codec that is safe to decode untrusted data with, which
+        excludes pickle.
+    """
+    codec = get_codec(codec_id)
+    allowed = codec.safe if allowed_codecs is None else codec_id in allowed_codecs
+    if not allowed:
+        raise CodecNotAllowedError(
+            f"Objects stored with codec {codec_id!r} are not allowed to be decoded. "
+            f"Pass `allowed_codecs` including it to decode objects from trusted sources."
+        )
+    return codec
+
+
+def _yaml_encode(obj: Any) -> bytes:
+    return yaml.safe_dump(obj, encoding="utf-8")
+
+
+def _json_encode(obj: Any) -> bytes:
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+def _pickle_encode(obj: Any) -> bytes:
+    return pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _bytes_encode(obj: Any) -> bytes:
+    if not isinstance(obj, (bytes, bytearray, memoryview)):
+        raise TypeError(
+            f"The bytes codec can only store bytes-like objects. Got {obj!r}."
+        )
+    return bytes(obj)
+
+
+def _bytes_encode_buffer(obj: Any) -> Tuple[Buffer, Dict[str, str]]:
+    if not isinstance(obj, (bytes, bytearray, memoryview)):
+        raise TypeError(
+            f"The bytes codec can only store bytes-like objects. Got {obj!r}."
+        )
+    return obj, {}
+
+
+def _bytes_decode_buffer(data: memoryview, fields: Dict[str, str]) -> Any:
+    # Copied, so that values are immutable bytes independent of the downloaded data,
+    # e.g. of a memory-mapped disk cache file. Use the ndarray codec to avoid the copy.
+    return bytes(data)
+
+
+def _yaml_dump(obj: Any, file: BinaryIO) -> None:
+    yaml.safe_dump(obj, stream=file, encoding="utf-8")
+
+
+def _json_dump(obj: Any, file: BinaryIO) -> None:
+    text_file = io.TextIOWrapper(file, encoding="utf-8")
+    json.dump(obj, text_file, separators=(",", ":"))
+    # Don't let the wrapper close the underlying file.
+    text_file.flush()
+    text_file.detach()
+
+
+def _json_load(file: BinaryIO) -> Any:
+    text_file = io.TextIOWrapper(file, encoding="utf-8")
+    obj = json.load(text_file)
+    text_file.detach()
+    return obj
+
+
+def _pickle_dump(obj: Any, file: BinaryIO) -> None:
+    pickle.dump(obj, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _bytes_dump(obj: Any, file: BinaryIO) -> None:
+    if not isinstance(obj, (bytes, bytearray, memoryview)):
+        raise TypeError(
+            f"The bytes codec can only store bytes-like objects. Got {obj!r}."
+        )
+    file.write(obj)
+
+
+register_codec(Codec("yaml", _yaml_encode, yaml.safe_load, _yaml_dump, yaml.safe_load))
+register_codec(Codec("json", _json_encode, json.loads, _json_dump, _json_load))
+# NB: Unpickling data can execute arbitrary code. Only read pickled objects from
+# buckets that are written to by trusted sources.
+register_codec(
+    Codec("pickle", _pickle_encode, pickle.loads, _pickle_dump, pickle.load, safe=False)
+)
+register_codec(
+    Codec(
+        "bytes",
+        _bytes_encode,
+        bytes,
+        _bytes_dump,
+        encode_buffer=_bytes_encode_buffer,
+        decode_buffer=_bytes_decode_buffer,
+    )
+)
+
+if msgpack is not None:
+
+    def _msgpack_encode(obj: Any) -> bytes:
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def _msgpack_decode(data: bytes) -> Any:
+        return msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+    def _msgpack_load(file: BinaryIO) -> Any:
+        unpacker = msgpack.Unpacker(file, raw=False, strict_map_key=False)
+        return unpacker.unpack()
+
+    register_codec(
+        Codec(
+            "msgpack",
+            _msgpack_encode,
+            _msgpack_decode,
+            lambda obj, file: msgpack.pack(obj, file, use_bin_type=True),
+            _msgpack_load,
+        )
+    )
+
+
+if numpy is not None:
+
+    def _ndarray_encode_buffer(obj: Any) -> Tuple[Buffer, Dict[str, str]]:
+        if not isinstance(obj, numpy.ndarray):
+            raise TypeError(
+                f"The ndarray codec can only store numpy arrays. Got {obj!r}."
+            )
+        if obj.dtype.hasobject or obj.dtype.fields is not None:
+            raise TypeError(
+                f"The ndarray codec can't store arrays of dtype {obj.dtype}. "
+                f"Use the pickle codec instead."
+            )
+        # Only copies arrays that aren't already contiguous, e.g. slices.
+        array = obj if obj.flags.c_contiguous else obj.copy(order="C")
+        fields = {
+            "dtype": array.dtype.str,
+            "shape": ",".join(str(dimension) for dimension in array.shape),
+        }
+        return array.reshape(-1).view(numpy.uint8).data, fields
+
+    def _ndarray_decode_buffer(data: memoryview, fields: Dict[str, str]) -> Any:
+        shape = tuple(
+            int(dimension) for dimension in fields["shape"].split(",") if dimension
+        )
+        return numpy.frombuffer(data, dtype=fields["dtype"]).reshape(shape)
+
+    register_codec(
+        Codec(
+            "ndarray",
+            None,
+            None,
+            encode_buffer=_ndarray_encode_buffer,
+            decode_buffer=_ndarray_decode_buffer,
+            aligned=True,
+        )
+    )
+
+
+def _encode(codec: Codec, obj: Any) -> Tuple[Buffer, Dict[str, str]]:
+    """Encode the object with the codec, avoiding copies if it supports buffers."""
+    if codec.encode_buffer is not None:
+        return codec.encode_buffer(obj)
+    return codec.encode(obj), {}  # type: ignore
+
+
+def _decode(codec: Codec, payload: Buffer, fields: Dict[str, str]) -> Any:
+    """Decode the payload with the codec, avoiding copies if it supports buffers."""
+    if codec.decode_buffer is not None:
+        return codec.decode_buffer(memoryview(payload), fields)
+    if not isinstance(payload, bytes):
+        payload = bytes(payload)
+    return codec.decode(payload)  # type: ignore
+
+
+def encode_header(fields: Dict[str, str], align: bool = False) -> bytes:
+    """
+    Create the header describing how an object is encoded.
+
+    The header is the magic prefix, a version byte, the length of the fields and then
+    the fields themselves as `key=value` pairs separated by `;`.
+
+    :param align: If True, the fields are padded with extra separators so that the
+        header is a multiple of PAYLOAD_ALIGNMENT bytes long.
+    """
+    body = ";".join(f"{key}={value}" for key, value in fields.items()).encode("ascii")
+    if align:
+        prefix_length = len(HEADER_MAGIC) + 3
+        body += b";" * (-(prefix_length + len(body)) % PAYLOAD_ALIGNMENT)
+    if len(body) > 0xFFFF:
+        raise ValueError(f"Object header is too large. {fields=}.")
+    return HEADER_MAGIC + bytes([HEADER_VERSION]) + len(body).to_bytes(2, "big") + body
+
+
+def split_header(data: Buffer) -> Tuple[Dict[str, str], Buffer]:
+    """
+    Split encoded object data into its header fields and payload.
+
+    The payload is a slice of the data, so is only a copy if `data` is `bytes`.
+    Data without a header is assumed to be plain YAML.
+    """
+    if bytes(data[: len(HEADER_MAGIC)]) != HEADER_MAGIC:
+        return {"codec": "yaml"}, data
+
+    offset = len(HEADER_MAGIC)
+    version = data[offset]
+    if version != HEADER_VERSION:
+        raise ValueError(f"Unsupported object header version: {version}.")
+    length = int.from_bytes(data[offset + 1 : offset + 3], "big")
+    start = offset + 3
+    body = bytes(data[start : start + length]).decode("ascii")
+    fields = dict(pair.split("=", 1) for pair in body.split(";") if pair)
+    return fields, data[start + length :]
+
+
+def object_to_stream(
+    obj: Any,
+    codec: Optional[str] = None,
+    compression: Optional[CompressionConfig] = None,
+) -> BufferStream:
+    """
+    Convert the given object into a byte stream using the given codec.
+
+    Uncompressed YAML objects are written without a header, so they stay readable by
+    older versions of s3os. Otherwise the codec and any compression are recorded in
+    a header. The stream refers to the encoded data rather than copying it. For codecs
+    that support buffers, that is the memory of the object itself, so the object must
+    not be modified while the stream is in use.
+
+    :param obj: The object to convert.
+    :param codec: Optional ID of the codec to use. Defaults to YAML.
+    :param compression: Optional configuration of compression to apply after encoding.
+        Objects are only compressed if they are at least `min_size` bytes once encoded,
+        and compression actually makes them smaller.
+    """
+    codec_id = DEFAULT_CODEC if codec is None else codec
+    selected_codec = get_codec(codec_id)
+    with phase("encode"):
+        payload, codec_fields = _encode(selected_codec, obj)
+        fields = {"codec": codec_id, **codec_fields}
+
+        if compression is not None and len(payload) >= compression.min_size:
+            compressor = get_compressor(compression.algorithm)
+            compressed = compressor.compress(payload, compression.level)
+            if len(compressed) < len(payload):
+                payload = compressed
+                fields["compression"] = compressor.id
+
+    if fields == {"codec": "yaml"}:
+        return BufferStream([payload])
+    align = selected_codec.aligned and "compression" not in fields
+    return BufferStream([encode_header(fields, align=align), payload])
+
+
+def content_hash(stream: BufferStream) -> str:
+    """
+    Return the SHA-256 hex digest of the data of an encoded object.
+
+    Equal objects encoded with the same codec and compression have the same hash, so it
+    identifies the stored version of an object without comparing the data itself.
+    """
+    digest = hashlib.sha256()
+    for buffer in stream.buffers:
+        digest.update(buffer)
+    return digest.hexdigest()
+
+
+def object_from_stream(
+    stream: Union[io.BytesIO, BufferStream],
+    allowed_codecs: Optional[Collection[str]] = None,
+) -> Any:
+    """
+    Create an object from a byte stream.
+
+    The object is decompressed and decoded as recorded in its header.
+
+    :param allowed_codecs: See `object_from_buffer`.
+    """
+    data = stream.getbuffer()[stream.tell() :]
+    stream.seek(0, io.SEEK_END)
+    return object_from_buffer(data, allowed_codecs)
+
+
+def object_from_buffer(
+    data: Buffer, allowed_codecs: Optional[Collection[str]] = None
+) -> Any:
+    """
+    Create an object from a buffer of encoded object data.
+
+    For codecs that support buffers, the object may share memory with `data`
+    rather than copying it. E.g. numpy arrays are views of it, which are read-only if
+    `data` is.
+
+    :param data: The encoded object data.
+    :param allowed_codecs: Optional. IDs of the codecs allowed to decode the object.
+        Defaults to every codec that is safe to decode untrusted data with, which
+        excludes pickle. CodecNotAllowedError is raised for objects stored with any
+        other codec. See `get_decoding_codec`.
+    """
+    with phase("decode"):
+        fields, payload = split_header(memoryview(data))
+        codec = get_decoding_codec(fields["codec"], allowed_codecs)
+        if "compression" in fields:
+            payload = get_compressor(fields["compression"]).decompress(payload)
+        return _decode(codec, payload, fields)
+
+
+class _PrefixedReader(io.RawIOBase):
+    """Readable file of some bytes that have already been read, then the rest of a file."""
+
+    def __init__(self, prefix: bytes, file: BinaryIO):
+        self._prefix = prefix
+        self._file = file
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:  # type: ignore
+        if self._prefix:
+            size = min(len(buffer), len(self._prefix))
+            buffer[:size] = self._prefix[:size]
+            self._prefix = self._prefix[size:]
+            return size
+        data = self._file.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+
+def _read_exactly(file: BinaryIO, size: int) -> bytes:
+    """Read `size` bytes from the file, or fewer if it ends first."""
+    data = b""
+    while len(data) < size:
+        chunk = file.read(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def read_header(file: BinaryIO) -> Tuple[Dict[str, str], BinaryIO]:
+    """
+    Read the header from the start of a file of encoded object data.
+
+    Data without a header is assumed to be plain YAML.
+
+    :return: Tuple of the header fields, and a file of the payload.
+    """
+    start = _read_exactly(file, len(HEADER_MAGIC) + 3)
+    if not start.startswith(HEADER_MAGIC):
+        payload = io.BufferedReader(_PrefixedReader(start, file))
+        return {"codec": "yaml"}, payload
+
+    length = int.from_bytes(start[len(HEADER_MAGIC) + 1 :], "big")
+    fields, _ = split_header(start + _read_exactly(file, length))
+    return fields, file
+
+
+def object_to_file(
+    obj: Any,
+    file: BinaryIO,
+    codec: Optional[str] = None,
+    compression: Optional[CompressionConfig] = None,
+) -> None:
+    """
+    Write the given object to a binary file incrementally, using the given codec.
+
+    The output can be read by both `object_from_file` and `object_from_stream`.
+    Unlike `object_to_stream`, compression is always applied if given, as the size of
+    the encoded object isn't known up front.
+
+    :param obj: The object to write.
+    :param file: Writable binary file to write the object to.
+    :param codec: Optional ID of the codec to use. Defaults to YAML.
+    :param compression: Optional configuration of compression to apply while encoding.
+    """
+    codec_id = DEFAULT_CODEC if codec is None else codec
+    selected_codec = get_codec(codec_id)
+    fields = {"codec": codec_id}
+    payload = None
+    if selected_codec.encode_buffer is not None:
+        # The fields recorded by the codec are needed before the header is written.
+        payload, codec_fields = selected_codec.encode_buffer(obj)
+        fields.update(codec_fields)
+    if compression is not None:
+        fields["compression"] = compression.algorithm
+
+    if fields != {"codec": "yaml"}:
+        align = selected_codec.aligned and compression is None
+        file.write(encode_header(fields, align=align))
+
+    target = file
+    if compression is not None:
+        compress_stream = get_compressor(compression.algorithm).compress_stream
+        if compress_stream is None:
+            raise ValueError(
+                f"Compression algorithm {compression.algorithm!r} can't be streamed."
+            )
+        target = compress_stream(file, compression.level)
+
+    if payload is not None:
+        target.write(payload)
+    elif selected_codec.dump is None:
+        target.write(selected_codec.encode(obj))  # type: ignore
+    else:
+        selected_codec.dump(obj, target)
+
+    if target is not file:
+        target.close()
+
+
+def object_from_file(
+    file: BinaryIO, allowed_codecs: Optional[Collection[str]] = None
+) -> Any:
+    """
+    Read an object from a binary file incrementally.
+
+    The object is decompressed and decoded as recorded in its header.
+
+    :param allowed_codecs: See `object_from_buffer`.
+    """
+    fields, payload = read_header(file)
+    codec = get_decoding_codec(fields["codec"], allowed_codecs)
+    if "compression" in fields:
+        decompress_stream = get_compressor(fields["compression"]).decompress_stream
+        if decompress_stream is None:
+            compressed = payload.read()
+            payload = io.BytesIO(
+                get_compressor(fields["compression"]).decompress(compressed)
+            )
+        else:
+            payload = decompress_stream(payload)
+
+    if codec.decode_buffer is not None or codec.load is None:
+        return _decode(codec, payload.read(), fields)
+    return codec.load(payload)
 
 
 def object_to_yaml_stream(obj: Any) -> io.BytesIO:
@@ -0,0 +1,60 @@
+"""Definition of the in-memory index of the keys stored in s3 under an S3Dict."""
+
+import bisect
+import threading
+import time
+
+from typing import Iterable, Iterator, List, Optional
+
+
+class KeyIndex:
+    """
+    Thread-safe sorted list of keys, as listed from s3.
+
+    Keys are kept in a plain sorted list rather than a set, which takes a fraction of the
+    memory for large dicts. Lookups are by binary search.
+    """
+
+    def __init__(self, keys: Iterable[str]):
+        """
+        Create a new KeyIndex.
+
+        :param keys: The keys to index, in any order.
+        """
+        self._keys: List[str] = sorted(set(keys))
+        self._lock = threading.Lock()
+        self.listed_time = time.monotonic()
+
+    def is_expired(self, ttl: Optional[float]) -> bool:
+        """Return True if the keys were listed more than `ttl` seconds ago."""
+        return ttl is not None and time.monotonic() - self.listed_time >= ttl
+
+    def add(self, key: str) -> None:
+        """Add the key, if it is not already indexed."""
+        with self._lock:
+            index = bisect.bisect_left(self._keys, key)
+            if index == len(self._keys) or self._keys[index] != key:
+                self._keys.insert(index, key)
+
+    def discard(self, key: str) -> None:
+        """Remove the key, if it is indexed."""
+        with self._lock:
+            index = bisect.bisect_left(self._keys, key)
+            if index < len(self._keys) and self._keys[index] == key:
+                del self._keys[index]
+
+    def __contains__(self, key: object) -> bool:
+        """Return True if the key is indexed."""
+        with self._lock:
+            index = bisect.bisect_left(self._keys, key)  # type: ignore
+            return index < len(self._keys) and self._keys[index] == key
+
+    def __iter__(self) -> Iterator[str]:
+        """Iterate over a copy of the keys, in sorted order."""
+        with self._lock:
+            return iter(list(self._keys))
+
+    def __len__(self) -> int:
+        """Return the number of keys."""
+        with self._lock:
+            return len(self._keys)
@@ -0,0 +1,65 @@
+"""Definitions of references to buckets and objects, and details of stored objects."""
+
+from dataclasses import dataclass, field
+from typing import Optional
+
+from .compression import CompressionConfig
+
+#: Name of the storage backend of buckets that don't choose one. See `s3os.backends`.
+DEFAULT_BACKEND = "s3"
+
+
+@dataclass(frozen=True)
+class BucketLocation:
+    """
+    Definition of a reference to an S3 bucket.
+
+    :param name: The name of the bucket.
+    :param region: Optional. The region of the bucket.
+    :param backend: Name of the storage backend the bucket is in. Defaults to s3.
+        See `s3os.backends.available_backends()`.
+    """
+
+    name: str = "s3os"
+    region: Optional[str] = None
+    backend: str = DEFAULT_BACKEND
+
+
+@dataclass(frozen=True)
+class ObjectLocation:
+    """
+    Definition of a reference to a single S3 object.
+
+    :param key: The key of the object.
+    :param bucket: Optional. The bucket containing the object.
+    :param codec: Optional. ID of the codec to store the object with.
+    :param compression: Optional. Configuration of compression to store the object with.
+
+    `codec` and `compression` are not part of the identity of the location.
+    Objects are always read using the codec and compression they were stored with.
+    """
+
+    key: str
+    bucket: BucketLocation = field(default_factory=BucketLocation)
+    codec: Optional[str] = field(default=None, compare=False)
+    compression: Optional[CompressionConfig] = field(default=None, compare=False)
+
+
+@dataclass(frozen=True)
+class ObjectInfo:
+    """
+    Details of an object stored in s3.
+
+    :param size: Size of the stored object data in bytes.
+    :param etag: Optional. ETag of the stored object, if known.
+    :param content_hash: Optional. SHA-256 hex digest of the stored object data, if it
+        was recorded when the object was stored.
+    """
+
+    size: int
+    etag: Optional[str] = None
+    content_hash: Optional[str] = None
+
+
+class ObjectNotModified(Exception):
+    """Raised by a conditional download when the object still has the given ETag."""
@@ -0,0 +1,494 @@
+"""
+Metrics and tracing of s3os operations.
+
+Each operation - e.g. `store`, `retrieve`, or a single upload or download - is measured
+as a Span: its wall time, the part of that time spent encoding, on the network and
+decoding, the bytes sent and received, and the number of requests retried. Spans are
+recorded as counters and histograms in a MetricsRegistry, which can be snapshotted or
+scraped in the Prometheus text format, and are passed to any registered TraceHooks:
+
+    from s3os import enable_metrics, get_metrics_registry
+
+    enable_metrics()
+    ...
+    print(get_metrics_registry().to_prometheus())
+
+S3Dict cache hits, misses and evictions are also counted. All of this is disabled by
+default, and then costs no more than a check of a flag per operation.
+"""
+
+import bisect
+import contextlib
+import logging
+import threading
+import time
+
+from dataclasses import dataclass, field
+from typing import Any, ContextManager, Dict, List, Optional, Tuple
+
+from .locations import ObjectNotModified
+
+log = logging.getLogger(__name__)
+
+#: Upper bounds in seconds of the buckets of the histograms of durations.
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+@dataclass
+class Histogram:
+    """
+    Distribution of observed values, counted in buckets.
+
+    :param bounds: The upper bound of each bucket, in increasing order. Values greater
+        than the last bound are counted in a final, unbounded bucket.
+    :param counts: Number of values observed in each bucket, including the final one.
+    :param count: Total number of values observed.
+    :param sum: Sum of all values observed.
+    """
+
+    bounds: Tuple[float, ...] = DEFAULT_BUCKETS
+    counts: List[int] = field(default_factory=list)
+    count: int = 0
+    sum: float = 0.0
+
+    def __post_init__(self):
+        """Create the bucket counts, if not given."""
+        if not self.counts:
+            self.counts = [0] * (len(self.bounds) + 1)
+        if len(self.counts) != len(self.bounds) + 1:
+            raise ValueError(
+                f"`counts` must have one more entry than `bounds`. You passed: "
+                f"{self.counts=}, {self.bounds=}."
+            )
+
+    def observe(self, value: float) -> None:
+        """Count the value."""
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """
+        Return an upper bound of the q-quantile of the observed values, e.g. 0.95 for p95.
+
+        Returns the upper bound of the bucket the quantile falls in, which is infinite
+        for the final bucket, or 0 if no values have been observed.
+        """
+        rank = q * self.count
+        seen = 0
+        for bound, bucket_count in zip(self.bounds + (float("inf"),), self.counts):
+            seen += bucket_count
+            if seen >= rank and seen > 0:
+                return bound
+        return 0.0
+
+
+class MetricsRegistry:
+    """
+    Thread-safe collection of named counters and histograms.
+
+    Each metric has a separate value for each combination of label values.
+    """
+
+    def __init__(self) -> None:
+        """Create a new, empty MetricsRegistry."""
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _labels(labels: Dict[str, Any]) -> Labels:
+        return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels: Any) -> None:
+        """Add the value to the counter with the given name and labels."""
+        key = self._labels(labels)
+        with self._lock:
+            counters = self._counters.setdefault(name, {})
+            counters[key] = counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels: Any) -> None:
+        """Count the value in the histogram with the given name and labels."""
+        key = self._labels(labels)
+        with self._lock:
+            histograms = self._histograms.setdefault(name, {})
+            histogram = histograms.get(key)
+            if histogram is None:
+                histogram = histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def counter(self, name: str, **labels: Any) -> float:
+        """Return the value of the counter with the given name and labels, or 0."""
+        with self._lock:
+            return self._counters.get(name, {}).get(self._labels(labels), 0)
+
+    def histogram(self, name: str, **labels: Any) -> Histogram:
+        """Return a copy of the histogram with the given name and labels."""
+        with self._lock:
+            histogram = self._histograms.get(name, {}).get(self._labels(labels))
+            if histogram is None:
+                return Histogram()
+            return Histogram(
+                histogram.bounds, list(histogram.counts), histogram.count, histogram.sum
+            )
+
+    def reset(self) -> None:
+        """Discard all recorded values."""
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def snapshot(self) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Return a copy of all recorded values, that can be serialised as JSON.
+
+        :return: For each metric name, a list with an entry for each combination of
+            labels. Counter entries have the `labels` and `value`. Histogram entries
+            have the `labels`, `count`, `sum`, and the `bounds` and `counts` of the
+            buckets.
+        """
+        snapshot: Dict[str, List[Dict[str, Any]]] = {}
+        with self._lock:
+            for name, counters in self._counters.items():
+                snapshot[name] = [
+                    {"labels": dict(labels), "value": value}
+                    for labels, value in sorted(counters.items())
+                ]
+            for name, histograms in self._histograms.items():
+                snapshot[name] = [
+                    {
+                        "labels": dict(labels),
+                        "count": histogram.count,
+                        "sum": histogram.sum,
+                        "bounds": list(histogram.bounds),
+                        "counts": list(histogram.counts),
+                    }
+                    for labels, histogram in sorted(histograms.items())
+                ]
+        return snapshot
+
+    def to_prometheus(self) -> str:
+        """Format all recorded values in the Prometheus text exposition format."""
+
+        def format_labels(labels: Labels, *extra: Tuple[str, str]) -> str:
+            pairs = labels + extra
+            if not pairs:
+                return ""
+            escaped = (
+                (name, value.replace("\\", "\\\\").replace('"', '\\"'))
+                for name, value in pairs
+            )
+            return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+        lines = []
+        with self._lock:
+            for name, counters in sorted(self._counters.items()):
+                lines.append(f"# TYPE {name} counter")
+                for labels, value in sorted(counters.items()):
+                    lines.append(f"{name}{format_labels(labels)} {value}")
+            for name, histograms in sorted(self._histograms.items()):
+                lines.append(f"# TYPE {name} histogram")
+                for labels, histogram in sorted(histograms.items()):
+                    cumulative = 0
+                    bounds = [str(bound) for bound in histogram.bounds] + ["+Inf"]
+                    for bound, bucket_count in zip(bounds, histogram.counts):
+                        cumulative += bucket_count
+                        lines.append(
+                            f"{name}_bucket{format_labels(labels, ('le', bound))} "
+                            f"{cumulative}"
+                        )
+                    lines.append(f"{name}_sum{format_labels(labels)} {histogram.sum}")
+                    lines.append(
+                        f"{name}_count{format_labels(labels)} {histogram.count}"
+                    )
+        return "\n".join(lines) + "\n"
+
+
+@dataclass
+class Span:
+    """
+    Measurements of a single operation.
+
+    Operations run within other operations in the same thread, e.g. the download made
+    by `retrieve`, have their own spans. Their time, bytes and retries also count
+    towards the spans of the operations they are part of.
+
+    :param operation: Name of the operation, e.g. "store" or "download_object".
+    :param attributes: Details of the operation, e.g. the bucket and key.
+    :param parent: Optional. The span of the operation this one is part of.
+    :param start_time: Time the operation started, in seconds since the epoch.
+    :param duration: Wall time of the operation in seconds, once it has finished.
+    :param phases: Seconds of the wall time spent in each phase of the operation:
+        "encode", "network" and "decode".
+    :param bytes_sent: Number of bytes uploaded.
+    :param bytes_received: Number of bytes downloaded.
+    :param retries: Number of requests that were retried.
+    :param error: The exception the operation failed with, if any.
+    """
+
+    operation: str
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    parent: Optional["Span"] = None
+    start_time: float = 0.0
+    duration: Optional[float] = None
+    phases: Dict[str, float] = field(default_factory=dict)
+    bytes_sent: int = 0
+    bytes_received: int = 0
+    retries: int = 0
+    error: Optional[BaseException] = None
+
+    @property
+    def outcome(self) -> str:
+        """
+        Summary of how the operation ended.
+
+        One of "ok", "missing" (KeyError), "not_modified" (ObjectNotModified) or "error".
+        """
+        if self.error is None:
+            return "ok"
+        if isinstance(self.error, KeyError):
+            return "missing"
+        if isinstance(self.error, ObjectNotModified):
+            return "not_modified"
+        return "error"
+
+
+class TraceHook:
+    """
+    Receiver of the spans of s3os operations, e.g. to pass them on to a tracing system.
+
+    Subclass and override either method, and register an instance with
+    `add_trace_hook`. Hooks are called in the thread running the operation, so should
+    be quick. Exceptions raised by hooks are logged, and otherwise ignored.
+    """
+
+    def on_start(self, span: Span) -> None:
+        """Handle the start of an operation. Only the name and attributes are set."""
+
+    def on_end(self, span: Span) -> None:
+        """Handle the end of an operation, with all of its measurements."""
+
+
+_registry = MetricsRegistry()
+_enabled = False
+# Replaced rather than modified, so that it can be iterated without a lock.
+_hooks: Tuple[TraceHook, ...] = ()
+_hooks_lock = threading.Lock()
+_local = threading.local()
+_NOTHING: ContextManager[Any] = contextlib.nullcontext()
+
+
+def get_metrics_registry() -> MetricsRegistry:
+    """Return the MetricsRegistry that s3os operations are recorded in."""
+    return _registry
+
+
+def enable_metrics(enabled: bool = True) -> None:
+    """
+    Start or stop recording s3os operations in the MetricsRegistry.
+
+    Trace hooks are called whether or not metrics are enabled.
+    """
+    global _enabled
+    _enabled = enabled
+
+
+def metrics_enabled() -> bool:
+    """Return True if s3os operations are being recorded in the MetricsRegistry."""
+    return _enabled
+
+
+def add_trace_hook(hook: TraceHook) -> None:
+    """Call the hook at the start and end of every s3os operation."""
+    global _hooks
+    if not isinstance(hook, TraceHook):
+        raise TypeError(f"`hook` must be a TraceHook. You passed: {hook=}.")
+    with _hooks_lock:
+        _hooks = _hooks + (hook,)
+
+
+def remove_trace_hook(hook: TraceHook) -> None:
+    """Stop calling a hook added by `add_trace_hook`. Does nothing if it wasn't added."""
+    global _hooks
+    with _hooks_lock:
+        _hooks = tuple(existing for existing in _hooks if existing is not hook)
+
+
+def _current_spans() -> List[Span]:
+    try:
+        return _local.spans
+    except AttributeError:
+        _local.spans = []
+        return _local.spans
+
+
+def current_span() -> Optional[Span]:
+    """Return the span of the innermost operation running in this thread, if any."""
+    spans = getattr(_local, "spans", None)
+    return spans[-1] if spans else None
+
+
+def _call_hooks(method: str, span: Span) -> None:
+    for hook in _hooks:
+        try:
+            getattr(hook, method)(span)
+        except Exception:
+            log.exception(f"Trace hook {hook!r} failed in {method}.")
+
+
+class _Operation:
+    """Context manager that measures an operation as a Span."""
+
+    def __init__(
+        self, name: str, phase_name: Optional[str], attributes: Dict[str, Any]
+    ):
+        self._name = name
+        self._phase_name = phase_name
+        self._attributes = attributes
+
+    def __enter__(self) -> Span:
+        spans = _current_spans()
+        span = Span(
+            self._name,
+            self._attributes,
+            parent=spans[-1] if spans else None,
+            start_time=time.time(),
+        )
+        spans.append(span)
+        _call_hooks("on_start", span)
+        self._span = span
+        self._start = time.perf_counter()
+        return span
+
+    def __exit__(self, exc_type: Any, exc: Any, traceback: Any) -> None:
+        span = self._span
+        span.duration = time.perf_counter() - self._start
+        span.error = exc
+        spans = _current_spans()
+        if self._phase_name is not None:
+            _add_phase(spans, self._phase_name, span.duration)
+        spans.pop()
+        if _enabled:
+            _record(span)
+        _call_hooks("on_end", span)
+
+
+def _record(span: Span) -> None:
+    """Record the measurements of the finished span in the registry."""
+    operation = span.operation
+    _registry.inc("s3os_operations_total", operation=operation, outcome=span.outcome)
+    _registry.observe("s3os_operation_seconds", span.duration or 0, operation=operation)
+    for phase_name, seconds in span.phases.items():
+        _registry.observe(
+            "s3os_phase_seconds", seconds, operation=operation, phase=phase_name
+        )
+    # Bytes also count towards enclosing spans, so are only counted once, by the
+    # outermost span, to keep the totals across operations meaningful.
+    if span.parent is None:
+        if span.bytes_sent:
+            _registry.inc("s3os_bytes_sent_total", span.bytes_sent, operation=operation)
+        if span.bytes_received:
+            _registry.inc(
+                "s3os_bytes_received_total", span.bytes_received, operation=operation
+            )
+
+
+def operation(
+    name: str, phase_name: Optional[str] = None, **attributes: Any
+) -> ContextManager[Optional[Span]]:
+    """
+    Measure the code run within the returned context manager as an operation.
+
+    Returns a context manager that does nothing if metrics are disabled and there
+    are no trace hooks.
+
+    :param name: Name of the operation.
+    :param phase_name: Optional. Phase that all the time of the operation is spent in,
+        e.g. "network" for a single request. See `phase`.
+    :param attributes: Details of the operation to pass to trace hooks.
+    """
+    if not (_enabled or _hooks):
+        return _NOTHING
+    return _Operation(name, phase_name, attributes)
+
+
+class _Phase:
+    """Context manager that adds the time spent within it to the phase of all spans."""
+
+    def __init__(self, name: str, spans: List[Span]):
+        self._name = name
+        self._spans = list(spans)
+
+    def __enter__(self) -> None:
+        self._start = time.perf_counter()
+
+    def __exit__(self, *args: Any) -> None:
+        _add_phase(self._spans, self._name, time.perf_counter() - self._start)
+
+
+def _add_phase(spans: List[Span], name: str, seconds: float) -> None:
+    for span in spans:
+        span.phases[name] = span.phases.get(name, 0.0) + seconds
+
+
+def phase(name: str) -> ContextManager[None]:
+    """
+    Count the time spent within the returned context manager as the given phase.
+
+    The time counts towards every operation running in this thread. Does nothing if
+    no operations are being measured.
+
+    :param name: Name of the phase. One of "encode", "network" or "decode".
+    """
+    spans = getattr(_local, "spans", None)
+    if not spans:
+        return _NOTHING
+    return _Phase(name, spans)
+
+
+def record_transfer(sent: int = 0, received: int = 0) -> None:
+    """Count bytes sent or received towards every operation running in this thread."""
+    for span in getattr(_local, "spans", ()):
+        span.bytes_sent += sent
+        span.bytes_received += received
+
+
+def record_retries(count: int, request: str) -> None:
+    """
+    Count requests that were retried.
+
+    :param count: Number of times the request was retried.
+    :param request: Name of the request, e.g. "PutObject".
+    """
+    if _enabled:
+        _registry.inc("s3os_retries_total", count, request=request)
+    for span in getattr(_local, "spans", ()):
+        span.retries += count
+
+
+def record_cache_event(cache: str, event: str) -> None:
+    """
+    Count an event of a cache of S3Dict values.
+
+    :param cache: Which cache. Either "memory" or "disk".
+    :param event: One of "hit", "miss", "eviction" or "revalidation".
+    """
+    if _enabled:
+        _registry.inc("s3os_cache_events_total", cache=cache, event=event)
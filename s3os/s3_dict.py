@@ -1,12 +1,70 @@
 """Definition of a dict-like interface to s3."""
 
-from collections import UserDict
-from dataclasses import dataclass, field
-from typing import Optional, Dict, Any
+import itertools
+import logging
+import threading
+import time
+import weakref
+
+from collections import UserDict, deque
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+from dataclasses import dataclass, field, replace
+from typing import (
+    Collection,
+    Deque,
+    Optional,
+    Dict,
+    Any,
+    Generator,
+    Iterable,
+    Iterator,
+    List,
+    Set,
+    Tuple,
+)
 from uuid import uuid4
 
-from s3os.api import store, retrieve, delete
-from s3os.s3_wrapper import BucketLocation, ObjectLocation, generate_items_in_bucket
+from s3os.api import (
+    store,
+    store_by_content,
+    retrieve,
+    retrieve_with_info,
+    retrieve_encoded,
+    delete,
+    store_many,
+    retrieve_many,
+    delete_many,
+    BulkOperationError,
+    BulkResult,
+)
+from s3os.backends import get_backend
+from s3os.buffers import Buffer
+from s3os.cache import Cache, CachePolicy, CacheStats, estimate_size
+from s3os.compression import CompressionConfig
+from s3os.concurrency import (
+    DEFAULT_MAX_CONCURRENCY,
+    bounded_map,
+    new_worker_executor,
+)
+from s3os.decode_pool import DecodeConfig, decode_in_processes
+from s3os.disk_cache import DiskCache, DiskCacheConfig
+from s3os.key_index import KeyIndex
+from s3os.s3_wrapper import (
+    BucketLocation,
+    ObjectInfo,
+    ObjectLocation,
+    ObjectNotModified,
+    generate_items_in_bucket,
+    generate_objects_in_bucket,
+    object_exists,
+)
+from s3os.segments import SegmentPolicy, SegmentStore
+from s3os.write_buffer import DELETED, FlushPolicy, WriteBuffer
+
+log = logging.getLogger(__name__)
+
+WRITE_MODES = ("immediate", "deferred")
+LAYOUTS = ("objects", "packed")
 
 
 @dataclass
@@ -29,18 +87,154 @@ class S3DictConfig:
             - Set operations immediately upload to s3.
             - Get operations synchronously download objects from s3.
             - Delete operations immediately delete objects in s3.
+    :param cache_policy: Optional. Limits on the number, total size and age of cached
+        values, and how often they are revalidated against s3. By default the cache is
+        unbounded and values are never revalidated. See CachePolicy.
+    :param disk_cache: Optional. Configuration of a cache of encoded values on local disk,
+        which is checked before downloading values from s3. The directory can be shared
+        by any number of processes, so sibling and restarted processes don't download
+        values again. Only used if `use_cache` is True. If the `cache_policy` has a
+        `ttl` or `revalidate_after`, values read from disk are revalidated by their ETag.
     :param bucket: Optional. The s3 bucket to use.
+    :param backend: Optional. Name of the storage backend to keep the bucket in, e.g.
+        "memory" or "local". Overrides the `backend` of the `bucket`.
+        See `s3os.backends.available_backends()`.
+    :param check_bucket: If True (the default), the bucket is created on first use if
+        it does not already exist. Set to False for buckets that are managed elsewhere.
+    :param codec: Optional. ID of the codec used to store values. Defaults to YAML.
+        Values are always read using the codec they were stored with.
+        See `s3os.encoding.available_codecs()`.
+    :param allowed_codecs: Optional. IDs of the codecs allowed to decode values read
+        from s3. Defaults to every codec that is safe to decode untrusted data with,
+        which excludes pickle. Only allow pickle for buckets that only trusted parties
+        can write to, as reading a value could otherwise run arbitrary code.
+    :param compression: Optional. Configuration of compression applied to stored values.
+        Values are uncompressed by default.
+    :param max_concurrency: Maximum number of s3 requests in progress at once when
+        operating on many values, e.g. in `update()` or `iter_items_from_s3()`.
+    :param write_mode: Either "immediate" (the default) or "deferred".
+        In "immediate" mode, every set and delete is made in s3 straight away.
+        In "deferred" mode, sets and deletes are buffered and only the latest write to
+        each key is made in s3, in concurrent batches, when the dict is flushed.
+        Gets always see the buffered writes. See `S3Dict.flush()`.
+    :param flush_policy: Optional. When buffered writes are flushed in "deferred" mode.
+        See FlushPolicy.
+    :param listing_ttl: Number of seconds the keys listed from s3 are reused for by
+        `len()`, iteration and `in`, before listing them again. Writes made through this
+        dict are always reflected in the listed keys.
+    :param key_index: If True, the keys listed from s3 are kept in memory indefinitely
+        as a compact sorted index, rather than listed again after `listing_ttl`.
+        Suits large dicts that are only written to through this object.
+        Use `refresh_keys()` to list them again.
+    :param layout: Either "objects" (the default) or "packed".
+        In "objects" layout, each value is stored as its own object in s3.
+        In "packed" layout, each flush packs the values written into a few large
+        segment objects, with an index of where each value is. Values are read with
+        ranged GETs, and `iter_items_from_s3()` reads whole segments at once, which
+        suits dicts of many small values. Requires "deferred" `write_mode`.
+        The index is loaded on first use, so values written by other processes since
+        are only seen once it is reloaded by `refresh_keys()` or `iter_items_from_s3()`.
+        The `disk_cache` is not used.
+    :param segment_policy: Optional. Size of segments, and when they are compacted,
+        in "packed" layout. See SegmentPolicy.
+    :param read_ahead: Number of keys ahead of the current one whose values are
+        prefetched while iterating over the dict, including over `keys()`, `values()`
+        and `items()`. Suits walking the keys in order and getting each value.
+        0 (the default) disables read-ahead. Only used if `use_cache` is True.
+        See `S3Dict.prefetch()`.
+    :param decode: Optional. If given, `iter_items_from_s3()`, `get_all_from_s3()` and
+        `get_many()` download values on threads but decode them in a pool of processes,
+        which suits codecs that are slow to decode in Python, e.g. YAML. Not used in
+        "packed" layout. See DecodeConfig.
+    :param skip_unchanged: If True, the hash of each value's encoded data is kept with
+        its object in s3 and in the cache, and writes of values whose data is the same
+        as that already stored are skipped. If the hash of the stored value isn't
+        cached, it is checked with a HEAD request instead. Not used in "packed" layout.
+    :param content_addressed: If True, each distinct value is stored once, under a key
+        made of the hash of its encoded data (see `blob_prefix`), and the object of
+        each key only refers to it. Suits dicts where many keys have equal values.
+        Uncached values take two requests to read. Values that no key refers to any
+        more are only deleted by `S3Dict.compact()`. Not supported in "packed" layout.
     """
 
     id: str = field(default_factory=lambda: str(uuid4()))
     use_cache: bool = True
+    cache_policy: Optional[CachePolicy] = None
+    disk_cache: Optional[DiskCacheConfig] = None
     bucket: BucketLocation = field(default_factory=BucketLocation)
+    backend: Optional[str] = None
+    check_bucket: bool = True
+    codec: Optional[str] = None
+    allowed_codecs: Optional[Collection[str]] = None
+    compression: Optional[CompressionConfig] = None
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY
+    write_mode: str = "immediate"
+    flush_policy: Optional[FlushPolicy] = None
+    listing_ttl: float = 5.0
+    key_index: bool = False
+    layout: str = "objects"
+    segment_policy: Optional[SegmentPolicy] = None
+    read_ahead: int = 0
+    decode: Optional[DecodeConfig] = None
+    skip_unchanged: bool = False
+    content_addressed: bool = False
+
+    def __post_init__(self):
+        """Validate the config."""
+        if self.backend is not None:
+            get_backend(self.backend)
+            self.bucket = replace(self.bucket, backend=self.backend)
+        if self.write_mode not in WRITE_MODES:
+            raise ValueError(
+                f"`write_mode` must be one of {WRITE_MODES}. You passed: {self.write_mode=}."
+            )
+        if self.layout not in LAYOUTS:
+            raise ValueError(
+                f"`layout` must be one of {LAYOUTS}. You passed: {self.layout=}."
+            )
+        if self.layout == "packed" and self.write_mode != "deferred":
+            raise ValueError(
+                f"The packed layout requires the deferred write mode. "
+                f"You passed: {self.write_mode=}."
+            )
+        if self.read_ahead < 0:
+            raise ValueError(
+                f"`read_ahead` must be at least 0. You passed: {self.read_ahead=}."
+            )
+        if self.content_addressed and self.layout == "packed":
+            raise ValueError(
+                f"The packed layout can't be content addressed. You passed: {self.layout=}."
+            )
 
     @property
     def s3_prefix(self):
         """The prefix to use for all items stored by this dict."""
         return f"{self.id}/"
 
+    @property
+    def blob_prefix(self):
+        """The prefix of the values stored by this dict, in content addressed mode."""
+        return f"{self.id}.blobs/"
+
+
+@dataclass
+class RefreshSummary:
+    """
+    The changes to the values stored in s3 that were picked up by `S3Dict.refresh()`.
+
+    :param added: Keys whose values weren't cached, and have been downloaded.
+    :param changed: Keys whose cached values had changed in s3, and have been
+        downloaded again.
+    :param removed: Keys that are no longer stored in s3, and have been removed from
+        the cache.
+    :param unchanged: Number of cached values that were unchanged.
+    """
+
+    added: List[str] = field(default_factory=list)
+    changed: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+    unchanged: int = 0
+
 
 class S3Dict(UserDict):
     """
@@ -50,11 +244,21 @@ class S3Dict(UserDict):
 
     See S3DictConfig for configuration options.
 
+    `len()`, iteration, `keys()` and `in` are answered from a listing of the keys in s3,
+    without downloading any values, unless `read_ahead` is configured. See `listing_ttl`,
+    `key_index` and `read_ahead` of S3DictConfig.
+
     Deviations from the standard dict API:
       - del["item"] when "item" does not exist does not raise a KeyError.
       - __del__ doesn't delete all keys in s3 automatically. Use `clear()` to do this.
             This is different to normal behaviour where python garbage collection
             would delete all the items in a dictionary if they are no longer referenced.
+
+    Can be used as a context manager, which flushes any deferred writes on exit:
+
+        with S3Dict(_config=S3DictConfig(write_mode="deferred")) as s3dict:
+            for i in range(1000):
+                s3dict["counter"] = i  # Only the last value is uploaded.
     """
 
     def __init__(
@@ -75,34 +279,437 @@ class S3Dict(UserDict):
             )
         self._config: S3DictConfig = _config
 
-        # Call super after setting self._config so objects can be stored immediately.
-        super(S3Dict, self).__init__(*args, **kwargs)
+        # Replace the plain dict created by UserDict with our own cache, before adding
+        # the initial items so that they are cached according to the policy.
+        super(S3Dict, self).__init__()
+        self.data: Cache = Cache(self._config.cache_policy)  # type: ignore
+        self._disk_cache: Optional[DiskCache] = None
+        if self._config.use_cache and self._config.disk_cache is not None:
+            self._disk_cache = DiskCache(self._config.disk_cache)
 
-    def get_all_from_s3(self) -> Dict[str, Any]:
+        self._key_index: Optional[KeyIndex] = None
+        self._key_index_lock = threading.Lock()
+
+        self._segments: Optional[SegmentStore] = None
+        if self._config.layout == "packed":
+            self._segments = SegmentStore(
+                self._config.bucket,
+                self._config.s3_prefix,
+                policy=self._config.segment_policy,
+                codec=self._config.codec,
+                compression=self._config.compression,
+                check_bucket=self._config.check_bucket,
+                max_concurrency=self._config.max_concurrency,
+                allowed_codecs=self._config.allowed_codecs,
+            )
+
+        self._write_buffer: Optional[WriteBuffer] = None
+        self._flush_lock = threading.Lock()
+        self._flusher: Optional[threading.Thread] = None
+        self._flusher_wakeup = threading.Event()
+        self._closed = False
+
+        # Background downloads started by `prefetch`, by key.
+        self._prefetches: Dict[str, "Future[Any]"] = {}
+        self._prefetch_lock = threading.Lock()
+        self._prefetch_executor: Optional[ThreadPoolExecutor] = None
+
+        # Details of the objects stored for keys with deferred writes, from before the
+        # writes replaced them in the cache, to skip unchanged writes when flushed.
+        self._stored_before: Dict[str, ObjectInfo] = {}
+
+        if self._config.write_mode == "deferred":
+            self._write_buffer = WriteBuffer(self._config.flush_policy)
+            if self._write_buffer.policy.background:
+                # The flusher only holds a weak reference to the dict, so that a dict
+                # that is never closed can still be garbage collected, which wakes the
+                # flusher up to stop.
+                self._flusher = threading.Thread(
+                    target=_flush_in_background,
+                    args=(
+                        weakref.ref(self),
+                        self._flusher_wakeup,
+                        self._write_buffer.policy.max_age,
+                    ),
+                    name="s3os-flush",
+                    daemon=True,
+                )
+                self._flusher.start()
+                weakref.finalize(self, self._flusher_wakeup.set)
+
+        self.update(*args, **kwargs)
+
+    def __enter__(self) -> "S3Dict":
+        """Use the dict as a context manager, which flushes deferred writes on exit."""
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        """Flush any deferred writes, and stop the background flusher."""
+        self.close()
+
+    @property
+    def pending_writes(self) -> int:
+        """Number of keys with deferred writes that have not been flushed to s3 yet."""
+        return 0 if self._write_buffer is None else len(self._write_buffer)
+
+    def flush(self) -> None:
         """
-        Discover all objects stored in s3 using this dict's ID.
+        Make all deferred writes in s3.
 
-        Caches the result on this object if configured to do so.
+        Sets and deletes are each made in concurrent batches. If any fail, the rest are
+        still made, the failed writes are kept to be retried by the next flush, and then
+        a BulkOperationError is raised.
 
-        Returns a dict of the discovered objects.
+        In "packed" layout, all the writes are made together in new segments, so either
+        all of them are made or all are kept to be retried. Segments are then compacted
+        if needed, according to the `segment_policy`.
+
+        Does nothing in "immediate" write mode.
+        """
+        if self._write_buffer is None:
+            return
+
+        with self._flush_lock:
+            since = self._write_buffer.oldest_time
+            pending = self._write_buffer.take()
+            if not pending:
+                return
+            if self._segments is not None:
+                self._flush_segments(pending, since)
+                return
+
+            locations = {key: self._object_location(key) for key in pending}
+            result = self._store_many(
+                {key: value for key, value in pending.items() if value is not DELETED}
+            )
+            deletes = [
+                locations[key] for key, value in pending.items() if value is DELETED
+            ]
+            if deletes:
+                delete_result = delete_many(
+                    deletes, max_concurrency=self._config.max_concurrency
+                )
+                result.results.update(delete_result.results)
+                result.errors.update(delete_result.errors)
+
+            failed = {
+                key: value
+                for key, value in pending.items()
+                if locations[key] in result.errors
+            }
+            self._write_buffer.restore(
+                failed, since=time.monotonic() if since is None else since
+            )
+
+            if self._config.use_cache:
+                for key, value in pending.items():
+                    info = result.results.get(locations[key])
+                    # Record the size and ETag of the uploaded value, unless the key
+                    # has been written to again since the flush started.
+                    if info is not None and key not in self._write_buffer:
+                        self._cache(key, value, info)
+
+        log.debug(
+            f"Flushed {len(pending)} deferred writes of S3Dict {self._config.id}. "
+            f"{len(failed)} failed."
+        )
+        result.raise_for_errors()
+
+    def _flush_segments(self, pending: Dict[str, Any], since: Optional[float]) -> None:
+        """Write the pending writes to new segments. Needs the flush lock."""
+        assert self._write_buffer is not None and self._segments is not None
+        try:
+            infos = self._segments.write(pending)
+        except Exception:
+            self._write_buffer.restore(
+                pending, since=time.monotonic() if since is None else since
+            )
+            raise
+
+        if self._config.use_cache:
+            for key, value in pending.items():
+                if key in infos and key not in self._write_buffer:
+                    self._cache(key, value, infos[key])
+        log.debug(
+            f"Flushed {len(pending)} deferred writes of S3Dict {self._config.id}."
+        )
+        self._segments.compact_if_needed()
+
+    def compact(self) -> int:
         """
+        Rewrite small segments, and those holding mostly overwritten or deleted values.
+
+        In content addressed mode, deletes the values that no key refers to any more
+        instead. This must not run while the dict is written to elsewhere, as values
+        that are being stored may be deleted.
+
+        Otherwise does nothing in "objects" layout.
+
+        :return: The number of segments that were rewritten, or of values deleted.
+        """
+        if self._config.content_addressed:
+            return self._delete_unreferenced_values()
+        if self._segments is None:
+            return 0
+        return self._segments.compact()
+
+    def _delete_unreferenced_values(self) -> int:
+        """Delete the values that no key refers to, in content addressed mode."""
+        self.flush()
+        # List the values before the keys, so that values stored meanwhile are kept.
+        values = list(
+            generate_items_in_bucket(
+                self._config.bucket, prefix=self._config.blob_prefix
+            )
+        )
+        pointers = retrieve_many(
+            generate_items_in_bucket(
+                self._config.bucket, prefix=self._config.s3_prefix
+            ),
+            max_concurrency=self._config.max_concurrency,
+        )
+        errors = {
+            location: err
+            for location, err in pointers.errors.items()
+            if not isinstance(err, KeyError)
+        }
+        if errors:
+            raise BulkOperationError(BulkResult(pointers.results, errors))
+
+        referenced = {
+            self._blob_location(digest).key for digest in pointers.results.values()
+        }
+        unreferenced = [
+            object_location
+            for object_location in values
+            if object_location.key not in referenced
+        ]
+        if unreferenced:
+            delete_many(
+                unreferenced, max_concurrency=self._config.max_concurrency
+            ).raise_for_errors()
+        log.debug(
+            f"Deleted {len(unreferenced)} unreferenced values of S3Dict {self._config.id}."
+        )
+        return len(unreferenced)
+
+    def close(self) -> None:
+        """
+        Stop the background flusher if there is one, and flush any deferred writes.
+
+        Also cancels prefetches that have not started, and waits for the rest and any
+        background compaction of segments to finish.
+        """
+        self._cancel_prefetches()
+        with self._prefetch_lock:
+            executor, self._prefetch_executor = self._prefetch_executor, None
+        if executor is not None:
+            executor.shutdown()
+        if self._flusher is not None:
+            self._closed = True
+            self._flusher_wakeup.set()
+            self._flusher.join()
+            self._flusher = None
+        self.flush()
+        if self._segments is not None:
+            self._segments.wait_for_compaction()
+
+    def _flush_if_full(self) -> None:
+        """Flush deferred writes if they have passed a threshold of the flush policy."""
+        if self._write_buffer is not None and self._write_buffer.is_full():
+            if self._flusher is not None:
+                self._flusher_wakeup.set()
+            else:
+                self.flush()
+
+    @property
+    def cache_stats(self) -> CacheStats:
+        """Hit, miss and eviction counters of the local cache of this dict."""
+        return self.data.stats
+
+    @property
+    def disk_cache_stats(self) -> Optional[CacheStats]:
+        """Hit, miss and eviction counters of the disk cache of this dict, if it has one."""
+        return None if self._disk_cache is None else self._disk_cache.stats
+
+    def prefetch(self, keys: Iterable[str]) -> None:
+        """
+        Start downloading the values of the keys into the cache, and return straight away.
+
+        Downloads run in the background, at most `max_concurrency` at once. Getting a key
+        whose download is still in progress waits for it rather than downloading it
+        again. Keys that are already cached, already being prefetched or have deferred
+        writes are skipped, as are keys that don't exist in s3 once their download
+        fails. Writing to a key cancels its prefetch.
+
+        Does nothing if `use_cache` is False, as there is nowhere to keep the values.
+
+        :param keys: The keys of the items to prefetch.
+        """
+        if not self._config.use_cache:
+            return
+
+        with self._prefetch_lock:
+            executor = self._prefetch_executor
+            if executor is None:
+                # Calls on the shared executor wait on prefetches, so they must not
+                # use the shared executor themselves.
+                executor = self._prefetch_executor = new_worker_executor(
+                    self._config.max_concurrency, "s3os-prefetch"
+                )
+            for key in keys:
+                if key in self._prefetches or key in self.data:
+                    continue
+                if self._write_buffer is not None and key in self._write_buffer:
+                    continue
+                future: "Future[Any]" = Future()
+                self._prefetches[key] = future
+                executor.submit(self._prefetch_item, key, future)
+
+    def _prefetch_item(self, key: str, future: "Future[Any]") -> None:
+        """Download the item for `prefetch`, and cache it unless it was written since."""
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            value, info = self._download(key)
+        except BaseException as err:
+            with self._prefetch_lock:
+                if self._prefetches.get(key) is future:
+                    del self._prefetches[key]
+            future.set_exception(err)
+            return
+
+        with self._prefetch_lock:
+            if self._prefetches.get(key) is future:
+                del self._prefetches[key]
+                if info is not None:
+                    self._cache(key, value, info)
+        future.set_result(value)
+
+    def _cancel_prefetch(self, key: str) -> None:
+        """Stop any prefetch of the key from caching the value it downloads."""
+        if not self._prefetches:
+            return
+        with self._prefetch_lock:
+            future = self._prefetches.pop(key, None)
+        if future is not None:
+            future.cancel()
+
+    def _cancel_prefetches(self) -> None:
+        """Stop all prefetches from caching the values they download."""
+        with self._prefetch_lock:
+            futures = list(self._prefetches.values())
+            self._prefetches.clear()
+        for future in futures:
+            future.cancel()
+
+    def _fetch_or_wait(self, item: str, future: Optional["Future[Any]"]) -> Any:
+        """
+        Wait for the prefetch of the item if there is one, otherwise `_fetch` it.
+
+        :param future: The prefetch of the item, taken before the item was looked up in
+            the cache, as prefetches are forgotten once they have cached their value.
+        """
+        if future is not None:
+            try:
+                return future.result()
+            except CancelledError:
+                pass
+        return self._fetch(item)
+
+    def _read_ahead(self, keys: Iterable[str]) -> Generator[str, None, None]:
+        """Generate the keys, prefetching the next `read_ahead` of them as we go."""
+        keys = iter(keys)
+        window: Deque[str] = deque(itertools.islice(keys, self._config.read_ahead + 1))
+        self.prefetch(tuple(window))
+        while window:
+            key = window.popleft()
+            for next_key in itertools.islice(keys, 1):
+                window.append(next_key)
+                self.prefetch((next_key,))
+            yield key
+
+    def iter_items_from_s3(
+        self, max_in_flight: Optional[int] = None, ordered: bool = False
+    ) -> Generator[Tuple[str, Any], None, None]:
+        """
+        Generate all (key, value) pairs stored in s3 using this dict's ID.
+
+        Values are downloaded concurrently while the keys are still being listed.
+        At most `max_in_flight` values are held in memory by the generator at once.
+        Objects that are deleted between being listed and being downloaded are skipped.
+
+        Caches each value on this object if configured to do so.
+
+        :param max_in_flight: Maximum number of downloads that are in progress or
+            completed but not yet yielded. Defaults to the `max_concurrency` of this
+            dict's config.
+        :param ordered: If True, items are yielded in the order they are listed in s3.
+            Otherwise items are yielded as soon as they are downloaded.
+        """
+        # Make any deferred writes first, so that they are seen by the listing.
+        self.flush()
+        if self._segments is not None:
+            yield from self._iter_items_from_segments(ordered)
+            return
+
         object_generator = generate_items_in_bucket(
             self._config.bucket, prefix=self._config.s3_prefix
         )
+        if self._config.decode is None:
+            results = bounded_map(
+                self._retrieve,
+                object_generator,
+                max_in_flight=max_in_flight or self._config.max_concurrency,
+                ordered=ordered,
+            )
+        else:
+            downloads = bounded_map(
+                self._retrieve_encoded,
+                object_generator,
+                max_in_flight=max_in_flight or self._config.max_concurrency,
+                ordered=ordered,
+            )
+            results = decode_in_processes(
+                downloads,
+                self._config.decode,
+                ordered,
+                allowed_codecs=self._config.allowed_codecs,
+            )
 
-        all_items = dict()
+        for object_location, future in results:
+            try:
+                value, info = future.result()
+            except KeyError:
+                continue
 
-        for object_location in object_generator:
-            value = retrieve(object_location)
             key = self.convert_from_s3_key(object_location.key)
-            all_items[key] = value
+            if self._config.use_cache:
+                # Update `data` directly rather than `self` so we don't just re-write
+                # the keys back to s3 again.
+                self._cache(key, value, info)
+            yield key, value
 
-        if self._config.use_cache:
-            # Update `data` directly rather than `self` so we don't just re-write
-            # the keys back to s3 again.
-            self.data.update(all_items)
+    def _iter_items_from_segments(
+        self, ordered: bool
+    ) -> Generator[Tuple[str, Any], None, None]:
+        """Generate all (key, value) pairs, reading each segment with a single GET."""
+        assert self._segments is not None
+        self._segments.refresh()
+        for key, value, info in self._segments.get_many(ordered=ordered):
+            if self._config.use_cache:
+                self._cache(key, value, info)
+            yield key, value
 
-        return all_items
+    def get_all_from_s3(self) -> Dict[str, Any]:
+        """
+        Discover all objects stored in s3 using this dict's ID.
+
+        Caches the result on this object if configured to do so.
+
+        Returns a dict of the discovered objects.
+        """
+        return dict(self.iter_items_from_s3())
 
     @property
     def as_dict(self) -> Dict[str, Any]:
@@ -115,7 +722,7 @@ class S3Dict(UserDict):
             Use `get_all_from_s3()` to force population of the entire dict.
         """
         if self._config.use_cache:
-            return self.data
+            return self.data.snapshot()
         else:
             return self.get_all_from_s3()
 
@@ -129,47 +736,670 @@ class S3Dict(UserDict):
         """Prepend this dicts ID to the key for unique identification in s3."""
         return f"{self._config.s3_prefix}{key}"
 
+    def _object_location(self, key: str) -> ObjectLocation:
+        """Return the location in s3 of the given key of this dict."""
+        if self._config.content_addressed:
+            # The object only holds the hash of the value, which is short.
+            return ObjectLocation(
+                key=self.convert_to_s3_key(key),
+                bucket=self._config.bucket,
+                codec="json",
+            )
+        return ObjectLocation(
+            key=self.convert_to_s3_key(key),
+            bucket=self._config.bucket,
+            codec=self._config.codec,
+            compression=self._config.compression,
+        )
+
+    def _blob_location(self, digest: str) -> ObjectLocation:
+        """Return the location in s3 of the value with the given hash."""
+        return ObjectLocation(
+            key=f"{self._config.blob_prefix}{digest}", bucket=self._config.bucket
+        )
+
+    def update(self, *args: Any, **kwargs: Any) -> None:
+        """
+        Store all the given items in s3 concurrently, as well as in the cache if configured.
+
+        Accepts the same arguments as `dict.update`. If any items fail to be stored, the
+        rest are still stored and then a BulkOperationError is raised. Items that failed
+        to be stored are not cached.
+        """
+        items = dict(*args, **kwargs)
+        if not items:
+            return
+
+        for key in items:
+            self._cancel_prefetch(key)
+        if self._write_buffer is not None:
+            for key, value in items.items():
+                self._index_key(key, exists=True)
+                self._write_buffer.set(key, value)
+                if self._config.use_cache:
+                    self._keep_stored_info(key)
+                    self._cache_pending(key, value)
+            self._flush_if_full()
+            return
+
+        locations = {key: self._object_location(key) for key in items}
+        result = self._store_many(items)
+
+        for key, object_location in locations.items():
+            if object_location in result.results:
+                self._index_key(key, exists=True)
+                if self._config.use_cache:
+                    self._cache(key, items[key], result.results[object_location])
+
+        result.raise_for_errors()
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        """
+        Get many items at once, downloading those not already cached concurrently.
+
+        Keys that do not exist in s3 are left out of the result.
+        If any items fail to be downloaded for any other reason, a BulkOperationError
+        is raised once the rest have been downloaded.
+
+        :param keys: The keys of the items to get.
+        :return: Dict of the found items.
+        """
+        found: Dict[str, Any] = {}
+        missing = []
+        for key in keys:
+            try:
+                found[key] = self._get_pending(key)
+            except KeyError:
+                missing.append(key)
+            else:
+                if found[key] is DELETED:
+                    del found[key]
+
+        stale = []
+        uncached = missing
+        if self._config.use_cache:
+            prefetches = {key: self._prefetches.get(key) for key in missing}
+            uncached = []
+            for key in missing:
+                try:
+                    found[key] = self.data[key]
+                except KeyError:
+                    if prefetches[key] is not None or self.data.etag(key) is not None:
+                        stale.append(key)
+                    else:
+                        uncached.append(key)
+
+        # Stale values are fetched individually so they can be revalidated by ETag.
+        result = BulkResult()
+        for key, future in bounded_map(
+            lambda key: self._fetch_or_wait(key, prefetches[key]),
+            stale,
+            max_in_flight=self._config.max_concurrency,
+        ):
+            try:
+                found[key] = future.result()
+            except KeyError:
+                continue
+            except Exception as err:
+                result.errors[self._object_location(key)] = err
+            else:
+                result.results[self._object_location(key)] = found[key]
+
+        retrieved = self._retrieve_many(uncached)
+        result.errors.update(retrieved.errors)
+        for object_location, (value, info) in retrieved.results.items():
+            key = self.convert_from_s3_key(object_location.key)
+            if self._config.use_cache:
+                self._cache(key, value, info)
+            found[key] = value
+            result.results[object_location] = value
+
+        result.raise_for_errors()
+        return found
+
+    def _retrieve_many(self, keys: Iterable[str]) -> BulkResult:
+        """
+        Download many items concurrently, without using the cache. See `get_many`.
+
+        :return: BulkResult of the value and ObjectInfo of each item. Items that do not
+            exist in s3 are left out.
+        """
+        result = BulkResult()
+        if self._segments is not None:
+            for key, value, info in self._segments.get_many(keys):
+                result.results[self._object_location(key)] = (value, info)
+            return result
+
+        locations = (self._object_location(key) for key in keys)
+        if not self._config.content_addressed and self._disk_cache is None:
+            result = retrieve_many(
+                locations,
+                max_concurrency=self._config.max_concurrency,
+                with_info=True,
+                decode=self._config.decode,
+                allowed_codecs=self._config.allowed_codecs,
+            )
+        else:
+            if self._config.decode is None:
+                results = bounded_map(
+                    self._retrieve,
+                    locations,
+                    max_in_flight=self._config.max_concurrency,
+                )
+            else:
+                downloads = bounded_map(
+                    self._retrieve_encoded,
+                    locations,
+                    max_in_flight=self._config.max_concurrency,
+                )
+                results = decode_in_processes(
+                    downloads,
+                    self._config.decode,
+                    allowed_codecs=self._config.allowed_codecs,
+                )
+            for object_location, future in results:
+                try:
+                    result.results[object_location] = future.result()
+                except Exception as err:
+                    result.errors[object_location] = err
+        result.errors = {
+            location: err
+            for location, err in result.errors.items()
+            if not isinstance(err, KeyError)
+        }
+        return result
+
     def __setitem__(self, key: str, value: Any) -> None:
         """Store the item in s3, as well as in the cache if configured to do so."""
-        object_location = ObjectLocation(
-            key=self.convert_to_s3_key(key), bucket=self._config.bucket
-        )
-        store(object_location, value)
+        self._cancel_prefetch(key)
+        if self._write_buffer is not None:
+            self._index_key(key, exists=True)
+            self._write_buffer.set(key, value)
+            if self._config.use_cache:
+                self._keep_stored_info(key)
+                self._cache_pending(key, value)
+            self._flush_if_full()
+            return
+
+        info = self._store(key, value)
 
+        self._index_key(key, exists=True)
         if self._config.use_cache:
-            super(S3Dict, self).__setitem__(key, value)
+            self._cache(key, value, info)
+
+    def _store(self, key: str, value: Any) -> ObjectInfo:
+        """Store the item in s3, skipping it if unchanged when configured to."""
+        object_location = self._object_location(key)
+        if not self._config.content_addressed:
+            return store(
+                object_location,
+                value,
+                check_bucket=self._config.check_bucket,
+                disk_cache=self._disk_cache,
+                **self._skip_unchanged_kwargs(self._stored_info(key)),
+            )
+
+        blob_info = self._store_blob(value)
+        info = store(
+            object_location,
+            blob_info.content_hash,
+            check_bucket=self._config.check_bucket,
+            **self._skip_unchanged_kwargs(self._stored_info(key)),
+        )
+        return replace(info, size=blob_info.size)
+
+    def _store_many(self, items: Dict[str, Any]) -> BulkResult:
+        """
+        Store many items in s3 concurrently, skipping unchanged ones when configured to.
+
+        :return: BulkResult of the ObjectInfo of the object of each key, by location.
+        """
+        locations = {key: self._object_location(key) for key in items}
+        blob_infos: Dict[str, ObjectInfo] = {}
+        blob_errors: Dict[ObjectLocation, Exception] = {}
+        if self._config.content_addressed:
+            # Store the values first, so that keys never refer to missing values.
+            for (key, _), future in bounded_map(
+                lambda item: self._store_blob(item[1]),
+                items.items(),
+                max_in_flight=self._config.max_concurrency,
+            ):
+                try:
+                    blob_infos[key] = future.result()
+                except Exception as err:
+                    blob_errors[locations[key]] = err
+            items = {key: info.content_hash for key, info in blob_infos.items()}
+
+        current: Dict[ObjectLocation, ObjectInfo] = {}
+        if self._config.skip_unchanged:
+            for key in items:
+                info = self._stored_info(key)
+                if info is not None:
+                    current[locations[key]] = info
+
+        result = store_many(
+            ((locations[key], value) for key, value in items.items()),
+            check_bucket=self._config.check_bucket,
+            max_concurrency=self._config.max_concurrency,
+            disk_cache=None if self._config.content_addressed else self._disk_cache,
+            **self._skip_unchanged_kwargs(current),
+        )
+        for key, blob_info in blob_infos.items():
+            info = result.results.get(locations[key])
+            if info is not None:
+                result.results[locations[key]] = replace(info, size=blob_info.size)
+        result.errors.update(blob_errors)
+        return result
+
+    def _store_blob(self, value: Any) -> ObjectInfo:
+        """Store the value under the hash of its data, unless it is stored already."""
+        _, info = store_by_content(
+            self._config.bucket,
+            self._config.blob_prefix,
+            value,
+            check_bucket=self._config.check_bucket,
+            codec=self._config.codec,
+            compression=self._config.compression,
+            disk_cache=self._disk_cache,
+        )
+        return info
+
+    def _skip_unchanged_kwargs(self, current: Any) -> Dict[str, Any]:
+        """Return the arguments to `store` or `store_many` to skip unchanged writes."""
+        if not self._config.skip_unchanged:
+            return {}
+        return dict(skip_unchanged=True, current=current)
+
+    def _stored_info(self, key: str) -> Optional[ObjectInfo]:
+        """Return the details of the object stored for the key, if known locally."""
+        info = self._stored_before.pop(key, None)
+        if info is None and self._config.use_cache:
+            info = self.data.object_info(key)
+        return info
+
+    def _keep_stored_info(self, key: str) -> None:
+        """Keep the details of the object stored for the key before a deferred write."""
+        if self._config.skip_unchanged and key not in self._stored_before:
+            info = self.data.object_info(key)
+            if info is not None and info.content_hash is not None:
+                self._stored_before[key] = info
+
+    def _cache_pending(self, key: str, value: Any) -> None:
+        """
+        Store the value of a deferred write in the cache.
+
+        Its size once stored isn't known until it is flushed, so it is estimated if the
+        cache is limited by size. Otherwise pending writes could grow it without bound.
+        """
+        size = 0 if self.data.policy.max_bytes is None else estimate_size(value)
+        self.data.set(key, value, size=size)
+
+    def _cache(self, key: str, value: Any, info: ObjectInfo) -> None:
+        """Store the value in the cache, along with the details of its object in s3."""
+        self.data.set(
+            key, value, size=info.size, etag=info.etag, content_hash=info.content_hash,
+        )
+
+    def _retrieve(
+        self, object_location: ObjectLocation, if_none_match: Optional[str] = None
+    ) -> Tuple[Any, ObjectInfo]:
+        """Retrieve the object, from the disk cache if possible. See `retrieve_with_info`."""
+        if self._config.content_addressed:
+            digest, info = retrieve_with_info(
+                object_location, if_none_match=if_none_match
+            )
+            # Values are never modified once stored, so copies on disk are always valid.
+            value, blob_info = retrieve_with_info(
+                self._blob_location(digest),
+                disk_cache=self._disk_cache,
+                revalidate_disk_cache=False,
+                allowed_codecs=self._config.allowed_codecs,
+            )
+            return value, replace(info, size=blob_info.size)
+
+        if self._disk_cache is None:
+            return retrieve_with_info(
+                object_location,
+                if_none_match=if_none_match,
+                allowed_codecs=self._config.allowed_codecs,
+            )
+
+        policy = self.data.policy
+        return retrieve_with_info(
+            object_location,
+            if_none_match=if_none_match,
+            disk_cache=self._disk_cache,
+            revalidate_disk_cache=(
+                policy.ttl is not None or policy.revalidate_after is not None
+            ),
+            allowed_codecs=self._config.allowed_codecs,
+        )
+
+    def _retrieve_encoded(
+        self, object_location: ObjectLocation
+    ) -> Tuple[Buffer, ObjectInfo]:
+        """Retrieve the encoded data of the object, from the disk cache if possible."""
+        if self._config.content_addressed:
+            digest, info = retrieve_with_info(object_location)
+            data, blob_info = retrieve_encoded(
+                self._blob_location(digest),
+                disk_cache=self._disk_cache,
+                revalidate_disk_cache=False,
+            )
+            return data, replace(info, size=blob_info.size)
+
+        policy = self.data.policy
+        return retrieve_encoded(
+            object_location,
+            disk_cache=self._disk_cache,
+            revalidate_disk_cache=(
+                policy.ttl is not None or policy.revalidate_after is not None
+            ),
+        )
+
+    def _fetch(self, item: str) -> Any:
+        """
+        Download the item from s3 and store it in the cache.
+
+        If a stale copy of the item is cached, it is only downloaded if it has changed.
+        """
+        value, info = self._download(item)
+        if info is not None:
+            self._cache(item, value, info)
+        return value
+
+    def _download(self, item: str) -> Tuple[Any, Optional[ObjectInfo]]:
+        """
+        Download the item from s3, unless a stale copy of it is cached and unchanged.
+
+        :return: The value, and the details of its object in s3, or None if the cached
+            copy was revalidated instead.
+        """
+        if self._segments is not None:
+            return self._segments.get(item)
+
+        object_location = self._object_location(item)
+        etag = self.data.etag(item)
+        try:
+            return self._retrieve(object_location, if_none_match=etag)
+        except ObjectNotModified:
+            try:
+                return self.data.revalidate(item, etag), None
+            except KeyError:
+                # The cached copy was evicted or replaced while we were checking.
+                return self._retrieve(object_location)
+
+    def _index_key(self, key: str, exists: bool) -> None:
+        """Record a write to the key in the listed keys, if they have been listed."""
+        key_index = self._key_index
+        if key_index is None:
+            return
+        if exists:
+            key_index.add(key)
+        else:
+            key_index.discard(key)
+
+    def _listed_keys(self) -> KeyIndex:
+        """Return the keys stored under this dict, listing them from s3 if needed."""
+        with self._key_index_lock:
+            key_index = self._key_index
+            if key_index is None or (
+                not self._config.key_index
+                and key_index.is_expired(self._config.listing_ttl)
+            ):
+                key_index = self.refresh_keys()
+            return key_index
+
+    def refresh_keys(self) -> KeyIndex:
+        """List the keys stored under this dict from s3, replacing any listed before."""
+        if self._segments is not None:
+            self._segments.refresh()
+            return self._index_listed_keys(self._segments.keys())
+
+        object_generator = generate_items_in_bucket(
+            self._config.bucket, prefix=self._config.s3_prefix
+        )
+        return self._index_listed_keys(
+            self.convert_from_s3_key(object_location.key)
+            for object_location in object_generator
+        )
+
+    def _index_listed_keys(self, keys: Iterable[str]) -> KeyIndex:
+        """Replace the listed keys with the given keys listed from s3."""
+        key_index = KeyIndex(keys)
+        # Deferred writes are not in s3 yet.
+        if self._write_buffer is not None:
+            for key, value in self._write_buffer.snapshot().items():
+                if value is DELETED:
+                    key_index.discard(key)
+                else:
+                    key_index.add(key)
+        self._key_index = key_index
+        return key_index
+
+    def refresh(self) -> RefreshSummary:
+        """
+        Bring the cache up to date with s3, only downloading the values that changed.
+
+        Lists the objects stored under this dict, and compares the ETag of each with
+        that of its cached value. The values of new keys and of changed objects are
+        downloaded concurrently and cached. Unchanged values are kept, and are fresh
+        again if they were due to be revalidated. Keys that are no longer stored in s3
+        are removed from the cache. The listed keys are replaced, as by `refresh_keys()`.
+
+        Changes are detected by ETag alone, as listings give no other details of each
+        object, so this relies on the backend giving an object a new ETag whenever its
+        data changes. s3 and the "memory" backend do. The "local" backend derives ETags
+        from the modification time and size of each file, so a change that keeps both,
+        e.g. a rewrite within the resolution of the filesystem's timestamps, or a file
+        copied into place with its times preserved, is not seen.
+
+        Deferred writes are flushed first. Values cached without an ETag, e.g. those of
+        large objects uploaded in parts, are downloaded again. In "packed" layout, the
+        index of segments is reloaded instead of listing the objects, and values moved
+        by compaction since are downloaded again.
+
+        Without a cache, there are no values to bring up to date, so only the keys
+        are listed again.
+
+        If any values fail to be downloaded, the rest are still downloaded and then a
+        BulkOperationError is raised.
+
+        :return: RefreshSummary of the keys that were added, changed and removed.
+        """
+        self.flush()
+        if not self._config.use_cache:
+            self.refresh_keys()
+            return RefreshSummary()
+        if self._segments is not None:
+            return self._refresh_segments()
+
+        listed = {
+            self.convert_from_s3_key(object_location.key): info
+            for object_location, info in generate_objects_in_bucket(
+                self._config.bucket, prefix=self._config.s3_prefix
+            )
+        }
+        self._index_listed_keys(listed)
+
+        summary = RefreshSummary()
+        for key, info in listed.items():
+            if key not in self.data:
+                summary.added.append(key)
+                continue
+            try:
+                self.data.revalidate(key, info.etag)
+            except KeyError:
+                summary.changed.append(key)
+            else:
+                summary.unchanged += 1
+
+        # Fetch each value individually, as conditional GETs can tell if the object has
+        # changed back since it was listed.
+        result = BulkResult()
+        missing: Set[str] = set()
+        for key, future in bounded_map(
+            self._fetch,
+            summary.added + summary.changed,
+            max_in_flight=self._config.max_concurrency,
+        ):
+            try:
+                future.result()
+            except KeyError:
+                # Deleted since it was listed.
+                missing.add(key)
+            except Exception as err:
+                result.errors[self._object_location(key)] = err
+
+        self._remove_missing(summary, missing.union(set(self.data) - set(listed)))
+        log.debug(
+            f"Refreshed S3Dict {self._config.id}: {len(summary.added)} added, "
+            f"{len(summary.changed)} changed, {len(summary.removed)} removed."
+        )
+        result.raise_for_errors()
+        return summary
+
+    def _refresh_segments(self) -> RefreshSummary:
+        """Bring the cache up to date with the segments in s3. See `refresh`."""
+        assert self._segments is not None
+        before = self._segments.value_locations()
+        self._segments.refresh()
+        after = self._segments.value_locations()
+        self._index_listed_keys(after)
+
+        summary = RefreshSummary()
+        for key, value_location in after.items():
+            if key not in self.data:
+                summary.added.append(key)
+            elif before.get(key) != value_location:
+                summary.changed.append(key)
+            else:
+                summary.unchanged += 1
+
+        for key, value, info in self._segments.get_many(
+            summary.added + summary.changed
+        ):
+            self._cache(key, value, info)
+
+        self._remove_missing(summary, set(self.data) - set(after))
+        return summary
+
+    def _remove_missing(self, summary: RefreshSummary, missing: Set[str]) -> None:
+        """Remove the keys that are no longer stored in s3 from the cache and summary."""
+        summary.added = [key for key in summary.added if key not in missing]
+        summary.changed = [key for key in summary.changed if key not in missing]
+        summary.removed = sorted(missing)
+        for key in missing:
+            try:
+                del self.data[key]
+            except KeyError:
+                pass
+            self._index_key(key, exists=False)
+
+    def __len__(self) -> int:
+        """Return the number of keys stored in s3 under this dict."""
+        return len(self._listed_keys())
+
+    def __iter__(self) -> Iterator[str]:
+        """
+        Iterate over the keys stored in s3 under this dict, in sorted order.
+
+        Prefetches the values of the next keys if `read_ahead` is configured.
+        """
+        keys = iter(self._listed_keys())
+        if self._config.read_ahead and self._config.use_cache:
+            return self._read_ahead(keys)
+        return keys
+
+    def __contains__(self, item: object) -> bool:
+        """
+        Return True if the key is stored in s3 under this dict.
+
+        Answered from the pending writes, the cache or the listed keys if possible.
+        Otherwise s3 is asked about just this key.
+        """
+        if not isinstance(item, str):
+            return False
+        try:
+            return self._get_pending(item) is not DELETED
+        except KeyError:
+            pass
+
+        if self._config.use_cache and item in self.data:
+            return True
+        key_index = self._key_index
+        if key_index is not None and (
+            self._config.key_index or not key_index.is_expired(self._config.listing_ttl)
+        ):
+            return item in key_index
+        if self._segments is not None:
+            return item in self._segments
+        return object_exists(self._object_location(item))
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Return the value for the key, or `default` if it does not exist."""
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def _get_pending(self, item: str) -> Any:
+        """
+        Return the deferred write to the item, which may be DELETED.
+
+        Raises KeyError if there is no deferred write to the item.
+        """
+        if self._write_buffer is None:
+            raise KeyError(item)
+        return self._write_buffer.get(item)
 
     def __getitem__(self, item: str) -> Any:
         """Get the item from s3, using the cache if configured to do so."""
-        object_location = ObjectLocation(
-            key=self.convert_to_s3_key(item), bucket=self._config.bucket
-        )
+        try:
+            value = self._get_pending(item)
+        except KeyError:
+            pass
+        else:
+            if value is DELETED:
+                raise KeyError(item)
+            return value
+
+        object_location = self._object_location(item)
         if self._config.use_cache:
+            prefetch = self._prefetches.get(item)
             try:
                 # Try find it locally.
-                value = super(S3Dict, self).__getitem__(item)
+                value = self.data[item]
             except KeyError:
-                # On failure, grab it from s3
+                # On failure, grab it from s3, or wait for it to be prefetched.
                 # If it doesn't exist in s3, then this will raise a KeyError itself
                 # which is normal behaviour for a Dict.
-                value = retrieve(object_location)
-                # Store it locally to cache it for next time
-                super(S3Dict, self).__setitem__(item, value)
+                value = self._fetch_or_wait(item, prefetch)
+        elif self._segments is not None:
+            value, _ = self._segments.get(item)
+        elif self._config.content_addressed:
+            value, _ = self._retrieve(object_location)
         else:
-            value = retrieve(object_location)
+            value = retrieve(
+                object_location, allowed_codecs=self._config.allowed_codecs
+            )
 
         return value
 
     def __delitem__(self, item: str) -> None:
         """Delete the item from s3, as well as from the cache if configured to do so."""
-        object_location = ObjectLocation(
-            key=self.convert_to_s3_key(item), bucket=self._config.bucket
-        )
+        object_location = self._object_location(item)
         # As s3 delete operations are a no-op if it doesn't exist, then we can't
         # tell if the item existed already or not.
         # Therefore this is a departure from the normal `dict` API because we can't
         # raise a KeyError on failure to delete.
-        delete(object_location)
+        self._cancel_prefetch(item)
+        if self._write_buffer is not None:
+            self._write_buffer.delete(item)
+            self._stored_before.pop(item, None)
+        else:
+            delete(object_location)
+        self._index_key(item, exists=False)
         if self._config.use_cache:
             try:
                 super(S3Dict, self).__delitem__(item)
@@ -177,14 +1407,77 @@ class S3Dict(UserDict):
                 # To keep things consistent, also don't raise a KeyError
                 # when deleting from the cache.
                 pass
+        self._flush_if_full()
 
     def clear(self) -> None:
-        """Delete all the objects stored in s3 under this dict and clear the cache."""
-        object_generator = generate_items_in_bucket(
+        """
+        Delete all the objects stored in s3 under this dict and clear the cache.
+
+        Objects are deleted in concurrent batches. If any objects fail to be deleted,
+        the rest are still deleted and then a BulkOperationError is raised. Values that
+        failed to be deleted are kept in the cache.
+
+        Deferred writes that have not been flushed yet are discarded.
+
+        In content addressed mode, the values the keys refer to are deleted too.
+        """
+        self._cancel_prefetches()
+        if self._write_buffer is not None:
+            with self._flush_lock:
+                self._write_buffer.discard()
+                self._stored_before.clear()
+        if self._segments is not None:
+            # Otherwise compaction may rewrite segments as they are deleted.
+            self._segments.wait_for_compaction()
+        self._key_index = None
+        object_generator: Iterable[ObjectLocation] = generate_items_in_bucket(
             self._config.bucket, prefix=self._config.s3_prefix
         )
+        if self._config.content_addressed:
+            object_generator = itertools.chain(
+                object_generator,
+                generate_items_in_bucket(
+                    self._config.bucket, prefix=self._config.blob_prefix
+                ),
+            )
+        result = delete_many(
+            object_generator, max_concurrency=self._config.max_concurrency
+        )
+        if self._segments is not None:
+            # Segments that failed to be deleted are loaded again by the next refresh.
+            self._segments.reset()
+            failed_keys: Set[str] = set()
+        else:
+            failed_keys = {
+                self.convert_from_s3_key(location.key) for location in result.errors
+            }
+        for key in list(self.data):
+            if key not in failed_keys:
+                del self.data[key]
+
+        result.raise_for_errors()
 
-        for object_location in object_generator:
-            delete(object_location)
 
-        super(S3Dict, self).clear()
+def _flush_in_background(
+    ref: "weakref.ReferenceType[S3Dict]", wakeup: threading.Event, max_age: float
+) -> None:
+    """
+    Flush deferred writes every `max_age` seconds, or when woken up, until closed.
+
+    Stops once the dict is closed or garbage collected. Deferred writes that have not
+    been flushed when the dict is collected are lost, so close dicts to flush them.
+    """
+    while True:
+        wakeup.wait(timeout=max_age)
+        wakeup.clear()
+        s3dict = ref()
+        if s3dict is None or s3dict._closed:
+            return
+        try:
+            s3dict.flush()
+        except Exception:
+            log.exception(
+                f"Failed to flush deferred writes of S3Dict {s3dict._config.id}. "
+                "They will be retried."
+            )
+        del s3dict
@@ -1,91 +1,547 @@
-"""Wrapper around boto3 to make it simpler to use."""
+"""
+Wrapper around boto3 to make it simpler to use.
 
-import boto3
-import botocore
-import io
+The functions in this module operate on objects in whichever storage backend their
+bucket is in (see `s3os.backends`). The s3 backend itself is implemented here by
+S3Backend, and is the default.
+"""
+
+import hashlib
 import logging
+import threading
+import time
 
 
+from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import ClientError
-from dataclasses import dataclass, field
-from typing import Generator, Optional
-
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Any,
+    BinaryIO,
+    Dict,
+    Generator,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+from .backends import StorageBackend, Stream, get_backend, register_backend
+from .buffers import BufferStream
+from .clients import get_client
+from .locations import BucketLocation, ObjectInfo, ObjectLocation, ObjectNotModified
+from .metrics import operation, record_transfer
+from .streaming import MultipartConfig, MultipartUpload, open_object
+from .throttling import call_with_retries
 
 log = logging.getLogger(__name__)
 
+#: The maximum number of keys that can be deleted by a single DeleteObjects request.
+MAX_KEYS_PER_DELETE = 1000
+#: Default size in bytes below which objects are transferred with a single
+#: PutObject/GetObject request, rather than in concurrent parts.
+DEFAULT_SMALL_OBJECT_LIMIT = 8 * 2 ** 20
+#: Key of the user metadata of objects that holds the hash of their data.
+CONTENT_HASH_METADATA = "s3os-sha256"
+
+_small_object_limit = DEFAULT_SMALL_OBJECT_LIMIT
+_transfer_config = TransferConfig()
+
+
+def configure_transfers(
+    small_object_limit: int = DEFAULT_SMALL_OBJECT_LIMIT,
+    transfer_config: Optional[TransferConfig] = None,
+) -> None:
+    """
+    Set how objects are transferred to and from s3.
+
+    Objects smaller than `small_object_limit` bytes are transferred with a single request,
+    which avoids the overhead of the s3transfer manager's threads and futures. Larger
+    objects are uploaded by the s3transfer manager, in concurrent parts, and downloaded
+    in concurrent ranged requests of the `multipart_chunksize` of the transfer config,
+    at most its `max_request_concurrency` at once.
+
+    :param small_object_limit: Size in bytes below which objects are transferred with
+        a single request.
+    :param transfer_config: Optional boto3 TransferConfig used to transfer larger objects.
+        Defaults to `TransferConfig()`.
+    """
+    global _small_object_limit, _transfer_config
+
+    if small_object_limit < 0:
+        raise ValueError(
+            f"`small_object_limit` must not be negative. You passed: {small_object_limit=}."
+        )
+    _small_object_limit = small_object_limit
+    _transfer_config = (
+        transfer_config if transfer_config is not None else TransferConfig()
+    )
+
+
+class S3Backend(StorageBackend):
+    """
+    Backend that keeps objects in s3 itself, via boto3. The default backend.
+
+    Every request is made within the concurrency limit of its bucket, and retried if
+    throttled or failed transiently. See `s3os.throttling`.
+    """
+
+    def bucket_exists(self, bucket: BucketLocation) -> bool:
+        """Return True if the given bucket exists. Otherwise False."""
+        s3_client = get_client(bucket.region)
+        try:
+            call_with_retries(
+                bucket, "HeadBucket", lambda: s3_client.head_bucket(Bucket=bucket.name)
+            )
+        except ClientError as err:
+            if err.response.get("Error", {}).get("Code") in ("404", "NoSuchBucket"):
+                return False
+            raise
+        return True
+
+    def create_bucket(self, bucket: BucketLocation) -> None:
+        """
+        Create an S3 bucket in a specified region.
+
+        If a region is not specified, the bucket is created in the S3 default
+        region (us-east-1).
+        """
+        try:
+            s3_client = get_client(bucket.region)
+            kwargs: Dict[str, Any] = {"Bucket": bucket.name}
+            if bucket.region is not None:
+                kwargs["CreateBucketConfiguration"] = {
+                    "LocationConstraint": bucket.region
+                }
+            call_with_retries(
+                bucket, "CreateBucket", lambda: s3_client.create_bucket(**kwargs)
+            )
+        except ClientError as e:
+            log.error(f"Failed to create bucket {bucket!r}. {e}")
+            raise
+
+    def put(
+        self,
+        object_location: ObjectLocation,
+        stream: Stream,
+        content_hash: Optional[str] = None,
+    ) -> Optional[str]:
+        """
+        Upload the given data stream as an object to s3.
+
+        Objects smaller than the `small_object_limit` (see `configure_transfers`) are
+        uploaded with a single PutObject request, and larger ones by the s3transfer
+        manager. The ETag is known for objects uploaded in a single request.
+        The `content_hash` is kept in the user metadata of the object.
+        """
+        if isinstance(stream, BufferStream):
+            buffers = stream.buffers
+        else:
+            buffers = [stream.getbuffer()]
+        size = sum(buffer.nbytes for buffer in buffers)
+        transfer_config = _transfer_config
+        s3 = get_client(object_location.bucket.region)
+        bucket = object_location.bucket
+        metadata: Dict[str, Any] = {}
+        if content_hash is not None:
+            metadata["Metadata"] = {CONTENT_HASH_METADATA: content_hash}
+
+        def put_object() -> Any:
+            stream.seek(0)
+            return s3.put_object(
+                Bucket=bucket.name, Key=object_location.key, Body=stream, **metadata
+            )
+
+        def upload_fileobj() -> Any:
+            stream.seek(0)
+            return s3.upload_fileobj(
+                stream,
+                bucket.name,
+                object_location.key,
+                Config=transfer_config,
+                **({"ExtraArgs": metadata} if metadata else {}),
+            )
+
+        try:
+            if size < _small_object_limit:
+                result = call_with_retries(bucket, "PutObject", put_object)
+                etag = result.get("ETag")
+            else:
+                etag = None
+                if size < transfer_config.multipart_threshold:
+                    # Uploaded in a single request, so the ETag is the MD5 of the data.
+                    md5 = hashlib.md5()
+                    for buffer in buffers:
+                        md5.update(buffer)
+                    etag = f'"{md5.hexdigest()}"'
+                result = call_with_retries(bucket, "Upload", upload_fileobj)
+        except ClientError as err:
+            if err.response.get("Error", {}).get("Code") == "NoSuchBucket":
+                # The bucket has been deleted since we last checked for it.
+                invalidate_known_buckets(object_location.bucket)
+            raise
+        log.debug(f"Result of upload to {object_location}: {result}")
+        return etag
+
+    def get(
+        self, object_location: ObjectLocation, if_none_match: Optional[str] = None
+    ) -> Tuple[BufferStream, ObjectInfo]:
+        """
+        Download the given object from s3, along with its details.
+
+        Objects are first requested with a GetObject request for their first
+        `small_object_limit` bytes (see `configure_transfers`), which is the whole of
+        smaller objects. The rest of larger objects is then downloaded in concurrent
+        ranged requests of the `multipart_chunksize` of the transfer config, which only
+        succeed while the object has the ETag of the first response. So no data is
+        downloaded twice, and every part is of the same object. The data is read
+        straight into a buffer of the object's size, rather than copied between growing
+        buffers.
+        """
+        s3 = get_client(object_location.bucket.region)
+        kwargs = {"Bucket": object_location.bucket.name, "Key": object_location.key}
+        if if_none_match is not None:
+            kwargs["IfNoneMatch"] = if_none_match
+        first_part_size = _small_object_limit or _transfer_config.multipart_chunksize
+
+        def get_first_part() -> Tuple[Dict[str, Any], bytearray]:
+            # The body is read within the request, so failures reading it are retried.
+            try:
+                result = s3.get_object(Range=f"bytes=0-{first_part_size - 1}", **kwargs)
+            except ClientError as err:
+                if err.response.get("Error", {}).get("Code") != "InvalidRange":
+                    raise
+                # Empty objects have no bytes to request a range of.
+                result = s3.get_object(**kwargs)
+            data = bytearray(_object_size(result))
+            with memoryview(data) as view:
+                _read_body_into(result["Body"], view[: result["ContentLength"]])
+            return result, data
+
+        try:
+            result, data = call_with_retries(
+                object_location.bucket, "GetObject", get_first_part
+            )
+            if result["ContentLength"] < len(data):
+                _download_remaining_parts(
+                    object_location, result.get("ETag"), data, result["ContentLength"]
+                )
+        except ClientError as err:
+            code = err.response.get("Error", {}).get("Code")
+            if code == "304":
+                raise ObjectNotModified(object_location) from err
+            if code in ("404", "NoSuchKey"):
+                log.debug(f"S3 object {object_location} does not exist.")
+                raise KeyError(f"S3 object {object_location} does not exist.") from err
+            if code in ("412", "PreconditionFailed"):
+                raise IOError(
+                    f"{object_location} changed while it was being downloaded."
+                ) from err
+            raise
+
+        log.debug(f"Result of download from {object_location}: {result}")
+        return BufferStream([data]), _object_info(result, size=len(data))
+
+    def get_range(
+        self, object_location: ObjectLocation, start: int, length: int
+    ) -> BufferStream:
+        """Download part of the given object with a single ranged GetObject request."""
+        if length == 0:
+            return BufferStream([])
+
+        s3 = get_client(object_location.bucket.region)
+
+        def get_object_range() -> bytearray:
+            result = s3.get_object(
+                Bucket=object_location.bucket.name,
+                Key=object_location.key,
+                Range=f"bytes={start}-{start + length - 1}",
+            )
+            return _read_body(result["Body"], result["ContentLength"])
+
+        try:
+            body = call_with_retries(
+                object_location.bucket, "GetObject", get_object_range
+            )
+        except ClientError as err:
+            if err.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                log.debug(f"S3 object {object_location} does not exist.")
+                raise KeyError(f"S3 object {object_location} does not exist.") from err
+            raise
+
+        return BufferStream([body])
+
+    def head(self, object_location: ObjectLocation) -> ObjectInfo:
+        """Describe the given object with a HeadObject request."""
+        s3 = get_client(object_location.bucket.region)
+        try:
+            result = call_with_retries(
+                object_location.bucket,
+                "HeadObject",
+                lambda: s3.head_object(
+                    Bucket=object_location.bucket.name, Key=object_location.key
+                ),
+            )
+        except ClientError as err:
+            if err.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                raise KeyError(f"S3 object {object_location} does not exist.") from err
+            raise
+        return _object_info(result, size=result.get("ContentLength"))
+
+    def delete(self, object_location: ObjectLocation) -> None:
+        """Delete the given object from s3."""
+        s3 = get_client(object_location.bucket.region)
+        result = call_with_retries(
+            object_location.bucket,
+            "DeleteObject",
+            lambda: s3.delete_object(
+                Bucket=object_location.bucket.name, Key=object_location.key
+            ),
+        )
+        log.debug(f"Result of delete of {object_location}: {result}")
+
+    def delete_batch(
+        self, bucket: BucketLocation, keys: Sequence[str]
+    ) -> Tuple[List[str], Dict[str, Exception]]:
+        """Delete up to MAX_KEYS_PER_DELETE objects with a single DeleteObjects request."""
+        s3 = get_client(bucket.region)
+        # Quiet mode only reports the keys that failed, which keeps responses small.
+        result = call_with_retries(
+            bucket,
+            "DeleteObjects",
+            lambda: s3.delete_objects(
+                Bucket=bucket.name,
+                Delete={"Objects": [{"Key": key} for key in keys], "Quiet": True},
+            ),
+        )
+        log.debug(f"Result of delete of {len(keys)} objects from {bucket}: {result}")
+
+        errors: Dict[str, Exception] = {
+            error["Key"]: ClientError({"Error": error}, "DeleteObjects")
+            for error in result.get("Errors", [])
+        }
+        deleted = [key for key in keys if key not in errors]
+        return deleted, errors
+
+    def list(
+        self, bucket: BucketLocation, prefix: Optional[str] = None
+    ) -> Iterator[str]:
+        """List the keys in the bucket, a page of up to 1000 keys at a time."""
+        for obj in self._list_objects(bucket, prefix):
+            yield obj["Key"]
+
+    def list_with_info(
+        self, bucket: BucketLocation, prefix: Optional[str] = None
+    ) -> Iterator[Tuple[str, ObjectInfo]]:
+        """
+        List the keys in the bucket with the size and ETag of each object.
+
+        These are part of the listing, so no requests are made per object. Content
+        hashes are not, so they are not given.
+        """
+        for obj in self._list_objects(bucket, prefix):
+            yield obj["Key"], ObjectInfo(size=obj["Size"], etag=obj.get("ETag"))
+
+    def _list_objects(
+        self, bucket: BucketLocation, prefix: Optional[str]
+    ) -> Iterator[Dict[str, Any]]:
+        """Generate the description of each object listed by ListObjectsV2."""
+        s3 = get_client(bucket.region)
+
+        kwargs = {"Bucket": bucket.name}
+
+        if prefix is not None:
+            kwargs["Prefix"] = prefix
+
+        while True:
+            response = call_with_retries(
+                bucket, "ListObjectsV2", lambda: s3.list_objects_v2(**kwargs)
+            )
+
+            # Contents is missing entirely if there are no matching objects.
+            for obj in response.get("Contents", []):
+                yield obj
+
+            # The S3 API is paginated, returning up to 1000 keys at a time.
+            # Pass the continuation token into the next response, until we
+            # reach the final page (when this field is missing).
+            try:
+                kwargs["ContinuationToken"] = response["NextContinuationToken"]
+            except KeyError:
+                break
+
+    def open_reader(
+        self, object_location: ObjectLocation
+    ) -> Tuple[BinaryIO, ObjectInfo]:
+        """Open the object for reading, reading its body in chunks as needed."""
+        return open_object(object_location)
+
+    def open_writer(
+        self, object_location: ObjectLocation, multipart: Any = None
+    ) -> Any:
+        """Open the object for writing, uploading it in parts as it is written."""
+        return MultipartUpload(object_location, multipart)
 
-@dataclass(frozen=True)
-class BucketLocation:
-    """Definition of a reference to an S3 bucket."""
 
-    name: str = "s3os"
-    region: Optional[str] = None
+register_backend("s3", S3Backend())
+
+
+def _object_info(result: Dict[str, Any], size: int) -> ObjectInfo:
+    """Create an ObjectInfo from the result of a GetObject or HeadObject request."""
+    return ObjectInfo(
+        size=size,
+        etag=result.get("ETag"),
+        content_hash=result.get("Metadata", {}).get(CONTENT_HASH_METADATA),
+    )
+
 
+def _backend(bucket: BucketLocation) -> StorageBackend:
+    return get_backend(bucket.backend)
 
-@dataclass(frozen=True)
-class ObjectLocation:
-    """Definition of a reference to a single S3 object."""
 
-    key: str
-    bucket: BucketLocation = field(default_factory=BucketLocation)
+def _network_operation(name: str, object_location: ObjectLocation) -> Any:
+    """Measure a request about a single object, all spent on the network."""
+    return operation(
+        name,
+        phase_name="network",
+        bucket=object_location.bucket.name,
+        key=object_location.key,
+    )
 
 
 def create_bucket(bucket: BucketLocation) -> None:
     """
-    Create an S3 bucket in a specified region.
+    Create a bucket.
 
-    If a region is not specified, the bucket is created in the S3 default
+    For s3, if a region is not specified, the bucket is created in the S3 default
     region (us-east-1).
 
     :param bucket: BucketLocation to create
     """
-    try:
-        if bucket.region is None:
-            s3_client = boto3.client("s3")
-            s3_client.create_bucket(Bucket=bucket.name)
-        else:
-            s3_client = boto3.client("s3", region_name=bucket.region)
-            location = {"LocationConstraint": bucket.region}
-            s3_client.create_bucket(
-                Bucket=bucket.name, CreateBucketConfiguration=location
-            )
-    except ClientError as e:
-        log.error(f"Failed to create bucket {bucket!r}. {e}")
-        raise
+    _backend(bucket).create_bucket(bucket)
+
+
+class BucketCache:
+    """
+    Thread-safe record of the buckets that are known to exist.
+
+    Entries expire after `ttl` seconds, after which the bucket is checked again.
+    """
+
+    def __init__(self, ttl: Optional[float] = 300):
+        """
+        Create a new BucketCache.
+
+        :param ttl: Seconds to remember that a bucket exists for.
+            If None, buckets are remembered until explicitly invalidated.
+        """
+        self.ttl = ttl
+        self._expiry_times: Dict[BucketLocation, Optional[float]] = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, bucket: BucketLocation) -> bool:
+        """Return True if the bucket is known to exist and the entry has not expired."""
+        with self._lock:
+            try:
+                expiry_time = self._expiry_times[bucket]
+            except KeyError:
+                return False
+            if expiry_time is not None and expiry_time <= time.monotonic():
+                del self._expiry_times[bucket]
+                return False
+            return True
+
+    def add(self, bucket: BucketLocation) -> None:
+        """Record that the given bucket exists."""
+        expiry_time = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            self._expiry_times[bucket] = expiry_time
+
+    def invalidate(self, bucket: Optional[BucketLocation] = None) -> None:
+        """
+        Forget that a bucket exists, so it is checked again on next use.
+
+        :param bucket: The bucket to forget. If not given, all buckets are forgotten.
+        """
+        with self._lock:
+            if bucket is None:
+                self._expiry_times.clear()
+            else:
+                self._expiry_times.pop(bucket, None)
+
+
+#: Process-wide cache of buckets that are known to exist, used by `ensure_bucket`.
+known_buckets = BucketCache()
+
+
+def invalidate_known_buckets(bucket: Optional[BucketLocation] = None) -> None:
+    """
+    Forget that a bucket exists, e.g. because it has been deleted by another process.
+
+    :param bucket: The bucket to forget. If not given, all buckets are forgotten.
+    """
+    known_buckets.invalidate(bucket)
 
 
 def bucket_exists(bucket: BucketLocation) -> bool:
     """Return True if the given bucket exists. Otherwise False."""
-    s3_client = boto3.client("s3")
-    response = s3_client.list_buckets()
-
-    return bucket.name in response["Buckets"]
+    return _backend(bucket).bucket_exists(bucket)
 
 
 def ensure_bucket(bucket: BucketLocation) -> None:
     """
     Ensure the given bucket exists.
 
-    If the bucket already exists, then no action is taken.
-    Otherwise, the bucket is created.
+    If the bucket is already known to exist, then no action is taken.
+    Otherwise, the bucket is checked for, and created if it does not exist.
     """
+    if bucket in known_buckets:
+        return
+
     if not bucket_exists(bucket):
-        create_bucket(bucket)
+        try:
+            create_bucket(bucket)
+        except ClientError as err:
+            # Another process may have created the bucket since we checked.
+            code = err.response.get("Error", {}).get("Code")
+            if code != "BucketAlreadyOwnedByYou":
+                raise
 
+    known_buckets.add(bucket)
 
-def upload_object(object_location: ObjectLocation, stream: io.BytesIO) -> None:
+
+def _stream_size(stream: Stream) -> int:
+    if isinstance(stream, BufferStream):
+        return len(stream)
+    return stream.getbuffer().nbytes
+
+
+def upload_object(
+    object_location: ObjectLocation, stream: Stream, content_hash: Optional[str] = None,
+) -> Optional[str]:
     """
     Upload the given data stream as an object to s3.
 
     :param object_location: Location of the object to create/update.
-    :param stream: Byte steam of the object data.
+    :param stream: Byte steam of the object data. A BufferStream is uploaded straight
+        from the buffers it refers to.
+    :param content_hash: Optional SHA-256 hex digest of the data, to keep in the
+        metadata of the object. See `s3os.encoding.content_hash`.
+    :return: The ETag of the uploaded object, if known. For s3, this is the case for
+        objects uploaded in a single request.
     """
-    s3 = boto3.client("s3")
-    result = s3.upload_fileobj(stream, object_location.bucket.name, object_location.key)
-    log.debug(f"Result of upload to {object_location}: {result}")
+    backend = _backend(object_location.bucket)
+    with _network_operation("upload_object", object_location):
+        if content_hash is None:
+            etag = backend.put(object_location, stream)
+        else:
+            etag = backend.put(object_location, stream, content_hash=content_hash)
+        record_transfer(sent=_stream_size(stream))
+    return etag
 
 
-def download_object(object_location: ObjectLocation) -> io.BytesIO:
+def download_object(object_location: ObjectLocation) -> BufferStream:
     """
     Download the given object from s3.
 
@@ -94,34 +550,208 @@ def download_object(object_location: ObjectLocation) -> io.BytesIO:
     :param object_location: Location of the object to download.
     :return: Byte stream of the object data.
     """
-    s3 = boto3.client("s3")
-    stream = io.BytesIO()
-    try:
-        result = s3.download_fileobj(
-            object_location.bucket.name, object_location.key, stream
+    stream, _ = download_object_with_info(object_location)
+    return stream
+
+
+def download_object_with_info(
+    object_location: ObjectLocation, if_none_match: Optional[str] = None
+) -> Tuple[BufferStream, ObjectInfo]:
+    """
+    Download the given object from s3, along with its details.
+
+    Raises KeyError if the object could not be found. See `S3Backend.get` for how
+    objects are downloaded from s3.
+
+    :param object_location: Location of the object to download.
+    :param if_none_match: Optional ETag. If the object still has this ETag, then
+        ObjectNotModified is raised instead of downloading the object again.
+    :return: Tuple of the byte stream of the object data, and an ObjectInfo describing it.
+    """
+    with _network_operation("download_object", object_location):
+        stream, info = _backend(object_location.bucket).get(
+            object_location, if_none_match
+        )
+        record_transfer(received=info.size)
+    return stream, info
+
+
+def download_object_range(
+    object_location: ObjectLocation, start: int, length: int
+) -> BufferStream:
+    """
+    Download part of the given object from s3, with a single ranged GetObject request.
+
+    Raises KeyError if the object could not be found.
+
+    :param object_location: Location of the object to download from.
+    :param start: Offset of the first byte to download.
+    :param length: Number of bytes to download.
+    :return: Byte stream of the downloaded part of the object data.
+    """
+    with _network_operation("download_object_range", object_location):
+        stream = _backend(object_location.bucket).get_range(
+            object_location, start, length
         )
-    except botocore.exceptions.ClientError as err:
-        if err.response.get("Error", {}).get("Message", "Unknown") == "Not Found":
-            log.debug(f"S3 object {object_location} does not exist.")
-            raise KeyError(f"S3 object {object_location} does not exist.") from err
-        raise
-
-    stream.seek(0)
-    log.debug(f"Result of download from {object_location}: {result}")
+        record_transfer(received=len(stream))
     return stream
 
 
+def open_object_reader(object_location: ObjectLocation) -> Tuple[BinaryIO, ObjectInfo]:
+    """
+    Open the given object for reading, without downloading it all at once if possible.
+
+    Raises KeyError if the object could not be found.
+
+    :param object_location: Location of the object to read.
+    :return: Tuple of a readable binary file of the object data, which should be closed
+        once read, and an ObjectInfo describing the object.
+    """
+    return _backend(object_location.bucket).open_reader(object_location)
+
+
+def open_object_writer(
+    object_location: ObjectLocation, multipart: Optional[MultipartConfig] = None
+) -> Any:
+    """
+    Open the given object for writing, uploading it in parts as it is written to s3.
+
+    :param object_location: Location of the object to create/update.
+    :param multipart: Optional MultipartConfig of uploads to s3.
+    :return: Writable binary file. See `StorageBackend.open_writer`.
+    """
+    return _backend(object_location.bucket).open_writer(object_location, multipart)
+
+
+def _read_body(body: Any, size: int) -> bytearray:
+    """Read the body of a response into a buffer preallocated to its expected size."""
+    buffer = bytearray(size)
+    with memoryview(buffer) as view:
+        _read_body_into(body, view)
+    return buffer
+
+
+def _read_body_into(body: Any, view: memoryview) -> None:
+    """Read the body of a response into the given view, which is the size expected."""
+    size = len(view)
+    readinto = getattr(body, "readinto", None)
+    if readinto is None:  # pragma: no cover
+        # Older versions of botocore can only read into new bytes objects.
+        data = body.read()
+        if len(data) != size:
+            raise IOError(f"Response had {len(data)} bytes rather than {size}.")
+        view[:] = data
+        return
+
+    position = 0
+    while position < size:
+        count = readinto(view[position:])
+        if not count:
+            raise IOError(f"Response ended after {position} of {size} bytes.")
+        position += count
+
+
+def _object_size(result: Dict[str, Any]) -> int:
+    """Return the size of the whole object, given the result of a ranged GetObject."""
+    content_range = result.get("ContentRange")
+    if content_range is None:
+        # The whole object was sent, e.g. by stores that ignore ranges.
+        return result["ContentLength"]
+    return int(content_range.rsplit("/", 1)[1])
+
+
+def _download_remaining_parts(
+    object_location: ObjectLocation, etag: Optional[str], data: bytearray, start: int
+) -> None:
+    """
+    Download the object from `start` onwards into `data`, in concurrent ranged requests.
+
+    The requests fail with a PreconditionFailed error if the object no longer has the
+    given ETag.
+    """
+    s3 = get_client(object_location.bucket.region)
+    part_size = _transfer_config.multipart_chunksize
+    kwargs = {"Bucket": object_location.bucket.name, "Key": object_location.key}
+    if etag is not None:
+        kwargs["IfMatch"] = etag
+
+    def get_part(view: memoryview, part_start: int) -> None:
+        part_end = min(part_start + part_size, len(view))
+
+        def get_object_range() -> None:
+            result = s3.get_object(Range=f"bytes={part_start}-{part_end - 1}", **kwargs)
+            _read_body_into(result["Body"], view[part_start:part_end])
+
+        call_with_retries(object_location.bucket, "GetObject", get_object_range)
+
+    with memoryview(data) as view, ThreadPoolExecutor(
+        max_workers=_transfer_config.max_request_concurrency,
+        thread_name_prefix="s3os-download",
+    ) as executor:
+        futures = [
+            executor.submit(get_part, view, part_start)
+            for part_start in range(start, len(data), part_size)
+        ]
+        # Raise the first failure. The other parts finish before the view is released.
+        for future in futures:
+            future.result()
+
+
+def head_object(object_location: ObjectLocation) -> ObjectInfo:
+    """
+    Describe the given object, without downloading it.
+
+    Raises KeyError if the object could not be found.
+
+    :param object_location: Location of the object to describe.
+    """
+    with _network_operation("head_object", object_location):
+        return _backend(object_location.bucket).head(object_location)
+
+
+def object_exists(object_location: ObjectLocation) -> bool:
+    """
+    Check whether the given object exists, without downloading it.
+
+    :param object_location: Location of the object to check for.
+    """
+    try:
+        head_object(object_location)
+    except KeyError:
+        return False
+    return True
+
+
 def delete_object(object_location: ObjectLocation) -> None:
     """
-    Download the given object from s3.
+    Delete the given object from s3.
 
     :param object_location: Location of the object to delete.
     """
-    s3 = boto3.client("s3")
-    result = s3.delete_object(
-        Bucket=object_location.bucket.name, Key=object_location.key
-    )
-    log.debug(f"Result of delete of {object_location}: {result}")
+    with _network_operation("delete_object", object_location):
+        _backend(object_location.bucket).delete(object_location)
+
+
+def delete_objects(
+    bucket: BucketLocation, keys: Sequence[str]
+) -> Tuple[List[str], Dict[str, Exception]]:
+    """
+    Delete multiple objects from a bucket with a single request.
+
+    :param bucket: The bucket containing the objects.
+    :param keys: The keys of the objects to delete. At most MAX_KEYS_PER_DELETE.
+    :return: Tuple of the keys that were deleted, and a dict of the errors
+        for each key that failed to be deleted.
+    """
+    if len(keys) > MAX_KEYS_PER_DELETE:
+        raise ValueError(
+            f"At most {MAX_KEYS_PER_DELETE} objects can be deleted at once. "
+            f"You passed {len(keys)}."
+        )
+    with operation(
+        "delete_objects", phase_name="network", bucket=bucket.name, keys=len(keys)
+    ):
+        return _backend(bucket).delete_batch(bucket, keys)
 
 
 def generate_items_in_bucket(
@@ -134,23 +764,22 @@ def generate_items_in_bucket(
     :param prefix: Optional string prefix to filter the objects in the bucket by.
     :return: Generator of ObjectLocation for each object in the bucket.
     """
-    s3 = boto3.client("s3")
+    for key in _backend(bucket).list(bucket, prefix):
+        yield ObjectLocation(key=key, bucket=bucket)
 
-    kwargs = {"Bucket": bucket.name}
 
-    if prefix is not None:
-        kwargs["Prefix"] = prefix
-
-    while True:
-        response = s3.list_objects(**kwargs)
+def generate_objects_in_bucket(
+    bucket: BucketLocation, prefix: Optional[str] = None
+) -> Generator[Tuple[ObjectLocation, ObjectInfo], None, None]:
+    """
+    Generate all object locations in a bucket, with details of each object.
 
-        for obj in response["Contents"]:
-            yield ObjectLocation(key=obj["Key"], bucket=bucket)
+    For s3, the size and ETag of each object are part of the listing, so this costs no
+    more requests than `generate_items_in_bucket`.
 
-        # The S3 API is paginated, returning up to 1000 keys at a time.
-        # Pass the continuation token into the next response, until we
-        # reach the final page (when this field is missing).
-        try:
-            kwargs["ContinuationToken"] = response["NextContinuationToken"]
-        except KeyError:
-            break
+    :param bucket: BucketLocation to inspect.
+    :param prefix: Optional string prefix to filter the objects in the bucket by.
+    :return: Generator of the ObjectLocation and ObjectInfo of each object in the bucket.
+    """
+    for key, info in _backend(bucket).list_with_info(bucket, prefix):
+        yield ObjectLocation(key=key, bucket=bucket), info
@@ -0,0 +1,707 @@
+"""
+Definition of the packed layout of S3Dict values, as segments of many values each.
+
+Rather than storing each value as its own object, batches of values are written together
+into segment objects, each with an index object recording the offset and length of each
+value in the segment, and the keys deleted by the batch. Values are read with ranged
+GETs, and whole segments can be read at once with a single GET.
+
+Segments are ordered by their IDs, which increase with the time they were written. Later
+segments override the values and deletes of earlier ones. As values are overwritten and
+deleted, older segments hold more and more dead data. Compaction rewrites the live values
+of runs of adjacent segments into a single new segment, which takes the place of the
+last segment of the run in the order, and then deletes the old segments.
+"""
+
+import itertools
+import logging
+import threading
+import time
+import uuid
+
+from dataclasses import dataclass, field
+from typing import (
+    Any,
+    Collection,
+    Dict,
+    Generator,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Set,
+    Tuple,
+)
+
+from .api import BulkOperationError, BulkResult, delete_many, retrieve_many, store
+from .buffers import Buffer, BufferStream
+from .compression import CompressionConfig
+from .concurrency import bounded_map
+from .encoding import object_from_buffer, object_to_stream
+from .s3_wrapper import (
+    BucketLocation,
+    ObjectInfo,
+    ObjectLocation,
+    download_object_range,
+    download_object_with_info,
+    ensure_bucket,
+    generate_items_in_bucket,
+    upload_object,
+)
+from .write_buffer import DELETED
+
+log = logging.getLogger(__name__)
+
+#: Values in the same segment that are at most this many bytes apart are read with a
+#: single ranged GET, as that is cheaper than a second request.
+RANGE_COALESCE_GAP = 2 ** 16
+
+_id_lock = threading.Lock()
+_last_id_time = 0
+
+
+@dataclass(frozen=True)
+class SegmentPolicy:
+    """
+    Configuration of the packed layout of S3Dict values.
+
+    :param max_segment_bytes: Approximate maximum size of each segment.
+        Larger batches of writes are split over several segments.
+    :param min_segment_bytes: Segments smaller than this are merged with adjacent
+        segments by compaction, so that loading the whole dict takes few requests.
+    :param min_merge_segments: Adjacent small segments are only merged once there are
+        at least this many, so that each value is not rewritten by every flush.
+    :param compaction_threshold: Segments where at least this fraction of the data has
+        been overwritten or deleted are rewritten by compaction.
+    :param auto_compact: If True, compaction runs after each flush that leaves segments
+        that need compacting. Otherwise use `S3Dict.compact()`.
+    :param background: If True, automatic compaction runs in a background thread rather
+        than as part of the flush.
+    """
+
+    max_segment_bytes: int = 64 * 2 ** 20
+    min_segment_bytes: int = 4 * 2 ** 20
+    min_merge_segments: int = 8
+    compaction_threshold: float = 0.5
+    auto_compact: bool = True
+    background: bool = True
+
+    def __post_init__(self):
+        """Validate the policy."""
+        if self.max_segment_bytes < 1:
+            raise ValueError(
+                f"`max_segment_bytes` must be at least 1. "
+                f"You passed: {self.max_segment_bytes=}."
+            )
+        if self.min_merge_segments < 2:
+            raise ValueError(
+                f"`min_merge_segments` must be at least 2. "
+                f"You passed: {self.min_merge_segments=}."
+            )
+        if not 0 < self.compaction_threshold <= 1:
+            raise ValueError(
+                f"`compaction_threshold` must be in (0, 1]. "
+                f"You passed: {self.compaction_threshold=}."
+            )
+
+
+@dataclass
+class Segment:
+    """
+    The index of a segment of packed values.
+
+    :param id: ID of the segment. Segments are ordered by their IDs.
+    :param size: Size of the segment data in bytes.
+    :param entries: The offset and length of each value in the segment data, by key.
+    :param deleted: The keys deleted by this segment.
+    """
+
+    id: str
+    size: int = 0
+    entries: Dict[str, Tuple[int, int]] = field(default_factory=dict)
+    deleted: Set[str] = field(default_factory=set)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the index as a JSON-compatible dict, to be stored in s3."""
+        return {
+            "size": self.size,
+            "entries": {key: list(entry) for key, entry in self.entries.items()},
+            "deleted": sorted(self.deleted),
+        }
+
+    @classmethod
+    def from_dict(cls, segment_id: str, index: Mapping[str, Any]) -> "Segment":
+        """Create a Segment from an index stored in s3."""
+        return cls(
+            id=segment_id,
+            size=index["size"],
+            entries={
+                key: (entry[0], entry[1]) for key, entry in index["entries"].items()
+            },
+            deleted=set(index["deleted"]),
+        )
+
+
+def new_segment_id() -> str:
+    """Return a new segment ID, later in the order than any made by this process before."""
+    global _last_id_time
+
+    with _id_lock:
+        _last_id_time = max(time.time_ns(), _last_id_time + 1)
+        id_time = _last_id_time
+    # The random suffix keeps IDs of segments written by different processes apart.
+    return f"{id_time:020d}-{uuid.uuid4().hex[:8]}"
+
+
+def next_generation(segment_id: str) -> str:
+    """
+    Return the ID of a segment that replaces the given one in the order of segments.
+
+    The ID is later than the given one, but earlier than any later segment written.
+    """
+    base, _, generation = segment_id.partition(".")
+    return f"{base}.{int(generation or 0) + 1:04d}"
+
+
+# A planned read of part of a segment: (segment ID, start, end, [(key, offset, length)]).
+_Read = Tuple[str, int, int, List[Tuple[str, int, int]]]
+
+
+class SegmentStore:
+    """
+    Thread-safe store of values packed into segments in s3. See the module docs.
+
+    The index of every segment is loaded into memory on first use. Use `refresh()` to
+    pick up segments written by other processes since.
+    """
+
+    def __init__(
+        self,
+        bucket: BucketLocation,
+        prefix: str,
+        policy: Optional[SegmentPolicy] = None,
+        codec: Optional[str] = None,
+        compression: Optional[CompressionConfig] = None,
+        check_bucket: bool = True,
+        max_concurrency: Optional[int] = None,
+        allowed_codecs: Optional[Collection[str]] = None,
+    ):
+        """
+        Create a new SegmentStore.
+
+        :param bucket: The bucket to store segments in.
+        :param prefix: Prefix of the keys of the segment and index objects.
+        :param policy: Optional SegmentPolicy. Defaults to `SegmentPolicy()`.
+        :param codec: Optional ID of the codec to encode values with.
+        :param compression: Optional compression to apply to each value.
+        :param check_bucket: If True, the bucket is created if needed before writing.
+        :param max_concurrency: Maximum number of s3 requests in progress at once.
+        :param allowed_codecs: Optional IDs of the codecs allowed to decode values.
+            See `s3os.encoding.object_from_buffer`.
+        """
+        self.bucket = bucket
+        self.prefix = prefix
+        self.policy = policy if policy is not None else SegmentPolicy()
+        self.codec = codec
+        self.compression = compression
+        self.check_bucket = check_bucket
+        self.max_concurrency = max_concurrency
+        self.allowed_codecs = allowed_codecs
+
+        self._segments: Dict[str, Segment] = {}
+        # The segment, offset and length of the latest value of each key.
+        self._locations: Dict[str, Tuple[str, int, int]] = {}
+        # Number of bytes of each segment that hold latest values.
+        self._live_bytes: Dict[str, int] = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._compaction_lock = threading.Lock()
+        self._compactor: Optional[threading.Thread] = None
+
+    def _data_location(self, segment_id: str) -> ObjectLocation:
+        return ObjectLocation(f"{self.prefix}segments/{segment_id}", bucket=self.bucket)
+
+    def _index_location(self, segment_id: str) -> ObjectLocation:
+        return ObjectLocation(f"{self.prefix}index/{segment_id}", bucket=self.bucket)
+
+    def _list_segment_ids(self) -> Set[str]:
+        """Return the IDs of the segments whose index is in s3."""
+        return {
+            location.key.rsplit("/", 1)[1]
+            for location in generate_items_in_bucket(
+                self.bucket, prefix=f"{self.prefix}index/"
+            )
+        }
+
+    def refresh(self) -> None:
+        """Load the index of segments written or removed in s3 since last loaded."""
+        listed = self._list_segment_ids()
+        with self._lock:
+            known = set(self._segments)
+
+        new = sorted(listed - known)
+        result = retrieve_many(
+            (self._index_location(segment_id) for segment_id in new),
+            max_concurrency=self.max_concurrency,
+        )
+        errors = {
+            location: err
+            for location, err in result.errors.items()
+            # Segments removed by compaction since they were listed.
+            if not isinstance(err, KeyError)
+        }
+        if errors:
+            raise BulkOperationError(BulkResult(result.results, errors))
+
+        with self._lock:
+            for segment_id in known - listed:
+                self._segments.pop(segment_id, None)
+            for location, index in result.results.items():
+                segment_id = location.key.rsplit("/", 1)[1]
+                self._segments[segment_id] = Segment.from_dict(segment_id, index)
+            self._rebuild()
+            self._loaded = True
+
+    def _ensure_loaded(self) -> None:
+        if not self._loaded:
+            self.refresh()
+
+    def _rebuild(self) -> None:
+        """Work out the latest location of each key from the segments, in order."""
+        locations: Dict[str, Tuple[str, int, int]] = {}
+        live_bytes = dict.fromkeys(self._segments, 0)
+        for segment_id in sorted(self._segments):
+            segment = self._segments[segment_id]
+            for key in segment.deleted:
+                self._remove_location(locations, live_bytes, key)
+            for key, (offset, length) in segment.entries.items():
+                self._remove_location(locations, live_bytes, key)
+                locations[key] = (segment_id, offset, length)
+                live_bytes[segment_id] += length
+        self._locations = locations
+        self._live_bytes = live_bytes
+
+    @staticmethod
+    def _remove_location(
+        locations: Dict[str, Tuple[str, int, int]], live_bytes: Dict[str, int], key: str
+    ) -> None:
+        old = locations.pop(key, None)
+        if old is not None:
+            live_bytes[old[0]] -= old[2]
+
+    def reset(self) -> None:
+        """Forget all segments, e.g. once they have all been deleted from s3."""
+        with self._lock:
+            self._segments = {}
+            self._locations = {}
+            self._live_bytes = {}
+            self._loaded = True
+
+    def keys(self) -> List[str]:
+        """Return the keys that have a value in the store."""
+        self._ensure_loaded()
+        with self._lock:
+            return list(self._locations)
+
+    def __contains__(self, key: object) -> bool:
+        """Return True if the key has a value in the store."""
+        self._ensure_loaded()
+        with self._lock:
+            return key in self._locations
+
+    def __len__(self) -> int:
+        """Return the number of keys with a value in the store."""
+        self._ensure_loaded()
+        with self._lock:
+            return len(self._locations)
+
+    def value_locations(self) -> Dict[str, Tuple[str, int, int]]:
+        """
+        Return the segment ID, offset and length of the value of each key.
+
+        Only the segments loaded so far are included, without loading the index.
+        """
+        with self._lock:
+            return dict(self._locations)
+
+    @property
+    def segment_count(self) -> int:
+        """Number of segments in the store."""
+        with self._lock:
+            return len(self._segments)
+
+    def get(self, key: str) -> Tuple[Any, ObjectInfo]:
+        """
+        Read the value of the key with a ranged GET.
+
+        Raises KeyError if the key has no value.
+
+        :return: Tuple of the value and an ObjectInfo describing its encoded data.
+        """
+        self._ensure_loaded()
+        for attempt in range(2):
+            with self._lock:
+                segment_id, offset, length = self._locations[key]
+            try:
+                stream = download_object_range(
+                    self._data_location(segment_id), offset, length
+                )
+            except KeyError:
+                if attempt:
+                    raise
+                # The segment was compacted away since, so find where the value is now.
+                self.refresh()
+                continue
+            value = object_from_buffer(stream.getbuffer(), self.allowed_codecs)
+            return value, ObjectInfo(size=length)
+        raise KeyError(key)  # pragma: no cover
+
+    def get_many(
+        self,
+        keys: Optional[Iterable[str]] = None,
+        max_gap: int = RANGE_COALESCE_GAP,
+        ordered: bool = False,
+    ) -> Generator[Tuple[str, Any, ObjectInfo], None, None]:
+        """
+        Read the values of many keys concurrently.
+
+        Values that are close together in the same segment are read with a single
+        ranged GET. Keys without a value are skipped.
+
+        :param keys: The keys to read. Defaults to all keys, in which case each segment
+            is read with a single GET.
+        :param max_gap: Values at most this many bytes apart are read together.
+        :param ordered: If True, values are yielded in the order of the segments they
+            are in. Otherwise they are yielded as soon as they are downloaded.
+        :return: Generator of (key, value, ObjectInfo).
+        """
+        self._ensure_loaded()
+        with self._lock:
+            if keys is None:
+                locations = dict(self._locations)
+            else:
+                locations = {
+                    key: self._locations[key] for key in keys if key in self._locations
+                }
+            sizes = {segment_id: seg.size for segment_id, seg in self._segments.items()}
+
+        reads = _plan_reads(locations, max_gap if keys is not None else None)
+        for read, future in bounded_map(
+            lambda read: self._read(read, sizes[read[0]]),
+            reads,
+            max_in_flight=self.max_concurrency,
+            ordered=ordered,
+        ):
+            try:
+                data = future.result()
+            except KeyError:
+                # The segment was compacted away since, so read the values one by one.
+                for key, _, _ in read[3]:
+                    try:
+                        value, info = self.get(key)
+                    except KeyError:
+                        continue
+                    yield key, value, info
+                continue
+
+            for key, offset, length in read[3]:
+                start = offset - read[1]
+                value = object_from_buffer(
+                    data[start : start + length], self.allowed_codecs
+                )
+                yield key, value, ObjectInfo(size=length)
+
+    def _read(self, read: _Read, segment_size: int) -> memoryview:
+        """Download the given range of a segment, as a single ranged or full GET."""
+        segment_id, start, end, _ = read
+        location = self._data_location(segment_id)
+        if start == 0 and end == segment_size:
+            stream, _ = download_object_with_info(location)
+        else:
+            stream = download_object_range(location, start, end - start)
+        return stream.getbuffer()
+
+    def write(self, pending: Mapping[str, Any]) -> Dict[str, ObjectInfo]:
+        """
+        Write a batch of values and deletes to new segments.
+
+        :param pending: The value to write to each key, or DELETED to delete it.
+        :return: ObjectInfo describing the encoded value written to each key.
+        """
+        if self.check_bucket:
+            ensure_bucket(self.bucket)
+        self._ensure_loaded()
+        # Deletes are recorded even for keys without a known value, as other processes
+        # may have written them. Compaction drops those that aren't needed.
+        deleted = {key for key, value in pending.items() if value is DELETED}
+
+        segments: List[Tuple[Segment, List[Buffer]]] = []
+        segment = Segment(new_segment_id())
+        buffers: List[Buffer] = []
+        for key, value in pending.items():
+            if value is DELETED:
+                continue
+            stream = object_to_stream(
+                value, codec=self.codec, compression=self.compression
+            )
+            if (
+                segment.size
+                and segment.size + len(stream) > self.policy.max_segment_bytes
+            ):
+                segments.append((segment, buffers))
+                segment, buffers = Segment(new_segment_id()), []
+            segment.entries[key] = (segment.size, len(stream))
+            segment.size += len(stream)
+            buffers.extend(stream.buffers)
+        segment.deleted = deleted
+        segments.append((segment, buffers))
+
+        segments = [
+            (segment, buffers)
+            for segment, buffers in segments
+            if segment.entries or segment.deleted
+        ]
+        for segment, buffers in segments:
+            self._upload(segment, buffers)
+
+        infos = {}
+        with self._lock:
+            for segment, _ in segments:
+                self._segments[segment.id] = segment
+                self._live_bytes[segment.id] = 0
+                for key in segment.deleted:
+                    self._remove_location(self._locations, self._live_bytes, key)
+                for key, (offset, length) in segment.entries.items():
+                    self._remove_location(self._locations, self._live_bytes, key)
+                    self._locations[key] = (segment.id, offset, length)
+                    self._live_bytes[segment.id] += length
+                    infos[key] = ObjectInfo(size=length)
+        return infos
+
+    def _upload(self, segment: Segment, buffers: List[Buffer]) -> None:
+        """Upload the data and then the index of the segment."""
+        if segment.size:
+            upload_object(self._data_location(segment.id), BufferStream(buffers))
+        store(
+            self._index_location(segment.id),
+            segment.to_dict(),
+            check_bucket=False,
+            codec="json",
+            compression=CompressionConfig("zlib"),
+        )
+
+    def _is_candidate(self, segment_id: str) -> bool:
+        """Return True if the segment is small or holds dead data. Needs the lock."""
+        size = self._segments[segment_id].size
+        return (
+            size < self.policy.min_segment_bytes or self._live_bytes[segment_id] < size
+        )
+
+    def _is_mostly_dead(self, segment_id: str) -> bool:
+        """Return True if enough of the segment is dead to rewrite it. Needs the lock."""
+        size = self._segments[segment_id].size
+        dead = size - self._live_bytes[segment_id]
+        return size > 0 and dead / size >= self.policy.compaction_threshold
+
+    def _compaction_runs(self) -> List[List[str]]:
+        """Return the runs of adjacent segments to compact together. Needs the lock."""
+        candidates: List[List[str]] = [[]]
+        run_bytes = 0
+        for segment_id in sorted(self._segments):
+            live = self._live_bytes[segment_id]
+            if not self._is_candidate(segment_id):
+                candidates.append([])
+                run_bytes = 0
+                continue
+            if candidates[-1] and run_bytes + live > self.policy.max_segment_bytes:
+                candidates.append([])
+                run_bytes = 0
+            candidates[-1].append(segment_id)
+            run_bytes += live
+
+        return [
+            run
+            for run in candidates
+            if len(run) >= self.policy.min_merge_segments
+            or any(self._is_mostly_dead(segment_id) for segment_id in run)
+        ]
+
+    def needs_compaction(self) -> bool:
+        """Return True if any segments would be rewritten by `compact()`."""
+        with self._lock:
+            return bool(self._compaction_runs())
+
+    def compact(self) -> int:
+        """
+        Rewrite runs of small or mostly dead segments into new segments.
+
+        The new segment of a run takes its place in the order, so it would override any
+        segment written by another process that sorts before it but was not loaded when
+        the run was read. The index is listed again before and after writing the new
+        segment, and the run is abandoned if any such segment appeared. This still
+        relies on segment IDs, which come from the writers' clocks, sorting in the order
+        the segments were written: values written by a process whose clock is behind
+        can be overridden by earlier writes, with or without compaction.
+
+        If a run is abandoned, or segments have been removed from s3 by another
+        process, e.g. by its own compaction, the index is reloaded and the remaining
+        runs are left for next time.
+
+        :return: The number of segments that were rewritten.
+        """
+        with self._compaction_lock:
+            self._ensure_loaded()
+            with self._lock:
+                runs = self._compaction_runs()
+            compacted = 0
+            for run in runs:
+                if not self._compact_run(run):
+                    self.refresh()
+                    break
+                compacted += len(run)
+            if compacted:
+                log.debug(f"Compacted {compacted} segments of {self.prefix}.")
+            return compacted
+
+    def _compact_run(self, run: List[str]) -> bool:
+        """
+        Rewrite the live values of a run of adjacent segments into a single segment.
+
+        :return: False if the run could not be read, as segments in it no longer exist,
+            or if segments not in the run were written that sort before the new one.
+        """
+        run_ids = set(run)
+        with self._lock:
+            locations = {
+                key: location
+                for key, location in self._locations.items()
+                if location[0] in run_ids
+            }
+            older = [
+                segment
+                for segment_id, segment in self._segments.items()
+                if segment_id < run[0]
+            ]
+            # Deletes are only still needed if an older segment has a value to hide.
+            deleted = {
+                key
+                for segment_id in run
+                for key in self._segments[segment_id].deleted
+                if key not in locations and any(key in seg.entries for seg in older)
+            }
+            sizes = {segment_id: self._segments[segment_id].size for segment_id in run}
+
+        segment = Segment(next_generation(run[-1]), deleted=deleted)
+        buffers: List[Buffer] = []
+        reads = _plan_reads(locations, None)
+        for read, future in bounded_map(
+            lambda read: self._read(read, sizes[read[0]]),
+            reads,
+            max_in_flight=self.max_concurrency,
+            ordered=True,
+        ):
+            try:
+                data = future.result()
+            except KeyError:
+                return False
+            for key, offset, length in read[3]:
+                start = offset - read[1]
+                segment.entries[key] = (segment.size, length)
+                segment.size += length
+                buffers.append(data[start : start + length])
+
+        if self._has_unknown_segments_before(segment.id):
+            return False
+        if segment.entries or segment.deleted:
+            self._upload(segment, buffers)
+            # Segments written since the check above must not be overridden either.
+            if self._has_unknown_segments_before(segment.id):
+                delete_many(
+                    [self._index_location(segment.id), self._data_location(segment.id)],
+                    max_concurrency=self.max_concurrency,
+                ).raise_for_errors()
+                return False
+
+        with self._lock:
+            for segment_id in run:
+                self._segments.pop(segment_id, None)
+            if segment.entries or segment.deleted:
+                self._segments[segment.id] = segment
+            # Values overwritten since they were read are overridden by later segments.
+            self._rebuild()
+
+        delete_many(
+            itertools.chain.from_iterable(
+                (self._data_location(segment_id), self._index_location(segment_id))
+                for segment_id in run
+            ),
+            max_concurrency=self.max_concurrency,
+        ).raise_for_errors()
+        return True
+
+    def _has_unknown_segments_before(self, segment_id: str) -> bool:
+        """Return True if s3 has segments not loaded yet that sort before the given one."""
+        listed = self._list_segment_ids()
+        listed.discard(segment_id)
+        with self._lock:
+            unknown = listed - set(self._segments)
+        return any(other <= segment_id for other in unknown)
+
+    def compact_if_needed(self) -> None:
+        """Compact the segments according to the policy, if any need it."""
+        if not self.policy.auto_compact or not self.needs_compaction():
+            return
+        if not self.policy.background:
+            self.compact()
+            return
+        with self._lock:
+            if self._compactor is not None and self._compactor.is_alive():
+                return
+            self._compactor = threading.Thread(
+                target=self._compact_in_background, name="s3os-compact", daemon=True
+            )
+            self._compactor.start()
+
+    def _compact_in_background(self) -> None:
+        try:
+            self.compact()
+        except Exception:
+            log.exception(f"Failed to compact segments of {self.prefix}.")
+
+    def wait_for_compaction(self) -> None:
+        """Wait for any background compaction to finish."""
+        compactor = self._compactor
+        if compactor is not None:
+            compactor.join()
+
+
+def _plan_reads(
+    locations: Mapping[str, Tuple[str, int, int]], max_gap: Optional[int]
+) -> List[_Read]:
+    """
+    Group the values to read into ranges of segments to read with a single request each.
+
+    :param locations: The segment, offset and length of each value to read, by key.
+    :param max_gap: Values at most this many bytes apart are read together.
+        If None, all the values in a segment are read together.
+    """
+    by_segment: Dict[str, List[Tuple[str, int, int]]] = {}
+    for key, (segment_id, offset, length) in locations.items():
+        by_segment.setdefault(segment_id, []).append((key, offset, length))
+
+    reads: List[_Read] = []
+    for segment_id in sorted(by_segment):
+        entries = sorted(by_segment[segment_id], key=lambda entry: entry[1])
+        current: List[Tuple[str, int, int]] = []
+        start = end = 0
+        for key, offset, length in entries:
+            if current and (max_gap is None or offset - end <= max_gap):
+                current.append((key, offset, length))
+                end = max(end, offset + length)
+                continue
+            if current:
+                reads.append((segment_id, start, end, current))
+            current, start, end = [(key, offset, length)], offset, offset + length
+        if current:
+            reads.append((segment_id, start, end, current))
+    return reads
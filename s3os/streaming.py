@@ -0,0 +1,289 @@
+"""
+Streaming transfers of large objects to and from s3.
+
+Objects are encoded straight into a multipart upload, a part at a time, and decoded
+straight from the body of the download. So at most a few parts of an object are held in
+memory at once, rather than several complete copies of its encoded data.
+"""
+
+import io
+import logging
+
+from botocore.exceptions import ClientError
+from concurrent.futures import (
+    ALL_COMPLETED,
+    FIRST_COMPLETED,
+    Future,
+    ThreadPoolExecutor,
+    wait,
+)
+from dataclasses import dataclass
+from typing import Any, BinaryIO, Callable, Dict, List, Optional, Set, Tuple, TypeVar
+
+from .clients import get_client
+from .locations import ObjectInfo, ObjectLocation
+from .throttling import call_with_retries
+
+log = logging.getLogger(__name__)
+
+R = TypeVar("R")
+
+#: The smallest part size s3 allows, other than for the last part of an upload.
+MIN_PART_SIZE = 5 * 2 ** 20
+#: Number of bytes read from the body of a download at a time.
+DOWNLOAD_CHUNK_SIZE = 2 ** 20
+
+
+@dataclass(frozen=True)
+class MultipartConfig:
+    """
+    Configuration of streaming multipart uploads.
+
+    Peak memory use of an upload is roughly `part_size * (max_concurrency + 1)`.
+
+    :param part_size: Number of bytes in each part. At least MIN_PART_SIZE.
+    :param max_concurrency: Maximum number of parts uploaded at once.
+    """
+
+    part_size: int = 8 * 2 ** 20
+    max_concurrency: int = 4
+
+    def __post_init__(self):
+        """Validate the config."""
+        if self.part_size < MIN_PART_SIZE:
+            raise ValueError(
+                f"`part_size` must be at least {MIN_PART_SIZE}. "
+                f"You passed: {self.part_size=}."
+            )
+        if self.max_concurrency < 1:
+            raise ValueError(
+                f"`max_concurrency` must be at least 1. "
+                f"You passed: {self.max_concurrency=}."
+            )
+
+
+class MultipartUpload(io.RawIOBase):
+    """
+    Writable file that uploads the data written to it to s3, in parts.
+
+    Each time a part's worth of data has been written, it is uploaded in the background.
+    Objects smaller than a single part are uploaded with a single request when closed.
+    The object only appears in s3 once the file is closed. If the upload fails, or the
+    file is used as a context manager and an exception is raised, the upload is aborted.
+
+        with MultipartUpload(ObjectLocation("key")) as upload:
+            upload.write(data)
+    """
+
+    def __init__(
+        self, object_location: ObjectLocation, config: Optional[MultipartConfig] = None
+    ):
+        """
+        Create a new MultipartUpload.
+
+        :param object_location: Location of the object to create/update.
+        :param config: Optional MultipartConfig. Defaults to `MultipartConfig()`.
+        """
+        super().__init__()
+        self.object_location = object_location
+        self.config = config if config is not None else MultipartConfig()
+        #: Details of the uploaded object, once the file is closed.
+        self.info: Optional[ObjectInfo] = None
+
+        self._client = get_client(object_location.bucket.region)
+        self._buffer = bytearray()
+        self._size = 0
+        self._upload_id: Optional[str] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._in_flight: Set["Future[Dict[str, Any]]"] = set()
+        self._parts: List[Dict[str, Any]] = []
+
+    def _request(self, name: str, method: Callable[..., R], **kwargs: Any) -> R:
+        """Make a request with retries. See `s3os.throttling.call_with_retries`."""
+        return call_with_retries(
+            self.object_location.bucket, name, lambda: method(**kwargs)
+        )
+
+    def writable(self) -> bool:
+        """Return True, as data can be written to the upload."""
+        return True
+
+    def write(self, data) -> int:  # type: ignore
+        """Buffer the data, uploading a part whenever there is a part's worth."""
+        if self.closed:
+            raise ValueError("Write to a closed MultipartUpload.")
+        view = memoryview(data).cast("B")
+        size = len(view)
+        self._size += size
+        part_size = self.config.part_size
+        # Fill the buffer up to a part at a time and hand the full buffer over to the
+        # upload, so each byte is copied once and never shifted along the buffer.
+        while view:
+            space = part_size - len(self._buffer)
+            self._buffer += view[:space]
+            view = view[space:]
+            if len(self._buffer) >= part_size:
+                part, self._buffer = self._buffer, bytearray()
+                self._upload_part(part)
+        return size
+
+    def _upload_part(self, data: bytearray) -> None:
+        """Upload the data as the next part, waiting if too many are in flight."""
+        if self._upload_id is None:
+            response = self._request(
+                "CreateMultipartUpload",
+                self._client.create_multipart_upload,
+                Bucket=self.object_location.bucket.name,
+                Key=self.object_location.key,
+            )
+            self._upload_id = response["UploadId"]
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.config.max_concurrency,
+                thread_name_prefix="s3os-multipart",
+            )
+
+        while len(self._in_flight) >= self.config.max_concurrency:
+            self._wait(FIRST_COMPLETED)
+
+        part_number = len(self._parts) + len(self._in_flight) + 1
+        self._in_flight.add(
+            self._executor.submit(  # type: ignore
+                self._upload_part_data, part_number, data
+            )
+        )
+
+    def _upload_part_data(self, part_number: int, data: bytearray) -> Dict[str, Any]:
+        response = self._request(
+            "UploadPart",
+            self._client.upload_part,
+            Bucket=self.object_location.bucket.name,
+            Key=self.object_location.key,
+            UploadId=self._upload_id,
+            PartNumber=part_number,
+            Body=data,
+        )
+        return {"PartNumber": part_number, "ETag": response["ETag"]}
+
+    def _wait(self, return_when: str) -> None:
+        """Wait for parts in flight to finish, raising the first error."""
+        done, self._in_flight = wait(self._in_flight, return_when=return_when)
+        for future in done:
+            self._parts.append(future.result())
+
+    def close(self) -> None:
+        """Upload any remaining data and complete the upload."""
+        if self.closed:
+            return
+        try:
+            if self._upload_id is None:
+                response = self._request(
+                    "PutObject",
+                    self._client.put_object,
+                    Bucket=self.object_location.bucket.name,
+                    Key=self.object_location.key,
+                    Body=self._buffer,
+                )
+            else:
+                if self._buffer:
+                    self._upload_part(self._buffer)
+                self._wait(ALL_COMPLETED)
+                response = self._request(
+                    "CompleteMultipartUpload",
+                    self._client.complete_multipart_upload,
+                    Bucket=self.object_location.bucket.name,
+                    Key=self.object_location.key,
+                    UploadId=self._upload_id,
+                    MultipartUpload={
+                        "Parts": sorted(
+                            self._parts, key=lambda part: part["PartNumber"]
+                        )
+                    },
+                )
+        except BaseException:
+            self.abort()
+            raise
+
+        self._buffer = bytearray()
+        self.info = ObjectInfo(size=self._size, etag=response.get("ETag"))
+        self._shutdown()
+        log.debug(f"Result of upload to {self.object_location}: {response}")
+        super().close()
+
+    def abort(self) -> None:
+        """Abandon the upload. Parts already uploaded are deleted by s3."""
+        if self.closed:
+            return
+        for future in self._in_flight:
+            future.cancel()
+        self._shutdown()
+        if self._upload_id is not None:
+            self._request(
+                "AbortMultipartUpload",
+                self._client.abort_multipart_upload,
+                Bucket=self.object_location.bucket.name,
+                Key=self.object_location.key,
+                UploadId=self._upload_id,
+            )
+        self._buffer = bytearray()
+        super().close()
+
+    def _shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def __exit__(self, exc_type: Any, *args: Any) -> None:
+        """Complete the upload, or abort it if an exception was raised."""
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class _BodyReader(io.RawIOBase):
+    """Readable file of the body of an s3 download, read in chunks as needed."""
+
+    def __init__(self, body: Any):
+        self._body = body
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:  # type: ignore
+        data = self._body.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+    def close(self) -> None:
+        self._body.close()
+        super().close()
+
+
+def open_object(object_location: ObjectLocation) -> Tuple[BinaryIO, ObjectInfo]:
+    """
+    Open the given object in s3 for reading, without downloading it all at once.
+
+    Raises KeyError if the object could not be found.
+
+    :param object_location: Location of the object to read.
+    :return: Tuple of a readable binary file of the object data, which should be closed
+        once read, and an ObjectInfo describing the object.
+    """
+    s3 = get_client(object_location.bucket.region)
+    try:
+        # Only the request is retried, not reads of the body as the file is read.
+        response = call_with_retries(
+            object_location.bucket,
+            "GetObject",
+            lambda: s3.get_object(
+                Bucket=object_location.bucket.name, Key=object_location.key
+            ),
+        )
+    except ClientError as err:
+        if err.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+            raise KeyError(f"S3 object {object_location} does not exist.") from err
+        raise
+
+    stream = io.BufferedReader(_BodyReader(response["Body"]), DOWNLOAD_CHUNK_SIZE)
+    info = ObjectInfo(size=response["ContentLength"], etag=response.get("ETag"))
+    return stream, info
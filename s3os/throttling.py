@@ -0,0 +1,333 @@
+"""
+Retries and adaptive concurrency limits of requests to s3.
+
+Under heavy load s3 throttles requests, e.g. with 503 SlowDown errors. Every request
+s3os makes to s3 is made by `call_with_retries`, which:
+
+- Waits for a slot from the AdaptiveLimiter of the bucket, which limits the number of
+  requests in flight to the bucket at once. The limit is raised by one for each limit's
+  worth of successful requests, and halved whenever requests are throttled (additive
+  increase, multiplicative decrease), so it settles at about the highest concurrency
+  the bucket sustains without throttling.
+- Retries requests that are throttled or fail with transient errors, after a random
+  delay of up to an exponentially increasing backoff ("full jitter"), so retries from
+  many threads don't arrive in bursts.
+
+Retries are counted in the `stats` of each limiter, and as `s3os_retries_total` in the
+metrics registry (see `s3os.metrics`).
+"""
+
+import random
+import threading
+import time
+
+from botocore.exceptions import ClientError, ConnectionError, HTTPClientError
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Tuple, TypeVar
+
+from .locations import BucketLocation
+from .metrics import record_retries
+
+try:
+    from botocore.exceptions import ResponseStreamingError
+except ImportError:  # pragma: no cover
+    # Older versions of botocore raise HTTPClientErrors instead.
+    ResponseStreamingError = HTTPClientError
+
+R = TypeVar("R")
+
+#: Error codes of requests that were throttled, and should be retried more slowly.
+THROTTLING_ERROR_CODES = frozenset(
+    {
+        "503",
+        "SlowDown",
+        "Throttling",
+        "ThrottlingException",
+        "ThrottledException",
+        "RequestThrottled",
+        "RequestThrottledException",
+        "RequestLimitExceeded",
+        "TooManyRequests",
+        "TooManyRequestsException",
+        "BandwidthLimitExceeded",
+    }
+)
+#: Error codes of requests that failed for reasons that are likely to pass.
+TRANSIENT_ERROR_CODES = frozenset(
+    {
+        "500",
+        "502",
+        "504",
+        "InternalError",
+        "ServiceUnavailable",
+        "RequestTimeout",
+        "RequestTimeoutException",
+        "PriorRequestNotComplete",
+    }
+)
+#: Errors of the connection to s3, which are always transient.
+TRANSIENT_ERRORS = (ConnectionError, HTTPClientError, ResponseStreamingError)
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """
+    How requests to s3 that are throttled or fail with transient errors are retried.
+
+    :param max_attempts: Maximum number of times each request is made, including the
+        first. Use 1 to never retry.
+    :param base_delay: Seconds of backoff after the first failure. The backoff doubles
+        with each further failure, and the delay before each retry is a random
+        fraction of it.
+    :param max_delay: Maximum seconds of backoff.
+    """
+
+    max_attempts: int = 5
+    base_delay: float = 0.05
+    max_delay: float = 5.0
+
+    def __post_init__(self):
+        """Validate the policy."""
+        if self.max_attempts < 1:
+            raise ValueError(
+                f"`max_attempts` must be at least 1. You passed: {self.max_attempts=}."
+            )
+        if self.base_delay < 0 or self.max_delay < self.base_delay:
+            raise ValueError(
+                f"`base_delay` must be at least 0, and at most `max_delay`. "
+                f"You passed: {self.base_delay=}, {self.max_delay=}."
+            )
+
+    def delay(self, failures: int) -> float:
+        """Return a random delay in seconds to wait after the given number of failures."""
+        backoff = min(self.max_delay, self.base_delay * 2 ** (failures - 1))
+        return random.uniform(0, backoff)
+
+
+@dataclass(frozen=True)
+class ConcurrencyPolicy:
+    """
+    Limits on the number of requests in flight to each bucket at once.
+
+    :param initial_limit: The limit before any requests have been made.
+    :param min_limit: The limit is never lowered below this.
+    :param max_limit: The limit is never raised above this.
+    :param decrease_factor: The limit is multiplied by this when requests are throttled.
+    """
+
+    initial_limit: int = 32
+    min_limit: int = 1
+    max_limit: int = 256
+    decrease_factor: float = 0.5
+
+    def __post_init__(self):
+        """Validate the policy."""
+        if not 1 <= self.min_limit <= self.initial_limit <= self.max_limit:
+            raise ValueError(
+                f"Limits must satisfy 1 <= `min_limit` <= `initial_limit` <= "
+                f"`max_limit`. You passed: {self.min_limit=}, {self.initial_limit=}, "
+                f"{self.max_limit=}."
+            )
+        if not 0 < self.decrease_factor < 1:
+            raise ValueError(
+                f"`decrease_factor` must be between 0 and 1. "
+                f"You passed: {self.decrease_factor=}."
+            )
+
+
+@dataclass
+class ThrottlingStats:
+    """
+    Counters of the requests made through an AdaptiveLimiter.
+
+    :param requests: Number of attempts at requests, including retries.
+    :param retries: Number of attempts that were retries of failed attempts.
+    :param throttled: Number of attempts that were throttled.
+    :param failures: Number of requests that failed, after any retries.
+    """
+
+    requests: int = 0
+    retries: int = 0
+    throttled: int = 0
+    failures: int = 0
+
+
+class AdaptiveLimiter:
+    """
+    Thread-safe limit on the number of requests in flight, adjusted by their outcomes.
+
+    Each success raises the limit by 1/limit while the limit is in use, i.e. by about
+    one per limit's worth of requests. Each throttled request lowers the limit by the
+    `decrease_factor`, unless it was started before the limit was last lowered, so a
+    burst of throttling only lowers the limit once.
+    """
+
+    def __init__(self, policy: Optional[ConcurrencyPolicy] = None):
+        """
+        Create a new AdaptiveLimiter.
+
+        :param policy: Optional ConcurrencyPolicy. See ConcurrencyPolicy for defaults.
+        """
+        self.policy: ConcurrencyPolicy = (
+            policy if policy is not None else ConcurrencyPolicy()
+        )
+        self.stats = ThrottlingStats()
+        self._limit = float(self.policy.initial_limit)
+        self._in_flight = 0
+        # Incremented whenever the limit is lowered.
+        self._generation = 0
+        self._condition = threading.Condition()
+
+    @property
+    def limit(self) -> int:
+        """The number of requests currently allowed in flight at once."""
+        return int(self._limit)
+
+    @property
+    def in_flight(self) -> int:
+        """The number of requests currently in flight."""
+        return self._in_flight
+
+    def acquire(self, retry: bool = False) -> int:
+        """
+        Wait until another request is allowed in flight, and count it as in flight.
+
+        :param retry: Whether the request is a retry of a failed request.
+        :return: Token to pass to `release` once the request has finished.
+        """
+        with self._condition:
+            while self._in_flight >= int(self._limit):
+                self._condition.wait()
+            self._in_flight += 1
+            self.stats.requests += 1
+            if retry:
+                self.stats.retries += 1
+            return self._generation
+
+    def release(
+        self, token: int, throttled: bool = False, failed: bool = False
+    ) -> None:
+        """
+        Record that a request has finished, and adjust the limit by its outcome.
+
+        :param token: The token returned by `acquire` for the request.
+        :param throttled: Whether the request was throttled.
+        :param failed: Whether the request failed, and won't be retried.
+        """
+        policy = self.policy
+        with self._condition:
+            saturated = self._in_flight >= int(self._limit)
+            self._in_flight -= 1
+            if failed:
+                self.stats.failures += 1
+            if throttled:
+                self.stats.throttled += 1
+                if token == self._generation:
+                    self._limit = max(
+                        float(policy.min_limit), self._limit * policy.decrease_factor
+                    )
+                    self._generation += 1
+            elif saturated:
+                self._limit = min(
+                    float(policy.max_limit), self._limit + 1 / self._limit
+                )
+            self._condition.notify_all()
+
+
+def classify_error(err: BaseException) -> Optional[str]:
+    """
+    Return whether a request that raised the error should be retried, and why.
+
+    :return: "throttled" if the request was throttled, "transient" if it failed for
+        a reason that is likely to pass, or None if it should not be retried.
+    """
+    if isinstance(err, ClientError):
+        code = str(err.response.get("Error", {}).get("Code"))
+        status = str(err.response.get("ResponseMetadata", {}).get("HTTPStatusCode"))
+        if code in THROTTLING_ERROR_CODES or status == "503":
+            return "throttled"
+        if code in TRANSIENT_ERROR_CODES or status in TRANSIENT_ERROR_CODES:
+            return "transient"
+        return None
+    if isinstance(err, TRANSIENT_ERRORS):
+        return "transient"
+    return None
+
+
+_retry_policy = RetryPolicy()
+_concurrency_policy = ConcurrencyPolicy()
+_limiters: Dict[Tuple[str, str], AdaptiveLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def configure_throttling(
+    retry_policy: Optional[RetryPolicy] = None,
+    concurrency_policy: Optional[ConcurrencyPolicy] = None,
+) -> None:
+    """
+    Set how all requests to s3 are retried and limited.
+
+    The limits of all buckets start again from the `initial_limit`.
+
+    :param retry_policy: Optional RetryPolicy. Defaults to `RetryPolicy()`.
+    :param concurrency_policy: Optional ConcurrencyPolicy.
+        Defaults to `ConcurrencyPolicy()`.
+    """
+    global _retry_policy, _concurrency_policy
+
+    with _limiters_lock:
+        _retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        _concurrency_policy = (
+            concurrency_policy
+            if concurrency_policy is not None
+            else ConcurrencyPolicy()
+        )
+        _limiters.clear()
+
+
+def get_limiter(bucket: BucketLocation) -> AdaptiveLimiter:
+    """Return the AdaptiveLimiter of requests to the given bucket."""
+    key = (bucket.backend, bucket.name)
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = _limiters[key] = AdaptiveLimiter(_concurrency_policy)
+        return limiter
+
+
+def call_with_retries(
+    bucket: BucketLocation, request: str, function: Callable[[], R]
+) -> R:
+    """
+    Make a request to the bucket, within its concurrency limit, retrying failures.
+
+    Requests are retried as described by the RetryPolicy (see `configure_throttling`),
+    if `classify_error` finds they were throttled or failed transiently. No slot of
+    the concurrency limit is held while waiting to retry.
+
+    :param bucket: The bucket the request is made to.
+    :param request: Name of the request, e.g. "PutObject", to record retries under.
+    :param function: Function that makes the request. Called again for each retry, so
+        must not depend on state left by earlier calls, e.g. the position of a stream.
+    :return: The result of the function.
+    """
+    limiter = get_limiter(bucket)
+    policy = _retry_policy
+    attempt = 0
+    while True:
+        attempt += 1
+        token = limiter.acquire(retry=attempt > 1)
+        try:
+            result = function()
+        except Exception as err:
+            kind = classify_error(err)
+            give_up = kind is None or attempt >= policy.max_attempts
+            limiter.release(token, throttled=kind == "throttled", failed=give_up)
+            if give_up:
+                raise
+        else:
+            limiter.release(token)
+            return result
+
+        record_retries(1, request)
+        time.sleep(policy.delay(attempt))
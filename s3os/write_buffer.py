@@ -0,0 +1,143 @@
+"""Definition of the buffer of pending writes used by S3Dict in deferred write mode."""
+
+import threading
+import time
+
+from dataclasses import dataclass
+from typing import Any, Dict, Mapping, Optional
+
+#: Placeholder for a pending delete in a WriteBuffer.
+DELETED = object()
+
+
+@dataclass(frozen=True)
+class FlushPolicy:
+    """
+    When the pending writes of a deferred S3Dict are flushed to s3.
+
+    Pending writes are always flushed by `S3Dict.flush()`, and when the dict is used
+    as a context manager and the context exits.
+
+    :param max_pending: Optional. Flush once this many keys have pending writes.
+    :param max_age: Optional. Flush once the oldest pending write is this many seconds old.
+    :param background: If True, flushes are made by a background thread rather than
+        by the write that passed a threshold. The thread also flushes every `max_age`
+        seconds, so requires `max_age` to be set. Failed background flushes are logged,
+        and the writes are kept to be retried by the next flush. The thread stops when
+        the dict is closed or garbage collected. Writes that have not been flushed when
+        the dict is collected are lost, so close the dict to flush them.
+    """
+
+    max_pending: Optional[int] = 1000
+    max_age: Optional[float] = None
+    background: bool = False
+
+    def __post_init__(self):
+        """Validate the policy."""
+        if self.background and self.max_age is None:
+            raise ValueError("`max_age` must be set to flush in the background.")
+
+
+class WriteBuffer:
+    """
+    Thread-safe buffer of the latest pending write to each key.
+
+    Repeated writes to the same key replace each other, so only the last is flushed.
+    Pending deletes are recorded as DELETED.
+    """
+
+    def __init__(self, policy: Optional[FlushPolicy] = None):
+        """
+        Create a new WriteBuffer.
+
+        :param policy: Optional FlushPolicy. Defaults to `FlushPolicy()`.
+        """
+        self.policy: FlushPolicy = policy if policy is not None else FlushPolicy()
+        self._pending: Dict[str, Any] = {}
+        self._oldest_time: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def set(self, key: str, value: Any) -> None:
+        """Record a pending write of the value to the key."""
+        with self._lock:
+            self._pending[key] = value
+            if self._oldest_time is None:
+                self._oldest_time = time.monotonic()
+
+    def delete(self, key: str) -> None:
+        """Record a pending delete of the key."""
+        self.set(key, DELETED)
+
+    def get(self, key: str) -> Any:
+        """
+        Return the pending value of the key, which may be DELETED.
+
+        Raises KeyError if the key has no pending write.
+        """
+        with self._lock:
+            return self._pending[key]
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return a copy of the pending writes."""
+        with self._lock:
+            return dict(self._pending)
+
+    def take(self) -> Dict[str, Any]:
+        """Remove and return all the pending writes."""
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+            self._oldest_time = None
+            return pending
+
+    def restore(self, pending: Mapping[str, Any], since: float) -> None:
+        """
+        Return writes that failed to be flushed to the buffer, to be retried.
+
+        Writes to keys that have been written to again since are dropped, as they
+        have been superseded.
+
+        :param pending: The writes to restore.
+        :param since: The time the writes were originally made, so they count towards
+            the `max_age` of the buffer.
+        """
+        if not pending:
+            return
+        with self._lock:
+            for key, value in pending.items():
+                self._pending.setdefault(key, value)
+            if self._oldest_time is None or since < self._oldest_time:
+                self._oldest_time = since
+
+    def discard(self) -> None:
+        """Drop all the pending writes."""
+        self.take()
+
+    @property
+    def oldest_time(self) -> Optional[float]:
+        """Time of the oldest pending write, from `time.monotonic()`."""
+        return self._oldest_time
+
+    def is_full(self) -> bool:
+        """Return True if the pending writes have passed a threshold of the policy."""
+        with self._lock:
+            max_pending = self.policy.max_pending
+            max_age = self.policy.max_age
+            return bool(self._pending) and (
+                (max_pending is not None and len(self._pending) >= max_pending)
+                or (
+                    max_age is not None
+                    and self._oldest_time is not None
+                    and time.monotonic() - self._oldest_time >= max_age
+                )
+            )
+
+    def __contains__(self, key: object) -> bool:
+        """Return True if the key has a pending write."""
+        with self._lock:
+            return key in self._pending
+
+    def __len__(self) -> int:
+        """Return the number of keys with pending writes."""
+        with self._lock:
+            return len(self._pending)
@@ -0,0 +1,241 @@
+"""Tests for the asyncio interface to s3."""
+
+import asyncio
+import pytest
+import threading
+import time
+
+from typing import List
+
+from s3os import aio
+from s3os.api import BulkOperationError
+from s3os.backends import MemoryBackend, register_backend
+from s3os.s3_dict import S3DictConfig
+from s3os.s3_wrapper import (
+    BucketLocation,
+    ObjectInfo,
+    ObjectLocation,
+    invalidate_known_buckets,
+)
+from s3os.segments import SegmentPolicy
+
+
+@pytest.fixture
+def mock_s3_api(mocker):
+    """Create mocked versions of the s3 API, recording which thread each call is made on."""
+    threads = []
+    stored = {}
+
+    def store(location, obj, **kwargs):
+        threads.append(threading.current_thread().name)
+        if obj == "bad":
+            raise ValueError("Upload failed.")
+        stored[location] = obj
+        return ObjectInfo(size=1)
+
+    def retrieve(location, **kwargs):
+        threads.append(threading.current_thread().name)
+        return stored[location]
+
+    def retrieve_with_info(location, if_none_match=None, **kwargs):
+        return retrieve(location), ObjectInfo(size=1)
+
+    def delete(location):
+        stored.pop(location, None)
+
+    def delete_objects(bucket, keys):
+        for key in keys:
+            stored.pop(ObjectLocation(key, bucket=bucket), None)
+        return keys, {}
+
+    for module in ("s3os.api", "s3os.s3_dict"):
+        mocker.patch(f"{module}.store", side_effect=store)
+        mocker.patch(f"{module}.retrieve", side_effect=retrieve)
+        mocker.patch(f"{module}.retrieve_with_info", side_effect=retrieve_with_info)
+        mocker.patch(f"{module}.delete", side_effect=delete)
+    mocker.patch("s3os.api.delete_objects", side_effect=delete_objects)
+
+    def generate_items_in_bucket(bucket, prefix):
+        return iter(sorted(stored, key=lambda location: location.key))
+
+    mocker.patch(
+        "s3os.s3_dict.generate_items_in_bucket", side_effect=generate_items_in_bucket
+    )
+    return stored, threads
+
+
+def test_single_object_api(mock_s3_api):
+    """Test that single object operations run off the event loop thread."""
+    stored, threads = mock_s3_api
+
+    async def run():
+        await aio.store(ObjectLocation("a"), 1)
+        value = await aio.retrieve(ObjectLocation("a"))
+        await aio.delete(ObjectLocation("a"))
+        return value
+
+    assert asyncio.run(run()) == 1
+    assert len(stored) == 0
+    assert all(name.startswith("s3os-aio") for name in threads)
+
+
+def test_bulk_api(mock_s3_api):
+    """Test that bulk operations collect errors."""
+    stored, threads = mock_s3_api
+    items = {ObjectLocation(str(i)): i for i in range(20)}
+
+    async def run():
+        stored_result = await aio.store_many(
+            {**items, ObjectLocation("bad"): "bad"}, max_concurrency=3
+        )
+        retrieved_result = await aio.retrieve_many(
+            list(items) + [ObjectLocation("missing")]
+        )
+        return stored_result, retrieved_result
+
+    stored_result, retrieved_result = asyncio.run(run())
+
+    assert list(stored_result.errors) == [ObjectLocation("bad")]
+    assert retrieved_result.results == items
+    assert isinstance(retrieved_result.errors[ObjectLocation("missing")], KeyError)
+
+
+def test_bulk_api_is_bounded(mocker):
+    """Test that bulk operations only take items once they are ready to run them."""
+    taken = []
+    finished: List[int] = []
+
+    def locations():
+        for i in range(20):
+            taken.append(i)
+            yield ObjectLocation(str(i))
+
+    def retrieve(location, **kwargs):
+        unfinished = len(taken) - len(finished)
+        time.sleep(0.001)
+        finished.append(location)
+        return unfinished
+
+    mocker.patch("s3os.api.retrieve", side_effect=retrieve)
+    result = asyncio.run(aio.retrieve_many(locations(), max_concurrency=3))
+
+    assert len(result.results) == 20
+    assert max(result.results.values()) <= 3
+
+
+def test_bulk_api_takes_items_off_the_event_loop(mock_s3_api):
+    """Test that slow iterables of items don't block the event loop."""
+    stored, _ = mock_s3_api
+    stored.update({ObjectLocation(str(i)): i for i in range(5)})
+
+    def slow_locations():
+        for i in range(5):
+            time.sleep(0.05)
+            yield ObjectLocation(str(i))
+
+    async def run():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.005)
+                ticks += 1
+
+        ticker = asyncio.ensure_future(tick())
+        result = await aio.retrieve_many(slow_locations())
+        ticker.cancel()
+        return result, ticks
+
+    result, ticks = asyncio.run(run())
+    assert result.results == {ObjectLocation(str(i)): i for i in range(5)}
+    # The loop kept running while the locations were generated.
+    assert ticks >= 10
+
+
+def test_async_s3_dict(mock_s3_api, subtests):
+    """Test the AsyncS3Dict."""
+    stored, threads = mock_s3_api
+    dic = aio.AsyncS3Dict(_config=S3DictConfig(id="s3os_test", use_cache=False))
+
+    async def run():
+        await asyncio.gather(*(dic.set(str(i), i) for i in range(5)))
+        await dic.update({"x": "x"}, y="y")
+        await dic.delete("x")
+        return (
+            await dic.get("1"),
+            await dic.get("missing", "default"),
+            await dic.get_many(["2", "y", "missing"]),
+            [key async for key in dic],
+            await dic.get_all_from_s3(),
+        )
+
+    value, default, many, keys, all_items = asyncio.run(run())
+
+    with subtests.test("Values can be set, got and deleted."):
+        assert value == 1
+        assert default == "default"
+        assert ObjectLocation("s3os_test/x") not in stored
+
+    with subtests.test("Batch methods work."):
+        assert many == {"2": 2, "y": "y"}
+
+    with subtests.test("Keys and items can be iterated."):
+        assert keys == ["0", "1", "2", "3", "4", "y"]
+        assert all_items == {"0": 0, "1": 1, "2": 2, "3": 3, "4": 4, "y": "y"}
+
+    with subtests.test("Failures are raised."):
+        with pytest.raises(BulkOperationError):
+            asyncio.run(dic.update(bad="bad"))
+
+    with subtests.test("All items can be cleared."):
+        asyncio.run(dic.clear())
+        assert len(stored) == 0
+
+
+@pytest.mark.parametrize("layout", ["objects", "packed"])
+def test_async_s3_dict_keys(layout):
+    """Test that the keys of AsyncS3Dict include deferred writes, in either layout."""
+    register_backend("test", MemoryBackend())
+    invalidate_known_buckets()
+    config = S3DictConfig(
+        id="s3os_test",
+        bucket=BucketLocation("bucket", backend="test"),
+        write_mode="deferred",
+        layout=layout,
+        segment_policy=SegmentPolicy(background=False),
+    )
+    dic = aio.AsyncS3Dict(_config=config)
+
+    async def keys():
+        return [key async for key in dic], await dic.length()
+
+    async def run():
+        await dic.update({"a": 1, "b": 2})
+        before_flush = await keys()
+        await dic.flush()
+        after_flush = await keys()
+        await dic.set("c", 3)
+        await dic.delete("a")
+        return before_flush, after_flush, await keys()
+
+    try:
+        before_flush, after_flush, pending = asyncio.run(run())
+    finally:
+        invalidate_known_buckets()
+
+    assert before_flush == (["a", "b"], 2)
+    assert after_flush == (["a", "b"], 2)
+    assert pending == (["b", "c"], 2)
+
+
+def test_configure_executor():
+    """Test that the thread pool used for blocking calls can be resized."""
+    aio.configure_executor(max_workers=2)
+    try:
+        assert aio.get_executor()._max_workers == 2
+    finally:
+        aio.configure_executor()
+
+    with pytest.raises(ValueError):
+        aio.configure_executor(max_workers=0)
@@ -2,8 +2,37 @@
 
 import pytest
 
-from s3os.api import store, retrieve, delete
-from s3os.s3_wrapper import ObjectLocation
+from typing import Any, Dict
+
+from botocore.exceptions import ClientError
+
+from s3os.api import (
+    store,
+    store_by_content,
+    retrieve,
+    delete,
+    store_many,
+    retrieve_many,
+    delete_many,
+)
+from s3os.backends import MemoryBackend, register_backend
+from s3os.encoding import CodecNotAllowedError, split_header
+from s3os.s3_wrapper import (
+    BucketLocation,
+    ObjectLocation,
+    head_object,
+    invalidate_known_buckets,
+)
+
+
+@pytest.fixture
+def memory_backend():
+    """Register a fresh in-memory backend named "test"."""
+    backend = MemoryBackend()
+    register_backend("test", backend)
+    invalidate_known_buckets()
+    yield backend
+    invalidate_known_buckets()
 
 
 @pytest.mark.parametrize(
@@ -30,3 +59,187 @@ def test_failure_to_delete_missing_object():
     """Test that deleting non-existent objects fails correctly."""
     # No error expected - it's just a no-op.
     delete(ObjectLocation("DOES_NOT_EXIST"))
+
+
+@pytest.mark.parametrize(
+    "location_codec,call_codec,expected_codec",
+    [(None, None, "yaml"), ("json", None, "json"), ("json", "pickle", "pickle")],
+)
+def test_store_codec_selection(mocker, location_codec, call_codec, expected_codec):
+    """Test that the codec given to `store` takes precedence over the location's."""
+    mocker.patch("s3os.api.ensure_bucket")
+    mock_upload = mocker.patch("s3os.api.upload_object")
+
+    store(ObjectLocation("key", codec=location_codec), [1], codec=call_codec)
+
+    fields, _ = split_header(mock_upload.call_args[0][1].getvalue())
+    assert fields["codec"] == expected_codec
+
+
+def test_delete_many(mocker, subtests):
+    """Test that `delete_many` deletes objects in batches per bucket."""
+    error = ClientError({"Error": {"Code": "AccessDenied"}}, "DeleteObjects")
+
+    def delete_objects(bucket, keys):
+        if bucket.name == "broken":
+            raise error
+        return (
+            [key for key in keys if key != "3"],
+            {key: error for key in keys if key == "3"},
+        )
+
+    mock_delete_objects = mocker.patch(
+        "s3os.api.delete_objects", side_effect=delete_objects
+    )
+    other_bucket = BucketLocation("other")
+    broken_bucket = BucketLocation("broken")
+    locations = (
+        [ObjectLocation(str(i)) for i in range(2500)]
+        + [ObjectLocation(str(i), bucket=other_bucket) for i in range(2)]
+        + [ObjectLocation("a", bucket=broken_bucket)]
+    )
+
+    result = delete_many(iter(locations), max_concurrency=2)
+
+    with subtests.test("Objects are deleted in batches of up to 1000 per bucket."):
+        batches = sorted(
+            (call[0][0].name, len(call[0][1]))
+            for call in mock_delete_objects.call_args_list
+        )
+        assert batches == [
+            ("broken", 1),
+            ("other", 2),
+            ("s3os", 500),
+            ("s3os", 1000),
+            ("s3os", 1000),
+        ]
+
+    with subtests.test("Errors are collected per object."):
+        assert not result.ok
+        assert result.errors == {
+            ObjectLocation("3"): error,
+            ObjectLocation("a", bucket=broken_bucket): error,
+        }
+        assert len(result.results) == 2501
+        assert ObjectLocation("1", bucket=other_bucket) in result.results
+
+
+def test_store_many(mocker):
+    """Test that `store_many` stores every item and collects failures."""
+    mock_store = mocker.patch("s3os.api.store")
+    mock_store.side_effect = lambda location, obj, **kwargs: (
+        obj.fail() if obj == "bad" else None
+    )
+    items: Dict[ObjectLocation, Any] = {ObjectLocation(str(i)): i for i in range(20)}
+    items[ObjectLocation("bad")] = "bad"
+
+    result = store_many(items, codec="json", max_concurrency=3)
+
+    assert mock_store.call_count == 21
+    mock_store.assert_any_call(
+        ObjectLocation("5"),
+        5,
+        check_bucket=True,
+        codec="json",
+        compression=None,
+        disk_cache=None,
+    )
+    assert result.results == {ObjectLocation(str(i)): None for i in range(20)}
+    assert list(result.errors) == [ObjectLocation("bad")]
+    assert isinstance(result.errors[ObjectLocation("bad")], AttributeError)
+
+
+def test_retrieve_many(mocker):
+    """Test that `retrieve_many` retrieves every object and collects failures."""
+
+    def retrieve(location, **kwargs):
+        if location.key == "missing":
+            raise KeyError(location)
+        return int(location.key)
+
+    mocker.patch("s3os.api.retrieve", side_effect=retrieve)
+    locations = [ObjectLocation(str(i)) for i in range(20)]
+
+    result = retrieve_many(locations + [ObjectLocation("missing")])
+
+    assert result.results == {location: int(location.key) for location in locations}
+    assert isinstance(result.errors[ObjectLocation("missing")], KeyError)
+    assert not result.ok
+
+
+def test_retrieve_allowed_codecs(memory_backend):
+    """Test that pickled objects are only retrieved if pickle is allowed."""
+    location = ObjectLocation("key", bucket=BucketLocation(backend="test"))
+    store(location, {"a": 1}, codec="pickle")
+
+    with pytest.raises(CodecNotAllowedError):
+        retrieve(location)
+    assert isinstance(retrieve_many([location]).errors[location], CodecNotAllowedError)
+    assert retrieve(location, allowed_codecs=["pickle"]) == {"a": 1}
+    assert retrieve_many([location], allowed_codecs=["pickle"]).results == {
+        location: {"a": 1}
+    }
+
+
+def test_store_skip_unchanged(mocker, subtests, memory_backend):
+    """Test that storing the data that is already stored is skipped."""
+    put = mocker.spy(memory_backend, "put")
+    head = mocker.spy(memory_backend, "head")
+    location = ObjectLocation("key", bucket=BucketLocation(backend="test"))
+
+    with subtests.test("The hash of the data is kept with the object."):
+        info = store(location, [1, 2], skip_unchanged=True)
+        assert info.content_hash is not None
+        assert head_object(location) == info
+        assert put.call_count == 1
+
+    with subtests.test("Unchanged data is compared with the stored hash."):
+        head.reset_mock()
+        assert store(location, [1, 2], skip_unchanged=True) == info
+        assert put.call_count == 1
+        assert head.call_count == 1
+
+    with subtests.test("The hash of the current object saves a request."):
+        head.reset_mock()
+        assert store(location, [1, 2], skip_unchanged=True, current=info) == info
+        head.assert_not_called()
+        assert put.call_count == 1
+
+    with subtests.test("Changed data is stored."):
+        changed = store(location, [1, 2, 3], skip_unchanged=True, current=info)
+        assert changed.content_hash != info.content_hash
+        assert put.call_count == 2
+        assert retrieve(location) == [1, 2, 3]
+
+    with subtests.test("Objects stored without a hash are compared by ETag."):
+        store(location, "plain")
+        assert head_object(location).content_hash is None
+        store(location, "plain", skip_unchanged=True)
+        store(location, "other", skip_unchanged=True)
+        assert put.call_count == 4
+        assert retrieve(location) == "other"
+
+    with subtests.test("Missing objects are stored."):
+        store_many(
+            {location: "other", ObjectLocation("new", location.bucket): 1},
+            skip_unchanged=True,
+        ).raise_for_errors()
+        assert put.call_count == 5
+
+
+def test_store_by_content(mocker, memory_backend):
+    """Test that equal objects stored by content are only stored once."""
+    put = mocker.spy(memory_backend, "put")
+    bucket = BucketLocation(backend="test")
+
+    location, info = store_by_content(bucket, "blobs/", {"a": 1}, codec="json")
+    assert location.key == f"blobs/{info.content_hash}"
+    assert retrieve(location) == {"a": 1}
+
+    assert store_by_content(bucket, "blobs/", {"a": 1}, codec="json") == (
+        location,
+        info,
+    )
+    other, _ = store_by_content(bucket, "blobs/", {"a": 2}, codec="json")
+    assert other != location
+    assert put.call_count == 2
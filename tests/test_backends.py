@@ -0,0 +1,203 @@
+"""Tests for the storage backends other than s3."""
+
+import io
+
+import pytest
+
+from s3os.api import (
+    delete_many,
+    retrieve,
+    retrieve_streaming,
+    retrieve_with_info,
+    store,
+    store_streaming,
+)
+from s3os.backends import (
+    LocalBackend,
+    MemoryBackend,
+    StorageBackend,
+    available_backends,
+    get_backend,
+    register_backend,
+)
+from s3os.buffers import BufferStream
+from s3os.s3_dict import S3Dict, S3DictConfig
+from s3os.s3_wrapper import (
+    BucketLocation,
+    ObjectLocation,
+    ObjectNotModified,
+    delete_objects,
+    download_object_range,
+    ensure_bucket,
+    generate_items_in_bucket,
+    generate_objects_in_bucket,
+    head_object,
+    invalidate_known_buckets,
+    object_exists,
+    upload_object,
+)
+
+
+@pytest.fixture(params=["memory", "local"])
+def bucket(request, tmp_path):
+    """Register a fresh backend of each kind, and return a bucket in it."""
+    backend: StorageBackend
+    if request.param == "memory":
+        backend = MemoryBackend()
+    else:
+        backend = LocalBackend(str(tmp_path))
+    register_backend("test", backend)
+    invalidate_known_buckets()
+    yield BucketLocation("bucket", backend="test")
+    invalidate_known_buckets()
+
+
+def test_registry():
+    """Test that backends are looked up by name."""
+    assert {"s3", "memory", "local"} <= set(available_backends())
+    assert isinstance(get_backend("memory"), MemoryBackend)
+    with pytest.raises(ValueError):
+        get_backend("unknown")
+    with pytest.raises(TypeError):
+        register_backend("invalid", object())  # type: ignore
+
+
+def test_objects(bucket, subtests):
+    """Test storing, reading and deleting objects through the s3os API."""
+    location = ObjectLocation("dir/key", bucket=bucket)
+
+    with subtests.test("Buckets can be created."):
+        ensure_bucket(bucket)
+        assert list(generate_items_in_bucket(bucket)) == []
+
+    with subtests.test("Objects round trip."):
+        info = store(location, {"a": 1}, codec="json")
+        assert info.etag is not None
+        assert retrieve_with_info(location) == ({"a": 1}, info)
+        assert object_exists(location)
+
+    with subtests.test("Unchanged objects are not read again."):
+        with pytest.raises(ObjectNotModified):
+            retrieve_with_info(location, if_none_match=info.etag)
+
+    with subtests.test("Parts of objects can be read."):
+        upload_object(ObjectLocation("data", bucket=bucket), io.BytesIO(b"0123456789"))
+        stream = download_object_range(ObjectLocation("data", bucket=bucket), 2, 3)
+        assert stream.read() == b"234"
+
+    with subtests.test("Objects can be streamed."):
+        streamed = ObjectLocation("streamed", bucket=bucket)
+        info = store_streaming(streamed, list(range(1000)), codec="json")
+        assert info.size > 0
+        assert retrieve_streaming(streamed) == retrieve(streamed) == list(range(1000))
+
+    with subtests.test("Keys are listed in order, by prefix."):
+        keys = [item.key for item in generate_items_in_bucket(bucket)]
+        assert keys == ["data", "dir/key", "streamed"]
+        prefixed = generate_items_in_bucket(bucket, prefix="d")
+        assert [item.key for item in prefixed] == ["data", "dir/key"]
+
+    with subtests.test("Objects are described as they are listed."):
+        described = dict(generate_objects_in_bucket(bucket, prefix="d"))
+        assert described == {
+            listed: head_object(listed)
+            for listed in generate_items_in_bucket(bucket, prefix="d")
+        }
+
+    with subtests.test("Objects can be deleted."):
+        deleted, errors = delete_objects(bucket, ["data", "missing"])
+        assert deleted == ["data", "missing"]
+        assert errors == {}
+        assert delete_many([location]).ok
+        assert not object_exists(location)
+        with pytest.raises(KeyError):
+            retrieve(location)
+        with pytest.raises(KeyError):
+            download_object_range(location, 0, 1)
+
+
+def test_skip_unchanged(bucket, mocker, subtests):
+    """Test that storing data that is already stored is skipped, in every backend."""
+    put = mocker.spy(get_backend("test"), "put")
+    location = ObjectLocation("key", bucket=bucket)
+
+    with subtests.test("The hash of the data is kept with the object."):
+        info = store(location, [1, 2], skip_unchanged=True)
+        assert info.content_hash is not None
+        assert head_object(location) == info
+        assert retrieve_with_info(location) == ([1, 2], info)
+
+    with subtests.test("Unchanged data is not stored again."):
+        assert store(location, [1, 2], skip_unchanged=True) == info
+        assert put.call_count == 1
+
+    with subtests.test("Changed data is stored."):
+        changed = store(location, [1, 2, 3], skip_unchanged=True)
+        assert changed.content_hash != info.content_hash
+        assert put.call_count == 2
+        assert retrieve(location) == [1, 2, 3]
+
+    with subtests.test("Hashes are forgotten when data is replaced without one."):
+        store(location, [1, 2])
+        assert head_object(location).content_hash is None
+        assert delete_many([location]).ok
+        assert not object_exists(location)
+
+
+def test_local_backend_is_shared(tmp_path):
+    """Test that objects stored on disk are seen by other backends with the same root."""
+    first, second = LocalBackend(str(tmp_path)), LocalBackend(str(tmp_path))
+    location = ObjectLocation("a/../key", bucket=BucketLocation("bucket"))
+
+    etag = first.put(location, BufferStream([b"da", b"ta"]), content_hash="hash")
+    stream, info = second.get(location)
+    assert stream.read() == b"data"
+    assert info.etag == etag
+    assert info.content_hash == "hash"
+    assert list(second.list(location.bucket)) == ["a/../key"]
+    # Nothing but the object itself is left in the bucket.
+    assert len(list((tmp_path / "bucket").iterdir())) == 1
+
+
+def test_local_backend_long_keys(tmp_path, subtests):
+    """Test that keys too long to be file names are kept under their hash."""
+    backend = LocalBackend(str(tmp_path))
+    bucket = BucketLocation("bucket")
+    long_key = "dir/" + "é" * 200
+    location = ObjectLocation(long_key, bucket=bucket)
+
+    with subtests.test("Objects with long keys round trip."):
+        etag = backend.put(location, BufferStream([b"data"]), content_hash="hash")
+        stream, info = backend.get(location)
+        assert stream.read() == b"data"
+        assert info.etag == etag
+        assert info.content_hash == "hash"
+        assert backend.head(location) == info
+
+    with subtests.test("Long keys are listed in order, by prefix."):
+        backend.put(ObjectLocation("dir/a", bucket=bucket), BufferStream([b"a"]))
+        backend.put(ObjectLocation("other", bucket=bucket), BufferStream([b"o"]))
+        assert list(backend.list(bucket)) == ["dir/a", long_key, "other"]
+        assert list(backend.list(bucket, prefix="dir/é")) == [long_key]
+
+    with subtests.test("Objects with long keys can be deleted."):
+        backend.delete(location)
+        with pytest.raises(KeyError):
+            backend.get(location)
+        assert list(backend.list(bucket)) == ["dir/a", "other"]
+        assert list((tmp_path / ".keys" / "bucket").iterdir()) == []
+
+
+def test_s3_dict_backend(subtests):
+    """Test that S3Dicts can keep their values in any backend."""
+    config = S3DictConfig(id="dict", backend="memory", use_cache=False)
+    assert config.bucket == BucketLocation(backend="memory")
+    with pytest.raises(ValueError):
+        S3DictConfig(backend="unknown")
+
+    s3dict = S3Dict({"a": 1, "b": 2}, _config=config)
+    del s3dict["b"]
+    assert s3dict.get_all_from_s3() == {"a": 1}
+    assert list(s3dict) == ["a"]
+    s3dict.clear()
+    assert len(s3dict) == 0
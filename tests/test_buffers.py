@@ -0,0 +1,45 @@
+"""Tests for the file-like view of encoded object data."""
+
+import io
+import pytest
+
+from s3os.buffers import BufferStream
+
+
+def test_buffer_stream(subtests):
+    """Test that a BufferStream reads as the concatenation of its buffers."""
+    data = bytearray(b"world")
+    stream = BufferStream([b"hello ", memoryview(data), b"", b"!"])
+
+    with subtests.test("The stream reads as its buffers joined together."):
+        assert len(stream) == 12
+        assert stream.read() == b"hello world!"
+        assert stream.read() == b""
+
+    with subtests.test("Reads can cross the boundaries between buffers."):
+        stream.seek(4)
+        assert stream.read(4) == b"o wo"
+        assert stream.tell() == 8
+        assert stream.read(100) == b"rld!"
+
+    with subtests.test("Seeks are relative to the given position."):
+        assert stream.seek(-1, io.SEEK_END) == 11
+        assert stream.read() == b"!"
+        stream.seek(-6, io.SEEK_CUR)
+        assert stream.read(5) == b"world"
+        with pytest.raises(ValueError):
+            stream.seek(-1)
+
+    with subtests.test("Buffers are referred to rather than copied."):
+        data[0:5] = b"WORLD"
+        assert stream.getvalue() == b"hello WORLD!"
+
+
+def test_buffer_stream_getbuffer():
+    """Test that the buffer of a single buffer stream is not copied."""
+    data = bytearray(b"data")
+    view = BufferStream([data]).getbuffer()
+    data[0:1] = b"D"
+    assert view == b"Data"
+    assert BufferStream([b"a", b"b"]).getbuffer() == b"ab"
+    assert BufferStream([]).getbuffer() == b""
@@ -0,0 +1,229 @@
+"""Tests for the local cache used by S3Dict."""
+
+import pytest
+
+from s3os.cache import Cache, CachePolicy, estimate_size
+from s3os.s3_wrapper import ObjectInfo
+
+
+@pytest.fixture
+def mock_time(mocker):
+    """Mock the clock used to expire cached values."""
+    now = [0.0]
+    mocker.patch("s3os.cache.time.monotonic", side_effect=lambda: now[0])
+    return now
+
+
+def test_cache_policy_validation():
+    """Test that unknown eviction strategies are rejected."""
+    with pytest.raises(ValueError):
+        CachePolicy(eviction="random")
+
+
+def test_unbounded_cache(subtests):
+    """Test that a cache without a policy behaves like a dict."""
+    cache = Cache()
+    cache["a"] = 1
+    cache.set("b", 2, size=10)
+
+    with subtests.test("Values can be looked up."):
+        assert cache["a"] == 1
+        assert cache == {"a": 1, "b": 2}
+        assert "b" in cache
+        assert "c" not in cache
+
+    with subtests.test("Sizes are tracked."):
+        assert cache.nbytes == 10
+        cache.set("b", 3, size=4)
+        assert cache.nbytes == 4
+
+    with subtests.test("Values can be deleted."):
+        del cache["b"]
+        assert cache == {"a": 1}
+        assert cache.nbytes == 0
+        with pytest.raises(KeyError):
+            del cache["b"]
+
+
+def test_cache_stats():
+    """Test that lookups are counted, but looking at all the values is not."""
+    cache = Cache()
+    cache["a"] = 1
+
+    cache["a"]
+    cache.get("b")
+    assert cache.snapshot() == {"a": 1}
+    assert list(cache.items()) == [("a", 1)]
+
+    assert cache.stats.hits == 1
+    assert cache.stats.misses == 1
+    assert cache.stats.evictions == 0
+
+
+def test_lru_eviction(subtests):
+    """Test that the least recently used values are evicted first."""
+    cache = Cache(CachePolicy(max_entries=2))
+    cache["a"] = 1
+    cache["b"] = 2
+    cache["a"]
+    cache["c"] = 3
+
+    assert cache == {"a": 1, "c": 3}
+    assert cache.stats.evictions == 1
+
+
+def test_lfu_eviction(subtests):
+    """Test that the least frequently used values are evicted first."""
+    cache = Cache(CachePolicy(max_entries=2, eviction="lfu"))
+    cache["a"] = 1
+    cache["b"] = 2
+    cache["b"]
+    cache["b"]
+    cache["a"]
+    cache["c"] = 3
+
+    with subtests.test("The new value is kept, even though it has not been used yet."):
+        assert cache == {"b": 2, "c": 3}
+
+    cache = Cache(CachePolicy(max_entries=3, eviction="lfu"))
+    for key in "abc":
+        cache[key] = key
+    for key in "cab":
+        cache[key]
+
+    with subtests.test("Ties are broken by evicting the least recently used."):
+        cache["d"] = "d"
+        assert sorted(cache) == ["a", "b", "d"]
+
+    with subtests.test("Replaced values start counting their uses again."):
+        cache["a"]
+        cache["b"] = "b"
+        cache["e"] = "e"
+        assert sorted(cache) == ["a", "b", "e"]
+
+    with subtests.test("Deleted values are no longer candidates."):
+        cache["e"]
+        cache["e"]
+        del cache["b"]
+        cache["f"] = "f"
+        cache["g"] = "g"
+        assert sorted(cache) == ["a", "e", "g"]
+
+    with subtests.test("Values too large for the cache are not kept."):
+        cache = Cache(CachePolicy(max_bytes=10, eviction="lfu"))
+        cache.set("a", 1, size=4)
+        cache.set("b", 2, size=11)
+        assert cache == {}
+        cache.set("c", 3, size=4)
+        cache.set("d", 4, size=4)
+        cache["c"]
+        cache.set("e", 5, size=4)
+        assert cache == {"c": 3, "e": 5}
+
+    with subtests.test("The empty key is evicted like any other."):
+        cache = Cache(CachePolicy(max_entries=2, eviction="lfu"))
+        cache[""] = 1
+        cache["a"] = 2
+        cache["a"]
+        cache["a"]
+        cache["b"] = 3
+        assert cache == {"a": 2, "b": 3}
+
+
+def test_max_bytes(subtests):
+    """Test that values are evicted to stay within the byte limit."""
+    cache = Cache(CachePolicy(max_bytes=10))
+    cache.set("a", 1, size=4)
+    cache.set("b", 2, size=4)
+
+    with subtests.test("Old values are evicted to make room."):
+        cache.set("c", 3, size=4)
+        assert cache == {"b": 2, "c": 3}
+        assert cache.nbytes == 8
+
+    with subtests.test("Values larger than the limit are not cached."):
+        cache.set("d", 4, size=11)
+        assert cache == {}
+        assert cache.nbytes == 0
+        assert cache.stats.evictions == 4
+
+
+def test_ttl(mock_time):
+    """Test that values expire after the TTL."""
+    cache = Cache(CachePolicy(ttl=10))
+    cache["a"] = 1
+    mock_time[0] = 5
+    cache["b"] = 2
+
+    mock_time[0] = 10
+    assert "a" not in cache
+    assert cache["b"] == 2
+    assert len(cache) == 1
+
+    mock_time[0] = 15
+    with pytest.raises(KeyError):
+        cache["b"]
+    assert cache.stats.evictions == 2
+    assert cache.stats.misses == 1
+
+
+def test_revalidation(mock_time, subtests):
+    """Test that stale values are kept so they can be revalidated by their ETag."""
+    cache = Cache(CachePolicy(revalidate_after=10))
+    cache.set("a", 1, etag="x")
+
+    with subtests.test("Fresh values are hits."):
+        assert cache["a"] == 1
+        assert cache.stats.hits == 1
+
+    mock_time[0] = 10
+
+    with subtests.test("Stale values are misses, but stay cached."):
+        with pytest.raises(KeyError):
+            cache["a"]
+        assert cache.stats.misses == 1
+        assert cache.etag("a") == "x"
+
+    with subtests.test("Values can only be revalidated by their own ETag."):
+        with pytest.raises(KeyError):
+            cache.revalidate("a", "y")
+        with pytest.raises(KeyError):
+            cache.revalidate("b", "x")
+
+    with subtests.test("Revalidated values are fresh again."):
+        assert cache.revalidate("a", "x") == 1
+        assert cache["a"] == 1
+        assert cache.stats.revalidations == 1
+        assert cache.stats.hits == 2
+
+
+def test_object_info(mock_time):
+    """Test that the details of stored objects are only given for fresh values."""
+    cache = Cache(CachePolicy(revalidate_after=10))
+    cache.set("a", 1, size=3, etag="x", content_hash="hash")
+    cache["b"] = 2
+
+    assert cache.object_info("a") == ObjectInfo(3, "x", "hash")
+    assert cache.object_info("b") == ObjectInfo(0)
+    assert cache.object_info("c") is None
+
+    # The object may have changed in s3 once the value is stale.
+    mock_time[0] = 10
+    assert cache.object_info("a") is None
+
+
+def test_estimate_size(subtests):
+    """Test the estimates of the encoded size of values."""
+    with subtests.test("Buffers count their bytes."):
+        assert estimate_size(b"x" * 1000) == 1000
+        assert estimate_size(memoryview(bytearray(500))) == 500
+        assert estimate_size("x" * 100) == 100
+
+    with subtests.test("Containers count their contents."):
+        assert estimate_size(["x" * 100, {"key": b"y" * 100}]) >= 203
+        assert estimate_size([b"x" * 100] * 10) >= 1000
+
+    with subtests.test("Values that contain themselves are counted once."):
+        value: list = [b"x" * 100]
+        value.append(value)
+        assert 100 <= estimate_size(value) < 200
@@ -0,0 +1,119 @@
+"""Tests for the shared s3 client pool."""
+
+import boto3
+import pytest
+import threading
+
+from botocore.exceptions import EndpointConnectionError
+
+from s3os.clients import ClientConfig, ClientPool
+
+
+def make_session(access_key: str = "access") -> boto3.session.Session:
+    """Create a boto3 session with static credentials."""
+    return boto3.session.Session(
+        aws_access_key_id=access_key,
+        aws_secret_access_key="secret",
+        region_name="eu-west-1",
+    )
+
+
+def test_client_config():
+    """Test conversion of ClientConfig into a botocore Config."""
+    config = ClientConfig(max_pool_connections=50, read_timeout=5).to_botocore_config()
+    assert config.max_pool_connections == 50
+    assert config.read_timeout == 5
+    # Requests are retried by s3os rather than by botocore.
+    assert config.retries == {"max_attempts": 0}
+
+
+def test_client_config_limits_attempts(mocker):
+    """Test that clients built from the config make each request `max_attempts` times."""
+    mocker.patch("time.sleep")
+    config = ClientConfig(max_attempts=3, connect_timeout=1).to_botocore_config()
+    client = make_session().client(
+        "s3", config=config, endpoint_url="http://127.0.0.1:1"
+    )
+    attempts = []
+    client.meta.events.register("before-send.s3", lambda **kwargs: attempts.append(1))
+
+    with pytest.raises(EndpointConnectionError):
+        client.head_bucket(Bucket="bucket")
+    assert len(attempts) == 3
+
+
+def test_clients_are_reused(subtests):
+    """Test that the pool hands out the same client for the same region."""
+    pool = ClientPool(session=make_session())
+
+    with subtests.test("Same region gives the same client."):
+        assert pool.get_client() is pool.get_client()
+        assert pool.get_client("us-west-2") is pool.get_client("us-west-2")
+
+    with subtests.test("Different regions give different clients."):
+        assert pool.get_client("us-west-2") is not pool.get_client("eu-west-2")
+        assert pool.get_client("us-west-2").meta.region_name == "us-west-2"
+
+    with subtests.test("Clearing the pool creates new clients."):
+        client = pool.get_client()
+        pool.clear()
+        assert pool.get_client() is not client
+
+
+def test_clients_are_keyed_by_credentials(mocker):
+    """Test that changing credentials results in a new client."""
+    session = make_session()
+    pool = ClientPool(session=session)
+    client = pool.get_client()
+
+    mocker.patch.object(
+        session, "get_credentials", return_value=make_session("other").get_credentials()
+    )
+    assert pool.get_client() is not client
+
+
+def test_clients_are_looked_up_without_locking(mocker):
+    """Test that only creating a client takes the lock of the pool."""
+    pool = ClientPool(session=make_session())
+    client = pool.get_client()
+    lock = mocker.patch.object(pool, "_lock")
+
+    assert pool.get_client() is client
+    lock.__enter__.assert_not_called()
+
+    pool.get_client("us-west-2")
+    lock.__enter__.assert_called_once()
+
+
+def test_client_config_is_applied():
+    """Test that clients are created using the pool configuration."""
+    pool = ClientPool(
+        config=ClientConfig(
+            max_pool_connections=3, endpoint_url="http://localhost:9000"
+        ),
+        session=make_session(),
+    )
+    client = pool.get_client()
+    assert client.meta.endpoint_url == "http://localhost:9000"
+    assert client.meta.config.max_pool_connections == 3
+
+
+def test_concurrent_access_creates_one_client(mocker):
+    """Test that concurrent callers share a single client."""
+    session = make_session()
+    create_client = mocker.spy(session, "client")
+    pool = ClientPool(session=session)
+    clients = []
+
+    threads = [
+        threading.Thread(target=lambda: clients.append(pool.get_client()))
+        for _ in range(10)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(clients) == 10
+    assert all(client is clients[0] for client in clients)
+    create_client.assert_called_once()
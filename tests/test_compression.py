@@ -0,0 +1,78 @@
+"""Tests for compression of stored objects."""
+
+import io
+
+import pytest
+
+from s3os.compression import (
+    CompressionConfig,
+    available_compressors,
+    get_compressor,
+)
+from s3os.encoding import object_from_stream, object_to_stream, split_header
+
+LARGE_OBJECT = {"values": [{"name": "repeated", "value": i % 10} for i in range(500)]}
+
+
+@pytest.mark.parametrize("algorithm", ["zlib", "gzip", "zstd", "lz4"])
+@pytest.mark.parametrize("level", [None, 1])
+def test_compression_round_trip(algorithm, level):
+    """Test that objects round trip through each compression algorithm."""
+    if algorithm not in available_compressors():
+        pytest.skip(f"{algorithm} is not installed.")
+    compression = CompressionConfig(algorithm=algorithm, level=level, min_size=0)
+
+    stream = object_to_stream(LARGE_OBJECT, compression=compression)
+    fields, payload = split_header(stream.getvalue())
+
+    assert fields == {"codec": "yaml", "compression": algorithm}
+    assert len(payload) < len(object_to_stream(LARGE_OBJECT).getvalue())
+    assert object_from_stream(stream) == LARGE_OBJECT
+
+
+def test_compression_thresholds(subtests):
+    """Test that objects are only compressed when worthwhile."""
+    with subtests.test("Objects smaller than `min_size` are not compressed."):
+        stream = object_to_stream([1, 2], compression=CompressionConfig(min_size=100))
+        assert stream.getvalue() == object_to_stream([1, 2]).getvalue()
+
+    with subtests.test("Objects that don't get smaller are not compressed."):
+        stream = object_to_stream(
+            b"\x01", codec="bytes", compression=CompressionConfig(min_size=0)
+        )
+        assert split_header(stream.getvalue()) == ({"codec": "bytes"}, b"\x01")
+
+    with subtests.test("Compression is combined with other codecs."):
+        stream = object_to_stream(
+            LARGE_OBJECT, codec="json", compression=CompressionConfig(min_size=0)
+        )
+        assert split_header(stream.getvalue())[0]["codec"] == "json"
+        assert object_from_stream(stream) == LARGE_OBJECT
+
+
+def test_unknown_compressor():
+    """Test that unknown compression algorithms are rejected."""
+    with pytest.raises(ValueError):
+        get_compressor("unknown")
+    with pytest.raises(ValueError):
+        object_to_stream(
+            LARGE_OBJECT, compression=CompressionConfig("unknown", min_size=0)
+        )
+
+
+def test_gzip_output_is_deterministic(mocker):
+    """Test that gzip compresses equal data to equal bytes at different times."""
+    gzip_compressor = get_compressor("gzip")
+    assert gzip_compressor.compress_stream is not None
+    data = object_to_stream(LARGE_OBJECT).getvalue()
+    m_time = mocker.patch("time.time", return_value=1000000000.0)
+
+    outputs = []
+    for _ in range(2):
+        file = io.BytesIO()
+        with gzip_compressor.compress_stream(file, None) as wrapper:
+            wrapper.write(data)
+        outputs.append((gzip_compressor.compress(data, None), file.getvalue()))
+        m_time.return_value += 1.1
+
+    assert outputs[0] == outputs[1]
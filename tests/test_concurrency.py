@@ -0,0 +1,136 @@
+"""Tests for the concurrency helpers."""
+
+import pytest
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from s3os.concurrency import bounded_map, configure_executor, get_executor
+
+
+def test_bounded_map_results(subtests):
+    """Test that `bounded_map` calls the function on every item."""
+    with subtests.test("Ordered results are in order."):
+        results = [
+            (item, future.result())
+            for item, future in bounded_map(lambda x: x * 2, range(20), ordered=True)
+        ]
+        assert results == [(i, i * 2) for i in range(20)]
+
+    with subtests.test("Unordered results contain every item."):
+        results = [
+            (item, future.result())
+            for item, future in bounded_map(lambda x: x * 2, range(20), max_in_flight=3)
+        ]
+        assert sorted(results) == [(i, i * 2) for i in range(20)]
+
+    with subtests.test("Exceptions are returned in the futures."):
+
+        def fail_on_odd(x):
+            if x % 2:
+                raise ValueError(x)
+            return x
+
+        failures = [
+            item
+            for item, future in bounded_map(fail_on_odd, range(6))
+            if future.exception() is not None
+        ]
+        assert sorted(failures) == [1, 3, 5]
+
+    with subtests.test("Invalid limits are rejected."):
+        with pytest.raises(ValueError):
+            list(bounded_map(str, range(3), max_in_flight=0))
+
+
+def test_bounded_map_limits_in_flight_calls():
+    """Test that no more than `max_in_flight` calls are outstanding at once."""
+    lock = threading.Lock()
+    outstanding = 0
+    max_outstanding = 0
+
+    def track(x):
+        nonlocal outstanding, max_outstanding
+        with lock:
+            outstanding += 1
+            max_outstanding = max(max_outstanding, outstanding)
+        time.sleep(0.001)
+        return x
+
+    for _, future in bounded_map(track, range(50), max_in_flight=5):
+        with lock:
+            outstanding -= 1
+
+    assert max_outstanding <= 5
+
+
+def test_bounded_map_unordered_yields_fastest_first():
+    """Test that unordered results are yielded as soon as they complete."""
+    event = threading.Event()
+
+    def slow_first(x):
+        if x == 0:
+            event.wait(5)
+        return x
+
+    results = bounded_map(slow_first, range(3), max_in_flight=3)
+    first, _ = next(results)
+    event.set()
+    assert first != 0
+    assert sorted([first] + [item for item, _ in results]) == [0, 1, 2]
+
+
+def test_shared_executor(subtests):
+    """Test configuration of the shared executor."""
+    with subtests.test("The executor is shared."):
+        assert get_executor() is get_executor()
+
+    with subtests.test("The executor can be resized."):
+        configure_executor(max_workers=3)
+        try:
+            assert get_executor()._max_workers == 3
+        finally:
+            configure_executor()
+
+    with subtests.test("Invalid sizes are rejected."):
+        with pytest.raises(ValueError):
+            configure_executor(max_workers=0)
+
+    with subtests.test("A different executor can be used."):
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            names = [
+                future.result()
+                for _, future in bounded_map(
+                    lambda _: threading.current_thread().name,
+                    range(3),
+                    executor=executor,
+                )
+            ]
+        assert not any(name.startswith("s3os") for name in names)
+
+
+def test_nested_bounded_map():
+    """Test that bulk calls made from the shared executor's threads don't deadlock."""
+
+    def fan_out(x):
+        nested = bounded_map(lambda y: (y, threading.current_thread().name), range(3))
+        return [future.result() for _, future in nested]
+
+    def run():
+        return [future.result() for _, future in bounded_map(fan_out, range(3))]
+
+    configure_executor(max_workers=1)
+    # Run on another thread, so that a deadlock fails the test rather than hanging it.
+    runner = ThreadPoolExecutor(max_workers=1)
+    try:
+        results = runner.submit(run).result(timeout=5)
+    finally:
+        runner.shutdown(wait=False)
+        configure_executor()
+
+    assert len(results) == 3
+    for nested in results:
+        # The nested calls run inline, on the thread of the outer call.
+        assert sorted(y for y, _ in nested) == [0, 1, 2]
+        assert len({name for _, name in nested}) == 1
@@ -0,0 +1,137 @@
+"""Tests for decoding downloaded objects in a pool of processes."""
+
+import os
+
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, List, Optional, Tuple
+
+import pytest
+
+from s3os import decode_pool
+from s3os.api import retrieve_many, store_many
+from s3os.decode_pool import DecodeConfig, decode_in_processes
+from s3os.encoding import CodecNotAllowedError, object_to_stream
+from s3os.s3_dict import S3Dict, S3DictConfig
+from s3os.s3_wrapper import BucketLocation, ObjectLocation
+
+LARGE = [{"id": i, "name": f"item-{i}"} for i in range(200)]
+
+
+def download(result: Any = None, error: Optional[Exception] = None) -> "Future[Any]":
+    """Create a completed future of a download."""
+    future: "Future[Any]" = Future()
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+    return future
+
+
+def encoded(obj: Any) -> Tuple[bytes, str]:
+    """Encode the object as YAML, along with some info about it."""
+    return object_to_stream(obj).getvalue(), "info"
+
+
+def test_decode_config():
+    """Test the validation of the config."""
+    assert DecodeConfig(max_workers=3).workers == 3
+    assert DecodeConfig().workers >= 1
+    for invalid in (dict(max_workers=0), dict(batch_size=0), dict(min_size=-1)):
+        with pytest.raises(ValueError):
+            DecodeConfig(**invalid)
+
+
+@pytest.mark.parametrize("ordered", [True, False])
+def test_decode_in_processes(mocker, ordered):
+    """Test that large objects are decoded in processes, and small ones in thread."""
+    mock_get_decode_pool = mocker.spy(decode_pool, "get_decode_pool")
+    downloads = [
+        (0, download(encoded(LARGE))),
+        (1, download(encoded("small"))),
+        (2, download(error=KeyError("missing"))),
+        (3, download((b"\x00s3os\x01\x00\x0bcodec=other", "info"))),
+        (4, download(encoded(LARGE[::-1]))),
+    ]
+    config = DecodeConfig(max_workers=2, batch_size=2, min_size=100)
+
+    results: List[Tuple[int, Future]] = list(
+        decode_in_processes(downloads, config, ordered=ordered)
+    )
+
+    if ordered:
+        assert [index for index, _ in results] == [0, 1, 2, 3, 4]
+    futures = dict(results)
+    assert futures[0].result() == (LARGE, "info")
+    assert futures[1].result() == ("small", "info")
+    assert futures[4].result() == (LARGE[::-1], "info")
+    with pytest.raises(KeyError):
+        futures[2].result()
+    with pytest.raises(ValueError):
+        # Unknown codec, decoded in thread as it is small.
+        futures[3].result()
+    mock_get_decode_pool.assert_called_with(2)
+
+
+def test_decode_allowed_codecs():
+    """Test that objects are only decoded in processes with codecs that are allowed."""
+    pickled = object_to_stream(LARGE, codec="pickle").getvalue()
+    config = DecodeConfig(max_workers=1, min_size=0)
+
+    ((_, refused),) = decode_in_processes([(0, download((pickled, "info")))], config)
+    with pytest.raises(CodecNotAllowedError):
+        refused.result()
+
+    ((_, allowed),) = decode_in_processes(
+        [(0, download((pickled, "info")))], config, allowed_codecs=["pickle"]
+    )
+    assert allowed.result() == (LARGE, "info")
+
+
+def test_broken_pool(mocker, subtests):
+    """Test that a pool broken by a worker process dying is replaced."""
+    config = DecodeConfig(max_workers=1, batch_size=1, min_size=0)
+    pool = decode_pool.get_decode_pool(1)
+    with pytest.raises(BrokenProcessPool):
+        pool.submit(os._exit, 1).result()
+
+    with subtests.test("Batches sent to a broken pool fail."):
+        mocker.patch("s3os.decode_pool.get_decode_pool", return_value=pool)
+        results = dict(decode_in_processes([(0, download(encoded(LARGE)))], config))
+        with pytest.raises(BrokenProcessPool):
+            results[0].result()
+        mocker.stopall()
+
+    with subtests.test("The broken pool is replaced."):
+        assert decode_pool.get_decode_pool(1) is not pool
+        results = dict(decode_in_processes([(0, download(encoded(LARGE)))], config))
+        assert results[0].result() == (LARGE, "info")
+
+
+def test_bulk_reads(subtests):
+    """Test that bulk reads decode objects in processes when configured to."""
+    config = DecodeConfig(max_workers=2, batch_size=3, min_size=0)
+    bucket = BucketLocation("decode", backend="memory")
+
+    with subtests.test("retrieve_many"):
+        locations = [ObjectLocation(f"key/{i}", bucket=bucket) for i in range(10)]
+        store_many((location, LARGE[i:]) for i, location in enumerate(locations))
+        missing = ObjectLocation("missing", bucket=bucket)
+
+        result = retrieve_many(locations + [missing], decode=config)
+
+        assert result.results == {
+            location: LARGE[i:] for i, location in enumerate(locations)
+        }
+        assert isinstance(result.errors[missing], KeyError)
+        result = retrieve_many(locations[:1], with_info=True, decode=config)
+        assert result.results[locations[0]][1].size > 0
+
+    with subtests.test("S3Dict"):
+        s3dict = S3Dict(
+            {str(i): LARGE[i:] for i in range(10)},
+            _config=S3DictConfig(id="decode", backend="memory", decode=config),
+        )
+        s3dict.data.clear()
+        assert s3dict.get_all_from_s3() == {str(i): LARGE[i:] for i in range(10)}
+        assert s3dict.data.snapshot() == {str(i): LARGE[i:] for i in range(10)}
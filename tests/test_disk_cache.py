@@ -0,0 +1,168 @@
+"""Tests for the cache of encoded objects on local disk."""
+
+import io
+import os
+
+from s3os.api import retrieve_with_info, store
+from s3os.disk_cache import TEMP_PREFIX, DiskCache, DiskCacheConfig
+from s3os.encoding import PAYLOAD_ALIGNMENT, object_to_stream
+from s3os.s3_wrapper import (
+    BucketLocation,
+    ObjectInfo,
+    ObjectLocation,
+    ObjectNotModified,
+)
+
+
+def test_disk_cache(tmp_path, subtests):
+    """Test that cached objects are shared between caches using the same directory."""
+    config = DiskCacheConfig(directory=str(tmp_path))
+    cache = DiskCache(config)
+    location = ObjectLocation("key")
+
+    with subtests.test("Objects are missing until cached."):
+        assert cache.get(location) is None
+        assert cache.stats.misses == 1
+
+    with subtests.test("Objects are cached with their ETag."):
+        cache.put(location, '"abc"', memoryview(b"data"))
+        assert cache.get(location) == (b"data", '"abc"')
+        assert cache.stats.hits == 1
+
+    with subtests.test("Other caches of the same directory see the same objects."):
+        assert DiskCache(config).get(location) == (b"data", '"abc"')
+
+    with subtests.test("Objects are keyed by bucket as well as key."):
+        assert cache.get(ObjectLocation("key", bucket=BucketLocation("other"))) is None
+
+    with subtests.test("Newer copies replace older ones."):
+        cache.put(location, '"def"', memoryview(b"new data"))
+        assert cache.get(location) == (b"new data", '"def"')
+
+
+def test_disk_cache_eviction(tmp_path):
+    """Test that the least recently used objects are removed once over the size limit."""
+    cache = DiskCache(DiskCacheConfig(directory=str(tmp_path), max_bytes=400))
+    locations = [ObjectLocation(str(i)) for i in range(3)]
+
+    for index, location in enumerate(locations[:2]):
+        cache.put(location, "e", memoryview(bytes(100)))
+        # Make the order of use unambiguous, regardless of the timestamp resolution.
+        os.utime(cache._path(location), (index, index))
+
+    cache.put(locations[2], "e", memoryview(bytes(100)))
+
+    assert cache.get(locations[0]) is None
+    assert cache.get(locations[1]) is not None
+    assert cache.get(locations[2]) is not None
+    assert cache.stats.evictions == 1
+
+
+def test_disk_cache_eviction_failures(tmp_path, mocker):
+    """Test that files which can't be removed are skipped, without failing the write."""
+    cache = DiskCache(DiskCacheConfig(directory=str(tmp_path), max_bytes=400))
+    locations = [ObjectLocation(str(i)) for i in range(3)]
+
+    for index, location in enumerate(locations[:2]):
+        cache.put(location, "e", memoryview(bytes(100)))
+        os.utime(cache._path(location), (index, index))
+
+    remove = os.remove
+    locked = cache._path(locations[0])
+
+    def remove_unless_locked(path):
+        if path == locked:
+            raise PermissionError(path)
+        remove(path)
+
+    mocker.patch("s3os.disk_cache.os.remove", side_effect=remove_unless_locked)
+    cache.put(locations[2], "e", memoryview(bytes(100)))
+
+    assert cache.get(locations[0]) is not None
+    assert cache.get(locations[1]) is None
+    assert cache.get(locations[2]) is not None
+    assert cache.stats.evictions == 1
+
+
+def test_disk_cache_stale_temp_files(tmp_path):
+    """Test that temporary files left behind by crashed writers are removed."""
+    cache = DiskCache(DiskCacheConfig(directory=str(tmp_path)))
+    shard = tmp_path / "00"
+    shard.mkdir()
+    stale, recent = shard / f"{TEMP_PREFIX}stale", shard / f"{TEMP_PREFIX}recent"
+    stale.write_bytes(bytes(100))
+    recent.write_bytes(bytes(100))
+    os.utime(stale, (0, 0))
+
+    cache.put(ObjectLocation("key"), "e", memoryview(bytes(100)))
+
+    assert not stale.exists()
+    # May still be being written by another process.
+    assert recent.exists()
+
+
+def test_retrieve_with_disk_cache(tmp_path, mocker, subtests):
+    """Test that objects are read from the disk cache before s3."""
+    cache = DiskCache(DiskCacheConfig(directory=str(tmp_path)))
+    location = ObjectLocation("key")
+    data = object_to_stream({"a": 1}, codec="json").getvalue()
+    mock_download = mocker.patch(
+        "s3os.api.download_object_with_info",
+        side_effect=lambda *args, **kwargs: (
+            io.BytesIO(data),
+            ObjectInfo(size=len(data), etag='"abc"'),
+        ),
+    )
+
+    with subtests.test("Downloaded objects are cached."):
+        assert retrieve_with_info(location, disk_cache=cache)[0] == {"a": 1}
+        assert cache.get(location) == (data, '"abc"')
+
+    with subtests.test("Cached objects are not downloaded again."):
+        mock_download.reset_mock()
+        obj, info = retrieve_with_info(
+            location, disk_cache=cache, revalidate_disk_cache=False
+        )
+        assert obj == {"a": 1}
+        assert info == ObjectInfo(size=len(data), etag='"abc"')
+        mock_download.assert_not_called()
+
+    with subtests.test("Cached objects are revalidated by their ETag."):
+        mock_download.side_effect = ObjectNotModified(location)
+        assert retrieve_with_info(location, disk_cache=cache)[0] == {"a": 1}
+        mock_download.assert_called_once_with(location, if_none_match='"abc"')
+
+
+def test_store_with_disk_cache(tmp_path, mocker):
+    """Test that stored objects are cached if their ETag is known."""
+    cache = DiskCache(DiskCacheConfig(directory=str(tmp_path)))
+    mocker.patch("s3os.api.upload_object", return_value='"abc"')
+
+    store(
+        ObjectLocation("key"),
+        b"data",
+        check_bucket=False,
+        codec="bytes",
+        disk_cache=cache,
+    )
+
+    data, etag = cache.get(ObjectLocation("key"))  # type: ignore
+    assert etag == '"abc"'
+    assert bytes(data).endswith(b"data")
+
+
+def test_disk_cache_memory_maps_large_objects(tmp_path, mocker):
+    """Test that large cached objects are memory-mapped rather than read."""
+    mocker.patch("s3os.disk_cache.MMAP_MIN_SIZE", 100)
+    cache = DiskCache(DiskCacheConfig(directory=str(tmp_path)))
+    location = ObjectLocation("key")
+
+    cache.put(location, '"abc"', b"header", memoryview(bytes(100)))
+
+    data, etag = cache.get(location)  # type: ignore
+    assert isinstance(data, memoryview)
+    assert data.readonly
+    assert data == b"header" + bytes(100)
+    assert etag == '"abc"'
+    # The data starts at an aligned offset into the mapped file.
+    assert os.path.getsize(cache._path(location)) == PAYLOAD_ALIGNMENT + 106
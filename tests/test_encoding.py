@@ -1,8 +1,27 @@
 """Test encoding methods used to store/retrieve objects."""
 
+import io
 import pytest
 
-from s3os.encoding import object_from_yaml_stream, object_to_yaml_stream
+from s3os.compression import CompressionConfig, available_compressors
+from s3os.encoding import (
+    HEADER_MAGIC,
+    PAYLOAD_ALIGNMENT,
+    Codec,
+    CodecNotAllowedError,
+    available_codecs,
+    encode_header,
+    get_codec,
+    object_from_buffer,
+    object_from_file,
+    object_from_stream,
+    object_from_yaml_stream,
+    object_to_file,
+    object_to_stream,
+    object_to_yaml_stream,
+    register_codec,
+    split_header,
+)
 
 
 @pytest.mark.parametrize(
@@ -11,3 +30,209 @@ from s3os.encoding import object_from_yaml_stream, object_to_yaml_stream
 def test_yaml_to_stream_conversion(obj):
     """Test that a variety of objects can be round-trip translated to/from YAML."""
     assert object_from_yaml_stream(object_to_yaml_stream(obj)) == obj
+
+
+@pytest.mark.parametrize("codec", ["yaml", "json", "pickle", "msgpack"])
+@pytest.mark.parametrize(
+    "obj", ["asdf", [1, 2, 3], {"a": [1, {"b": None}]}, 5, 1.5],
+)
+def test_codec_round_trip(codec, obj):
+    """Test that objects round trip through each codec without being told the codec."""
+    if codec not in available_codecs():
+        pytest.skip(f"{codec} is not installed.")
+    stream = object_to_stream(obj, codec=codec)
+    assert object_from_stream(stream, allowed_codecs=[codec]) == obj
+
+
+def test_bytes_codec():
+    """Test that the bytes codec stores bytes-like objects as they are."""
+    stream = object_to_stream(bytearray(b"\x00\x01raw"), codec="bytes")
+    assert stream.getvalue().endswith(b"\x00\x01raw")
+    assert object_from_stream(stream) == b"\x00\x01raw"
+
+    with pytest.raises(TypeError):
+        object_to_stream("not bytes", codec="bytes")
+
+
+def test_headers(subtests):
+    """Test the header recording how objects are encoded."""
+    with subtests.test("YAML objects are stored without a header."):
+        stream = object_to_stream({"a": 1})
+        assert stream.getvalue() == object_to_yaml_stream({"a": 1}).getvalue()
+
+    with subtests.test("Other codecs are recorded in a header."):
+        stream = object_to_stream({"a": 1}, codec="json")
+        assert stream.getvalue().startswith(HEADER_MAGIC)
+        assert split_header(stream.getvalue()) == ({"codec": "json"}, b'{"a":1}')
+
+    with subtests.test("Data without a header is YAML."):
+        assert split_header(b"a: 1\n") == ({"codec": "yaml"}, b"a: 1\n")
+
+    with subtests.test("Header fields round trip."):
+        fields = {"codec": "pickle", "other": "x=y"}
+        assert split_header(encode_header(fields) + b"payload") == (fields, b"payload")
+
+    with subtests.test("Legacy YAML objects can be read."):
+        assert object_from_stream(io.BytesIO(b"- 1\n- 2\n")) == [1, 2]
+
+
+def test_allowed_codecs(subtests):
+    """Test that objects are only decoded with codecs that are allowed."""
+    pickled = object_to_stream({"a": 1}, codec="pickle").getvalue()
+
+    with subtests.test("Pickled objects are refused by default."):
+        with pytest.raises(CodecNotAllowedError):
+            object_from_buffer(pickled)
+        with pytest.raises(CodecNotAllowedError):
+            object_from_file(io.BytesIO(pickled))
+
+    with subtests.test("Compressed pickled objects are refused before decompressing."):
+        compressed = object_to_stream(
+            {"a": 1}, codec="pickle", compression=CompressionConfig(min_size=0)
+        )
+        with pytest.raises(CodecNotAllowedError):
+            object_from_stream(compressed)
+
+    with subtests.test("Pickled objects are decoded if pickle is allowed."):
+        assert object_from_buffer(pickled, allowed_codecs=["pickle"]) == {"a": 1}
+        assert object_from_file(io.BytesIO(pickled), allowed_codecs={"pickle"}) == {
+            "a": 1
+        }
+
+    with subtests.test("Only the codecs given are allowed."):
+        with pytest.raises(CodecNotAllowedError):
+            object_from_buffer(b"a: 1\n", allowed_codecs=["json"])
+
+
+def test_codec_registry(subtests):
+    """Test registration and lookup of codecs."""
+    with subtests.test("Unknown codecs are rejected."):
+        with pytest.raises(ValueError):
+            get_codec("unknown")
+        with pytest.raises(ValueError):
+            object_to_stream(1, codec="unknown")
+
+    with subtests.test("Custom codecs can be registered."):
+        register_codec(Codec("upper", str.encode, lambda data: data.decode().lower()))
+        assert object_from_stream(object_to_stream("abc", codec="upper")) == "abc"
+
+    with subtests.test("Codec IDs must be simple names."):
+        with pytest.raises(ValueError):
+            register_codec(Codec("a=b", str.encode, bytes.decode))
+
+
+@pytest.mark.parametrize("codec", ["yaml", "json", "pickle", "msgpack"])
+@pytest.mark.parametrize("compression", [None, "zlib", "gzip", "zstd", "lz4"])
+def test_file_round_trip(codec, compression, subtests):
+    """Test that objects written incrementally can be read by either decoder."""
+    if codec not in available_codecs():
+        pytest.skip(f"{codec} is not installed.")
+    if compression is not None and compression not in available_compressors():
+        pytest.skip(f"{compression} is not installed.")
+    config = None if compression is None else CompressionConfig(compression)
+    obj = {"values": [{"name": "repeated", "value": i % 10} for i in range(500)]}
+
+    file = io.BytesIO()
+    object_to_file(obj, file, codec=codec, compression=config)
+
+    with subtests.test("Written objects are read incrementally."):
+        file.seek(0)
+        assert object_from_file(file, allowed_codecs=[codec]) == obj
+
+    with subtests.test("Written objects are read all at once."):
+        file.seek(0)
+        assert object_from_stream(file, allowed_codecs=[codec]) == obj
+
+    with subtests.test("Objects encoded all at once are read incrementally."):
+        stream = object_to_stream(obj, codec=codec, compression=config)
+        assert object_from_file(stream, allowed_codecs=[codec]) == obj  # type: ignore
+
+
+def test_file_headers():
+    """Test that incrementally written objects have the same headers."""
+    file = io.BytesIO()
+    object_to_file({"a": 1}, file)
+    assert file.getvalue() == object_to_stream({"a": 1}).getvalue()
+
+    file = io.BytesIO()
+    object_to_file(b"raw", file, codec="bytes")
+    assert file.getvalue() == object_to_stream(b"raw", codec="bytes").getvalue()
+
+
+def test_bytes_codec_is_zero_copy():
+    """Test that bytes-like objects are uploaded from their own memory."""
+    data = bytearray(b"raw")
+    stream = object_to_stream(data, codec="bytes")
+    data[0:1] = b"R"
+    assert stream.getvalue().endswith(b"Raw")
+
+
+@pytest.mark.parametrize("shape", [(), (0,), (5,), (3, 4), (2, 3, 4)])
+@pytest.mark.parametrize("dtype", ["float64", ">i4", "uint8", "bool", "complex64"])
+def test_ndarray_codec_round_trip(shape, dtype):
+    """Test that arrays keep their dtype and shape."""
+    numpy = pytest.importorskip("numpy")
+    array = numpy.arange(int(numpy.prod(shape))).astype(dtype).reshape(shape)
+
+    result = object_from_stream(object_to_stream(array, codec="ndarray"))
+
+    assert result.dtype == array.dtype
+    assert result.shape == array.shape
+    assert numpy.array_equal(result, array)
+
+
+def test_ndarray_codec(subtests):
+    """Test that arrays are stored and read without copying their data."""
+    numpy = pytest.importorskip("numpy")
+    array = numpy.arange(12, dtype="float32").reshape(3, 4)
+
+    stream = object_to_stream(array, codec="ndarray")
+
+    with subtests.test("Dtype and shape are recorded in the header."):
+        fields, payload = split_header(stream.getvalue())
+        assert fields == {"codec": "ndarray", "dtype": "<f4", "shape": "3,4"}
+        assert payload == array.tobytes()
+
+    with subtests.test("Arrays are uploaded from their own memory."):
+        assert numpy.shares_memory(numpy.asarray(stream.buffers[-1]), array)
+
+    with subtests.test("Arrays are decoded as views of the downloaded data."):
+        data = bytearray(stream.getvalue())
+        result = object_from_buffer(data)
+        assert numpy.array_equal(result, array)
+        assert numpy.shares_memory(result, numpy.frombuffer(data, dtype="uint8"))
+
+    with subtests.test("Decoded arrays are aligned."):
+        for shape in [(3,), (3, 4), (300, 4000)]:
+            stream = object_to_stream(numpy.zeros(shape), codec="ndarray")
+            assert len(stream.buffers[0]) % PAYLOAD_ALIGNMENT == 0
+            file = io.BytesIO()
+            object_to_file(numpy.zeros(shape), file, codec="ndarray")
+            assert file.getvalue() == stream.getvalue()
+            assert object_from_buffer(bytearray(stream.getvalue())).flags.aligned
+
+    with subtests.test("Unaligned arrays can be read."):
+        fields, payload = split_header(stream.getvalue())
+        result = object_from_buffer(encode_header(fields) + bytes(payload))
+        assert numpy.array_equal(result, numpy.zeros((300, 4000)))
+
+    with subtests.test("Non-contiguous arrays are stored."):
+        column = array[:, 1]
+        assert numpy.array_equal(
+            object_from_stream(object_to_stream(column, codec="ndarray")), column
+        )
+
+    with subtests.test("Arrays can be compressed and streamed."):
+        compression = CompressionConfig(min_size=0)
+        stream = object_to_stream(array, codec="ndarray", compression=compression)
+        assert numpy.array_equal(object_from_stream(stream), array)
+        file = io.BytesIO()
+        object_to_file(array, file, codec="ndarray", compression=compression)
+        file.seek(0)
+        assert numpy.array_equal(object_from_file(file), array)
+
+    with subtests.test("Arrays of python objects are rejected."):
+        with pytest.raises(TypeError):
+            object_to_stream(numpy.array([{}, []], dtype=object), codec="ndarray")
+        with pytest.raises(TypeError):
+            object_to_stream([1, 2], codec="ndarray")
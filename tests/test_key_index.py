@@ -0,0 +1,28 @@
+"""Tests for the index of keys stored under an S3Dict."""
+
+from s3os.key_index import KeyIndex
+
+
+def test_key_index(mocker, subtests):
+    """Test that keys are kept sorted and unique."""
+    mock_time = mocker.patch("s3os.key_index.time.monotonic", return_value=100)
+    index = KeyIndex(["b", "c", "a", "b"])
+
+    with subtests.test("Keys are sorted and unique."):
+        assert list(index) == ["a", "b", "c"]
+        assert len(index) == 3
+        assert "b" in index
+        assert "d" not in index
+
+    with subtests.test("Keys can be added and removed."):
+        index.add("bb")
+        index.add("a")
+        index.discard("c")
+        index.discard("missing")
+        assert list(index) == ["a", "b", "bb"]
+
+    with subtests.test("The index expires after the TTL."):
+        assert not index.is_expired(10)
+        assert not index.is_expired(None)
+        mock_time.return_value = 110
+        assert index.is_expired(10)
@@ -0,0 +1,215 @@
+"""Tests for the metrics and tracing of s3os operations."""
+
+from typing import List
+
+import pytest
+
+from mock import MagicMock
+
+from s3os.api import retrieve, store
+from s3os.clients import _record_retries
+from s3os.metrics import (
+    Histogram,
+    MetricsRegistry,
+    Span,
+    TraceHook,
+    add_trace_hook,
+    enable_metrics,
+    get_metrics_registry,
+    operation,
+    phase,
+    remove_trace_hook,
+)
+from s3os.s3_dict import S3Dict, S3DictConfig
+from s3os.s3_wrapper import BucketLocation, ObjectLocation
+
+
+class RecordingHook(TraceHook):
+    """Trace hook that keeps the spans it is given."""
+
+    def __init__(self) -> None:
+        """Create a new RecordingHook."""
+        self.started: List[Span] = []
+        self.ended: List[Span] = []
+
+    def on_start(self, span: Span) -> None:
+        """Keep the started span."""
+        self.started.append(span)
+
+    def on_end(self, span: Span) -> None:
+        """Keep the ended span."""
+        self.ended.append(span)
+
+
+@pytest.fixture
+def registry():
+    """Enable metrics for the duration of a test, and return the empty registry."""
+    get_metrics_registry().reset()
+    enable_metrics()
+    yield get_metrics_registry()
+    enable_metrics(False)
+    get_metrics_registry().reset()
+
+
+@pytest.fixture
+def hook():
+    """Add a RecordingHook for the duration of a test."""
+    hook = RecordingHook()
+    add_trace_hook(hook)
+    yield hook
+    remove_trace_hook(hook)
+
+
+def test_histogram():
+    """Test that histograms count values in buckets."""
+    histogram = Histogram(bounds=(1, 10))
+    assert histogram.quantile(0.5) == 0
+    for value in (0.5, 1, 5, 100):
+        histogram.observe(value)
+
+    assert histogram.counts == [2, 1, 1]
+    assert (histogram.count, histogram.sum) == (4, 106.5)
+    assert histogram.quantile(0.5) == 1
+    assert histogram.quantile(0.75) == 10
+    assert histogram.quantile(1) == float("inf")
+
+    with pytest.raises(ValueError):
+        Histogram(bounds=(1, 10), counts=[0])
+
+
+def test_registry(subtests):
+    """Test that the registry records, reports and exports metrics."""
+    registry = MetricsRegistry()
+    registry.inc("requests_total", operation="get")
+    registry.inc("requests_total", 2, operation="get")
+    registry.observe("latency_seconds", 0.002, operation="get")
+
+    with subtests.test("Values can be read back."):
+        assert registry.counter("requests_total", operation="get") == 3
+        assert registry.counter("requests_total", operation="put") == 0
+        assert registry.histogram("latency_seconds", operation="get").count == 1
+
+    with subtests.test("Snapshots have every value."):
+        snapshot = registry.snapshot()
+        assert snapshot["requests_total"] == [
+            {"labels": {"operation": "get"}, "value": 3}
+        ]
+        assert snapshot["latency_seconds"][0]["count"] == 1
+
+    with subtests.test("Values are exported in the Prometheus format."):
+        text = registry.to_prometheus()
+        assert "# TYPE requests_total counter" in text
+        assert 'requests_total{operation="get"} 3' in text
+        assert 'latency_seconds_bucket{operation="get",le="0.0025"} 1' in text
+        assert 'latency_seconds_bucket{operation="get",le="+Inf"} 1' in text
+        assert 'latency_seconds_count{operation="get"} 1' in text
+
+    with subtests.test("Values can be reset."):
+        registry.reset()
+        assert registry.snapshot() == {}
+
+
+def test_disabled():
+    """Test that nothing is measured while metrics are disabled and there are no hooks."""
+    with operation("test") as span:
+        assert span is None
+        with phase("encode"):
+            pass
+    store(ObjectLocation("key", bucket=BucketLocation(backend="memory")), 1)
+    assert get_metrics_registry().snapshot() == {}
+
+
+def test_operations(registry, subtests):
+    """Test that operations are recorded with their phases and bytes transferred."""
+    location = ObjectLocation("key", bucket=BucketLocation(backend="memory"))
+
+    with subtests.test("Stores are measured."):
+        info = store(location, list(range(100)), codec="json")
+        assert registry.counter(
+            "s3os_operations_total", operation="store", outcome="ok"
+        )
+        assert registry.histogram("s3os_operation_seconds", operation="store").count
+        for phase_name in ("encode", "network"):
+            assert registry.histogram(
+                "s3os_phase_seconds", operation="store", phase=phase_name
+            ).count
+        assert registry.counter("s3os_bytes_sent_total", operation="store") == info.size
+        # Also measured as an operation of its own, but its bytes only count once.
+        assert registry.counter(
+            "s3os_operations_total", operation="upload_object", outcome="ok"
+        )
+        assert registry.counter("s3os_bytes_sent_total", operation="upload_object") == 0
+
+    with subtests.test("Retrieves are measured."):
+        retrieve(location)
+        for phase_name in ("network", "decode"):
+            assert registry.histogram(
+                "s3os_phase_seconds", operation="retrieve", phase=phase_name
+            ).count
+        assert (
+            registry.counter("s3os_bytes_received_total", operation="retrieve")
+            == info.size
+        )
+
+    with subtests.test("Failures are recorded by their outcome."):
+        with pytest.raises(KeyError):
+            retrieve(ObjectLocation("missing", bucket=location.bucket))
+        assert registry.counter(
+            "s3os_operations_total", operation="retrieve", outcome="missing"
+        )
+
+
+def test_trace_hooks(hook):
+    """Test that hooks are given the span of each operation."""
+    location = ObjectLocation("key", bucket=BucketLocation(backend="memory"))
+    store(location, b"data", codec="bytes")
+
+    assert [span.operation for span in hook.started] == ["store", "upload_object"]
+    assert [span.operation for span in hook.ended] == ["upload_object", "store"]
+    upload, outer = hook.ended
+    assert upload.parent is outer
+    assert outer.attributes == {"bucket": "s3os", "key": "key"}
+    assert outer.outcome == "ok"
+    assert outer.bytes_sent == upload.bytes_sent > 4
+    assert outer.duration >= upload.duration > 0
+    assert outer.phases["network"] == upload.phases["network"]
+
+
+def test_failing_trace_hook():
+    """Test that operations still succeed if a hook fails."""
+    failing_hook = MagicMock(spec=TraceHook)
+    failing_hook.on_start.side_effect = RuntimeError
+    add_trace_hook(failing_hook)
+    try:
+        store(ObjectLocation("key", bucket=BucketLocation(backend="memory")), 1)
+    finally:
+        remove_trace_hook(failing_hook)
+    assert failing_hook.on_end.called
+
+    with pytest.raises(TypeError):
+        add_trace_hook(object())  # type: ignore
+
+
+def test_retries(registry, hook):
+    """Test that retries reported by botocore are counted."""
+    model = MagicMock()
+    model.name = "PutObject"
+    with operation("test"):
+        _record_retries(parsed={"ResponseMetadata": {"RetryAttempts": 2}}, model=model)
+        _record_retries(parsed={"ResponseMetadata": {"RetryAttempts": 0}}, model=model)
+
+    assert registry.counter("s3os_retries_total", request="PutObject") == 2
+    assert hook.ended[0].retries == 2
+
+
+def test_cache_events(registry):
+    """Test that S3Dict cache hits and misses are counted."""
+    s3dict = S3Dict({"a": 1}, _config=S3DictConfig(id="metrics", backend="memory"))
+    s3dict["a"]
+    s3dict.data.pop("a")
+    s3dict["a"]
+
+    assert registry.counter("s3os_cache_events_total", cache="memory", event="hit") >= 1
+    assert (
+        registry.counter("s3os_cache_events_total", cache="memory", event="miss") >= 1
+    )
@@ -1,11 +1,28 @@
 """Tests for the S3Dict object."""
 
+import gc
 import pytest
+import threading
+import weakref
 
 from mock import MagicMock, call
 
-from s3os.s3_dict import S3Dict, S3DictConfig
-from s3os.s3_wrapper import ObjectLocation
+from dataclasses import replace
+
+from s3os.api import BulkOperationError, BulkResult, retrieve_many
+from s3os.backends import get_backend
+from s3os.cache import CachePolicy, CacheStats
+from s3os.disk_cache import DiskCacheConfig
+from s3os.encoding import CodecNotAllowedError
+from s3os.s3_dict import RefreshSummary, S3Dict, S3DictConfig
+from s3os.segments import SegmentPolicy
+from s3os.s3_wrapper import (
+    ObjectInfo,
+    ObjectLocation,
+    ObjectNotModified,
+    generate_items_in_bucket,
+)
+from s3os.write_buffer import FlushPolicy
 
 
 @pytest.fixture
@@ -14,6 +31,16 @@ def mock_s3_api(mocker):
     mocked_store = mocker.patch("s3os.s3_dict.store")
     mocked_retrieve = mocker.patch("s3os.s3_dict.retrieve")
     mocked_delete = mocker.patch("s3os.s3_dict.delete")
+    mocked_store.return_value = ObjectInfo(size=1)
+
+    def retrieve_with_info(location, if_none_match=None, **kwargs):
+        return mocked_retrieve(location), ObjectInfo(size=1)
+
+    mocker.patch("s3os.s3_dict.retrieve_with_info", side_effect=retrieve_with_info)
+    # The bulk API functions use the same mocks for each individual object.
+    mocker.patch("s3os.api.store", mocked_store)
+    mocker.patch("s3os.api.retrieve", mocked_retrieve)
+    mocker.patch("s3os.api.retrieve_with_info", side_effect=retrieve_with_info)
     return mocked_store, mocked_retrieve, mocked_delete
 
 
@@ -45,6 +72,28 @@ def test_s3_dict_config(subtests):
         assert c.s3_prefix == "test/"
 
 
+def test_s3_dict_codec(mock_s3_api):
+    """Test that the configured codec is used to store values."""
+    m_store, m_retrieve, m_delete = mock_s3_api
+    dic = S3Dict(_config=S3DictConfig(id="s3os_test", codec="json"))
+
+    dic["a"] = 1
+    location = m_store.call_args[0][0]
+    assert location == ObjectLocation("s3os_test/a")
+    assert location.codec == "json"
+
+
+def test_s3_dict_check_bucket(mock_s3_api):
+    """Test that the bucket check can be skipped for externally managed buckets."""
+    m_store, m_retrieve, m_delete = mock_s3_api
+    dic = S3Dict(_config=S3DictConfig(id="s3os_test", check_bucket=False))
+
+    dic["a"] = 1
+    m_store.assert_called_once_with(
+        ObjectLocation("s3os_test/a"), 1, check_bucket=False, disk_cache=None
+    )
+
+
 def test_s3_dict_init_no_items(subtests, mock_s3_api):
     """Tests for creating an S3Dict without initial items."""
     m_store, m_retrieve, m_delete = mock_s3_api
@@ -89,10 +138,14 @@ def test_s3_dict_init_with_items(subtests, mock_s3_api, init_items, use_cache):
             assert "b" not in dic.data
 
     with subtests.test("Items are uploaded to s3."):
+        # Initial items are stored concurrently with `store_many`.
+        store_options = dict(
+            check_bucket=True, codec=None, compression=None, disk_cache=None
+        )
         m_store.assert_has_calls(
             [
-                call(ObjectLocation("s3os_test/a"), 2),
-                call(ObjectLocation("s3os_test/b"), [1, 2]),
+                call(ObjectLocation("s3os_test/a"), 2, **store_options),
+                call(ObjectLocation("s3os_test/b"), [1, 2], **store_options),
             ],
             any_order=True,
         )
@@ -123,7 +176,9 @@ def test_setitem(subtests, mock_s3_api, use_cache):
     dic = S3Dict(_config=S3DictConfig(id="s3os_test", use_cache=use_cache))
 
     dic["set"] = 5
-    m_store.assert_has_calls([call(ObjectLocation("s3os_test/set"), 5)])
+    m_store.assert_has_calls(
+        [call(ObjectLocation("s3os_test/set"), 5, check_bucket=True, disk_cache=None)]
+    )
 
     # Check against the inner "data" dict
     if use_cache:
@@ -153,7 +208,9 @@ def test_getitem(subtests, mock_s3_api, use_cache):
     if use_cache:
         assert_no_calls(*mock_s3_api)
     else:
-        m_retrieve.assert_has_calls([call(ObjectLocation("s3os_test/get"))])
+        m_retrieve.assert_has_calls(
+            [call(ObjectLocation("s3os_test/get"), allowed_codecs=None)]
+        )
         assert_no_calls(m_store, m_delete)
 
 
@@ -186,7 +243,9 @@ def test_get_all_from_s3(subtests, mock_s3_api, mocker, use_cache):
     mock_generate_items_in_bucket = mocker.patch(
         "s3os.s3_dict.generate_items_in_bucket", return_value=location_gen,
     )
-    m_retrieve.side_effect = [str(i * i) for i in range(3)]
+    # Values are downloaded concurrently, so derive each value from its location
+    # rather than relying on the order of the calls.
+    m_retrieve.side_effect = lambda location: str(int(location.key) ** 2)
 
     s3dict = S3Dict(_config=S3DictConfig(id="s3os_test", use_cache=use_cache))
 
@@ -197,6 +256,177 @@ def test_get_all_from_s3(subtests, mock_s3_api, mocker, use_cache):
     mock_generate_items_in_bucket.assert_called_once()
     assert_no_calls(m_store, m_delete)
 
+    if use_cache:
+        assert s3dict.data == normal_dict
+    else:
+        assert len(s3dict.data) == 0
+
+
+@pytest.mark.parametrize("ordered", [True, False])
+def test_iter_items_from_s3(subtests, mock_s3_api, mocker, ordered):
+    """Test the `iter_items_from_s3` method."""
+    m_store, m_retrieve, m_delete = mock_s3_api
+    mocker.patch(
+        "s3os.s3_dict.generate_items_in_bucket",
+        return_value=(ObjectLocation(f"s3os_test/{i}") for i in range(50)),
+    )
+
+    def retrieve(location):
+        if location.key == "s3os_test/7":
+            raise KeyError("Deleted since being listed.")
+        return int(location.key.split("/")[1])
+
+    m_retrieve.side_effect = retrieve
+    s3dict = S3Dict(_config=S3DictConfig(id="s3os_test"))
+
+    items = list(s3dict.iter_items_from_s3(max_in_flight=4, ordered=ordered))
+
+    with subtests.test("All items are downloaded."):
+        assert dict(items) == {str(i): i for i in range(50) if i != 7}
+        assert len(items) == 49
+
+    with subtests.test("Ordered items are yielded in listing order."):
+        if ordered:
+            assert items == [(str(i), i) for i in range(50) if i != 7]
+
+
+def test_iter_items_from_s3_is_lazy(mock_s3_api, mocker):
+    """Test that `iter_items_from_s3` only downloads up to `max_in_flight` items ahead."""
+    m_store, m_retrieve, m_delete = mock_s3_api
+    mocker.patch(
+        "s3os.s3_dict.generate_items_in_bucket",
+        return_value=(ObjectLocation(f"s3os_test/{i}") for i in range(100)),
+    )
+    m_retrieve.return_value = 1
+    s3dict = S3Dict(_config=S3DictConfig(id="s3os_test"))
+
+    items = s3dict.iter_items_from_s3(max_in_flight=4, ordered=True)
+    next(items)
+    items.close()
+
+    assert m_retrieve.call_count <= 5
+
+
+@pytest.mark.parametrize("use_cache", [True, False])
+def test_update_with_errors(mock_s3_api, use_cache):
+    """Test that `update` stores every item and only caches those that succeeded."""
+    m_store, m_retrieve, m_delete = mock_s3_api
+
+    def store(location, value, **kwargs):
+        if value == "bad":
+            raise ValueError("Upload failed.")
+        return ObjectInfo(size=1)
+
+    m_store.side_effect = store
+    dic = S3Dict(_config=S3DictConfig(id="s3os_test", use_cache=use_cache))
+
+    with pytest.raises(BulkOperationError) as err:
+        dic.update({str(i): i for i in range(20)}, bad="bad")
+
+    assert m_store.call_count == 21
+    assert list(err.value.result.errors) == [ObjectLocation("s3os_test/bad")]
+    if use_cache:
+        assert dic.data == {str(i): i for i in range(20)}
+    else:
+        assert len(dic.data) == 0
+
+
+@pytest.mark.parametrize("use_cache", [True, False])
+def test_get_many(mock_s3_api, use_cache):
+    """Test that `get_many` downloads the items that are not cached."""
+    m_store, m_retrieve, m_delete = mock_s3_api
+    dic = S3Dict(
+        {"cached": 0}, _config=S3DictConfig(id="s3os_test", use_cache=use_cache)
+    )
+
+    def retrieve(location):
+        if location.key == "s3os_test/missing":
+            raise KeyError(location)
+        if location.key == "s3os_test/broken":
+            raise ValueError("Download failed.")
+        return location.key
+
+    m_retrieve.side_effect = retrieve
+
+    found = dic.get_many(["cached", "a", "b", "missing"])
+
+    expected = {"a": "s3os_test/a", "b": "s3os_test/b"}
+    if use_cache:
+        assert found == {"cached": 0, **expected}
+        assert m_retrieve.call_count == 3
+    else:
+        assert found == {"cached": "s3os_test/cached", **expected}
+        assert m_retrieve.call_count == 4
+
+    with pytest.raises(BulkOperationError):
+        dic.get_many(["a", "broken"])
+
+
+def test_cache_policy(mock_s3_api):
+    """Test that evicted values are downloaded again, and lookups are counted."""
+    m_store, m_retrieve, m_delete = mock_s3_api
+    m_retrieve.side_effect = lambda location: location.key
+    dic = S3Dict(
+        {"a": 0, "b": 1},
+        _config=S3DictConfig(id="s3os_test", cache_policy=CachePolicy(max_entries=1)),
+    )
+    assert dic.data == {"b": 1}
+
+    assert dic["b"] == 1
+    assert dic["a"] == "s3os_test/a"
+    m_retrieve.assert_called_once_with(ObjectLocation("s3os_test/a"))
+    assert dic.data == {"a": "s3os_test/a"}
+    assert dic.cache_stats == CacheStats(hits=1, misses=1, evictions=2)
+    # Eviction only affects the cache, not s3.
+    assert_no_calls(m_delete)
+
+
+def test_cache_revalidation(mock_s3_api, mocker):
+    """Test that stale values are only downloaded again if they have changed in s3."""
+    m_store, m_retrieve, m_delete = mock_s3_api
+    m_store.return_value = ObjectInfo(size=1, etag="v1")
+    etags = {"a": "v1"}
+
+    def retrieve_with_info(location, if_none_match=None, **kwargs):
+        etag = etags[location.key.split("/")[-1]]
+        if if_none_match == etag:
+            raise ObjectNotModified(location)
+        return f"{location.key}@{etag}", ObjectInfo(size=1, etag=etag)
+
+    m_retrieve_with_info = mocker.patch(
+        "s3os.s3_dict.retrieve_with_info", side_effect=retrieve_with_info
+    )
+    dic = S3Dict(
+        {"a": 0},
+        _config=S3DictConfig(
+            id="s3os_test", cache_policy=CachePolicy(revalidate_after=0)
+        ),
+    )
+
+    # Unchanged, so the cached value is reused.
+    assert dic["a"] == 0
+    m_retrieve_with_info.assert_called_once_with(
+        ObjectLocation("s3os_test/a"), if_none_match="v1", allowed_codecs=None
+    )
+    assert dic.cache_stats.revalidations == 1
+
+    # Changed by another process, so it is downloaded again.
+    etags["a"] = "v2"
+    assert dic["a"] == "s3os_test/a@v2"
+    assert dic.data.etag("a") == "v2"
+
+    # `get_many` revalidates stale values, and downloads the rest in bulk.
+    m_retrieve.side_effect = lambda location: location.key
+    m_retrieve_many = mocker.patch("s3os.s3_dict.retrieve_many", wraps=retrieve_many)
+    m_retrieve_with_info.reset_mock()
+    assert dic.get_many(["a", "b"]) == {"a": "s3os_test/a@v2", "b": "s3os_test/b"}
+    m_retrieve_with_info.assert_called_once_with(
+        ObjectLocation("s3os_test/a"), if_none_match="v2", allowed_codecs=None
+    )
+    m_retrieve_many.assert_called_once()
+    m_retrieve.assert_called_once_with(ObjectLocation("s3os_test/b"))
+    assert dic.data.peek("b") == "s3os_test/b"
+
 
 def test_del(mock_s3_api):
     """Test that __del__ does not delete items from s3."""
@@ -213,20 +443,469 @@ def test_del(mock_s3_api):
 def test_clear(mocker, mock_s3_api):
     """Test the `clear` method."""
     m_store, m_retrieve, m_delete = mock_s3_api
+    locations = [ObjectLocation(f"s3os_test/{str(i)}") for i in range(3)]
     mock_generate_items_in_bucket = mocker.patch(
-        "s3os.s3_dict.generate_items_in_bucket",
-        return_value=(ObjectLocation(f"s3os_test/{str(i)}") for i in range(3)),
+        "s3os.s3_dict.generate_items_in_bucket", return_value=iter(locations),
     )
-    s3dict = S3Dict(_config=S3DictConfig(id="s3os_test"))
+    mock_delete_many = mocker.patch(
+        "s3os.s3_dict.delete_many",
+        return_value=BulkResult(results={location: None for location in locations}),
+    )
+    s3dict = S3Dict({"0": 0, "1": 1}, _config=S3DictConfig(id="s3os_test"))
 
     s3dict.clear()
 
-    m_delete.assert_has_calls(
-        [
-            call(ObjectLocation("s3os_test/0")),
-            call(ObjectLocation("s3os_test/1")),
-            call(ObjectLocation("s3os_test/2")),
-        ]
+    mock_delete_many.assert_called_once()
+    assert list(mock_delete_many.call_args[0][0]) == locations
+    mock_generate_items_in_bucket.assert_called_once()
+    assert len(s3dict.data) == 0
+    assert_no_calls(m_retrieve, m_delete)
+
+
+def test_clear_with_errors(mocker, mock_s3_api):
+    """Test that `clear` keeps values it failed to delete in the cache."""
+    mocker.patch("s3os.s3_dict.generate_items_in_bucket")
+    mocker.patch(
+        "s3os.s3_dict.delete_many",
+        return_value=BulkResult(
+            results={ObjectLocation("s3os_test/0"): None},
+            errors={ObjectLocation("s3os_test/1"): ValueError("AccessDenied")},
+        ),
+    )
+    s3dict = S3Dict({"0": 0, "1": 1}, _config=S3DictConfig(id="s3os_test"))
+
+    with pytest.raises(BulkOperationError):
+        s3dict.clear()
+
+    assert s3dict.data == {"1": 1}
+
+
+@pytest.mark.parametrize("use_cache", [True, False])
+def test_deferred_writes(mocker, mock_s3_api, use_cache):
+    """Test that deferred writes are collapsed, visible to reads, and flushed together."""
+    m_store, m_retrieve, m_delete = mock_s3_api
+    m_delete_many = mocker.patch("s3os.s3_dict.delete_many", return_value=BulkResult())
+    config = S3DictConfig(id="s3os_test", use_cache=use_cache, write_mode="deferred")
+
+    with S3Dict(_config=config) as dic:
+        for i in range(100):
+            dic["a"] = i
+        dic["b"] = 1
+        del dic["b"]
+
+        assert dic["a"] == 99
+        with pytest.raises(KeyError):
+            dic["b"]
+        assert dic.get_many(["a", "b"]) == {"a": 99}
+        assert dic.pending_writes == 2
+        assert_no_calls(m_store, m_retrieve, m_delete)
+
+    m_store.assert_called_once_with(
+        ObjectLocation("s3os_test/a"),
+        99,
+        check_bucket=True,
+        codec=None,
+        compression=None,
+        disk_cache=None,
+    )
+    assert list(m_delete_many.call_args[0][0]) == [ObjectLocation("s3os_test/b")]
+    assert dic.pending_writes == 0
+
+
+def test_deferred_writes_count_towards_cache_limits(mock_s3_api):
+    """Test that values with deferred writes count towards the size of the cache."""
+    config = S3DictConfig(
+        id="s3os_test",
+        write_mode="deferred",
+        cache_policy=CachePolicy(max_bytes=2500),
+        flush_policy=FlushPolicy(max_pending=None),
     )
+    dic = S3Dict(_config=config)
+    for i in range(10):
+        dic[str(i)] = b"x" * 1000
+
+    assert dic.data.nbytes <= 2500
+    assert len(dic.data) == 2
+    # Values evicted from the cache are still read from the pending writes.
+    assert dic["0"] == b"x" * 1000
+    assert dic.pending_writes == 10
+
+
+def test_deferred_write_failures(mock_s3_api):
+    """Test that writes that fail to be flushed are kept to be retried."""
+    m_store, m_retrieve, m_delete = mock_s3_api
+    m_store.side_effect = ValueError("Upload failed.")
+    dic = S3Dict(_config=S3DictConfig(id="s3os_test", write_mode="deferred"))
+    dic.update(a=1, b=2)
+
+    with pytest.raises(BulkOperationError) as err:
+        dic.flush()
+    assert len(err.value.result.errors) == 2
+    assert dic.pending_writes == 2
+
+    m_store.side_effect = None
+    dic.flush()
+    assert m_store.call_count == 4
+    assert dic.pending_writes == 0
+
+
+def test_deferred_write_thresholds(mock_s3_api):
+    """Test that deferred writes are flushed once they pass a threshold."""
+    m_store, m_retrieve, m_delete = mock_s3_api
+    dic = S3Dict(
+        _config=S3DictConfig(
+            id="s3os_test",
+            write_mode="deferred",
+            flush_policy=FlushPolicy(max_pending=3),
+        )
+    )
+
+    dic.update(a=1, b=2)
+    assert_no_calls(m_store)
+    dic["c"] = 3
+    assert m_store.call_count == 3
+    assert dic.pending_writes == 0
+
+
+def test_deferred_writes_in_background(mock_s3_api):
+    """Test that deferred writes can be flushed by a background thread."""
+    m_store, m_retrieve, m_delete = mock_s3_api
+    flushed = threading.Event()
+    m_store.side_effect = lambda *args, **kwargs: flushed.set()
+    config = S3DictConfig(
+        id="s3os_test",
+        write_mode="deferred",
+        flush_policy=FlushPolicy(max_age=0.01, background=True),
+    )
+
+    with S3Dict(_config=config) as dic:
+        dic["a"] = 1
+        assert flushed.wait(timeout=5)
+
+    assert dic.pending_writes == 0
+    assert dic._flusher is None
+
+
+def test_background_flusher_stops_when_dict_is_collected(mock_s3_api):
+    """Test that the background flusher doesn't keep a dict that isn't closed alive."""
+    config = S3DictConfig(
+        id="s3os_test",
+        write_mode="deferred",
+        flush_policy=FlushPolicy(max_age=60, background=True),
+    )
+    dic = S3Dict(_config=config)
+    flusher = dic._flusher
+    ref = weakref.ref(dic)
+
+    del dic
+    gc.collect()
+
+    assert ref() is None
+    flusher.join(timeout=5)
+    assert not flusher.is_alive()
+
+
+def test_disk_cache(tmp_path, mocker):
+    """Test that a new dict reads values cached on disk by another, without s3."""
+    mocker.patch("s3os.api.ensure_bucket")
+    mocker.patch("s3os.api.upload_object", return_value='"abc"')
+    mock_download = mocker.patch("s3os.api.download_object_with_info")
+    config = S3DictConfig(
+        id="s3os_test", disk_cache=DiskCacheConfig(directory=str(tmp_path))
+    )
+
+    S3Dict({"a": [1, 2]}, _config=config)
+    dic = S3Dict(_config=config)
+
+    assert dic["a"] == [1, 2]
+    mock_download.assert_not_called()
+    assert dic.disk_cache_stats == CacheStats(hits=1)
+
+
+@pytest.mark.parametrize("key_index", [True, False])
+def test_key_operations(mocker, mock_s3_api, key_index):
+    """Test that key operations are answered from a listing, without downloading values."""
+    m_store, m_retrieve, m_delete = mock_s3_api
+    mock_time = mocker.patch("s3os.key_index.time.monotonic", return_value=100)
+    listed = ["b", "a"]
+    mock_generate_items_in_bucket = mocker.patch(
+        "s3os.s3_dict.generate_items_in_bucket",
+        side_effect=lambda *args, **kwargs: (
+            ObjectLocation(f"s3os_test/{key}") for key in listed
+        ),
+    )
+    mock_object_exists = mocker.patch("s3os.s3_dict.object_exists", return_value=True)
+    dic = S3Dict(
+        _config=S3DictConfig(id="s3os_test", listing_ttl=10, key_index=key_index)
+    )
+
+    # Before listing, `in` asks s3 about the single key.
+    assert "b" in dic
+    mock_object_exists.assert_called_once_with(ObjectLocation("s3os_test/b"))
+
+    assert list(dic) == ["a", "b"]
+    assert len(dic) == 2
+    assert "c" not in dic
+    assert list(dic.keys()) == ["a", "b"]
     mock_generate_items_in_bucket.assert_called_once()
-    assert_no_calls(m_store, m_retrieve)
+    mock_object_exists.assert_called_once()
+
+    # Writes through this dict are reflected without listing again.
+    dic["c"] = 3
+    del dic["a"]
+    assert list(dic) == ["b", "c"]
+
+    # The listing is only repeated after the TTL, unless the keys are indexed.
+    listed.append("d")
+    mock_time.return_value = 110
+    if key_index:
+        assert list(dic) == ["b", "c"]
+        mock_generate_items_in_bucket.assert_called_once()
+    else:
+        assert list(dic) == ["a", "b", "d"]
+        assert mock_generate_items_in_bucket.call_count == 2
+    assert_no_calls(m_retrieve)
+
+
+def test_prefetch(mock_s3_api, subtests):
+    """Test that prefetched values are downloaded in the background, only once."""
+    m_store, m_retrieve, m_delete = mock_s3_api
+    release = threading.Event()
+
+    def retrieve(location):
+        assert release.wait(5)
+        if location.key == "s3os_test/missing":
+            raise KeyError(location)
+        return location.key
+
+    m_retrieve.side_effect = retrieve
+    dic = S3Dict(_config=S3DictConfig(id="s3os_test"))
+
+    with subtests.test("Prefetching returns before the values are downloaded."):
+        dic.prefetch(["a", "b", "c", "missing"])
+        assert "a" not in dic.data
+
+    with subtests.test("Writes during a prefetch are not overwritten."):
+        dic["c"] = "written"
+
+    with subtests.test("Gets wait for the prefetches, rather than downloading again."):
+        threading.Timer(0.1, release.set).start()
+        assert dic["a"] == "s3os_test/a"
+        assert dic.get_many(["b", "c"]) == {
+            "b": "s3os_test/b",
+            "c": "written",
+        }
+        dic.close()
+        assert dic.data.snapshot() == {
+            "a": "s3os_test/a",
+            "b": "s3os_test/b",
+            "c": "written",
+        }
+        assert m_retrieve.call_count == 4
+
+    with subtests.test("Cached keys are not prefetched again."):
+        dic.prefetch(["a", "b"])
+        dic.close()
+        assert m_retrieve.call_count == 4
+
+    with subtests.test("Nothing is prefetched without a cache."):
+        dic = S3Dict(_config=S3DictConfig(id="s3os_test", use_cache=False))
+        dic.prefetch(["a"])
+        dic.close()
+        assert m_retrieve.call_count == 4
+
+
+def test_read_ahead(mocker, mock_s3_api):
+    """Test that iterating prefetches the values of the next keys."""
+    m_store, m_retrieve, m_delete = mock_s3_api
+    m_retrieve.side_effect = lambda location: location.key
+    mocker.patch(
+        "s3os.s3_dict.generate_items_in_bucket",
+        return_value=(ObjectLocation(f"s3os_test/{key}") for key in "abcde"),
+    )
+    dic = S3Dict(_config=S3DictConfig(id="s3os_test", read_ahead=2))
+    mock_prefetch = mocker.spy(dic, "prefetch")
+
+    keys = iter(dic)
+    assert next(keys) == "a"
+    assert [list(args[0]) for args, _ in mock_prefetch.call_args_list] == [
+        ["a", "b", "c"],
+        ["d"],
+    ]
+    assert dict(dic.items()) == {key: f"s3os_test/{key}" for key in "abcde"}
+    assert m_retrieve.call_count == 5
+
+    with pytest.raises(ValueError):
+        S3DictConfig(read_ahead=-1)
+
+
+@pytest.mark.parametrize("write_mode", ["immediate", "deferred"])
+def test_skip_unchanged(mocker, write_mode):
+    """Test that writes of values that are already stored are skipped."""
+    backend = get_backend("memory")
+    put = mocker.spy(backend, "put")
+    head = mocker.spy(backend, "head")
+    config = S3DictConfig(
+        id=f"skip_unchanged_{write_mode}",
+        backend="memory",
+        write_mode=write_mode,
+        skip_unchanged=True,
+    )
+
+    with S3Dict(_config=config) as s3dict:
+        s3dict["a"] = 1
+        s3dict.update({"b": 2, "c": 3})
+        s3dict.flush()
+        assert put.call_count == 3
+
+        # The hashes of the stored values are known from the cache.
+        head.reset_mock()
+        s3dict["a"] = 1
+        s3dict.update({"b": 2, "c": 4})
+        s3dict.flush()
+        assert put.call_count == 4
+        head.assert_not_called()
+
+    # Otherwise they are checked with a HEAD request.
+    uncached = S3Dict(_config=replace(config, use_cache=False, write_mode="immediate"))
+    uncached.update({"a": 1, "b": 2})
+    assert put.call_count == 4
+    assert head.call_count == 2
+    assert uncached.get_all_from_s3() == {"a": 1, "b": 2, "c": 4}
+    uncached.clear()
+
+
+def test_content_addressed(subtests):
+    """Test that each distinct value is stored once, and referred to by the keys."""
+    config = S3DictConfig(
+        id="content_addressed", backend="memory", content_addressed=True, codec="json"
+    )
+    s3dict = S3Dict(_config=config)
+
+    def stored_values() -> int:
+        return len(list(generate_items_in_bucket(config.bucket, config.blob_prefix)))
+
+    with subtests.test("Equal values are stored once."):
+        s3dict["a"] = [1, 2]
+        s3dict.update({"b": [1, 2], "c": [3]})
+        assert stored_values() == 2
+        assert list(s3dict) == ["a", "b", "c"]
+
+    with subtests.test("Values are read through the keys."):
+        assert S3Dict(_config=config)["a"] == [1, 2]
+        uncached = S3Dict(_config=replace(config, use_cache=False))
+        assert uncached["a"] == [1, 2]
+        assert uncached.get_many(["b", "c", "d"]) == {"b": [1, 2], "c": [3]}
+        assert uncached.get_all_from_s3() == {"a": [1, 2], "b": [1, 2], "c": [3]}
+
+    with subtests.test("Values no key refers to are deleted by compaction."):
+        s3dict["c"] = [1, 2]
+        assert s3dict.compact() == 1
+        assert stored_values() == 1
+        assert s3dict.compact() == 0
+        assert S3Dict(_config=config).get_all_from_s3()["c"] == [1, 2]
+
+    with subtests.test("Values are deleted by clearing the dict."):
+        s3dict.clear()
+        assert stored_values() == 0
+
+    with subtests.test("The packed layout can't be content addressed."):
+        with pytest.raises(ValueError):
+            S3DictConfig(content_addressed=True, layout="packed", write_mode="deferred")
+
+
+def test_allowed_codecs(subtests):
+    """Test that pickled values are only read if the config allows pickle."""
+    config = S3DictConfig(
+        id="allowed_codecs", backend="memory", use_cache=False, codec="pickle"
+    )
+    S3Dict({"a": 1}, _config=config)
+
+    with subtests.test("Pickled values are refused by default."):
+        with pytest.raises(CodecNotAllowedError):
+            S3Dict(_config=config)["a"]
+        with pytest.raises(CodecNotAllowedError):
+            S3Dict(_config=config).get_all_from_s3()
+
+    with subtests.test("Pickled values are read if pickle is allowed."):
+        s3dict = S3Dict(_config=replace(config, allowed_codecs=["pickle"]))
+        assert s3dict["a"] == 1
+        assert s3dict.get_all_from_s3() == {"a": 1}
+
+    s3dict.clear()
+
+
+def test_refresh(mocker, subtests):
+    """Test that refreshing the cache only downloads the values that changed in s3."""
+    config = S3DictConfig(id="refresh", backend="memory")
+    writer = S3Dict(
+        {f"key{i}": i for i in range(10)}, _config=replace(config, use_cache=False)
+    )
+    reader = S3Dict(_config=config)
+    get = mocker.spy(get_backend("memory"), "get")
+
+    with subtests.test("New values are downloaded."):
+        summary = reader.refresh()
+        assert summary == RefreshSummary(added=[f"key{i}" for i in range(10)])
+        assert get.call_count == 10
+        assert reader.as_dict == {f"key{i}": i for i in range(10)}
+
+    with subtests.test("Only changed values are downloaded again."):
+        writer["key1"] = "changed"
+        writer["new"] = "new"
+        del writer["key2"]
+        get.reset_mock()
+
+        summary = reader.refresh()
+        assert summary == RefreshSummary(
+            added=["new"], changed=["key1"], removed=["key2"], unchanged=8
+        )
+        assert get.call_count == 2
+        assert reader.as_dict == writer.get_all_from_s3()
+        assert "key2" not in list(reader)
+
+    with subtests.test("Without a cache, only the keys are listed again."):
+        assert writer.refresh() == RefreshSummary()
+        assert len(writer) == 10
+
+    writer.clear()
+
+
+def test_refresh_stale_values(mocker):
+    """Test that unchanged values that were due to be revalidated are fresh again."""
+    now = [0.0]
+    mocker.patch("s3os.cache.time.monotonic", side_effect=lambda: now[0])
+    config = S3DictConfig(
+        id="refresh_stale",
+        backend="memory",
+        cache_policy=CachePolicy(revalidate_after=10),
+    )
+    s3dict = S3Dict({"a": 1}, _config=config)
+
+    now[0] = 10
+    assert s3dict.refresh() == RefreshSummary(unchanged=1)
+    assert s3dict.data["a"] == 1
+    assert s3dict.cache_stats.revalidations == 1
+    s3dict.clear()
+
+
+def test_refresh_packed():
+    """Test refreshing the cache of a dict in the packed layout."""
+    config = S3DictConfig(
+        id="refresh_packed",
+        backend="memory",
+        write_mode="deferred",
+        layout="packed",
+        segment_policy=SegmentPolicy(auto_compact=False),
+    )
+    with S3Dict(_config=config) as writer:
+        writer.update({"a": 1, "b": 2, "c": 3})
+    reader = S3Dict(_config=config)
+    assert reader.refresh() == RefreshSummary(added=["a", "b", "c"])
+
+    with S3Dict(_config=config) as writer:
+        writer["a"] = "changed"
+        del writer["b"]
+    assert reader.refresh() == RefreshSummary(changed=["a"], removed=["b"], unchanged=1)
+    assert reader.as_dict == {"a": "changed", "c": 3}
+    reader.clear()
@@ -1,7 +1,34 @@
 """Tests for s3 API wrapper functions."""
 
+import io
+import pytest
+
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
+from mock import MagicMock
+
 from s3os.api import retrieve
-from s3os.s3_wrapper import generate_items_in_bucket, BucketLocation
+from s3os.s3_wrapper import (
+    DEFAULT_SMALL_OBJECT_LIMIT,
+    generate_items_in_bucket,
+    generate_objects_in_bucket,
+    BucketCache,
+    BucketLocation,
+    ObjectInfo,
+    ObjectLocation,
+    bucket_exists,
+    configure_transfers,
+    delete_objects,
+    ensure_bucket,
+    invalidate_known_buckets,
+    known_buckets,
+    download_object_range,
+    download_object_with_info,
+    head_object,
+    object_exists,
+    upload_object,
+    ObjectNotModified,
+)
 
 
 def test_generate_items_in_bucket():
@@ -17,3 +44,354 @@ def test_generate_items_in_bucket():
     # Download an object to make sure generation gave us valid items
     obj = retrieve(items[0])
     assert obj is not None
+
+
+@pytest.fixture
+def mock_client(mocker):
+    """Replace the s3 client used by the wrapper functions with a mock."""
+    client = MagicMock()
+    mocker.patch("s3os.s3_wrapper.get_client", return_value=client)
+    known_buckets.invalidate()
+    yield client
+    known_buckets.invalidate()
+
+
+def make_client_error(code: str) -> ClientError:
+    """Create a ClientError with the given error code."""
+    return ClientError({"Error": {"Code": code, "Message": code}}, "operation")
+
+
+def test_bucket_cache(mocker, subtests):
+    """Test the expiry and invalidation of the BucketCache."""
+    mock_time = mocker.patch("s3os.s3_wrapper.time.monotonic", return_value=100)
+    cache = BucketCache(ttl=10)
+    bucket = BucketLocation("cached")
+
+    with subtests.test("Buckets are unknown until added."):
+        assert bucket not in cache
+        cache.add(bucket)
+        assert bucket in cache
+        assert BucketLocation("cached", region="eu-west-1") not in cache
+
+    with subtests.test("Buckets are forgotten after the TTL expires."):
+        mock_time.return_value = 110
+        assert bucket not in cache
+
+    with subtests.test("Buckets can be invalidated."):
+        cache.add(bucket)
+        cache.invalidate(bucket)
+        assert bucket not in cache
+
+    with subtests.test("Buckets are remembered forever with no TTL."):
+        cache = BucketCache(ttl=None)
+        cache.add(bucket)
+        mock_time.return_value = 10 ** 9
+        assert bucket in cache
+
+
+def test_bucket_exists(mock_client):
+    """Test that `bucket_exists` uses `head_bucket`."""
+    assert bucket_exists(BucketLocation("exists"))
+    mock_client.head_bucket.assert_called_once_with(Bucket="exists")
+    mock_client.list_buckets.assert_not_called()
+
+    mock_client.head_bucket.side_effect = make_client_error("404")
+    assert not bucket_exists(BucketLocation("missing"))
+
+    mock_client.head_bucket.side_effect = make_client_error("403")
+    with pytest.raises(ClientError):
+        bucket_exists(BucketLocation("forbidden"))
+
+
+def test_ensure_bucket_is_memoized(mock_client, subtests):
+    """Test that `ensure_bucket` only checks each bucket once."""
+    bucket = BucketLocation("memoized")
+
+    with subtests.test("Existing buckets are checked once and not created."):
+        ensure_bucket(bucket)
+        ensure_bucket(bucket)
+        mock_client.head_bucket.assert_called_once_with(Bucket="memoized")
+        mock_client.create_bucket.assert_not_called()
+
+    with subtests.test("Missing buckets are created once."):
+        mock_client.reset_mock()
+        invalidate_known_buckets(bucket)
+        mock_client.head_bucket.side_effect = make_client_error("404")
+        ensure_bucket(bucket)
+        ensure_bucket(bucket)
+        mock_client.create_bucket.assert_called_once_with(Bucket="memoized")
+
+    with subtests.test("Upload to a deleted bucket invalidates the cache."):
+        mock_client.put_object.side_effect = make_client_error("NoSuchBucket")
+        with pytest.raises(ClientError):
+            upload_object(ObjectLocation("key", bucket=bucket), io.BytesIO())
+        assert bucket not in known_buckets
+
+
+@pytest.fixture
+def small_object_limit():
+    """Transfer objects of at least 4 bytes by the s3transfer manager."""
+    transfer_config = TransferConfig(multipart_threshold=8)
+    configure_transfers(small_object_limit=4, transfer_config=transfer_config)
+    yield transfer_config
+    configure_transfers()
+
+
+def test_upload_object(mock_client, small_object_limit, subtests):
+    """Test that only larger objects are uploaded by the s3transfer manager."""
+    with subtests.test("Small objects are uploaded with a single request."):
+        mock_client.put_object.return_value = {"ETag": '"abc"'}
+        stream = io.BytesIO(b"abc")
+        assert upload_object(ObjectLocation("key"), stream) == '"abc"'
+        mock_client.put_object.assert_called_once_with(
+            Bucket="s3os", Key="key", Body=stream
+        )
+        mock_client.upload_fileobj.assert_not_called()
+
+    with subtests.test("Larger objects are uploaded by the transfer manager."):
+        stream = io.BytesIO(b"data")
+        etag = upload_object(ObjectLocation("key"), stream)
+        mock_client.upload_fileobj.assert_called_once_with(
+            stream, "s3os", "key", Config=small_object_limit
+        )
+        # Uploaded in a single part, so the ETag is the MD5 of b"data" as s3 reports it.
+        assert etag == '"8d777f385d3dfec8815d20f7496026dc"'
+
+    with subtests.test("The ETag of multipart uploads is unknown."):
+        assert upload_object(ObjectLocation("key"), io.BytesIO(bytes(8))) is None
+
+    with subtests.test("Content hashes are kept in the object metadata."):
+        mock_client.put_object.reset_mock()
+        stream = io.BytesIO(b"abc")
+        upload_object(ObjectLocation("key"), stream, content_hash="hash")
+        mock_client.put_object.assert_called_once_with(
+            Bucket="s3os", Key="key", Body=stream, Metadata={"s3os-sha256": "hash"}
+        )
+
+
+def fake_get_object(data, etag='"abc"'):
+    """Return a fake `get_object` of an object with the given data, honouring ranges."""
+
+    def get_object(Bucket, Key, Range=None, IfMatch=None, **kwargs):
+        if IfMatch is not None and IfMatch != etag:
+            raise make_client_error("PreconditionFailed")
+        result = {"ETag": etag}
+        if Range is None:
+            part = data
+        elif not data:
+            raise make_client_error("InvalidRange")
+        else:
+            start, end = (int(bound) for bound in Range[len("bytes=") :].split("-"))
+            part = data[start : end + 1]
+            content_range = f"bytes {start}-{start + len(part) - 1}/{len(data)}"
+            result["ContentRange"] = content_range
+        return {**result, "Body": io.BytesIO(part), "ContentLength": len(part)}
+
+    return get_object
+
+
+def test_download_large_object(mock_client, small_object_limit, subtests):
+    """Test that larger objects are downloaded in concurrent ranged requests."""
+    small_object_limit.multipart_chunksize = 3
+    location = ObjectLocation("key")
+
+    with subtests.test("The rest of the object is downloaded in parts."):
+        mock_client.get_object.side_effect = fake_get_object(b"0123456789")
+        stream, info = download_object_with_info(location)
+        assert stream.read() == b"0123456789"
+        assert (info.size, info.etag) == (10, '"abc"')
+        # The first part is the small object limit, and each other part is a chunk.
+        ranges = sorted(
+            call[1]["Range"] for call in mock_client.get_object.call_args_list
+        )
+        assert ranges == ["bytes=0-3", "bytes=4-6", "bytes=7-9"]
+        for call in mock_client.get_object.call_args_list[1:]:
+            assert call[1]["IfMatch"] == '"abc"'
+        mock_client.download_fileobj.assert_not_called()
+
+    with subtests.test("Objects that change while downloaded are not mixed up."):
+        first_part = fake_get_object(b"0123456789")
+        mock_client.get_object.side_effect = lambda **kwargs: (
+            first_part(**kwargs)
+            if kwargs["Range"] == "bytes=0-3"
+            else fake_get_object(b"changed!!!", etag='"def"')(**kwargs)
+        )
+        with pytest.raises(IOError):
+            download_object_with_info(location)
+
+    with subtests.test("Empty objects are downloaded."):
+        mock_client.get_object.side_effect = fake_get_object(b"")
+        stream, info = download_object_with_info(location)
+        assert stream.read() == b""
+        assert info.size == 0
+
+
+def test_configure_transfers():
+    """Test that the small object limit can't be negative."""
+    with pytest.raises(ValueError):
+        configure_transfers(small_object_limit=-1)
+
+
+def test_download_object_with_info(mock_client, subtests):
+    """Test downloading objects along with their ETag, and conditionally."""
+    location = ObjectLocation("key")
+
+    with subtests.test("Objects are downloaded with their details."):
+        mock_client.get_object.side_effect = fake_get_object(b"data")
+        stream, info = download_object_with_info(location)
+        assert stream.read() == b"data"
+        assert info.size == 4
+        assert info.etag == '"abc"'
+        mock_client.get_object.assert_called_once_with(
+            Bucket="s3os", Key="key", Range=f"bytes=0-{DEFAULT_SMALL_OBJECT_LIMIT - 1}"
+        )
+
+    with subtests.test("Stores that ignore ranges send the whole object."):
+        mock_client.get_object.side_effect = None
+        mock_client.get_object.return_value = {
+            "Body": io.BytesIO(b"data"),
+            "ContentLength": 4,
+            "ETag": '"abc"',
+        }
+        stream, _ = download_object_with_info(location)
+        assert stream.read() == b"data"
+
+    with subtests.test("Truncated responses are detected."):
+        mock_client.get_object.return_value = {
+            "Body": io.BytesIO(b"dat"),
+            "ContentLength": 4,
+        }
+        with pytest.raises(IOError):
+            download_object_with_info(location)
+
+    with subtests.test("Unchanged objects are not downloaded again."):
+        mock_client.get_object.side_effect = make_client_error("304")
+        with pytest.raises(ObjectNotModified):
+            download_object_with_info(location, if_none_match='"abc"')
+        mock_client.get_object.assert_called_with(
+            Bucket="s3os",
+            Key="key",
+            Range=f"bytes=0-{DEFAULT_SMALL_OBJECT_LIMIT - 1}",
+            IfNoneMatch='"abc"',
+        )
+
+    with subtests.test("Missing objects raise KeyError."):
+        mock_client.get_object.side_effect = make_client_error("NoSuchKey")
+        with pytest.raises(KeyError):
+            download_object_with_info(location)
+
+
+def test_download_object_range(mock_client, subtests):
+    """Test downloading part of an object with a ranged GET."""
+    location = ObjectLocation("key")
+
+    with subtests.test("The range is requested inclusive of its last byte."):
+        mock_client.get_object.return_value = {
+            "Body": io.BytesIO(b"ata"),
+            "ContentLength": 3,
+        }
+        assert download_object_range(location, 1, 3).read() == b"ata"
+        mock_client.get_object.assert_called_once_with(
+            Bucket="s3os", Key="key", Range="bytes=1-3"
+        )
+
+    with subtests.test("Empty ranges are not requested."):
+        mock_client.get_object.reset_mock()
+        assert download_object_range(location, 4, 0).read() == b""
+        mock_client.get_object.assert_not_called()
+
+    with subtests.test("Missing objects raise KeyError."):
+        mock_client.get_object.side_effect = make_client_error("NoSuchKey")
+        with pytest.raises(KeyError):
+            download_object_range(location, 0, 1)
+
+
+def test_head_object(mock_client):
+    """Test describing objects, including the content hash in their metadata."""
+    mock_client.head_object.return_value = {
+        "ContentLength": 3,
+        "ETag": '"abc"',
+        "Metadata": {"s3os-sha256": "hash"},
+    }
+    info = head_object(ObjectLocation("key"))
+    assert (info.size, info.etag, info.content_hash) == (3, '"abc"', "hash")
+
+    mock_client.head_object.return_value = {"ContentLength": 3, "ETag": '"abc"'}
+    assert head_object(ObjectLocation("key")).content_hash is None
+
+    mock_client.head_object.side_effect = make_client_error("404")
+    with pytest.raises(KeyError):
+        head_object(ObjectLocation("key"))
+
+
+def test_object_exists(mock_client):
+    """Test checking for objects without downloading them."""
+    assert object_exists(ObjectLocation("key"))
+    mock_client.head_object.assert_called_once_with(Bucket="s3os", Key="key")
+
+    mock_client.head_object.side_effect = make_client_error("404")
+    assert not object_exists(ObjectLocation("key"))
+
+    mock_client.head_object.side_effect = make_client_error("403")
+    with pytest.raises(ClientError):
+        object_exists(ObjectLocation("key"))
+
+
+def test_delete_objects(mock_client):
+    """Test that `delete_objects` reports which keys were deleted."""
+    mock_client.delete_objects.return_value = {
+        "Errors": [{"Key": "b", "Code": "AccessDenied", "Message": "Access Denied"}]
+    }
+
+    deleted, errors = delete_objects(BucketLocation("bucket"), ["a", "b", "c"])
+
+    mock_client.delete_objects.assert_called_once_with(
+        Bucket="bucket",
+        Delete={"Objects": [{"Key": "a"}, {"Key": "b"}, {"Key": "c"}], "Quiet": True},
+    )
+    assert deleted == ["a", "c"]
+    assert isinstance(errors["b"], ClientError)
+    assert errors["b"].response["Error"]["Code"] == "AccessDenied"
+
+    with pytest.raises(ValueError):
+        delete_objects(BucketLocation("bucket"), [str(i) for i in range(1001)])
+
+
+def test_generate_items_in_bucket_paging(mock_client):
+    """Test that `generate_items_in_bucket` follows continuation tokens."""
+    mock_client.list_objects_v2.side_effect = [
+        {"Contents": [{"Key": "a"}], "NextContinuationToken": "token"},
+        {"Contents": [{"Key": "b"}]},
+    ]
+
+    items = list(generate_items_in_bucket(BucketLocation("bucket"), prefix="p"))
+
+    assert items == [
+        ObjectLocation("a", BucketLocation("bucket")),
+        ObjectLocation("b", BucketLocation("bucket")),
+    ]
+    mock_client.list_objects_v2.assert_called_with(
+        Bucket="bucket", Prefix="p", ContinuationToken="token"
+    )
+
+    mock_client.list_objects_v2.side_effect = [{"KeyCount": 0}]
+    assert list(generate_items_in_bucket(BucketLocation("empty"))) == []
+
+
+def test_generate_objects_in_bucket(mock_client):
+    """Test that objects are described from the listing, without a request for each."""
+    mock_client.list_objects_v2.side_effect = [
+        {
+            "Contents": [{"Key": "a", "Size": 1, "ETag": '"x"'}],
+            "NextContinuationToken": "token",
+        },
+        {"Contents": [{"Key": "b", "Size": 2, "ETag": '"y"'}]},
+    ]
+
+    objects = list(generate_objects_in_bucket(BucketLocation("bucket")))
+
+    assert objects == [
+        (ObjectLocation("a", BucketLocation("bucket")), ObjectInfo(1, '"x"')),
+        (ObjectLocation("b", BucketLocation("bucket")), ObjectInfo(2, '"y"')),
+    ]
+    mock_client.head_object.assert_not_called()
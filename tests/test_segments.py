@@ -0,0 +1,322 @@
+"""Tests for the packed layout of S3Dict values in segments."""
+
+import pytest
+
+from mock import patch
+from typing import Any, Dict, List
+
+from s3os.api import BulkResult
+from s3os.buffers import BufferStream
+from s3os.encoding import object_from_buffer, object_to_stream
+from s3os.s3_dict import S3Dict, S3DictConfig
+from s3os.s3_wrapper import BucketLocation, ObjectInfo, ObjectLocation
+from s3os.segments import (
+    Segment,
+    SegmentPolicy,
+    SegmentStore,
+    new_segment_id,
+    next_generation,
+)
+from s3os.write_buffer import DELETED
+
+
+class FakeS3:
+    """Stand-in for the s3 operations used by segments, backed by a dict of objects."""
+
+    def __init__(self, mocker):
+        """Patch the s3 operations with the methods of this object."""
+        self.objects: Dict[str, bytes] = {}
+        self.range_requests = 0
+        self.full_requests = 0
+        for name in (
+            "upload_object",
+            "download_object_range",
+            "download_object_with_info",
+            "generate_items_in_bucket",
+            "store",
+            "retrieve_many",
+            "delete_many",
+        ):
+            mocker.patch(f"s3os.segments.{name}", side_effect=getattr(self, name))
+        mocker.patch("s3os.segments.ensure_bucket")
+        mocker.patch(
+            "s3os.s3_dict.generate_items_in_bucket",
+            side_effect=self.generate_items_in_bucket,
+        )
+        mocker.patch("s3os.s3_dict.delete_many", side_effect=self.delete_many)
+
+    def upload_object(self, location, stream):
+        """Fake `upload_object`."""
+        self.objects[location.key] = stream.getvalue()
+
+    def _get(self, location):
+        try:
+            return self.objects[location.key]
+        except KeyError:
+            raise KeyError(location) from None
+
+    def download_object_range(self, location, start, length):
+        """Fake `download_object_range`, counting requests."""
+        self.range_requests += 1
+        return BufferStream([self._get(location)[start : start + length]])
+
+    def download_object_with_info(self, location):
+        """Fake `download_object_with_info`, counting requests."""
+        self.full_requests += 1
+        data = self._get(location)
+        return BufferStream([data]), ObjectInfo(size=len(data))
+
+    def generate_items_in_bucket(self, bucket, prefix=None):
+        """Fake `generate_items_in_bucket`."""
+        for key in sorted(self.objects):
+            if key.startswith(prefix or ""):
+                yield ObjectLocation(key, bucket=bucket)
+
+    def store(self, location, obj, check_bucket=True, codec=None, compression=None):
+        """Fake `store`."""
+        stream = object_to_stream(obj, codec=codec, compression=compression)
+        self.objects[location.key] = stream.getvalue()
+
+    def retrieve_many(self, locations, max_concurrency=None):
+        """Fake `retrieve_many`."""
+        result = BulkResult()
+        for location in locations:
+            try:
+                result.results[location] = object_from_buffer(self._get(location))
+            except KeyError as err:
+                result.errors[location] = err
+        return result
+
+    def delete_many(self, locations, max_concurrency=None):
+        """Fake `delete_many`."""
+        result = BulkResult()
+        for location in locations:
+            self.objects.pop(location.key, None)
+            result.results[location] = None
+        return result
+
+    def keys(self, prefix: str) -> List[str]:
+        """Return the keys of the stored objects with the given prefix."""
+        return [key for key in sorted(self.objects) if key.startswith(prefix)]
+
+
+@pytest.fixture
+def fake_s3(mocker):
+    """Replace the s3 operations used by segments with an in-memory fake."""
+    return FakeS3(mocker)
+
+
+def make_store(policy: SegmentPolicy = SegmentPolicy(), **kwargs: Any) -> SegmentStore:
+    """Create a SegmentStore in the default bucket."""
+    return SegmentStore(BucketLocation(), "dict/", policy=policy, **kwargs)
+
+
+def test_segment_policy():
+    """Test that invalid policies are rejected."""
+    with pytest.raises(ValueError):
+        SegmentPolicy(max_segment_bytes=0)
+    with pytest.raises(ValueError):
+        SegmentPolicy(min_merge_segments=1)
+    with pytest.raises(ValueError):
+        SegmentPolicy(compaction_threshold=0)
+
+
+def test_segment_ids():
+    """Test that segment IDs sort in the order they are made, around compactions."""
+    first, second = new_segment_id(), new_segment_id()
+    assert first < next_generation(first) < next_generation(next_generation(first))
+    assert next_generation(next_generation(first)) < second
+
+    segment = Segment("id", size=3, entries={"a": (0, 3)}, deleted={"b"})
+    assert Segment.from_dict("id", segment.to_dict()) == segment
+
+
+def test_write_and_read(fake_s3, subtests):
+    """Test that batches of values are packed into segments and read by range."""
+    store = make_store(codec="json")
+
+    with subtests.test("Each batch is written as a segment and its index."):
+        infos = store.write({"a": 1, "b": [2, 3]})
+        assert sorted(infos) == ["a", "b"]
+        assert len(fake_s3.keys("dict/segments/")) == 1
+        assert len(fake_s3.keys("dict/index/")) == 1
+
+    with subtests.test("Values are read with ranged GETs."):
+        assert store.get("b")[0] == [2, 3]
+        assert store.get("a") == (1, infos["a"])
+        assert fake_s3.range_requests == 2
+        with pytest.raises(KeyError):
+            store.get("c")
+
+    with subtests.test("Later segments override earlier ones."):
+        store.write({"a": "new", "b": DELETED})
+        assert store.get("a")[0] == "new"
+        assert sorted(store.keys()) == ["a"]
+        assert "b" not in store
+
+    with subtests.test("Segments written elsewhere are seen once refreshed."):
+        other = make_store()
+        assert sorted(other.keys()) == ["a"]
+        other.write({"c": 4})
+        assert "c" not in store
+        store.refresh()
+        assert store.get("c")[0] == 4
+
+
+def test_large_batches_are_split(fake_s3):
+    """Test that batches larger than a segment are written to several segments."""
+    store = make_store(SegmentPolicy(max_segment_bytes=100, auto_compact=False))
+    store.write({f"key-{i}": "x" * 40 for i in range(10)})
+    assert store.segment_count > 1
+    assert len(store) == 10
+
+
+def test_get_many(fake_s3, subtests):
+    """Test that values close together are read with a single request."""
+    store = make_store()
+    values = {f"key-{i}": i for i in range(20)}
+    store.write(values)
+
+    with subtests.test("Adjacent values are read together."):
+        found = {key: value for key, value, _ in store.get_many(["key-1", "key-5"])}
+        assert found == {"key-1": 1, "key-5": 5}
+        assert fake_s3.range_requests == 1
+
+    with subtests.test("Distant values are read separately."):
+        fake_s3.range_requests = 0
+        found = {key: value for key, value, _ in store.get_many(["key-1", "key-5"], 0)}
+        assert found == {"key-1": 1, "key-5": 5}
+        assert fake_s3.range_requests == 2
+
+    with subtests.test("Reading all values reads whole segments."):
+        assert {key: value for key, value, _ in store.get_many()} == values
+        assert fake_s3.full_requests == 1
+
+
+def test_compaction(fake_s3, subtests):
+    """Test that small and mostly dead segments are rewritten."""
+    policy = SegmentPolicy(
+        min_segment_bytes=0, min_merge_segments=3, auto_compact=False
+    )
+    store = make_store(policy)
+    store.write({"a": 1, "b": 2, "c": 3})
+    store.write({"a": 10, "b": 20})
+
+    with subtests.test("Segments that are mostly dead are rewritten."):
+        assert store.needs_compaction()
+        assert store.compact() == 1
+        assert store.segment_count == 2
+        assert {key: value for key, value, _ in store.get_many()} == {
+            "a": 10,
+            "b": 20,
+            "c": 3,
+        }
+        assert len(fake_s3.keys("dict/index/")) == 2
+
+    with subtests.test("Runs of small segments are merged."):
+        fake_s3.objects.clear()
+        store = make_store(SegmentPolicy(min_merge_segments=3, auto_compact=False))
+        for i in range(3):
+            store.write({f"key-{i}": i, "deleted": DELETED})
+        assert store.compact() == 3
+        assert store.segment_count == 1
+        assert sorted(store.keys()) == ["key-0", "key-1", "key-2"]
+        assert len(fake_s3.keys("dict/segments/")) == 1
+
+    with subtests.test("Stores with stale indexes find compacted values."):
+        stale = make_store()
+        stale.write({"key-0": "old"})
+        store.write({"key-0": "new"})
+        stale.refresh()
+        store.refresh()
+        store.write({f"key-{i}": i for i in range(3, 6)})
+        assert store.compact() > 0
+        assert stale.get("key-0")[0] == "new"
+
+    with subtests.test("Compaction stops if segments were compacted elsewhere."):
+        stale.write({"key-9": 9})
+        stale.write({"key-9": 10})
+        assert stale.needs_compaction()
+        store.refresh()
+        assert store.compact() > 0
+        assert stale.compact() == 0
+        assert stale.get("key-9")[0] == 10
+
+
+def test_compaction_with_concurrent_writer(fake_s3, mocker, subtests):
+    """Test that compaction does not override segments written by another process."""
+    policy = SegmentPolicy(min_merge_segments=2, auto_compact=False)
+    store = make_store(policy)
+    store.write({"k": "v1"})
+    store.write({"j": 1})
+    first = min(store.value_locations()["k"][0], store.value_locations()["j"][0])
+
+    # Another process writes a segment that sorts within the run being compacted, e.g.
+    # as it took its ID before the run's last segment was written.
+    other = make_store(policy)
+    with patch("s3os.segments.new_segment_id", return_value=f"{first}-late"):
+        other.write({"k": "v2"})
+
+    with subtests.test("The run is abandoned if it would override other segments."):
+        assert store.compact() == 0
+        assert make_store().get("k")[0] == "v2"
+        assert store.get("k")[0] == "v2"
+
+    with subtests.test("The run is compacted once the index is up to date."):
+        assert store.compact() == 3
+        assert store.segment_count == 1
+        assert make_store().get("k")[0] == "v2"
+
+    with subtests.test("Segments written during the upload are not overridden."):
+        store.write({"k": "v3"})
+        store.write({"j": 2})
+        latest = store.value_locations()["j"][0]
+        upload = fake_s3.upload_object
+
+        def upload_and_write(location, stream):
+            upload(location, stream)
+            mocker.patch("s3os.segments.upload_object", side_effect=upload)
+            with patch("s3os.segments.new_segment_id", return_value=f"{latest}-late"):
+                other.write({"k": "v4"})
+
+        mocker.patch("s3os.segments.upload_object", side_effect=upload_and_write)
+        assert store.compact() == 0
+        assert make_store().get("k")[0] == "v4"
+        assert len(fake_s3.keys("dict/index/")) == 4
+
+
+def test_s3_dict_packed_layout(fake_s3, subtests):
+    """Test S3Dict with values packed into segments."""
+    with subtests.test("The packed layout requires deferred writes."):
+        with pytest.raises(ValueError):
+            S3DictConfig(layout="packed")
+        with pytest.raises(ValueError):
+            S3DictConfig(layout="unknown")
+
+    config = S3DictConfig(
+        id="dict",
+        write_mode="deferred",
+        layout="packed",
+        segment_policy=SegmentPolicy(background=False),
+    )
+    with S3Dict(_config=config) as s3dict:
+        s3dict.update({"a": 1, "b": 2})
+        s3dict.flush()
+        s3dict["a"] = 3
+        del s3dict["b"]
+    assert len(fake_s3.keys("dict/segments/")) == 1
+
+    reader = S3Dict(_config=S3DictConfig(**{**config.__dict__, "use_cache": False}))
+    with subtests.test("Values are read from segments."):
+        assert reader["a"] == 3
+        with pytest.raises(KeyError):
+            reader["b"]
+        assert reader.get_many(["a", "b"]) == {"a": 3}
+        assert "a" in reader and "b" not in reader
+        assert list(reader) == ["a"]
+        assert reader.get_all_from_s3() == {"a": 3}
+
+    with subtests.test("Clearing the dict deletes all segments."):
+        reader.clear()
+        assert fake_s3.keys("dict/") == []
+        assert len(reader) == 0
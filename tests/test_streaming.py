@@ -0,0 +1,166 @@
+"""Tests for streaming transfers of large objects."""
+
+import io
+import pytest
+
+from botocore.exceptions import ClientError
+from mock import MagicMock
+
+from s3os.api import retrieve_streaming, store_streaming
+from s3os.encoding import object_to_stream
+from s3os.s3_wrapper import ObjectInfo, ObjectLocation
+from s3os.streaming import (
+    MIN_PART_SIZE,
+    MultipartConfig,
+    MultipartUpload,
+    open_object,
+)
+
+
+@pytest.fixture
+def mock_client(mocker):
+    """Replace the s3 client used for streaming transfers with a mock."""
+    client = MagicMock()
+    client.create_multipart_upload.return_value = {"UploadId": "upload"}
+    client.upload_part.side_effect = lambda PartNumber, **kwargs: {
+        "ETag": f'"part-{PartNumber}"'
+    }
+    client.complete_multipart_upload.return_value = {"ETag": '"complete"'}
+    client.put_object.return_value = {"ETag": '"single"'}
+    mocker.patch("s3os.streaming.get_client", return_value=client)
+    return client
+
+
+def test_multipart_config():
+    """Test that parts must be large enough for s3."""
+    with pytest.raises(ValueError):
+        MultipartConfig(part_size=MIN_PART_SIZE - 1)
+    with pytest.raises(ValueError):
+        MultipartConfig(max_concurrency=0)
+
+
+def test_small_upload(mock_client):
+    """Test that objects smaller than a part are uploaded with a single request."""
+    with MultipartUpload(ObjectLocation("key")) as upload:
+        upload.write(b"data")
+
+    mock_client.put_object.assert_called_once_with(
+        Bucket="s3os", Key="key", Body=b"data"
+    )
+    mock_client.create_multipart_upload.assert_not_called()
+    assert upload.info == ObjectInfo(size=4, etag='"single"')
+
+
+def test_multipart_upload(mock_client):
+    """Test that larger objects are uploaded in parts, in order."""
+    config = MultipartConfig(part_size=MIN_PART_SIZE, max_concurrency=2)
+    data = bytes(range(256)) * (MIN_PART_SIZE // 256 * 3 + 1)
+
+    with MultipartUpload(ObjectLocation("key"), config) as upload:
+        for start in range(0, len(data), 100_000):
+            upload.write(data[start : start + 100_000])
+
+    bodies = {
+        call.kwargs["PartNumber"]: call.kwargs["Body"]
+        for call in mock_client.upload_part.call_args_list
+    }
+    assert sorted(bodies) == [1, 2, 3, 4]
+    assert b"".join(bodies[number] for number in sorted(bodies)) == data
+    assert all(len(bodies[number]) == MIN_PART_SIZE for number in (1, 2, 3))
+
+    mock_client.complete_multipart_upload.assert_called_once_with(
+        Bucket="s3os",
+        Key="key",
+        UploadId="upload",
+        MultipartUpload={
+            "Parts": [
+                {"PartNumber": number, "ETag": f'"part-{number}"'}
+                for number in range(1, 5)
+            ]
+        },
+    )
+    mock_client.put_object.assert_not_called()
+    assert upload.info == ObjectInfo(size=len(data), etag='"complete"')
+
+
+def test_large_write(mock_client):
+    """Test that a single write of several parts is split into parts."""
+    config = MultipartConfig(part_size=MIN_PART_SIZE)
+    data = bytes(range(256)) * (MIN_PART_SIZE // 256 * 2 + 1)
+
+    with MultipartUpload(ObjectLocation("key"), config) as upload:
+        assert upload.write(b"head") == 4
+        assert upload.write(memoryview(data)) == len(data)
+
+    calls = sorted(
+        mock_client.upload_part.call_args_list,
+        key=lambda call: call.kwargs["PartNumber"],
+    )
+    bodies = [call.kwargs["Body"] for call in calls]
+    assert [len(body) for body in bodies] == [MIN_PART_SIZE, MIN_PART_SIZE, 260]
+    assert b"".join(bodies) == b"head" + data
+    assert upload.info == ObjectInfo(size=len(data) + 4, etag='"complete"')
+
+
+def test_failed_upload_is_aborted(mock_client, subtests):
+    """Test that failed uploads are aborted, so parts aren't left behind."""
+    config = MultipartConfig(part_size=MIN_PART_SIZE)
+
+    with subtests.test("Failures to upload parts abort the upload."):
+        mock_client.upload_part.side_effect = RuntimeError("failed")
+        with pytest.raises(RuntimeError):
+            with MultipartUpload(ObjectLocation("key"), config) as upload:
+                upload.write(bytes(MIN_PART_SIZE + 1))
+        mock_client.abort_multipart_upload.assert_called_once_with(
+            Bucket="s3os", Key="key", UploadId="upload"
+        )
+        mock_client.complete_multipart_upload.assert_not_called()
+
+    with subtests.test("Exceptions while writing abort the upload."):
+        mock_client.abort_multipart_upload.reset_mock()
+        mock_client.upload_part.side_effect = lambda **kwargs: {"ETag": '"part"'}
+        with pytest.raises(ValueError):
+            with MultipartUpload(ObjectLocation("key"), config) as upload:
+                upload.write(bytes(MIN_PART_SIZE))
+                raise ValueError("failed to encode")
+        mock_client.abort_multipart_upload.assert_called_once()
+        mock_client.complete_multipart_upload.assert_not_called()
+
+
+def test_open_object(mock_client, subtests):
+    """Test reading objects from s3 without downloading them all at once."""
+    with subtests.test("Objects are read from the body of the response."):
+        mock_client.get_object.return_value = {
+            "Body": io.BytesIO(b"data"),
+            "ContentLength": 4,
+            "ETag": '"abc"',
+        }
+        stream, info = open_object(ObjectLocation("key"))
+        assert stream.read() == b"data"
+        assert info == ObjectInfo(size=4, etag='"abc"')
+
+    with subtests.test("Missing objects raise KeyError."):
+        mock_client.get_object.side_effect = ClientError(
+            {"Error": {"Code": "NoSuchKey", "Message": "NoSuchKey"}}, "GetObject"
+        )
+        with pytest.raises(KeyError):
+            open_object(ObjectLocation("key"))
+
+
+def test_store_and_retrieve_streaming(mock_client, mocker, subtests):
+    """Test that streamed objects round trip, and are compatible with `retrieve`."""
+    mocker.patch("s3os.api.ensure_bucket")
+    obj = {"values": list(range(1000))}
+
+    with subtests.test("Objects are stored with the same encoding as `store`."):
+        info = store_streaming(ObjectLocation("key"), obj, codec="json")
+        body = mock_client.put_object.call_args.kwargs["Body"]
+        assert body == object_to_stream(obj, codec="json").getvalue()
+        assert info == ObjectInfo(size=len(body), etag='"single"')
+
+    with subtests.test("Stored objects are retrieved by streaming."):
+        mock_client.get_object.return_value = {
+            "Body": io.BytesIO(body),
+            "ContentLength": len(body),
+        }
+        assert retrieve_streaming(ObjectLocation("key")) == obj
@@ -0,0 +1,177 @@
+"""Tests for the retries and adaptive concurrency limits of requests to s3."""
+
+import io
+import threading
+
+import pytest
+
+from botocore.exceptions import ClientError, EndpointConnectionError
+from mock import MagicMock
+
+from s3os.metrics import enable_metrics, get_metrics_registry
+from s3os.s3_wrapper import BucketLocation, ObjectLocation, upload_object
+from s3os.throttling import (
+    AdaptiveLimiter,
+    ConcurrencyPolicy,
+    RetryPolicy,
+    call_with_retries,
+    classify_error,
+    configure_throttling,
+    get_limiter,
+)
+
+
+def make_client_error(code: str, status: int = 400) -> ClientError:
+    """Create a ClientError with the given error code and HTTP status."""
+    return ClientError(
+        {
+            "Error": {"Code": code, "Message": code},
+            "ResponseMetadata": {"HTTPStatusCode": status},
+        },
+        "operation",
+    )
+
+
+@pytest.fixture
+def no_backoff():
+    """Retry up to 3 times without waiting, with fresh limiters."""
+    configure_throttling(RetryPolicy(max_attempts=3, base_delay=0, max_delay=0))
+    yield
+    configure_throttling()
+
+
+def test_policies():
+    """Test the validation of policies, and the range of backoff delays."""
+    policy = RetryPolicy(base_delay=1, max_delay=3)
+    assert 0 <= policy.delay(1) <= 1
+    assert 0 <= policy.delay(10) <= 3
+
+    for invalid in (
+        dict(max_attempts=0),
+        dict(base_delay=-1),
+        dict(base_delay=2, max_delay=1),
+    ):
+        with pytest.raises(ValueError):
+            RetryPolicy(**invalid)
+
+    for invalid in (
+        dict(min_limit=0),
+        dict(initial_limit=300),
+        dict(min_limit=40),
+        dict(decrease_factor=1),
+    ):
+        with pytest.raises(ValueError):
+            ConcurrencyPolicy(**invalid)
+
+
+def test_classify_error():
+    """Test which errors are retried."""
+    assert classify_error(make_client_error("SlowDown", 503)) == "throttled"
+    assert classify_error(make_client_error("Unknown", 503)) == "throttled"
+    assert classify_error(make_client_error("InternalError", 500)) == "transient"
+    assert classify_error(EndpointConnectionError(endpoint_url="url")) == "transient"
+    assert classify_error(make_client_error("NoSuchKey", 404)) is None
+    assert classify_error(make_client_error("304", 304)) is None
+    assert classify_error(ValueError()) is None
+
+
+def test_adaptive_limiter(subtests):
+    """Test that the limit is raised additively and lowered multiplicatively."""
+    limiter = AdaptiveLimiter(ConcurrencyPolicy(initial_limit=2, max_limit=3))
+
+    with subtests.test("The limit is only raised while it is in use."):
+        limiter.release(limiter.acquire())
+        assert limiter.limit == 2
+        # Raised by 1/2, then 1/2.5, then capped at the maximum.
+        for _ in range(3):
+            tokens = [limiter.acquire(), limiter.acquire()]
+            assert limiter.in_flight == 2
+            for token in tokens:
+                limiter.release(token)
+        assert limiter.limit == 3
+
+    with subtests.test("A burst of throttling lowers the limit once."):
+        tokens = [limiter.acquire() for _ in range(3)]
+        for token in tokens:
+            limiter.release(token, throttled=True)
+        assert limiter.limit == 1
+        assert limiter.stats.throttled == 3
+
+    with subtests.test("The limit is never lowered below the minimum."):
+        limiter.release(limiter.acquire(), throttled=True)
+        assert limiter.limit == 1
+
+    with subtests.test("Requests wait for a slot."):
+        token = limiter.acquire()
+        acquired = threading.Event()
+
+        def acquire() -> None:
+            limiter.release(limiter.acquire())
+            acquired.set()
+
+        thread = threading.Thread(target=acquire)
+        thread.start()
+        assert not acquired.wait(0.1)
+        limiter.release(token)
+        assert acquired.wait(1)
+        thread.join()
+
+
+def test_call_with_retries(no_backoff, subtests):
+    """Test that throttled and transient failures are retried, up to a limit."""
+    bucket = BucketLocation("retries")
+    limiter = get_limiter(bucket)
+
+    with subtests.test("Failures are retried until they succeed."):
+        function = MagicMock(
+            side_effect=[
+                make_client_error("SlowDown", 503),
+                make_client_error("InternalError", 500),
+                "result",
+            ]
+        )
+        assert call_with_retries(bucket, "GetObject", function) == "result"
+        assert function.call_count == 3
+        assert (limiter.stats.requests, limiter.stats.retries) == (3, 2)
+        assert limiter.stats.throttled == 1
+        assert limiter.limit == 16
+
+    with subtests.test("Requests are only retried up to `max_attempts`."):
+        function = MagicMock(side_effect=make_client_error("SlowDown", 503))
+        with pytest.raises(ClientError):
+            call_with_retries(bucket, "GetObject", function)
+        assert function.call_count == 3
+        assert limiter.stats.failures == 1
+
+    with subtests.test("Other errors are raised straight away."):
+        function = MagicMock(side_effect=make_client_error("NoSuchKey", 404))
+        with pytest.raises(ClientError):
+            call_with_retries(bucket, "GetObject", function)
+        assert function.call_count == 1
+        assert limiter.in_flight == 0
+
+
+def test_s3_requests_are_retried(mocker, no_backoff):
+    """Test that requests to s3 are retried, from the start of their data."""
+    client = MagicMock()
+    mocker.patch("s3os.s3_wrapper.get_client", return_value=client)
+    bodies = []
+
+    def put_object(Body: io.BytesIO, **kwargs: str) -> dict:
+        bodies.append(Body.read())
+        if len(bodies) == 1:
+            raise make_client_error("SlowDown", 503)
+        return {"ETag": '"abc"'}
+
+    client.put_object.side_effect = put_object
+    get_metrics_registry().reset()
+    enable_metrics()
+    try:
+        etag = upload_object(ObjectLocation("key"), io.BytesIO(b"data"))
+    finally:
+        enable_metrics(False)
+
+    assert etag == '"abc"'
+    assert bodies == [b"data", b"data"]
+    assert get_metrics_registry().counter("s3os_retries_total", request="PutObject")
+    assert get_limiter(BucketLocation()).stats.retries == 1
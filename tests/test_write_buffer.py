@@ -0,0 +1,59 @@
+"""Tests for the buffer of deferred writes used by S3Dict."""
+
+import pytest
+
+from s3os.write_buffer import DELETED, FlushPolicy, WriteBuffer
+
+
+def test_flush_policy_validation():
+    """Test that background flushing requires a maximum age."""
+    with pytest.raises(ValueError):
+        FlushPolicy(background=True)
+
+
+def test_write_buffer(subtests):
+    """Test that repeated writes to a key collapse into the latest one."""
+    buffer = WriteBuffer()
+    buffer.set("a", 1)
+    buffer.set("a", 2)
+    buffer.set("b", 3)
+    buffer.delete("b")
+
+    with subtests.test("Only the latest write is kept."):
+        assert len(buffer) == 2
+        assert buffer.get("a") == 2
+        assert buffer.get("b") is DELETED
+        assert "c" not in buffer
+        with pytest.raises(KeyError):
+            buffer.get("c")
+
+    with subtests.test("Writes are removed when taken."):
+        assert buffer.take() == {"a": 2, "b": DELETED}
+        assert len(buffer) == 0
+        assert buffer.oldest_time is None
+
+    with subtests.test("Restored writes don't replace newer ones."):
+        buffer.set("a", 4)
+        buffer.restore({"a": 2, "b": DELETED}, since=0)
+        assert buffer.take() == {"a": 4, "b": DELETED}
+
+
+def test_write_buffer_thresholds(mocker, subtests):
+    """Test that the buffer is full once it passes a threshold of its policy."""
+    mocker.patch("s3os.write_buffer.time.monotonic", return_value=100)
+
+    with subtests.test("Number of pending writes."):
+        buffer = WriteBuffer(FlushPolicy(max_pending=2))
+        buffer.set("a", 1)
+        buffer.set("a", 2)
+        assert not buffer.is_full()
+        buffer.set("b", 1)
+        assert buffer.is_full()
+
+    with subtests.test("Age of the oldest pending write."):
+        buffer = WriteBuffer(FlushPolicy(max_pending=None, max_age=10))
+        assert not buffer.is_full()
+        buffer.restore({"a": 1}, since=95)
+        assert not buffer.is_full()
+        buffer.restore({"b": 1}, since=90)
+        assert buffer.is_full()